@@ -0,0 +1,99 @@
+from amaranth import *
+from amaranth.back import *
+from amaranth_soc.memory import *
+from amaranth_soc.wishbone import *
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+
+#############################################################
+# 'Core-Local Interruptor' (CLINT) peripheral.              #
+# It holds a 64-bit 'mtime' counter which increments every  #
+# 'prescale' clock cycles, a 64-bit 'mtimecmp' compare      #
+# value, and a software interrupt bit. 'mtip' is set while  #
+# mtime >= mtimecmp, and 'msip' follows the software bit.   #
+# The registers use the usual CLINT layout, so existing     #
+# firmware can find them at the same offsets:               #
+# *  0x0000 = msip                                          #
+# *  0x4000 = mtimecmp (low word, then high word)           #
+# *  0xBFF8 = mtime    (low word, then high word)           #
+# Accesses are whole words, and are acknowledged on the     #
+# cycle after they start.                                   #
+#############################################################
+
+# Register offsets.
+CLINT_MSIP      = 0x0000
+CLINT_MTIMECMP  = 0x4000
+CLINT_MTIMECMPH = 0x4004
+CLINT_MTIME     = 0xBFF8
+CLINT_MTIMEH    = 0xBFFC
+
+class CLINT( Elaboratable ):
+  def __init__( self, prescale = 1 ):
+    # Clock cycles per 'mtime' tick.
+    self.prescale = prescale
+    # Timer registers. 'mtimecmp' starts out at its maximum value,
+    # so the timer interrupt stays clear until it is set.
+    self.mtime    = Signal( 64, reset = 0 )
+    self.mtimecmp = Signal( 64, reset = 0xFFFFFFFFFFFFFFFF )
+    # Interrupt outputs: machine software and timer interrupts.
+    self.msip     = Signal( 1, reset = 0 )
+    self.mtip     = Signal( 1, reset = 0 )
+
+    # Wishbone bus interface.
+    self.bus = Interface( addr_width = 16, data_width = 32 )
+    self.bus.memory_map = MemoryMap( addr_width = self.bus.addr_width,
+                                     data_width = self.bus.data_width,
+                                     alignment = 0 )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    # Count up 'mtime', and compare it against 'mtimecmp'.
+    if self.prescale > 1:
+      pre = Signal( range( self.prescale ), reset = 0 )
+      with m.If( pre == ( self.prescale - 1 ) ):
+        m.d.sync += [
+          pre.eq( 0 ),
+          self.mtime.eq( self.mtime + 1 )
+        ]
+      with m.Else():
+        m.d.sync += pre.eq( pre + 1 )
+    else:
+      m.d.sync += self.mtime.eq( self.mtime + 1 )
+    m.d.comb += self.mtip.eq( self.mtime >= self.mtimecmp )
+
+    # Acknowledge each access one cycle after it starts. Reads are
+    # registered, and writes happen on the first cycle.
+    m.d.sync += self.bus.ack.eq( self.bus.cyc & ~self.bus.ack )
+    with m.If( self.bus.cyc & ~self.bus.ack ):
+      with m.Switch( self.bus.adr[ 2 : 16 ] ):
+        with m.Case( CLINT_MSIP >> 2 ):
+          m.d.sync += self.bus.dat_r.eq( self.msip )
+          with m.If( self.bus.we ):
+            m.d.sync += self.msip.eq( self.bus.dat_w[ 0 ] )
+        with m.Case( CLINT_MTIMECMP >> 2 ):
+          m.d.sync += self.bus.dat_r.eq( self.mtimecmp[ :32 ] )
+          with m.If( self.bus.we ):
+            m.d.sync += self.mtimecmp[ :32 ].eq( self.bus.dat_w )
+        with m.Case( CLINT_MTIMECMPH >> 2 ):
+          m.d.sync += self.bus.dat_r.eq( self.mtimecmp[ 32: ] )
+          with m.If( self.bus.we ):
+            m.d.sync += self.mtimecmp[ 32: ].eq( self.bus.dat_w )
+        # (Writes to 'mtime' take priority over the increment)
+        with m.Case( CLINT_MTIME >> 2 ):
+          m.d.sync += self.bus.dat_r.eq( self.mtime[ :32 ] )
+          with m.If( self.bus.we ):
+            m.d.sync += self.mtime[ :32 ].eq( self.bus.dat_w )
+        with m.Case( CLINT_MTIMEH >> 2 ):
+          m.d.sync += self.bus.dat_r.eq( self.mtime[ 32: ] )
+          with m.If( self.bus.we ):
+            m.d.sync += self.mtime[ 32: ].eq( self.bus.dat_w )
+        # Unused addresses read as 0.
+        with m.Default():
+          m.d.sync += self.bus.dat_r.eq( 0 )
+
+    # End of CLINT module definition.
+    return m
@@ -11,21 +11,38 @@ sys.path.append("..")
 from src.alu import *
 from src.csr import *
 from src.isa import *
+from src.muldiv import *
 from src.spi_flash import *
 from src.rom import *
 from src.rv_mem import *
+from src.rvc import *
 
 # Optional: Enable verbose output for debugging.
 #os.environ["NMIGEN_verbose"] = "Yes"
 
 # CPU module.
+# With 'compressed' set, the C extension is enabled: fetches only
+# need to be halfword-aligned, and 16-bit instructions are expanded
+# in front of the decoder.
 class CPU( Elaboratable ):
-  def __init__( self, rom_module ):
+  def __init__( self, rom_module, icache = None, dcache = None,
+                l2cache = None, prefetch = None, fast_ram = False,
+                compressed = False, shifter = SHIFT_FLIP ):
     # CPU signals:
     # 'Reset' signal for clock domains.
     self.clk_rst = Signal( reset = 0b0, reset_less = True )
     # Program Counter register.
     self.pc = Signal( 32, reset = 0x00000000 )
+    # Wait-state counter: 0 while fetching an instruction, and
+    # non-zero while it executes.
+    self.iws = Signal( 2, reset = 0 )
+    # Machine external interrupt request input.
+    self.irq = Signal( 1, reset = 0 )
+    # 'Idle' output: the CPU is waiting for an interrupt after a WFI
+    # instruction, and isn't fetching or accessing memory. Board
+    # code can use it to gate clocks. (The CLINT runs from the same
+    # clock, so the timer can only wake the CPU if it keeps running)
+    self.idle = Signal( 1, reset = 0 )
     # The main 32 CPU registers.
     self.register_file = Memory( width = 32, depth = 32,
                           init = ( 0x00000000 for i in range( 32 ) ) )
@@ -36,16 +53,35 @@ class CPU( Elaboratable ):
     self.rb     = self.register_file.read_port()
     self.rc     = self.register_file.write_port()
     # The ALU submodule which performs logical operations.
-    self.alu    = ALU()
+    # 'shifter' selects its shifter configuration.
+    self.alu    = ALU( shifter )
     # CSR 'system registers'.
-    self.csr    = CSR()
+    self.csr    = CSR( compressed )
+    # RV32M multiply / divide unit.
+    self.muldiv = MulDiv()
     # Memory module to hold peripherals and ROM / RAM module(s)
-    # (4KB of RAM = 1024 words)
-    self.mem    = RV_Memory( rom_module, 1024 )
+    # (4KB of RAM = 1024 words), optional L1 I- / D-caches, and an
+    # optional shared L2 cache and ROM prefetch buffer. 'fast_ram'
+    # selects the RAM's single-cycle acknowledgement mode.
+    self.mem    = RV_Memory( rom_module, 1024, icache, dcache,
+                             l2cache, prefetch, fast_ram, compressed )
+    # RV32C expander, if the C extension is enabled.
+    self.rvc    = RVC_Expander() if compressed else None
+
+  # Helper method to get the return address held in 'mepc'.
+  def mepc( self ):
+    if self.rvc is not None:
+      return Cat( Repl( 0, 1 ), self.csr.mepc_half, self.csr.mepc_mepc )
+    return Cat( Repl( 0, 2 ), self.csr.mepc_mepc )
 
   # Helper method to enter a trap handler: jump to the appropriate
-  # address, and set the MCAUSE / MEPC CSRs.
+  # address, and set the MCAUSE / MEPC CSRs. The instruction which
+  # traps doesn't retire.
   def trigger_trap( self, m, trap_num, return_pc ):
+    m.d.comb += [
+      self.csr.events[ EV_TRAP ].eq( 1 ),
+      self.csr.retire.eq( 0 )
+    ]
     m.d.sync += [
       # Set mcause, mepc, interrupt context flag.
       self.csr.mcause_interrupt.eq( 0 ),
@@ -58,6 +94,29 @@ class CPU( Elaboratable ):
                      ( self.csr.mtvec_base +
                        Mux( self.csr.mtvec_mode, trap_num, 0 ) ) ) )
     ]
+    if self.rvc is not None:
+      m.d.sync += self.csr.mepc_half.eq( return_pc.bit_select( 1, 1 ) )
+
+  # Helper method to enter an interrupt handler. This works like a
+  # trap, but 'mcause' has its 'interrupt' bit set, and 'mepc'
+  # holds the address of the instruction which was interrupted.
+  # With vectored 'mtvec', each interrupt has its own entry point.
+  def trigger_irq( self, m, irq_num ):
+    m.d.comb += self.csr.events[ EV_TRAP ].eq( 1 )
+    m.d.sync += [
+      self.csr.mcause_interrupt.eq( 1 ),
+      self.csr.mcause_ecode.eq( irq_num ),
+      self.csr.mepc_mepc.eq( self.pc[ 2: ] ),
+      self.csr.mstatus_mie.eq( 0 ),
+      self.pc.eq( Cat( Repl( 0, 2 ),
+                     ( self.csr.mtvec_base +
+                       Mux( self.csr.mtvec_mode, irq_num, 0 ) ) ) )
+    ]
+    if self.rvc is not None:
+      m.d.sync += self.csr.mepc_half.eq( self.pc[ 1 ] )
+    # Stop the ROM prefetch buffer reading ahead.
+    if self.mem.iprefetch is not None:
+      m.d.comb += self.mem.iprefetch.flush.eq( 1 )
 
   # CPU object's 'elaborate' method to generate the hardware logic.
   def elaborate( self, platform ):
@@ -67,15 +126,24 @@ class CPU( Elaboratable ):
     m.submodules.alu = self.alu
     m.submodules.csr = self.csr
     m.submodules.mem = self.mem
+    m.submodules.muldiv = self.muldiv
     # Register the CPU register read/write ports.
     m.submodules.ra  = self.ra
     m.submodules.rb  = self.rb
     m.submodules.rc  = self.rc
 
     # Wait-state counter to let internal memories load.
-    iws = Signal( 2, reset = 0 )
+    iws = self.iws
 
-    instruction = self.mem.inst_mux.bus.dat_r
+    # Current instruction, expanded if it is compressed, and its
+    # length in bytes.
+    instruction = self.mem.ibus.dat_r
+    ilen = 4
+    if self.rvc is not None:
+      m.submodules.rvc = self.rvc
+      m.d.comb += self.rvc.c.eq( self.mem.ibus.dat_r )
+      instruction = self.rvc.ir
+      ilen = Mux( self.rvc.rvc, 2, 4 )
     rs1 = instruction[ 15 : 20 ]
     rs2 = instruction[ 20 : 25 ]
     rd  = instruction[ 7 : 12 ]
@@ -91,73 +159,161 @@ class CPU( Elaboratable ):
       self.rb.addr.eq( rs2 ),   #rs2
       self.rc.addr.eq( rd ),   #rd
       # Instruction bus address is always set to the program counter.
-      self.mem.inst_mux.bus.adr.eq( self.pc ),
+      self.mem.ibus.adr.eq( self.pc ),
       # The CSR inputs are always wired the same.
       self.csr.dat_w.eq(
-        Mux( self.mem.inst_mux.bus.dat_r[ 14 ] == 0,
+        Mux( instruction[ 14 ] == 0,
              self.ra.data,
              Cat( self.ra.addr,
                   Repl( self.ra.addr[ 4 ], 27 ) ) ) ),
       self.csr.f.eq( funct3 ),
       self.csr.adr.eq( imm_11_0 ),
       # Store data and width are always wired the same.
-      self.mem.ram.dw.eq( funct3 ),
-      self.mem.data_mux.bus.dat_w.eq( self.rb.data ),
+      self.mem.dw.eq( funct3 ),
+      self.mem.dbus.dat_w.eq( self.rb.data ),
+      # So are the multiply / divide unit's inputs.
+      self.muldiv.a.eq( self.ra.data ),
+      self.muldiv.b.eq( self.rb.data ),
+      self.muldiv.f.eq( funct3 )
+    ]
+    muldiv = ( opcode == OP_REG ) & ( funct7 == FF_MULDIV )
+
+    # Performance counter events: cycles spent waiting for the
+    # buses, and cache misses.
+    m.d.comb += [
+      self.csr.events[ EV_FETCH_STALL ].eq(
+        self.mem.ibus.cyc & ~self.mem.ibus.ack ),
+      self.csr.events[ EV_DBUS_STALL ].eq(
+        self.mem.dbus.cyc & ~self.mem.dbus.ack )
+    ]
+    if self.mem.icache is not None:
+      m.d.comb += self.csr.events[ EV_IMISS ].eq( self.mem.icache.miss )
+    if self.mem.dcache is not None:
+      m.d.comb += self.csr.events[ EV_DMISS ].eq( self.mem.dcache.miss )
+
+    # Interrupt inputs: the CLINT's software and timer interrupts,
+    # and the external interrupt request.
+    m.d.comb += [
+      self.csr.mip_msip.eq( self.mem.clint.msip ),
+      self.csr.mip_mtip.eq( self.mem.clint.mtip ),
+      self.csr.mip_meip.eq( self.irq )
     ]
+    # Pick the highest-priority enabled interrupt which is pending:
+    # external, then software, then timer. (Later entries win)
+    irq_num  = Signal( 4, reset = 0 )
+    irq_pend = Signal( 1, reset = 0 )
+    for num, en, ip in [
+        ( IRQ_MTI, self.csr.mie_mtie, self.csr.mip_mtip ),
+        ( IRQ_MSI, self.csr.mie_msie, self.csr.mip_msip ),
+        ( IRQ_MEI, self.csr.mie_meie, self.csr.mip_meip ) ]:
+      with m.If( en & ip ):
+        m.d.comb += [
+          irq_num.eq( num ),
+          irq_pend.eq( 1 )
+        ]
+    # Take a pending interrupt as soon as the current instruction
+    # is done, without waiting for the next one to be fetched: the
+    # fetch is abandoned if it hasn't reached the bus yet or the
+    # instruction bus allows it, and the fetched instruction is
+    # dropped otherwise. (Loads, stores and FENCEs which are
+    # waiting on memory finish first)
+    fetching = Signal( 1, reset = 0 )
+    m.d.sync += fetching.eq( self.mem.ibus.cyc & ~self.mem.ibus.ack )
+    irq_take = Signal( 1, reset = 0 )
+    irq_ok   = ( ( iws == 0 ) & ~fetching ) | ( iws == 1 )
+    if self.mem.ibus_abortable:
+      irq_ok = ( iws == 0 ) | ( iws == 1 )
+    m.d.comb += irq_take.eq( self.csr.mstatus_mie & irq_pend & irq_ok )
+
+    # After a WFI instruction, stop fetching until an enabled
+    # interrupt is pending. (Even if interrupts are disabled
+    # globally: then the CPU just carries on)
+    sleep = Signal( 1, reset = 0 )
+    with m.If( irq_pend ):
+      m.d.sync += sleep.eq( 0 )
+    m.d.comb += self.idle.eq( sleep & ~irq_pend )
 
-    # Trigger an 'instruction mis-aligned' trap if necessary. 
-    with m.If( self.pc[ :2 ] != 0 ):
+    # Trigger an 'instruction mis-aligned' trap if necessary.
+    # (Only odd addresses are mis-aligned with the C extension)
+    # Jumps and branches trap before they get to a mis-aligned
+    # address, so this only catches the PC being set some other way.
+    def misaligned( adr ):
+      if self.rvc is not None:
+        return adr[ 0 ]
+      return adr[ :2 ] != 0
+    with m.If( irq_take ):
+      m.d.sync += iws.eq( 0 )
+      self.trigger_irq( m, irq_num )
+    with m.Elif( misaligned( self.pc ) ):
       m.d.sync += self.csr.mtval_einfo.eq( self.pc )
       self.trigger_trap( m, TRAP_IMIS, Past( self.pc ) )
     with m.Else():
       # I-bus is active until it completes a transaction.
-      m.d.comb += self.mem.inst_mux.bus.cyc.eq( iws == 0 )
+      m.d.comb += self.mem.ibus.cyc.eq( ( iws == 0 ) & ~sleep )
 
     # Wait a cycle after 'ack' to load the appropriate CPU registers.
-    with m.If( self.mem.inst_mux.bus.ack ):
+    with m.If( self.mem.ibus.ack & ~irq_take ):
       # Increment the wait-state counter.
       # (This also lets the instruction bus' 'cyc' signal fall.)
       m.d.sync += iws.eq( 1 )
-      with m.If( iws == 0 ):
-        # Increment pared-down 32-bit MINSTRET counter.
-        # I'd remove the whole MINSTRET CSR to save space, but the
-        # test harnesses depend on it to count instructions.
-        # TODO: This is OBO; it'll be 1 before the first retire.
-        m.d.sync += self.csr.minstret_instrs.eq(
-          self.csr.minstret_instrs + 1 )
 
     # Execute the current instruction, once it loads.
-    with m.If( iws != 0 ):
+    with m.If( ( iws != 0 ) & ~irq_take ):
       # Increment the PC and reset the wait-state unless
-      # otherwise specified.
+      # otherwise specified. The instruction retires (and MINSTRET
+      # counts it) unless it has to wait for something, or traps.
       m.d.sync += [
-        self.pc.eq( self.pc + 4 ),
+        self.pc.eq( self.pc + ilen ),
         iws.eq( 0 )
       ]
+      m.d.comb += self.csr.retire.eq( 1 )
 
       # Decoder switch case:
       with m.Switch( opcode ):
         # LUI / AUIPC / R-type / I-type instructions: apply
-        # pending CPU register write.
+        # pending CPU register write. RV32M operations start the
+        # multiply / divide unit on their first cycle, and wait
+        # for its result.
         with m.Case( '0-10-11' ):
-          m.d.comb += self.rc.en.eq( self.rc.addr != 0 )
+          with m.If( muldiv & ( ( iws == 1 ) | self.muldiv.busy ) ):
+            m.d.comb += self.muldiv.start.eq( iws == 1 )
+            m.d.sync += [
+              self.pc.eq( self.pc ),
+              iws.eq( 2 )
+            ]
+            m.d.comb += self.csr.retire.eq( 0 )
+          with m.Else():
+            m.d.comb += self.rc.en.eq( self.rc.addr != 0 )
 
         # JAL / JALR instructions: jump to a new address and place
         # the 'return PC' in the destination register (rc).
+        # Jumping to a mis-aligned address traps on the jump itself.
+        # (JALR clears the target address' LSbit)
         with m.Case( '110-111' ):
-          m.d.sync += self.pc.eq(
-            Mux( self.mem.inst_mux.bus.dat_r[ 3 ],
+          jt = Signal( 32, reset = 0x00000000 )
+          m.d.comb += jt.eq(
+            Mux( instruction[ 3 ],
                  self.pc + Cat(
                    Repl( 0, 1 ),
-                   self.mem.inst_mux.bus.dat_r[ 21: 31 ],
-                   self.mem.inst_mux.bus.dat_r[ 20 ],
-                   self.mem.inst_mux.bus.dat_r[ 12 : 20 ],
-                   Repl( self.mem.inst_mux.bus.dat_r[ 31 ], 12 ) ),
-                 self.ra.data + Cat(
-                   self.mem.inst_mux.bus.dat_r[ 20 : 32 ],
-                   Repl( self.mem.inst_mux.bus.dat_r[ 31 ], 20 ) ) ),
-          )
-          m.d.comb += self.rc.en.eq( self.rc.addr != 0 )
+                   instruction[ 21: 31 ],
+                   instruction[ 20 ],
+                   instruction[ 12 : 20 ],
+                   Repl( instruction[ 31 ], 12 ) ),
+                 Cat( Repl( 0, 1 ), ( self.ra.data + Cat(
+                   instruction[ 20 : 32 ],
+                   Repl( instruction[ 31 ], 20 ) ) )[ 1 : 32 ] ) ) )
+          with m.If( misaligned( jt ) ):
+            m.d.sync += self.csr.mtval_einfo.eq( jt )
+            self.trigger_trap( m, TRAP_IMIS, self.pc )
+          with m.Else():
+            m.d.sync += self.pc.eq( jt )
+            m.d.comb += [
+              self.rc.en.eq( self.rc.addr != 0 ),
+              self.csr.events[ EV_BRANCH ].eq( 1 )
+            ]
+          # Stop the ROM prefetch buffer reading ahead.
+          if self.mem.iprefetch is not None:
+            m.d.comb += self.mem.iprefetch.flush.eq( 1 )
 
         # Conditional branch instructions: similar to JAL / JALR,
         # but only take the branch if the condition is met.
@@ -165,15 +321,24 @@ class CPU( Elaboratable ):
           # Check the ALU result. If it is zero, then:
           # a == b for BEQ/BNE, or a >= b for BLT[U]/BGE[U].
           with m.If( ( ( self.alu.y == 0 ) ^
-                         self.mem.inst_mux.bus.dat_r[ 12 ] ) !=
-                       self.mem.inst_mux.bus.dat_r[ 14 ] ):
+                         instruction[ 12 ] ) !=
+                       instruction[ 14 ] ):
             # Branch only if the condition is met.
-            m.d.sync += self.pc.eq( self.pc + Cat(
+            bt = Signal( 32, reset = 0x00000000 )
+            m.d.comb += bt.eq( self.pc + Cat(
               Repl( 0, 1 ),
-              self.mem.inst_mux.bus.dat_r[ 8 : 12 ],
-              self.mem.inst_mux.bus.dat_r[ 25 : 31 ],
-              self.mem.inst_mux.bus.dat_r[ 7 ],
-              Repl( self.mem.inst_mux.bus.dat_r[ 31 ], 20 ) ) )
+              instruction[ 8 : 12 ],
+              instruction[ 25 : 31 ],
+              instruction[ 7 ],
+              Repl( instruction[ 31 ], 20 ) ) )
+            with m.If( misaligned( bt ) ):
+              m.d.sync += self.csr.mtval_einfo.eq( bt )
+              self.trigger_trap( m, TRAP_IMIS, self.pc )
+            with m.Else():
+              m.d.sync += self.pc.eq( bt )
+              m.d.comb += self.csr.events[ EV_BRANCH ].eq( 1 )
+            if self.mem.iprefetch is not None:
+              m.d.comb += self.mem.iprefetch.flush.eq( 1 )
 
         # Load / Store instructions: perform memory access
         # through the data bus.
@@ -183,53 +348,57 @@ class CPU( Elaboratable ):
           # * Word-aligned accesses are never mis-aligned.
           # * Halfword accesses are only mis-aligned when both of
           #   the address' LSbits are 1s.
-          with m.If( ( ( self.mem.data_mux.bus.adr[ :2 ] == 0 ) |
-                       ( self.mem.inst_mux.bus.dat_r[ 12 : 14 ] == 0 ) |
-                       ( ~( self.mem.data_mux.bus.adr[ 0 ] &
-                            self.mem.data_mux.bus.adr[ 1 ] &
-                            self.mem.inst_mux.bus.dat_r[ 12 ] ) ) ) == 0 ):
+          with m.If( ( ( self.mem.dbus.adr[ :2 ] == 0 ) |
+                       ( instruction[ 12 : 14 ] == 0 ) |
+                       ( ~( self.mem.dbus.adr[ 0 ] &
+                            self.mem.dbus.adr[ 1 ] &
+                            instruction[ 12 ] ) ) ) == 0 ):
             self.trigger_trap( m,
               Cat( Repl( 0, 1 ),
-                   self.mem.inst_mux.bus.dat_r[ 5 ],
+                   instruction[ 5 ],
                    Repl( 1, 1 ) ),
               Past( self.pc ) )
           with m.Else():
             # Activate the data bus.
             m.d.comb += [
-              self.mem.data_mux.bus.cyc.eq( 1 ),
+              self.mem.dbus.cyc.eq( 1 ),
               # Stores only: set the 'write enable' bit.
-              self.mem.data_mux.bus.we.eq( self.mem.inst_mux.bus.dat_r[ 5 ] )
+              self.mem.dbus.we.eq( instruction[ 5 ] )
             ]
             # Don't proceed until the memory access finishes.
-            with m.If( self.mem.data_mux.bus.ack == 0 ):
+            with m.If( self.mem.dbus.ack == 0 ):
               m.d.sync += [
                 self.pc.eq( self.pc ),
                 iws.eq( 2 )
               ]
+              m.d.comb += self.csr.retire.eq( 0 )
             # Loads only: write to the CPU register.
-            with m.Elif( self.mem.inst_mux.bus.dat_r[ 5 ] == 0 ):
+            with m.Elif( instruction[ 5 ] == 0 ):
               m.d.comb += self.rc.en.eq( self.rc.addr != 0 )
 
-        # System call instruction: ECALL, EBREAK, MRET,
+        # System call instruction: ECALL, EBREAK, MRET, WFI,
         # and atomic CSR operations.
         with m.Case( OP_SYSTEM ):
-          with m.If( self.mem.inst_mux.bus.dat_r[ 12 : 15 ] == F_TRAPS ):
-            with m.Switch( self.mem.inst_mux.bus.dat_r[ 20 : 22 ] ):
+          with m.If( instruction[ 12 : 15 ] == F_TRAPS ):
+            with m.Switch( instruction[ 20 : 22 ] ):
               # An 'empty' ECALL instruction should raise an
               # 'environment-call-from-M-mode" exception.
               with m.Case( 0 ):
                 self.trigger_trap( m, TRAP_ECALL, Past( self.pc ) )
               # "EBREAK" instruction: enter the interrupt context
               # with 'breakpoint' as the cause of the exception.
+              # 'WFI' shares its low bits, and goes to sleep.
               with m.Case( 1 ):
-                self.trigger_trap( m, TRAP_BREAK, Past( self.pc ) )
+                with m.If( imm_11_0 == IMM_WFI ):
+                  m.d.sync += sleep.eq( ~irq_pend )
+                with m.Else():
+                  self.trigger_trap( m, TRAP_BREAK, Past( self.pc ) )
               # 'MRET' jumps to the stored 'pre-trap' PC in the
               # 30 MSbits of the MEPC CSR.
               with m.Case( 2 ):
                 m.d.sync += [
                   self.csr.mstatus_mie.eq( 1 ),
-                  self.pc.eq( Cat( Repl( 0, 2 ),
-                                   self.csr.mepc_mepc ) )
+                  self.pc.eq( self.mepc() )
                 ]
           # Defer to the CSR module for atomic CSR reads/writes.
           # 'CSRR[WSC]': Write/Set/Clear CSR value from a register.
@@ -242,26 +411,39 @@ class CPU( Elaboratable ):
             ]
 
         # FENCE instruction: clear any I-caches and ensure all
-        # memory operations are applied. There is no I-cache,
-        # and there is no caching of memory operations.
-        # There is also no pipelining. So...this is a nop.
+        # memory operations are applied. There is no pipelining,
+        # so only the caches (if there are any) need to do anything:
+        # the D-cache writes its dirty lines back, and then the
+        # I-cache is invalidated.
         with m.Case( OP_FENCE ):
-          pass
+          flushed = 1
+          if self.mem.dcache is not None:
+            flushed = self.mem.dcache.flushed
+            m.d.comb += self.mem.dcache.flush.eq( 1 )
+            # Don't proceed until the write-backs finish.
+            with m.If( flushed == 0 ):
+              m.d.sync += [
+                self.pc.eq( self.pc ),
+                iws.eq( 2 )
+              ]
+              m.d.comb += self.csr.retire.eq( 0 )
+          if self.mem.icache is not None:
+            m.d.comb += self.mem.icache.flush.eq( flushed )
 
     # 'Always-on' decode/execute logic:
-    with m.Switch( self.mem.inst_mux.bus.dat_r[ 0 : 7 ] ):
+    with m.Switch( instruction[ 0 : 7 ] ):
       # LUI / AUIPC instructions: set destination register to
       # 20 upper bits, +pc for AUIPC.
       with m.Case( '0-10111' ):
         m.d.comb += self.rc.data.eq(
-          Mux( self.mem.inst_mux.bus.dat_r[ 5 ], 0, self.pc ) +
+          Mux( instruction[ 5 ], 0, self.pc ) +
           Cat( Repl( 0, 12 ),
-               self.mem.inst_mux.bus.dat_r[ 12 : 32 ] ) )
+               instruction[ 12 : 32 ] ) )
 
       # JAL / JALR instructions: set destination register to
       # the 'return PC' value.
       with m.Case( '110-111' ):
-        m.d.comb += self.rc.data.eq( self.pc + 4 )
+        m.d.comb += self.rc.data.eq( self.pc + ilen )
 
       # Conditional branch instructions:
       # set us up the ALU for the condition check.
@@ -272,47 +454,52 @@ class CPU( Elaboratable ):
           self.alu.a.eq( self.ra.data ),
           self.alu.b.eq( self.rb.data ),
           self.alu.f.eq( Mux(
-            self.mem.inst_mux.bus.dat_r[ 14 ],
-            Cat( self.mem.inst_mux.bus.dat_r[ 13 ], 0b001 ),
+            instruction[ 14 ],
+            Cat( instruction[ 13 ], 0b001 ),
             0b1000 ) )
         ]
 
       # Load instructions: Set the memory address and data register.
       with m.Case( OP_LOAD ):
         m.d.comb += [
-          self.mem.data_mux.bus.adr.eq( self.ra.data +
-            Cat( self.mem.inst_mux.bus.dat_r[ 20 : 32 ],
-                 Repl( self.mem.inst_mux.bus.dat_r[ 31 ], 20 ) ) ),
+          self.mem.dbus.adr.eq( self.ra.data +
+            Cat( instruction[ 20 : 32 ],
+                 Repl( instruction[ 31 ], 20 ) ) ),
           self.rc.data.bit_select( 0, 8 ).eq(
-            self.mem.data_mux.bus.dat_r[ :8 ] )
+            self.mem.dbus.dat_r[ :8 ] )
         ]
-        with m.If( self.mem.inst_mux.bus.dat_r[ 12 ] ):
+        with m.If( instruction[ 12 ] ):
           m.d.comb += [
             self.rc.data.bit_select( 8, 8 ).eq(
-              self.mem.data_mux.bus.dat_r[ 8 : 16 ] ),
+              self.mem.dbus.dat_r[ 8 : 16 ] ),
             self.rc.data.bit_select( 16, 16 ).eq(
-              Repl( ( self.mem.inst_mux.bus.dat_r[ 14 ] == 0 ) &
-                    self.mem.data_mux.bus.dat_r[ 15 ], 16 ) )
+              Repl( ( instruction[ 14 ] == 0 ) &
+                    self.mem.dbus.dat_r[ 15 ], 16 ) )
           ]
-        with m.Elif( self.mem.inst_mux.bus.dat_r[ 13 ] ):
+        with m.Elif( instruction[ 13 ] ):
           m.d.comb += self.rc.data.bit_select( 8, 24 ).eq(
-            self.mem.data_mux.bus.dat_r[ 8 : 32 ] )
+            self.mem.dbus.dat_r[ 8 : 32 ] )
         with m.Else():
           m.d.comb += self.rc.data.bit_select( 8, 24 ).eq(
-            Repl( ( self.mem.inst_mux.bus.dat_r[ 14 ] == 0 ) &
-                  self.mem.data_mux.bus.dat_r[ 7 ], 24 ) )
+            Repl( ( instruction[ 14 ] == 0 ) &
+                  self.mem.dbus.dat_r[ 7 ], 24 ) )
 
       # Store instructions: Set the memory address.
       with m.Case( OP_STORE ):
-        m.d.comb += self.mem.data_mux.bus.adr.eq( self.ra.data +
-          Cat( self.mem.inst_mux.bus.dat_r[ 7 : 12 ],
-               self.mem.inst_mux.bus.dat_r[ 25 : 32 ],
-               Repl( self.mem.inst_mux.bus.dat_r[ 31 ], 20 ) ) )
+        m.d.comb += self.mem.dbus.adr.eq( self.ra.data +
+          Cat( instruction[ 7 : 12 ],
+               instruction[ 25 : 32 ],
+               Repl( instruction[ 31 ], 20 ) ) )
 
       # R-type ALU operation: set inputs for rc = ra ? rb
       with m.Case( OP_REG ):
-        # Implement left shifts using the right shift ALU operation.
-        with m.If( self.mem.inst_mux.bus.dat_r[ 12 : 15 ] == 0b001 ):
+        # RV32M operations: rc = the multiply / divide unit's result.
+        with m.If( funct7 == FF_MULDIV ):
+          m.d.comb += self.rc.data.eq( self.muldiv.y )
+        # Implement left shifts using the right shift ALU operation,
+        # unless the ALU has its own left shifter.
+        with m.Elif( ( instruction[ 12 : 15 ] == 0b001 ) &
+                     self.alu.flip ):
           m.d.comb += [
             self.alu.a.eq( FLIP( self.ra.data ) ),
             self.alu.f.eq( 0b0101 ),
@@ -322,8 +509,8 @@ class CPU( Elaboratable ):
           m.d.comb += [
             self.alu.a.eq( self.ra.data ),
             self.alu.f.eq( Cat(
-              self.mem.inst_mux.bus.dat_r[ 12 : 15 ],
-              self.mem.inst_mux.bus.dat_r[ 30 ] ) ),
+              instruction[ 12 : 15 ],
+              instruction[ 30 ] ) ),
             self.rc.data.eq( self.alu.y ),
           ]
         m.d.comb += self.alu.b.eq( self.rb.data )
@@ -334,8 +521,8 @@ class CPU( Elaboratable ):
         # They use 'funct7' bits like R-type operations, and the
         # left shift can be implemented as a right shift to avoid
         # having two barrel shifters in the ALU.
-        with m.If( self.mem.inst_mux.bus.dat_r[ 12 : 14 ] == 0b01 ):
-          with m.If( self.mem.inst_mux.bus.dat_r[ 14 ] == 0 ):
+        with m.If( instruction[ 12 : 14 ] == 0b01 ):
+          with m.If( ( instruction[ 14 ] == 0 ) & self.alu.flip ):
             m.d.comb += [
               self.alu.a.eq( FLIP( self.ra.data ) ),
               self.alu.f.eq( 0b0101 ),
@@ -344,20 +531,21 @@ class CPU( Elaboratable ):
           with m.Else():
             m.d.comb += [
               self.alu.a.eq( self.ra.data ),
-              self.alu.f.eq( Cat( 0b101, self.mem.inst_mux.bus.dat_r[ 30 ] ) ),
+              self.alu.f.eq( Cat( instruction[ 12 : 15 ],
+                                  instruction[ 30 ] ) ),
               self.rc.data.eq( self.alu.y ),
             ]
         # Normal I-type operation:
         with m.Else():
           m.d.comb += [
             self.alu.a.eq( self.ra.data ),
-            self.alu.f.eq( self.mem.inst_mux.bus.dat_r[ 12 : 15 ] ),
+            self.alu.f.eq( instruction[ 12 : 15 ] ),
             self.rc.data.eq( self.alu.y ),
           ]
         # Shared I-type logic:
         m.d.comb += self.alu.b.eq( Cat(
-          self.mem.inst_mux.bus.dat_r[ 20 : 32 ],
-          Repl( self.mem.inst_mux.bus.dat_r[ 31 ], 20 ) ) )
+          instruction[ 20 : 32 ],
+          Repl( instruction[ 31 ], 20 ) ) )
 
     # End of CPU module definition.
     return m
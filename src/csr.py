@@ -34,14 +34,42 @@ CSRA_MTVAL2     = 0x34B
 # Machine counters:
 CSRA_MCYCLE           = 0xB00
 CSRA_MINSTRET         = 0xB02
+CSRA_MHPMCOUNTER3     = 0xB03
+CSRA_MCYCLEH          = 0xB80
+CSRA_MINSTRETH        = 0xB82
+CSRA_MHPMCOUNTER3H    = 0xB83
 # Machine counter setup:
 CSRA_MCOUNTINHIBIT    = 0x320
+CSRA_MHPMEVENT3       = 0x323
 
-# CSR memory map definitions.
+# CSR memory map definitions. Each bitfield is listed as
+# [ first bit, last bit, access, reset value ]: 'rw' fields can be
+# written by CSR instructions, 'r' fields are constants, and 'rh'
+# fields are read-only inputs which the core drives.
 CSRS = {
+  # 64-bit cycle and retired instruction counters.
+  'mcycle': {
+    'c_addr': CSRA_MCYCLE,
+    'bits': { 'cycles': [ 0, 31, 'rw', 0 ] }
+  },
+  'mcycleh': {
+    'c_addr': CSRA_MCYCLEH,
+    'bits': { 'cycles': [ 0, 31, 'rw', 0 ] }
+  },
   'minstret': {
     'c_addr': CSRA_MINSTRET,
-    'bits': { 'instrs': [ 0, 15, 'rw', 0 ] }
+    'bits': { 'instrs': [ 0, 31, 'rw', 0 ] }
+  },
+  'minstreth': {
+    'c_addr': CSRA_MINSTRETH,
+    'bits': { 'instrs': [ 0, 31, 'rw', 0 ] }
+  },
+  'mcountinhibit': {
+    'c_addr': CSRA_MCOUNTINHIBIT,
+    'bits': {
+      'cy': [ 0, 0, 'rw', 0 ],
+      'ir': [ 2, 2, 'rw', 0 ]
+    }
   },
   'mstatus': {
     'c_addr': CSRA_MSTATUS,
@@ -50,6 +78,24 @@ CSRS = {
       'mpie': [ 7,  7,  'r',  0 ]
      }
   },
+  # Interrupt enable and pending bits: machine software, timer,
+  # and external interrupts.
+  'mie': {
+    'c_addr': CSRA_MIE,
+    'bits': {
+      'msie': [ 3,  3,  'rw', 0 ],
+      'mtie': [ 7,  7,  'rw', 0 ],
+      'meie': [ 11, 11, 'rw', 0 ]
+    }
+  },
+  'mip': {
+    'c_addr': CSRA_MIP,
+    'bits': {
+      'msip': [ 3,  3,  'rh', 0 ],
+      'mtip': [ 7,  7,  'rh', 0 ],
+      'meip': [ 11, 11, 'rh', 0 ]
+    }
+  },
   'mcause': {
     'c_addr': CSRA_MCAUSE,
     'bits': {
@@ -76,6 +122,43 @@ CSRS = {
   },
 }
 
+# Helper method to build the map of a CSR module's registers:
+# 'CSRS', plus the performance counters and the C extension's
+# 'mepc' bit. (See 'CSR' for the arguments)
+def csr_map( compressed = False, hpm = 4 ):
+  # With the C extension, instructions can start on any halfword,
+  # so 'mepc' keeps bit 1 as well.
+  csrs = dict( CSRS )
+  if compressed:
+    csrs[ 'mepc' ] = {
+      'c_addr': CSRA_MEPC,
+      'bits': {
+        'mepc': [ 2, 31, 'rw', 0 ],
+        'half': [ 1, 1,  'rw', 0 ]
+      }
+    }
+  # Performance counters, and their 'mcountinhibit' bits.
+  for i in range( 3, 3 + hpm ):
+    csrs[ 'mhpmcounter%d'%i ] = {
+      'c_addr': CSRA_MHPMCOUNTER3 + i - 3,
+      'bits': { 'count': [ 0, 31, 'rw', 0 ] }
+    }
+    csrs[ 'mhpmcounter%dh'%i ] = {
+      'c_addr': CSRA_MHPMCOUNTER3H + i - 3,
+      'bits': { 'count': [ 0, 31, 'rw', 0 ] }
+    }
+    csrs[ 'mhpmevent%d'%i ] = {
+      'c_addr': CSRA_MHPMEVENT3 + i - 3,
+      'bits': { 'event': [ 0, 2, 'rw', 0 ] }
+    }
+  if hpm > 0:
+    csrs[ 'mcountinhibit' ] = {
+      'c_addr': CSRA_MCOUNTINHIBIT,
+      'bits': dict( CSRS[ 'mcountinhibit' ][ 'bits' ],
+                    hpm = [ 3, 2 + hpm, 'rw', 0 ] )
+    }
+  return csrs
+
 #############################################
 # 'Control and Status Registers' file.      #
 # This contains logic for handling the      #
@@ -85,8 +168,18 @@ CSRS = {
 #############################################
 
 # Core "CSR" class, which addresses Control and Status Registers.
+# 'hpm' is the number of 'mhpmcounterN' / 'mhpmeventN' pairs,
+# starting from N = 3.
 class CSR( Elaboratable, Interface ):
-  def __init__( self ):
+  def __init__( self, compressed = False, hpm = 4 ):
+    # Supported CSRs, and the number of performance counters.
+    self.csrs = csr_map( compressed, hpm )
+    self.hpm = hpm
+    # 'Retire' input: the core finished an instruction this cycle.
+    self.retire = Signal( 1, reset = 0 )
+    # 'Events' input: one bit per 'EV_*' event which happened this
+    # cycle. (Bit 'EV_NONE' is ignored)
+    self.events = Signal( EV_COUNT, reset = 0 )
     # CSR function select signal.
     self.f  = Signal( 3,  reset = 0b000 )
     # Actual data to write (depends on write/set/clear function)
@@ -97,9 +190,9 @@ class CSR( Elaboratable, Interface ):
                                  data_width = self.data_width,
                                  alignment = 0 )
     # Initialize required CSR signals and constants.
-    for cname, reg in CSRS.items():
+    for cname, reg in self.csrs.items():
       for bname, bits in reg[ 'bits' ].items():
-        if 'w' in bits[ 2 ]:
+        if ( 'w' in bits[ 2 ] ) or ( 'h' in bits[ 2 ] ):
           setattr( self,
                    "%s_%s"%( cname, bname ),
                    Signal( bits[ 1 ] - bits[ 0 ] + 1,
@@ -113,24 +206,68 @@ class CSR( Elaboratable, Interface ):
   def elaborate( self, platform ):
     m = Module()
 
-    # Read values default to 0.
-    m.d.comb += self.dat_r.eq( 0 )
+    # 'Set' and 'clear' operations with a zero input only read the
+    # CSR, so reading a counter doesn't stop it for a cycle.
+    wen = Signal( 1, reset = 0 )
+    m.d.comb += wen.eq( self.we & ( ( self.f[ :2 ] == 0b01 ) |
+                                    ( self.dat_w != 0 ) ) )
 
-    with m.Switch( self.adr ):
-      # Generate logic for supported CSR reads / writes.
-      for cname, reg in CSRS.items():
-        with m.Case( reg['c_addr'] ):
-          # Assemble the read value from individual bitfields.
-          for bname, bits in reg[ 'bits' ].items():
-            if 'r' in bits[ 2 ]:
-              m.d.comb += self.dat_r \
-                .bit_select( bits[ 0 ], bits[ 1 ] - bits[ 0 ] + 1 ) \
-                .eq( getattr( self, "%s_%s"%( cname, bname ) ) )
-            with m.If( self.we == 1 ):
-              # Writes are enabled; set new values on the next tick.
-              if 'w' in bits[ 2 ]:
-                m.d.sync += getattr( self, "%s_%s"%( cname, bname ) ) \
-                  .eq( self.wd[ bits[ 0 ] : ( bits[ 1 ] + 1 ) ] )
+    # Performance counters. Each one is a pair of 32-bit CSRs, and
+    # stops counting while its 'mcountinhibit' bit is set. (CSR
+    # writes below take priority over the increments)
+    counters = [
+      ( self.mcountinhibit_cy, 1,
+        self.mcycle_cycles, self.mcycleh_cycles ),
+      ( self.mcountinhibit_ir, self.retire,
+        self.minstret_instrs, self.minstreth_instrs )
+    ]
+    for i in range( 3, 3 + self.hpm ):
+      ev = getattr( self, "mhpmevent%d_event"%i )
+      counters.append( ( self.mcountinhibit_hpm[ i - 3 ],
+        ( ev != EV_NONE ) & self.events.bit_select( ev, 1 ),
+        getattr( self, "mhpmcounter%d_count"%i ),
+        getattr( self, "mhpmcounter%dh_count"%i ) ) )
+    for inhibit, inc, lo, hi in counters:
+      with m.If( ~inhibit & inc ):
+        m.d.sync += Cat( lo, hi ).eq( Cat( lo, hi ) + 1 )
+
+    # Two-level address decode. The top 4 address bits select a
+    # bank (0x3xx trap setup, 0xBxx counters, ...), and each CSR
+    # only compares its low 8 bits within its bank. That gives one
+    # 'select' line per CSR, so reads are an AND-OR of the selected
+    # values rather than a chain of comparisons, and the decoder
+    # grows slowly as CSRs are added.
+    banks = {}
+    for cname, reg in self.csrs.items():
+      bank = reg[ 'c_addr' ] >> 8
+      if bank not in banks:
+        banks[ bank ] = Signal( 1, name = "csr_bank_%X"%bank, reset = 0 )
+        m.d.comb += banks[ bank ].eq( self.adr[ 8 : 12 ] == bank )
+    rd = []
+    for cname, reg in self.csrs.items():
+      sel = Signal( 1, name = "%s_sel"%cname, reset = 0 )
+      m.d.comb += sel.eq( banks[ reg[ 'c_addr' ] >> 8 ] &
+                          ( self.adr[ :8 ] == ( reg[ 'c_addr' ] & 0xFF ) ) )
+      # Assemble the read value from individual bitfields.
+      val = Signal( 32, name = "%s_val"%cname, reset = 0 )
+      for bname, bits in reg[ 'bits' ].items():
+        if 'r' in bits[ 2 ]:
+          m.d.comb += val \
+            .bit_select( bits[ 0 ], bits[ 1 ] - bits[ 0 ] + 1 ) \
+            .eq( getattr( self, "%s_%s"%( cname, bname ) ) )
+      rd.append( val & Repl( sel, 32 ) )
+      # Writes are enabled; set new values on the next tick.
+      with m.If( wen & sel ):
+        for bname, bits in reg[ 'bits' ].items():
+          if 'w' in bits[ 2 ]:
+            m.d.sync += getattr( self, "%s_%s"%( cname, bname ) ) \
+              .eq( self.wd[ bits[ 0 ] : ( bits[ 1 ] + 1 ) ] )
+    # OR the selected values together, in a balanced tree.
+    # (Unrecognized addresses read as 0)
+    while len( rd ) > 1:
+      rd = [ rd[ i ] | rd[ i + 1 ] if ( i + 1 ) < len( rd ) else rd[ i ]
+             for i in range( 0, len( rd ), 2 ) ]
+    m.d.comb += self.dat_r.eq( rd[ 0 ] )
 
     # Process 32-bit CSR write logic.
     with m.If( ( self.f[ :2 ] ) == 0b01 ):
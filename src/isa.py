@@ -78,6 +78,17 @@ FF_SRL    = 0b0000000
 FF_SRA    = 0b0100000
 FF_OR     = 0b0000000
 FF_AND    = 0b0000000
+# RV32M "funct3" / "funct7" bits. The M extension's multiply and
+# divide operations are R-type operations with funct7 = 1.
+FF_MULDIV = 0b0000001
+F_MUL     = 0b000
+F_MULH    = 0b001
+F_MULHSU  = 0b010
+F_MULHU   = 0b011
+F_DIV     = 0b100
+F_DIVU    = 0b101
+F_REM     = 0b110
+F_REMU    = 0b111
 # CSR definitions, for 'ECALL' system instructions.
 # Like with other "I-type" instructions, the 'funct3' bits select
 # between different types of environment calls.
@@ -99,6 +110,11 @@ TRAP_BREAK = 3
 TRAP_LMIS  = 4
 TRAP_SMIS  = 6
 TRAP_ECALL = 11
+# ID numbers for machine-mode interrupts. These are also their bit
+# positions in the 'mie' and 'mip' CSRs.
+IRQ_MSI = 3
+IRQ_MTI = 7
+IRQ_MEI = 11
 
 # Flip a word of data.
 def FLIP( v ):
@@ -138,6 +154,11 @@ ALU_STRS = {
   ALU_SLL: "<<", ALU_SRL: ">>", ALU_SRA: ">>",
   ALU_SUB:  "-"
 }
+# String representations of the RV32M operations, by funct3.
+MULDIV_STRS = {
+  F_MUL:    "*",   F_MULH: "*h", F_MULHSU: "*hsu", F_MULHU: "*hu",
+  F_DIV:    "/",   F_DIVU: "/u", F_REM:    "%",    F_REMU:  "%u"
+}
 
 # CSR Addresses for the supported subset of 'Machine-Level ISA' CSRs.
 # Machine information registers:
@@ -162,46 +183,31 @@ CSRA_MTVAL2     = 0x34B
 # Machine counters:
 CSRA_MCYCLE           = 0xB00
 CSRA_MINSTRET         = 0xB02
+CSRA_MHPMCOUNTER3     = 0xB03
+CSRA_MCYCLEH          = 0xB80
+CSRA_MINSTRETH        = 0xB82
+CSRA_MHPMCOUNTER3H    = 0xB83
 # Machine counter setup:
 CSRA_MCOUNTINHIBIT    = 0x320
-# CSR memory map definitions.
-CSRS = {
-  'minstret': {
-    'c_addr': CSRA_MINSTRET,
-    'bits': { 'instrs': [ 0, 15, 'rw', 0 ] }
-  },
-  'mstatus': {
-    'c_addr': CSRA_MSTATUS,
-    'bits': {
-      'mie':  [ 3,  3,  'rw', 0 ],
-      'mpie': [ 7,  7,  'r',  0 ]
-     }
-  },
-  'mcause': {
-    'c_addr': CSRA_MCAUSE,
-    'bits': {
-      'interrupt': [ 31, 31, 'rw', 0 ],
-      'ecode':     [ 0, 30,  'rw', 0 ]
-    }
-  },
-  'mtval': {
-    'c_addr': CSRA_MTVAL,
-    'bits': { 'einfo': [ 0, 31, 'rw', 0 ] }
-  },
-  'mtvec': {
-    'c_addr': CSRA_MTVEC,
-    'bits': {
-      'mode': [ 0, 0,  'rw', 0 ],
-      'base': [ 2, 31, 'rw', 0 ]
-    }
-  },
-  'mepc': {
-    'c_addr': CSRA_MEPC,
-    'bits': {
-      'mepc': [ 2, 31, 'rw', 0 ]
-    }
-  },
-}
+CSRA_MHPMEVENT3       = 0x323
+
+# Performance counter events. 'mhpmeventN' selects which one
+# 'mhpmcounterN' counts, and the core drives the matching bit of
+# the CSR module's 'events' input.
+EV_NONE        = 0
+# Cycles spent waiting for an instruction fetch.
+EV_FETCH_STALL = 1
+# Cycles spent waiting for the data bus.
+EV_DBUS_STALL  = 2
+# Taken branches and jumps.
+EV_BRANCH      = 3
+# Traps.
+EV_TRAP        = 4
+# L1 I-cache and D-cache misses.
+EV_IMISS       = 5
+EV_DMISS       = 6
+EV_COUNT       = 7
+# (The CSR memory map, 'CSRS', is in 'csr.py')
 
 # R-type operation: Rc = Ra ? Rb
 # The '?' operation depends on the opcode, funct3, and funct7 bits.
@@ -211,7 +217,7 @@ def RV32I_R( op, f, ff, c, a, b ):
          ( ( f  & 0x07 ) << 12 ) |
          ( ( a  & 0x1F ) << 15 ) |
          ( ( b  & 0x1F ) << 20 ) |
-         ( ( ff & 0x7C ) << 25 ) )
+         ( ( ff & 0x7F ) << 25 ) )
 
 # I-type operation: Rc = Ra ? Immediate
 # The '?' operation depends on the opcode and funct3 bits.
@@ -230,7 +236,7 @@ def RV32I_S( op, f, a, b, i ):
          ( ( f  & 0x07 ) << 12 ) |
          ( ( a  & 0x1F ) << 15 ) |
          ( ( b  & 0x1F ) << 20 ) |
-         ( ( ( i >> 5 ) & 0x7C ) ) )
+         ( ( ( i >> 5 ) & 0x7F ) << 25 ) )
 
 # B-type operation: Branch to (PC + Immediate) if Ra ? Rb.
 # The '?' compare operation depends on the funct3 bits.
@@ -289,6 +295,23 @@ def OR( c, a, b ):
   return RV32I_R( OP_REG, F_OR, FF_OR, c, a, b )
 def AND( c, a, b ):
   return RV32I_R( OP_REG, F_AND, FF_AND, c, a, b )
+# RV32M operations:
+def MUL( c, a, b ):
+  return RV32I_R( OP_REG, F_MUL, FF_MULDIV, c, a, b )
+def MULH( c, a, b ):
+  return RV32I_R( OP_REG, F_MULH, FF_MULDIV, c, a, b )
+def MULHSU( c, a, b ):
+  return RV32I_R( OP_REG, F_MULHSU, FF_MULDIV, c, a, b )
+def MULHU( c, a, b ):
+  return RV32I_R( OP_REG, F_MULHU, FF_MULDIV, c, a, b )
+def DIV( c, a, b ):
+  return RV32I_R( OP_REG, F_DIV, FF_MULDIV, c, a, b )
+def DIVU( c, a, b ):
+  return RV32I_R( OP_REG, F_DIVU, FF_MULDIV, c, a, b )
+def REM( c, a, b ):
+  return RV32I_R( OP_REG, F_REM, FF_MULDIV, c, a, b )
+def REMU( c, a, b ):
+  return RV32I_R( OP_REG, F_REMU, FF_MULDIV, c, a, b )
 # Special case: immediate shift operations use
 # 5-bit immediates, structured as an R-type operation.
 def SLLI( c, a, i ):
@@ -359,6 +382,140 @@ def LI( c, i ):
     return LUI( c, i ), ADDI( c, c, ( i & 0x0FFF ) )
 def NOP():
   return ADDI( 0, 0, 0x000 )
+# CSR operations: rc = CSR, then write / set / clear it with ra.
+def CSRRW( c, csr, a ):
+  return RV32I_I( OP_SYSTEM, F_CSRRW, c, a, csr )
+def CSRRS( c, csr, a ):
+  return RV32I_I( OP_SYSTEM, F_CSRRS, c, a, csr )
+def CSRRC( c, csr, a ):
+  return RV32I_I( OP_SYSTEM, F_CSRRC, c, a, csr )
+# Return from a machine-mode trap or interrupt handler.
+def MRET():
+  return RV32I_I( OP_SYSTEM, F_TRAPS, 0, 0, IMM_MRET )
+# Wait for an interrupt.
+def WFI():
+  return RV32I_I( OP_SYSTEM, F_TRAPS, 0, 0, IMM_WFI )
+
+# RV32C compressed instructions. These return 16-bit values; use
+# 'rvc_img' to pack them into a ROM image with 32-bit instructions.
+# Registers in the 'popular register' forms must be x8-x15, and
+# branch / jump offsets use the same halved representation as the
+# RV32I B- and J-type helpers. Other immediates are byte values.
+def RV32C_CI( op, f, c, i ):
+  return ( ( op & 0x3 ) |
+         ( ( i & 0x1F ) << 2 ) |
+         ( ( c & 0x1F ) << 7 ) |
+         ( ( ( i >> 5 ) & 0x01 ) << 12 ) |
+         ( ( f & 0x7 ) << 13 ) )
+def RV32C_CR( op, f, c, b ):
+  return ( ( op & 0x3 ) |
+         ( ( b & 0x1F ) << 2 ) |
+         ( ( c & 0x1F ) << 7 ) |
+         ( ( f & 0xF ) << 12 ) )
+def RV32C_CL( f, c, a, i ):
+  return ( ( ( c & 0x7 ) << 2 ) |
+         ( ( ( i >> 6 ) & 0x1 ) << 5 ) |
+         ( ( ( i >> 2 ) & 0x1 ) << 6 ) |
+         ( ( a & 0x7 ) << 7 ) |
+         ( ( ( i >> 3 ) & 0x7 ) << 10 ) |
+         ( ( f & 0x7 ) << 13 ) )
+def RV32C_CA( f, c, b ):
+  return ( 0b01 |
+         ( ( b & 0x7 ) << 2 ) |
+         ( ( f & 0x3 ) << 5 ) |
+         ( ( c & 0x7 ) << 7 ) |
+         ( 0b100011 << 10 ) )
+def RV32C_CB( f, a, i ):
+  return ( 0b01 |
+         ( ( ( i >> 4 ) & 0x1 ) << 2 ) |
+         ( ( i & 0x3 ) << 3 ) |
+         ( ( ( i >> 5 ) & 0x3 ) << 5 ) |
+         ( ( a & 0x7 ) << 7 ) |
+         ( ( ( i >> 2 ) & 0x3 ) << 10 ) |
+         ( ( ( i >> 7 ) & 0x1 ) << 12 ) |
+         ( ( f & 0x7 ) << 13 ) )
+def RV32C_CJ( f, i ):
+  return ( 0b01 |
+         ( ( ( i >> 4 ) & 0x1 ) << 2 ) |
+         ( ( i & 0x7 ) << 3 ) |
+         ( ( ( i >> 6 ) & 0x1 ) << 6 ) |
+         ( ( ( i >> 5 ) & 0x1 ) << 7 ) |
+         ( ( ( i >> 9 ) & 0x1 ) << 8 ) |
+         ( ( ( i >> 7 ) & 0x3 ) << 9 ) |
+         ( ( ( i >> 3 ) & 0x1 ) << 11 ) |
+         ( ( ( i >> 10 ) & 0x1 ) << 12 ) |
+         ( ( f & 0x7 ) << 13 ) )
+# Quadrant 0:
+def C_ADDI4SPN( c, i ):
+  return ( ( ( c & 0x7 ) << 2 ) |
+         ( ( ( i >> 3 ) & 0x1 ) << 5 ) |
+         ( ( ( i >> 2 ) & 0x1 ) << 6 ) |
+         ( ( ( i >> 6 ) & 0xF ) << 7 ) |
+         ( ( ( i >> 4 ) & 0x3 ) << 11 ) )
+def C_LW( c, a, i ):
+  return RV32C_CL( 0b010, c, a, i )
+def C_SW( a, b, i ):
+  return RV32C_CL( 0b110, b, a, i )
+# Quadrant 1:
+def C_NOP():
+  return RV32C_CI( 0b01, 0b000, 0, 0 )
+def C_ADDI( c, i ):
+  return RV32C_CI( 0b01, 0b000, c, i )
+def C_JAL( i ):
+  return RV32C_CJ( 0b001, i )
+def C_LI( c, i ):
+  return RV32C_CI( 0b01, 0b010, c, i )
+def C_ADDI16SP( i ):
+  return ( RV32C_CI( 0b01, 0b011, 2, 0 ) |
+         ( ( ( i >> 5 ) & 0x1 ) << 2 ) |
+         ( ( ( i >> 7 ) & 0x3 ) << 3 ) |
+         ( ( ( i >> 6 ) & 0x1 ) << 5 ) |
+         ( ( ( i >> 4 ) & 0x1 ) << 6 ) |
+         ( ( ( i >> 9 ) & 0x1 ) << 12 ) )
+def C_LUI( c, i ):
+  return RV32C_CI( 0b01, 0b011, c, i >> 12 )
+def C_SRLI( c, i ):
+  return RV32C_CI( 0b01, 0b100, ( c & 0x7 ), i )
+def C_SRAI( c, i ):
+  return RV32C_CI( 0b01, 0b100, ( c & 0x7 ) | 0b01000, i )
+def C_ANDI( c, i ):
+  return RV32C_CI( 0b01, 0b100, ( c & 0x7 ) | 0b10000, i )
+def C_SUB( c, b ):
+  return RV32C_CA( 0b00, c, b )
+def C_XOR( c, b ):
+  return RV32C_CA( 0b01, c, b )
+def C_OR( c, b ):
+  return RV32C_CA( 0b10, c, b )
+def C_AND( c, b ):
+  return RV32C_CA( 0b11, c, b )
+def C_J( i ):
+  return RV32C_CJ( 0b101, i )
+def C_BEQZ( a, i ):
+  return RV32C_CB( 0b110, a, i )
+def C_BNEZ( a, i ):
+  return RV32C_CB( 0b111, a, i )
+# Quadrant 2:
+def C_SLLI( c, i ):
+  return RV32C_CI( 0b10, 0b000, c, i )
+def C_LWSP( c, i ):
+  return RV32C_CI( 0b10, 0b010, c, ( ( i >> 6 ) & 0x3 ) |
+                   ( ( ( i >> 2 ) & 0x7 ) << 2 ) |
+                   ( ( ( i >> 5 ) & 0x1 ) << 5 ) )
+def C_JR( a ):
+  return RV32C_CR( 0b10, 0b1000, a, 0 )
+def C_MV( c, b ):
+  return RV32C_CR( 0b10, 0b1000, c, b )
+def C_EBREAK():
+  return RV32C_CR( 0b10, 0b1001, 0, 0 )
+def C_JALR( a ):
+  return RV32C_CR( 0b10, 0b1001, a, 0 )
+def C_ADD( c, b ):
+  return RV32C_CR( 0b10, 0b1001, c, b )
+def C_SWSP( b, i ):
+  return ( 0b10 | ( ( b & 0x1F ) << 2 ) |
+         ( ( ( i >> 6 ) & 0x3 ) << 7 ) |
+         ( ( ( i >> 2 ) & 0xF ) << 9 ) |
+         ( 0b110 << 13 ) )
 
 # Helper method to assemble a ROM image from a mix of instructions
 # and assembly pseudo-operations.
@@ -371,6 +528,22 @@ def rom_img( arr ):
     else:
       a.append( i )
   return a
+# Helper method to assemble a ROM image from a mix of 16-bit RV32C
+# instructions, 32-bit instructions, and assembly pseudo-operations.
+# (32-bit instructions can start at any halfword, and an odd number
+#  of halfwords is padded with a C.NOP)
+def rvc_img( arr ):
+  h = []
+  for i in rom_img( arr ):
+    if i <= 0xFFFF:
+      h.append( i )
+    else:
+      w = LITTLE_END( i )
+      h += [ w & 0xFFFF, w >> 16 ]
+  if len( h ) % 2:
+    h.append( C_NOP() )
+  return [ LITTLE_END( h[ j ] | ( h[ j + 1 ] << 16 ) )
+           for j in range( 0, len( h ), 2 ) ]
 # Helper method to assemble a RAM image for a test program.
 def ram_img( arr ):
   a = []
@@ -0,0 +1,406 @@
+import sys
+sys.path.append("..")
+
+from src.isa import *
+from src.csr import *
+
+#############################################################
+# RV32IM instruction set simulator.                         #
+# A pure-Python model of the machine which the cores        #
+# implement: ROM at 0x00000000, RAM at 0x20000000, and the  #
+# CSRs which the CSR module has. ('csr_map') It isn't       #
+# cycle-accurate, so 'mcycle' counts retired instructions   #
+# like 'minstret', and the 'mhpmcounterN' CSRs don't count. #
+# Instructions which trap don't retire.                     #
+# Peripherals aren't modelled: their addresses read as 0    #
+# and ignore writes, and there are no interrupts.           #
+# Each instruction word is decoded once, into a handler     #
+# which executes it and returns the next PC. Handlers are   #
+# cached by address, and stores to a cached word drop it.   #
+# Behaviour follows the cores where the spec leaves a       #
+# choice: unknown CSRs read as 0 and ignore writes, loads   #
+# and stores only trap if they cross a word boundary,       #
+# vectored 'mtvec' applies to exceptions as well, and MRET  #
+# sets 'mstatus.MIE'.                                       #
+#############################################################
+
+M32 = 0xFFFFFFFF
+
+# Sign-extend an 'n'-bit value.
+def sext( v, n ):
+  return v - ( ( v & ( 1 << ( n - 1 ) ) ) << 1 )
+
+# Signed 32-bit value of a register.
+def s32( v ):
+  return ( v ^ 0x80000000 ) - 0x80000000
+
+# Decoded instruction handlers by address, which decodes and
+# caches the instruction at an address the first time it is used.
+class HandlerCache( dict ):
+  def __init__( self, iss ):
+    self.iss = iss
+
+  def __missing__( self, pc ):
+    h = self.iss.decode( pc )
+    self[ pc ] = h
+    return h
+
+class ISS():
+  def __init__( self, rom, ram = [], ram_words = 1024, csrs = None ):
+    # ROM and RAM contents, as bytes. Image words are stored in the
+    # same byte order as the ROM module and the testbenches use.
+    self.rom = bytearray( b''.join( w.to_bytes( 4, 'big' )
+                                    for w in rom ) )
+    self.ram = bytearray( ram_words * 4 )
+    for i in range( len( ram ) ):
+      self.ram[ i * 4 : i * 4 + 4 ] = ram[ i ].to_bytes( 4, 'big' )
+    # Registers and program counter.
+    self.x = [ 0 ] * 32
+    self.pc = 0x00000000
+    # Retired instruction count once 'run' finishes, and the loop
+    # which 'run' is going through. (See 'instret')
+    self.end  = 0
+    self.loop = None
+    # CSRs: [ value, writable bits ] by address. ('rh' fields are
+    # interrupt inputs, which stay clear)
+    self.csrs = {}
+    for cname, reg in ( csrs or csr_map() ).items():
+      val = 0
+      wmask = 0
+      for bname, bits in reg[ 'bits' ].items():
+        mask = ( ( 1 << ( bits[ 1 ] - bits[ 0 ] + 1 ) ) - 1 ) << bits[ 0 ]
+        if 'h' not in bits[ 2 ]:
+          val |= ( bits[ 3 ] << bits[ 0 ] ) & mask
+        if 'w' in bits[ 2 ]:
+          wmask |= mask
+      self.csrs[ reg[ 'c_addr' ] ] = [ val, wmask ]
+    # Decoded instruction handlers, by address.
+    self.cache = HandlerCache( self )
+
+  # Retired instruction count. 'run' doesn't count instructions as
+  # it goes: while it runs, this is worked out from how many of its
+  # loop's iterations are left, counting the current instruction
+  # as not retired yet.
+  @property
+  def instret( self ):
+    if self.loop is None:
+      return self.end
+    return self.end - self.loop.__length_hint__() - 1
+
+  @instret.setter
+  def instret( self, v ):
+    if self.loop is None:
+      self.end = v
+    else:
+      self.end = v + self.loop.__length_hint__() + 1
+
+  # Read an 'n'-byte value from memory.
+  def load( self, adr, n ):
+    if ( adr >> 29 ) == 0:
+      return int.from_bytes( self.rom[ adr : adr + n ], 'little' )
+    elif ( adr >> 29 ) == 1:
+      off = adr & 0x1FFFFFFF
+      return int.from_bytes( self.ram[ off : off + n ], 'little' )
+    return 0
+
+  # Write an 'n'-byte value to memory. (The ROM is read-only)
+  def store( self, adr, n, v ):
+    if ( adr >> 29 ) == 1:
+      off = adr & 0x1FFFFFFF
+      if ( off + n ) <= len( self.ram ):
+        self.ram[ off : off + n ] = ( v & ( ( 1 << ( n * 8 ) ) - 1 ) ) \
+                                    .to_bytes( n, 'little' )
+        self.cache.pop( adr & ~3, None )
+
+  # Read a CSR. Unknown addresses read as 0.
+  def read_csr( self, adr ):
+    if adr in [ CSRA_MCYCLE, CSRA_MINSTRET ]:
+      return self.instret & M32
+    if adr in [ CSRA_MCYCLEH, CSRA_MINSTRETH ]:
+      return ( self.instret >> 32 ) & M32
+    return self.csrs.get( adr, [ 0, 0 ] )[ 0 ]
+
+  # Write a CSR's writable bits. Unknown addresses ignore writes.
+  def write_csr( self, adr, v ):
+    if adr in [ CSRA_MCYCLE, CSRA_MINSTRET ]:
+      self.instret = ( self.instret & ~M32 ) | ( v & M32 )
+    elif adr in [ CSRA_MCYCLEH, CSRA_MINSTRETH ]:
+      self.instret = ( self.instret & M32 ) | ( ( v & M32 ) << 32 )
+    elif adr in self.csrs:
+      c = self.csrs[ adr ]
+      c[ 0 ] = ( c[ 0 ] & ~c[ 1 ] ) | ( v & c[ 1 ] )
+
+  # Enter a trap handler. Returns the handler's address. (The
+  # instruction which traps doesn't count as retired)
+  def trap( self, cause, epc ):
+    self.end -= 1
+    self.write_csr( CSRA_MCAUSE, cause )
+    self.write_csr( CSRA_MEPC, epc )
+    self.write_csr( CSRA_MSTATUS, self.read_csr( CSRA_MSTATUS ) & ~0x8 )
+    mtvec = self.read_csr( CSRA_MTVEC )
+    return ( ( mtvec & ~3 ) + ( ( cause << 2 ) if mtvec & 1 else 0 ) ) & M32
+
+  # Run one instruction.
+  def step( self ):
+    self.run( 1 )
+
+  # Run 'n' instructions.
+  def run( self, n ):
+    cache = self.cache
+    pc = self.pc
+    self.end += n
+    self.loop = loop = iter( range( n ) )
+    try:
+      for i in loop:
+        pc = cache[ pc ]()
+    finally:
+      self.loop = None
+      self.pc = pc
+
+  # Decode the instruction at 'pc' into a handler.
+  def decode( self, pc ):
+    return self.decode_word( pc, self.load( pc, 4 ) )
+
+  # Build the handler for instruction word 'ir' at address 'pc'.
+  def decode_word( self, pc, ir ):
+    x   = self.x
+    nxt = ( pc + 4 ) & M32
+    op  = ir & 0x7F
+    rd  = ( ir >> 7 ) & 0x1F
+    f3  = ( ir >> 12 ) & 0x7
+    rs1 = ( ir >> 15 ) & 0x1F
+    rs2 = ( ir >> 20 ) & 0x1F
+    f7  = ir >> 25
+    imm_i = sext( ir >> 20, 12 )
+    imm_s = sext( ( ( ir >> 25 ) << 5 ) | rd, 12 )
+    imm_b = sext( ( ( ( ir >> 31 ) & 1 ) << 12 ) |
+                  ( ( ( ir >> 7 ) & 1 ) << 11 ) |
+                  ( ( ( ir >> 25 ) & 0x3F ) << 5 ) |
+                  ( ( ( ir >> 8 ) & 0xF ) << 1 ), 13 )
+    imm_j = sext( ( ( ( ir >> 31 ) & 1 ) << 20 ) |
+                  ( ( ( ir >> 12 ) & 0xFF ) << 12 ) |
+                  ( ( ( ir >> 20 ) & 1 ) << 11 ) |
+                  ( ( ( ir >> 21 ) & 0x3FF ) << 1 ), 21 )
+    trap = self.trap
+
+    # Trap on a jump to the mis-aligned address 'tgt'. (The jump
+    # doesn't write its destination register)
+    def misaligned( tgt ):
+      self.write_csr( CSRA_MTVAL, tgt )
+      return trap( TRAP_IMIS, pc )
+
+    # Illegal instruction.
+    def illegal():
+      return trap( TRAP_ILLI, pc )
+
+    # LUI / AUIPC
+    if op in [ OP_LUI, OP_AUIPC ]:
+      v = ( ( ir & 0xFFFFF000 ) + ( pc if op == OP_AUIPC else 0 ) ) & M32
+      if rd == 0:
+        return lambda: nxt
+      def h():
+        x[ rd ] = v
+        return nxt
+      return h
+
+    # JAL / JALR
+    if op == OP_JAL:
+      tgt = ( pc + imm_j ) & M32
+      if tgt & 3:
+        return lambda: misaligned( tgt )
+      def h():
+        if rd:
+          x[ rd ] = nxt
+        return tgt
+      return h
+    if op == OP_JALR and f3 == F_JALR:
+      def h():
+        tgt = ( x[ rs1 ] + imm_i ) & ( M32 - 1 )
+        if tgt & 3:
+          return misaligned( tgt )
+        if rd:
+          x[ rd ] = nxt
+        return tgt
+      return h
+
+    # Conditional branches.
+    if op == OP_BRANCH and f3 not in [ 0b010, 0b011 ]:
+      tgt = ( pc + imm_b ) & M32
+      if tgt & 3:
+        taken = lambda: misaligned( tgt )
+      else:
+        taken = lambda: tgt
+      if f3 == F_BEQ:
+        return lambda: taken() if x[ rs1 ] == x[ rs2 ] else nxt
+      if f3 == F_BNE:
+        return lambda: taken() if x[ rs1 ] != x[ rs2 ] else nxt
+      if f3 == F_BLT:
+        return lambda: taken() if s32( x[ rs1 ] ) < s32( x[ rs2 ] ) \
+                       else nxt
+      if f3 == F_BGE:
+        return lambda: taken() if s32( x[ rs1 ] ) >= s32( x[ rs2 ] ) \
+                       else nxt
+      if f3 == F_BLTU:
+        return lambda: taken() if x[ rs1 ] < x[ rs2 ] else nxt
+      return lambda: taken() if x[ rs1 ] >= x[ rs2 ] else nxt
+
+    # Loads and stores. Accesses which cross a word boundary trap.
+    if op == OP_LOAD and f3 in [ F_LB, F_LH, F_LW, F_LBU, F_LHU ]:
+      n = 1 << ( f3 & 3 )
+      sign = ( f3 & 4 ) == 0 and n < 4
+      load = self.load
+      def h():
+        adr = ( x[ rs1 ] + imm_i ) & M32
+        if ( adr & 3 ) + n > 4:
+          return trap( TRAP_LMIS, pc )
+        v = load( adr, n )
+        if rd:
+          x[ rd ] = ( sext( v, n * 8 ) & M32 ) if sign else v
+        return nxt
+      return h
+    if op == OP_STORE and f3 in [ F_SB, F_SH, F_SW ]:
+      n = 1 << f3
+      store = self.store
+      def h():
+        adr = ( x[ rs1 ] + imm_s ) & M32
+        if ( adr & 3 ) + n > 4:
+          return trap( TRAP_SMIS, pc )
+        store( adr, n, x[ rs2 ] )
+        return nxt
+      return h
+
+    # Register-immediate ALU operations. The immediate is folded
+    # into the handler.
+    if op == OP_IMM:
+      i = imm_i & M32
+      if f3 == F_SLLI:
+        if f7 != 0:
+          return illegal
+        fn = lambda a: ( a << rs2 ) & M32
+      elif f3 == F_SRLI:
+        if f7 == 0:
+          fn = lambda a: a >> rs2
+        elif f7 == FF_SRAI:
+          fn = lambda a: ( s32( a ) >> rs2 ) & M32
+        else:
+          return illegal
+      else:
+        fn = {
+          F_ADDI:  lambda a: ( a + i ) & M32,
+          F_SLTI:  lambda a: int( s32( a ) < s32( i ) ),
+          F_SLTIU: lambda a: int( a < i ),
+          F_XORI:  lambda a: a ^ i,
+          F_ORI:   lambda a: a | i,
+          F_ANDI:  lambda a: a & i
+        }[ f3 ]
+      if rd == 0:
+        return lambda: nxt
+      # (ADDI is the most common instruction, so skip the call)
+      if f3 == F_ADDI:
+        def h():
+          x[ rd ] = ( x[ rs1 ] + i ) & M32
+          return nxt
+        return h
+      def h():
+        x[ rd ] = fn( x[ rs1 ] )
+        return nxt
+      return h
+
+    # Register-register ALU operations.
+    if op == OP_REG and f7 in [ FF_ADD, FF_SUB ]:
+      if f7 == FF_SUB and f3 not in [ F_SUB, F_SRA ]:
+        return illegal
+      fn = {
+        F_ADD:  ( lambda a, b: ( a - b ) & M32 ) if f7 else
+                ( lambda a, b: ( a + b ) & M32 ),
+        F_SLL:  lambda a, b: ( a << ( b & 31 ) ) & M32,
+        F_SLT:  lambda a, b: int( s32( a ) < s32( b ) ),
+        F_SLTU: lambda a, b: int( a < b ),
+        F_XOR:  lambda a, b: a ^ b,
+        F_SRL:  ( lambda a, b: ( s32( a ) >> ( b & 31 ) ) & M32 ) if f7
+                else ( lambda a, b: a >> ( b & 31 ) ),
+        F_OR:   lambda a, b: a | b,
+        F_AND:  lambda a, b: a & b
+      }[ f3 ]
+      if rd == 0:
+        return lambda: nxt
+      def h():
+        x[ rd ] = fn( x[ rs1 ], x[ rs2 ] )
+        return nxt
+      return h
+
+    # RV32M multiply / divide operations.
+    if op == OP_REG and f7 == FF_MULDIV:
+      def div( a, b ):
+        if b == 0:
+          return -1
+        if a == -0x80000000 and b == -1:
+          return a
+        q = abs( a ) // abs( b )
+        return -q if ( a < 0 ) != ( b < 0 ) else q
+      def rem( a, b ):
+        if b == 0:
+          return a
+        if a == -0x80000000 and b == -1:
+          return 0
+        r = abs( a ) % abs( b )
+        return -r if a < 0 else r
+      fn = {
+        F_MUL:    lambda a, b: a * b,
+        F_MULH:   lambda a, b: ( s32( a ) * s32( b ) ) >> 32,
+        F_MULHSU: lambda a, b: ( s32( a ) * b ) >> 32,
+        F_MULHU:  lambda a, b: ( a * b ) >> 32,
+        F_DIV:    lambda a, b: div( s32( a ), s32( b ) ),
+        F_DIVU:   lambda a, b: ( a // b ) if b else M32,
+        F_REM:    lambda a, b: rem( s32( a ), s32( b ) ),
+        F_REMU:   lambda a, b: ( a % b ) if b else a
+      }[ f3 ]
+      if rd == 0:
+        return lambda: nxt
+      def h():
+        x[ rd ] = fn( x[ rs1 ], x[ rs2 ] ) & M32
+        return nxt
+      return h
+
+    # FENCE: there are no caches to manage.
+    if op == OP_FENCE:
+      return lambda: nxt
+
+    # System instructions: ECALL, EBREAK, MRET, WFI, and CSRs.
+    if op == OP_SYSTEM:
+      imm = ir >> 20
+      if f3 == F_TRAPS:
+        if ( rd | rs1 ) != 0:
+          return illegal
+        if imm == 0x000:
+          return lambda: trap( TRAP_ECALL, pc )
+        if imm == 0x001:
+          return lambda: trap( TRAP_BREAK, pc )
+        if imm == IMM_MRET:
+          def h():
+            self.write_csr( CSRA_MSTATUS,
+                            self.read_csr( CSRA_MSTATUS ) | 0x8 )
+            return self.read_csr( CSRA_MEPC )
+          return h
+        # (Without interrupts, WFI can return straight away)
+        if imm == IMM_WFI:
+          return lambda: nxt
+        return illegal
+      if ( f3 & 3 ) == 0:
+        return illegal
+      read_csr  = self.read_csr
+      write_csr = self.write_csr
+      # 'Set' and 'clear' with a zero operand don't write the CSR.
+      def h():
+        v = read_csr( imm )
+        s = rs1 if f3 & 4 else x[ rs1 ]
+        if ( f3 & 3 ) == 1:
+          write_csr( imm, s )
+        elif s != 0:
+          write_csr( imm, ( v | s ) if ( f3 & 3 ) == 2 else ( v & ~s ) )
+        if rd:
+          x[ rd ] = v
+        return nxt
+      return h
+
+    return illegal
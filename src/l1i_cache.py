@@ -0,0 +1,213 @@
+from amaranth import *
+from math import ceil, log2
+from amaranth.back import *
+from amaranth_soc.memory import *
+from amaranth_soc.wishbone import *
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+
+#############################################################
+# L1 instruction cache.                                     #
+# Sits between a core's instruction fetch logic and the     #
+# 'inst_mux' bus. Hits are acknowledged on the cycle after  #
+# the address is presented; misses refill a whole line from #
+# the instruction bus before the fetch is acknowledged.     #
+# The cache is read-only, so 'flush' only has to clear the  #
+# 'valid' bits. (The cores pulse it on FENCE / FENCE.I)     #
+# Each memory window behind 'inst_mux' must hold at least   #
+# one whole line, since refills read every word of a line.  #
+# With 'burst' set, each refill is one incrementing burst,  #
+# which the RAM and ROM modules answer with a word on every #
+# cycle. (Only set it if every memory on the bus supports   #
+# bursts; SPI_Flash does not)                               #
+#############################################################
+
+class L1I_Cache( Elaboratable ):
+  def __init__( self, size = 1024, line = 16, ways = 1, burst = False ):
+    # Cache geometry: total size and line size in bytes, and
+    # the number of ways in each set.
+    self.size  = size
+    self.line  = line
+    self.ways  = ways
+    self.words = line // 4
+    self.sets  = size // ( line * ways )
+    # Address fields: | tag | set index | word offset | 00 |
+    self.obits = int( log2( line ) )
+    self.ibits = int( log2( self.sets ) )
+    self.tbits = 32 - self.obits - self.ibits
+    # Refill lines with Wishbone bursts.
+    self.burst = burst
+
+    # Tag and data storage for each way.
+    self.tags  = [ Memory( width = self.tbits, depth = self.sets,
+                           init = ( 0 for i in range( self.sets ) ) )
+                   for w in range( ways ) ]
+    self.lines = [ Memory( width = 32, depth = self.sets * self.words,
+                           init = ( 0 for i in range( self.sets *
+                                                      self.words ) ) )
+                   for w in range( ways ) ]
+
+    # 'Flush' input: invalidate every line.
+    self.flush  = Signal( 1, reset = 0 )
+    # Hit / miss counters, and a 'miss' strobe for the core's
+    # performance counters.
+    self.hits   = Signal( 32, reset = 0 )
+    self.misses = Signal( 32, reset = 0 )
+    self.miss   = Signal( 1, reset = 0 )
+
+    # Wishbone bus which the core fetches instructions through.
+    self.bus = Interface( addr_width = 32, data_width = 32 )
+    self.bus.memory_map = MemoryMap( addr_width = self.bus.addr_width,
+                                     data_width = self.bus.data_width,
+                                     alignment = 0 )
+    # Wishbone bus which lines are refilled from. (This should be
+    # connected to the 'inst_mux' bus)
+    self.mbus = Interface( addr_width = 32, data_width = 32,
+                           features = { "cti", "bte" } )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    adr  = self.bus.adr
+    aset = adr[ self.obits : self.obits + self.ibits ]
+    atag = adr[ self.obits + self.ibits : 32 ]
+    vbits = max( 1, ceil( log2( self.ways ) ) )
+
+    # Line which is being refilled, and the next word to read.
+    radr = Signal( 32, reset = 0x00000000 )
+    rset = radr[ self.obits : self.obits + self.ibits ]
+    wc   = Signal( range( self.words + 1 ), reset = 0 )
+    # The line being refilled was invalidated by a flush.
+    stale = Signal( 1, reset = 0 )
+    # The core stopped waiting for the line being refilled.
+    abandon = Signal( 1, reset = 0 )
+    # The next lookup follows a refill, so it isn't counted as a hit.
+    refilled = Signal( 1, reset = 0 )
+    # Valid bits and tag matches for each way.
+    valid = [ Signal( self.sets, reset = 0, name = "valid_%d"%w )
+              for w in range( self.ways ) ]
+    hit   = Signal( self.ways, reset = 0 )
+    # Way which hit on the last cycle. (Selects the word to return)
+    lhit  = Signal( self.ways, reset = 0 )
+    m.d.sync += lhit.eq( hit )
+
+    # Replacement: fill an empty way if there is one, otherwise
+    # take turns between the ways of each set.
+    rr     = Signal( self.sets * vbits, reset = 0 )
+    choose = Signal( vbits, reset = 0 )
+    victim = Signal( vbits, reset = 0 )
+    m.d.comb += choose.eq( rr.word_select( aset, vbits ) )
+    for w in reversed( range( self.ways ) ):
+      with m.If( valid[ w ].bit_select( aset, 1 ) == 0 ):
+        m.d.comb += choose.eq( w )
+
+    for w in range( self.ways ):
+      # Tags are read asynchronously so that a hit can be detected
+      # on the same cycle that the address is presented; the data
+      # read port is synchronous, and holds the word for 'adr'.
+      tr = self.tags[ w ].read_port( domain = "comb" )
+      tw = self.tags[ w ].write_port()
+      dr = self.lines[ w ].read_port()
+      dw = self.lines[ w ].write_port()
+      m.submodules[ "tr%d"%w ] = tr
+      m.submodules[ "tw%d"%w ] = tw
+      m.submodules[ "dr%d"%w ] = dr
+      m.submodules[ "dw%d"%w ] = dw
+      m.d.comb += [
+        # Look up the address on the fetch bus.
+        tr.addr.eq( aset ),
+        dr.addr.eq( adr[ 2 : self.obits + self.ibits ] ),
+        hit[ w ].eq( valid[ w ].bit_select( aset, 1 ) &
+                     ( tr.data == atag ) ),
+        # Refill writes go to the victim way.
+        tw.addr.eq( rset ),
+        tw.data.eq( radr[ self.obits + self.ibits : 32 ] ),
+        dw.addr.eq( Cat( wc[ : self.obits - 2 ], rset ) ),
+        dw.data.eq( self.mbus.dat_r )
+      ]
+      # Return the word from whichever way hit.
+      with m.If( lhit[ w ] ):
+        m.d.comb += self.bus.dat_r.eq( dr.data )
+      with m.If( victim == w ):
+        m.d.comb += [
+          dw.en.eq( self.mbus.ack ),
+          tw.en.eq( self.mbus.ack & ( wc == self.words - 1 ) )
+        ]
+
+    # 'ack' is registered, like the ROM and RAM modules, so a core
+    # can drop 'cyc' in response to it without forming a loop.
+    m.d.sync += self.bus.ack.eq( 0 )
+    with m.FSM():
+      # Wait for a fetch, and refill the line if it misses.
+      with m.State( "LOOKUP" ):
+        with m.If( self.bus.cyc & ~self.bus.ack ):
+          with m.If( hit != 0 ):
+            m.d.sync += [
+              self.bus.ack.eq( 1 ),
+              self.hits.eq( self.hits + ( refilled == 0 ) ),
+              refilled.eq( 0 )
+            ]
+          with m.Else():
+            m.d.comb += self.miss.eq( 1 )
+            m.d.sync += [
+              self.misses.eq( self.misses + 1 ),
+              radr.eq( Cat( Repl( 0, self.obits ),
+                            adr[ self.obits : 32 ] ) ),
+              victim.eq( choose ),
+              rr.word_select( aset, vbits ).eq(
+                Mux( choose == self.ways - 1, 0, choose + 1 ) ),
+              wc.eq( 0 ),
+              stale.eq( 0 ),
+              abandon.eq( 0 )
+            ]
+            # The victim's old line is gone as soon as the first
+            # word is overwritten.
+            for w in range( self.ways ):
+              with m.If( choose == w ):
+                m.d.sync += valid[ w ].bit_select( aset, 1 ).eq( 0 )
+            m.next = "REFILL"
+      # Read the line one word at a time. 'cyc' is released as
+      # soon as 'ack' arrives so that each word is a new request,
+      # or held for the whole line in a burst. If the core gives
+      # up on the fetch (after a redirect) the refill stops once
+      # the word on the bus arrives; the SPI Flash can't abandon a
+      # read part-way through.
+      with m.State( "REFILL" ):
+        m.d.comb += self.mbus.adr.eq( Cat( Repl( 0, 2 ),
+                                           wc[ : self.obits - 2 ],
+                                           radr[ self.obits : 32 ] ) )
+        if self.burst:
+          m.d.comb += [
+            self.mbus.cyc.eq( 1 ),
+            self.mbus.cti.eq( Mux( ( wc == self.words - 1 ) | abandon |
+                                   ( self.bus.cyc == 0 ),
+                                   CycleType.END_OF_BURST,
+                                   CycleType.INCR_BURST ) )
+          ]
+        else:
+          m.d.comb += self.mbus.cyc.eq( ~self.mbus.ack )
+        with m.If( self.bus.cyc == 0 ):
+          m.d.sync += abandon.eq( 1 )
+        with m.If( self.mbus.ack ):
+          m.d.sync += wc.eq( wc + 1 )
+          with m.If( wc == self.words - 1 ):
+            for w in range( self.ways ):
+              with m.If( victim == w ):
+                m.d.sync += valid[ w ].bit_select( rset, 1 ).eq( ~stale )
+            m.d.sync += refilled.eq( ~abandon & self.bus.cyc )
+            m.next = "LOOKUP"
+          with m.Elif( abandon | ( self.bus.cyc == 0 ) ):
+            m.next = "LOOKUP"
+
+    # Invalidate every line on a flush. If a refill is underway,
+    # it finishes but its line is not marked as valid.
+    with m.If( self.flush ):
+      m.d.sync += stale.eq( 1 )
+      for w in range( self.ways ):
+        m.d.sync += valid[ w ].eq( 0 )
+
+    # End of L1 I-cache module definition.
+    return m
@@ -0,0 +1,358 @@
+from amaranth import *
+from math import ceil, log2
+from amaranth.back import *
+from amaranth_soc.memory import *
+from amaranth_soc.wishbone import *
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+from src.ram import *
+
+#############################################################
+# Shared (unified) L2 cache.                                #
+# Sits behind the L1 I- and D-caches (or the core's buses   #
+# directly) and in front of the 'data_mux' bus. Each master #
+# gets its own bus from 'new_bus', like the RAM and ROM     #
+# modules, and a round-robin arbiter picks one access at a  #
+# time, so there is only one refill / write-back port to    #
+# the ROM (or SPI Flash) and RAM. It is write-back and      #
+# write-allocate, and 'dw' works like the RAM's.            #
+# Hits are acknowledged on the cycle after the access is    #
+# presented, so an L1 refills each word in two cycles.      #
+# Victims are picked by a tree pseudo-LRU: each set keeps   #
+# one bit per node of a binary tree over its ways, which    #
+# points away from the half that was used most recently.    #
+# Addresses at or above 0x40000000 (peripherals) bypass the #
+# cache. Each memory window behind 'data_mux' must hold at  #
+# least one whole line.                                     #
+# With 'burst' set, each refill and write-back is one       #
+# incrementing burst, which the RAM and ROM modules answer  #
+# with a word on every cycle. (Only set it if every memory  #
+# on the bus supports bursts; SPI_Flash does not)           #
+#############################################################
+
+class L2S_Cache( Elaboratable ):
+  def __init__( self, size = 4096, line = 16, ways = 4, burst = False ):
+    # Cache geometry: total size and line size in bytes, and
+    # the number of ways in each set. (A power of two)
+    self.size  = size
+    self.line  = line
+    self.ways  = ways
+    self.words = line // 4
+    self.sets  = size // ( line * ways )
+    # Address fields: | tag | set index | word offset | 00 |
+    self.obits = int( log2( line ) )
+    self.ibits = int( log2( self.sets ) )
+    self.tbits = 32 - self.obits - self.ibits
+    # Refill and write back lines with Wishbone bursts.
+    self.burst = burst
+
+    # Tag and data storage for each way. Data is written one
+    # byte lane at a time.
+    self.tags  = [ Memory( width = self.tbits, depth = self.sets,
+                           init = ( 0 for i in range( self.sets ) ) )
+                   for w in range( ways ) ]
+    self.lines = [ Memory( width = 32, depth = self.sets * self.words,
+                           init = ( 0 for i in range( self.sets *
+                                                      self.words ) ) )
+                   for w in range( ways ) ]
+    # Valid and dirty bits for each way.
+    self.valid = [ Signal( self.sets, reset = 0, name = "valid_%d"%w )
+                   for w in range( ways ) ]
+    self.dirty = [ Signal( self.sets, reset = 0, name = "dirty_%d"%w )
+                   for w in range( ways ) ]
+
+    # Hit / miss / write-back counters.
+    self.hits       = Signal( 32, reset = 0 )
+    self.misses     = Signal( 32, reset = 0 )
+    self.writebacks = Signal( 32, reset = 0 )
+
+    # Width of stores on the arbitrated bus.
+    # (See 'RAM_DW_*' in 'src/ram.py')
+    self.dw   = Signal( 3, reset = 0b000 )
+    # Initialize Wishbone bus arbiter.
+    self.arb  = Arbiter( addr_width = 32, data_width = 32 )
+    self.arb.bus.memory_map = MemoryMap(
+      addr_width = self.arb.bus.addr_width,
+      data_width = self.arb.bus.data_width,
+      alignment = 0 )
+    # Wishbone bus which lines are refilled from and written back
+    # to, and the store width for that bus. (These should be
+    # connected to the 'data_mux' bus and the RAM's 'dw' input)
+    self.mbus = Interface( addr_width = 32, data_width = 32,
+                           features = { "cti", "bte" } )
+    self.mdw  = Signal( 3, reset = 0b000 )
+
+  def new_bus( self ):
+    # Initialize a new Wishbone bus interface.
+    bus = Interface( addr_width = self.arb.bus.addr_width,
+                     data_width = self.arb.bus.data_width )
+    bus.memory_map = MemoryMap( addr_width = bus.addr_width,
+                                data_width = bus.data_width,
+                                alignment = 0 )
+    self.arb.add( bus )
+    return bus
+
+  def elaborate( self, platform ):
+    m = Module()
+    m.submodules.arb = self.arb
+
+    bus  = self.arb.bus
+    adr  = bus.adr
+    aset = adr[ self.obits : self.obits + self.ibits ]
+    atag = adr[ self.obits + self.ibits : 32 ]
+    vbits = max( 1, ceil( log2( self.ways ) ) )
+    # The access goes around the cache.
+    bypass = Signal()
+    m.d.comb += bypass.eq( adr[ 30 : 32 ] != 0 )
+
+    # Line being refilled, line being written back, and a word
+    # counter for either.
+    radr = Signal( 32, reset = 0x00000000 )
+    wadr = Signal( 32, reset = 0x00000000 )
+    rset = radr[ self.obits : self.obits + self.ibits ]
+    wset = wadr[ self.obits : self.obits + self.ibits ]
+    wc   = Signal( range( self.words + 1 ), reset = 0 )
+    # The word being written back is ready on the read port.
+    wrdy = Signal( 1, reset = 0 )
+    # The next lookup follows a refill, so it isn't counted as a hit.
+    refilled = Signal( 1, reset = 0 )
+    # Read data for an access which bypassed the cache.
+    udat = Signal( 32, reset = 0x00000000 )
+    lbyp = Signal( 1, reset = 0 )
+    m.d.sync += lbyp.eq( 0 )
+    # Tag matches, and the way which hit on the last cycle.
+    hit  = Signal( self.ways, reset = 0 )
+    lhit = Signal( self.ways, reset = 0 )
+    m.d.sync += lhit.eq( hit )
+    # Byte offset of the last access. (For load data alignment)
+    loff = Signal( 2, reset = 0 )
+    m.d.sync += loff.eq( adr[ :2 ] )
+
+    # Byte lanes for a store hit, using the same rules as the RAM
+    # module: halfwords can't start in the last byte of a word,
+    # and words must be aligned.
+    lanes = Signal( 4, reset = 0 )
+    with m.Switch( self.dw ):
+      with m.Case( RAM_DW_8 ):
+        m.d.comb += lanes.eq( 0b0001 << adr[ :2 ] )
+      with m.Case( RAM_DW_16 ):
+        m.d.comb += lanes.eq( Mux( adr[ :2 ] == 3, 0,
+                                   0b0011 << adr[ :2 ] ) )
+      with m.Case():
+        m.d.comb += lanes.eq( Mux( adr[ :2 ] == 0, 0b1111, 0 ) )
+
+    # Pseudo-LRU tree bits, 'ways - 1' per set. Node 'n' has
+    # children '2n + 1' (bit = 0) and '2n + 2' (bit = 1), and
+    # each way's path from the root is fixed, so both the victim
+    # search and the update are unrolled here.
+    lbits  = max( 1, self.ways - 1 )
+    plru   = Signal( self.sets * lbits, reset = 0 )
+    paths  = []
+    for w in range( self.ways ):
+      node = 0
+      path = []
+      for level in reversed( range( vbits if self.ways > 1 else 0 ) ):
+        bit = ( w >> level ) & 1
+        path.append( ( node, bit ) )
+        node = ( node * 2 ) + 1 + bit
+      paths.append( path )
+    # Replacement: fill an empty way if there is one, otherwise
+    # follow the tree bits to the least recently used way.
+    choose = Signal( vbits, reset = 0 )
+    victim = Signal( vbits, reset = 0 )
+    for w in range( self.ways ):
+      follow = Const( 1, 1 )
+      for node, bit in paths[ w ]:
+        follow = follow & ( plru.bit_select( ( aset * lbits ) + node,
+                                             1 ) == bit )
+      with m.If( follow ):
+        m.d.comb += choose.eq( w )
+    for w in reversed( range( self.ways ) ):
+      with m.If( self.valid[ w ].bit_select( aset, 1 ) == 0 ):
+        m.d.comb += choose.eq( w )
+
+    # Storage ports for each way.
+    tr = []
+    tw = []
+    dr = []
+    dw = []
+    for w in range( self.ways ):
+      # Tags are read asynchronously so that a hit can be detected
+      # on the same cycle that the address is presented; the data
+      # read port is synchronous.
+      tr.append( self.tags[ w ].read_port( domain = "comb" ) )
+      tw.append( self.tags[ w ].write_port() )
+      dr.append( self.lines[ w ].read_port() )
+      dw.append( self.lines[ w ].write_port( granularity = 8 ) )
+      m.submodules[ "tr%d"%w ] = tr[ w ]
+      m.submodules[ "tw%d"%w ] = tw[ w ]
+      m.submodules[ "dr%d"%w ] = dr[ w ]
+      m.submodules[ "dw%d"%w ] = dw[ w ]
+      m.d.comb += [
+        # Look up the address on the bus by default.
+        tr[ w ].addr.eq( aset ),
+        dr[ w ].addr.eq( adr[ 2 : self.obits + self.ibits ] ),
+        hit[ w ].eq( self.valid[ w ].bit_select( aset, 1 ) &
+                     ( tr[ w ].data == atag ) & ~bypass ),
+        # Refills write the tag of the line being refilled.
+        tw[ w ].addr.eq( rset ),
+        tw[ w ].data.eq( radr[ self.obits + self.ibits : 32 ] )
+      ]
+      # Return load data from whichever way hit.
+      with m.If( lhit[ w ] ):
+        m.d.comb += bus.dat_r.eq( dr[ w ].data >> ( loff << 3 ) )
+    with m.If( lbyp ):
+      m.d.comb += bus.dat_r.eq( udat )
+
+    m.d.sync += bus.ack.eq( 0 )
+    with m.FSM():
+      # Wait for an access from whichever master was granted.
+      with m.State( "LOOKUP" ):
+        with m.If( bus.cyc & ~bus.ack ):
+          with m.If( bypass ):
+            m.next = "UNCACHED"
+          # Hit: acknowledge on the next cycle and point the tree
+          # bits away from the way that hit. Stores write their
+          # byte lanes now and mark the line as dirty.
+          with m.Elif( hit != 0 ):
+            m.d.sync += [
+              bus.ack.eq( 1 ),
+              self.hits.eq( self.hits + ( refilled == 0 ) ),
+              refilled.eq( 0 )
+            ]
+            for w in range( self.ways ):
+              with m.If( hit[ w ] ):
+                for node, bit in paths[ w ]:
+                  m.d.sync += plru.bit_select( ( aset * lbits ) + node,
+                                               1 ).eq( 1 - bit )
+                with m.If( bus.we ):
+                  m.d.comb += [
+                    dw[ w ].addr.eq( adr[ 2 : self.obits + self.ibits ] ),
+                    dw[ w ].data.eq(
+                      ( bus.dat_w << ( adr[ :2 ] << 3 ) )[ :32 ] ),
+                    dw[ w ].en.eq( lanes )
+                  ]
+                  m.d.sync += self.dirty[ w ].bit_select( aset, 1 ).eq( 1 )
+          # Miss: write the victim line back if it is dirty, then
+          # refill it with the line that was accessed.
+          with m.Else():
+            m.d.sync += [
+              self.misses.eq( self.misses + 1 ),
+              radr.eq( Cat( Repl( 0, self.obits ),
+                            adr[ self.obits : 32 ] ) ),
+              victim.eq( choose ),
+              wc.eq( 0 ),
+              wrdy.eq( 0 )
+            ]
+            m.next = "REFILL"
+            for w in range( self.ways ):
+              with m.If( choose == w ):
+                m.d.sync += [
+                  self.valid[ w ].bit_select( aset, 1 ).eq( 0 ),
+                  wadr.eq( Cat( Repl( 0, self.obits ), aset,
+                                tr[ w ].data ) )
+                ]
+                with m.If( self.valid[ w ].bit_select( aset, 1 ) &
+                           self.dirty[ w ].bit_select( aset, 1 ) ):
+                  m.next = "WRITEBACK"
+
+      # Pass the access straight through to the data bus.
+      with m.State( "UNCACHED" ):
+        m.d.comb += [
+          self.mbus.adr.eq( adr ),
+          self.mbus.dat_w.eq( bus.dat_w ),
+          self.mbus.we.eq( bus.we ),
+          self.mdw.eq( self.dw ),
+          self.mbus.cyc.eq( ~self.mbus.ack )
+        ]
+        with m.If( self.mbus.ack ):
+          m.d.sync += [
+            bus.ack.eq( 1 ),
+            udat.eq( self.mbus.dat_r ),
+            lbyp.eq( 1 )
+          ]
+          m.next = "LOOKUP"
+
+      # Write the victim line back one word at a time. Each word
+      # is read from the line storage on the cycle before it is
+      # put on the bus. In a burst, the next word is read as soon
+      # as the current one is acknowledged.
+      with m.State( "WRITEBACK" ):
+        m.d.sync += wrdy.eq( 1 )
+        m.d.comb += [
+          self.mbus.adr.eq( Cat( Repl( 0, 2 ), wc[ : self.obits - 2 ],
+                                 wadr[ self.obits : 32 ] ) ),
+          self.mbus.we.eq( 1 ),
+          self.mdw.eq( RAM_DW_32 )
+        ]
+        if self.burst:
+          rwc = Mux( self.mbus.ack, wc + 1, wc )
+          m.d.comb += [
+            self.mbus.cyc.eq( wrdy ),
+            self.mbus.cti.eq( Mux( wc == self.words - 1,
+                                   CycleType.END_OF_BURST,
+                                   CycleType.INCR_BURST ) )
+          ]
+        else:
+          rwc = wc
+          m.d.comb += self.mbus.cyc.eq( wrdy & ~self.mbus.ack )
+        for w in range( self.ways ):
+          m.d.comb += dr[ w ].addr.eq( Cat( rwc[ : self.obits - 2 ],
+                                            wset ) )
+          with m.If( victim == w ):
+            m.d.comb += self.mbus.dat_w.eq( dr[ w ].data )
+        with m.If( self.mbus.ack ):
+          m.d.sync += wc.eq( wc + 1 )
+          if not self.burst:
+            m.d.sync += wrdy.eq( 0 )
+          with m.If( wc == self.words - 1 ):
+            m.d.sync += [
+              self.writebacks.eq( self.writebacks + 1 ),
+              wc.eq( 0 )
+            ]
+            for w in range( self.ways ):
+              with m.If( victim == w ):
+                m.d.sync += self.dirty[ w ].bit_select( wset, 1 ).eq( 0 )
+            m.next = "REFILL"
+
+      # Read the new line one word at a time. 'cyc' is released as
+      # soon as 'ack' arrives so that each word is a new request,
+      # or held for the whole line in a burst.
+      with m.State( "REFILL" ):
+        m.d.comb += self.mbus.adr.eq( Cat( Repl( 0, 2 ),
+                                           wc[ : self.obits - 2 ],
+                                           radr[ self.obits : 32 ] ) )
+        if self.burst:
+          m.d.comb += [
+            self.mbus.cyc.eq( 1 ),
+            self.mbus.cti.eq( Mux( wc == self.words - 1,
+                                   CycleType.END_OF_BURST,
+                                   CycleType.INCR_BURST ) )
+          ]
+        else:
+          m.d.comb += self.mbus.cyc.eq( ~self.mbus.ack )
+        for w in range( self.ways ):
+          with m.If( victim == w ):
+            m.d.comb += [
+              dw[ w ].addr.eq( Cat( wc[ : self.obits - 2 ], rset ) ),
+              dw[ w ].data.eq( self.mbus.dat_r ),
+              dw[ w ].en.eq( Repl( self.mbus.ack, 4 ) ),
+              tw[ w ].en.eq( self.mbus.ack & ( wc == self.words - 1 ) )
+            ]
+        with m.If( self.mbus.ack ):
+          m.d.sync += wc.eq( wc + 1 )
+          with m.If( wc == self.words - 1 ):
+            for w in range( self.ways ):
+              with m.If( victim == w ):
+                m.d.sync += [
+                  self.valid[ w ].bit_select( rset, 1 ).eq( 1 ),
+                  self.dirty[ w ].bit_select( rset, 1 ).eq( 0 )
+                ]
+            m.d.sync += refilled.eq( 1 )
+            m.next = "LOOKUP"
+
+    # End of L2 cache module definition.
+    return m
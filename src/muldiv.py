@@ -0,0 +1,132 @@
+from amaranth import *
+from math import log2
+from .isa import *
+
+#############################################################
+# RV32M multiply / divide unit.                             #
+# 'start' latches the operands and the operation ('funct3'  #
+# of the instruction), and the result appears on 'y' once   #
+# 'busy' is clear. It stays there until the next 'start'.   #
+# * Multiplies: a 33x33 signed multiplier with a registered #
+#   output, which maps onto DSP blocks. It takes one cycle. #
+# * Divides: an iterative restoring divider, which works on #
+#   the operands' magnitudes and fixes the signs at the     #
+#   end. 'radix' 2 finds one quotient bit per cycle, and 4  #
+#   finds two. Leading zeros in the dividend are skipped,   #
+#   and division by zero or by a larger divisor finishes in #
+#   one cycle.                                              #
+#############################################################
+class MulDiv( Elaboratable ):
+  def __init__( self, radix = 4 ):
+    # Divider radix (2 or 4), and quotient bits found per cycle.
+    self.radix = radix
+    self.kbits = int( log2( radix ) )
+    # 'A' and 'B' data inputs.
+    self.a = Signal( 32, reset = 0x00000000 )
+    self.b = Signal( 32, reset = 0x00000000 )
+    # 'F' function select input. (The RV32M 'funct3' bits)
+    self.f = Signal( 3, reset = 0b000 )
+    # 'Start' input: begin an operation with the current inputs.
+    self.start = Signal( 1, reset = 0 )
+    # 'Busy' output: a division is in progress.
+    self.busy = Signal( 1, reset = 0 )
+    # 'Y' data output.
+    self.y = Signal( 32, reset = 0x00000000 )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    a = self.a
+    b = self.b
+    f = self.f
+
+    # Multiplier: sign-extend each operand by one bit if the
+    # operation treats it as signed, so that MULHSU works too.
+    ma   = Cat( a, a[ 31 ] & ( ( f == F_MULH ) | ( f == F_MULHSU ) ) )
+    mb   = Cat( b, b[ 31 ] & ( f == F_MULH ) )
+    prod = Signal( 66, reset = 0 )
+    m.d.comb += prod.eq( ma.as_signed() * mb.as_signed() )
+
+    # Divider operands: magnitudes, and whether they were negative.
+    sa = Signal( 1, reset = 0 )
+    sb = Signal( 1, reset = 0 )
+    ua = Signal( 32, reset = 0x00000000 )
+    ub = Signal( 32, reset = 0x00000000 )
+    m.d.comb += [
+      sa.eq( ~f[ 0 ] & a[ 31 ] ),
+      sb.eq( ~f[ 0 ] & b[ 31 ] ),
+      ua.eq( Mux( sa, -a, a ) ),
+      ub.eq( Mux( sb, -b, b ) )
+    ]
+    # Leading zeros in the dividend, rounded down to a whole number
+    # of divider steps.
+    lz = Signal( range( 33 ), reset = 32 )
+    for i in range( 32 ):
+      with m.If( ua[ i ] ):
+        m.d.comb += lz.eq( 31 - i )
+    shift = Signal( range( 33 ), reset = 0 )
+    m.d.comb += shift.eq( ( lz >> ( self.kbits - 1 ) ) << ( self.kbits - 1 ) )
+
+    # Divider state: partial remainder, dividend / quotient shift
+    # register, divisor, steps left, and the result signs.
+    rem   = Signal( 32, reset = 0x00000000 )
+    quo   = Signal( 32, reset = 0x00000000 )
+    dvs   = Signal( 32, reset = 0x00000000 )
+    steps = Signal( range( 33 ), reset = 0 )
+    nq    = Signal( 1, reset = 0 )
+    nr    = Signal( 1, reset = 0 )
+    isrem = Signal( 1, reset = 0 )
+
+    # One cycle's worth of divider steps: shift the next dividend
+    # bit into the remainder, and subtract the divisor if it fits.
+    r = rem
+    q = quo
+    for i in range( self.kbits ):
+      t  = Cat( q[ 31 ], r )
+      ge = ( t >= dvs )
+      r  = Mux( ge, t - dvs, t )[ :32 ]
+      q  = Cat( ge, q[ :31 ] )
+    nrem = Signal( 32, reset = 0x00000000 )
+    nquo = Signal( 32, reset = 0x00000000 )
+    m.d.comb += [
+      nrem.eq( r ),
+      nquo.eq( q )
+    ]
+
+    with m.If( self.busy ):
+      m.d.sync += [
+        rem.eq( nrem ),
+        quo.eq( nquo ),
+        steps.eq( steps - 1 )
+      ]
+      with m.If( steps == 1 ):
+        m.d.sync += [
+          self.busy.eq( 0 ),
+          self.y.eq( Mux( isrem, Mux( nr, -nrem, nrem ),
+                                 Mux( nq, -nquo, nquo ) ) )
+        ]
+    with m.Elif( self.start ):
+      with m.If( f[ 2 ] == 0 ):
+        m.d.sync += self.y.eq( Mux( f == F_MUL, prod[ :32 ],
+                                                prod[ 32 : 64 ] ) )
+      # Division by zero: the quotient is all ones, and the
+      # remainder is the dividend.
+      with m.Elif( b == 0 ):
+        m.d.sync += self.y.eq( Mux( f[ 1 ], a, 0xFFFFFFFF ) )
+      # Divisor larger than the dividend: the quotient is zero.
+      with m.Elif( ua < ub ):
+        m.d.sync += self.y.eq( Mux( f[ 1 ], a, 0 ) )
+      with m.Else():
+        m.d.sync += [
+          self.busy.eq( 1 ),
+          rem.eq( 0 ),
+          quo.eq( ua << shift ),
+          dvs.eq( ub ),
+          steps.eq( ( 32 - shift ) >> ( self.kbits - 1 ) ),
+          nq.eq( sa ^ sb ),
+          nr.eq( sa ),
+          isrem.eq( f[ 1 ] )
+        ]
+
+    # End of multiply / divide unit definition.
+    return m
@@ -0,0 +1,409 @@
+from amaranth import *
+from amaranth.back import *
+from amaranth.sim import *
+
+import os
+import sys
+import warnings
+sys.path.append("..")
+
+from src.alu import *
+from src.csr import *
+from src.muldiv import *
+from src.isa import *
+from src.spi_flash import *
+from src.rom import *
+from src.rv_mem import *
+
+# Multi-cycle core: one instruction at a time, stepped through
+# by a state machine.
+# * FETCH:     read the instruction word. The register file is
+#              read as the word arrives, so there is no separate
+#              'decode' state.
+# * EXECUTE:   run the ALU, resolve jumps and branches, perform
+#              CSR / system accesses, and write ALU results back.
+# * MULDIV:    RV32M operations only: wait for the multiply /
+#              divide unit, and write its result back.
+# * MEM:       loads and stores only: access the data bus.
+# * WRITEBACK: loads only: write the loaded value back.
+# An ALU instruction takes its fetch plus one cycle, a store
+# adds its data bus access, and a load adds one more cycle. It
+# is a drop-in replacement for 'CPU' which needs less logic than
+# the pipelined core.
+class multiple_cycle_core( Elaboratable ):
+  def __init__( self, rom_module, icache = None, dcache = None,
+                l2cache = None, prefetch = None, fast_ram = False,
+                shifter = SHIFT_FLIP ):
+    # 'Reset' signal for clock domains.
+    self.clk_rst = Signal( reset = 0b0, reset_less = True )
+    # Program Counter register: the address of the instruction
+    # being executed.
+    self.pc = Signal( 32, reset = 0x00000000 )
+    # Instruction register.
+    self.ir = Signal( 32, reset = 0x00000000 )
+    # Load result register.
+    self.ld = Signal( 32, reset = 0x00000000 )
+    # The main 32 CPU registers.
+    self.register_file = Memory( width = 32, depth = 32,
+                          init = ( 0x00000000 for i in range( 32 ) ) )
+
+    # CPU submodules:
+    # Memory access ports for rs1 (ra), rs2 (rb), and rd (rc).
+    self.ra     = self.register_file.read_port()
+    self.rb     = self.register_file.read_port()
+    self.rc     = self.register_file.write_port()
+    # The ALU submodule which performs logical operations.
+    # 'shifter' selects its shifter configuration.
+    self.alu    = ALU( shifter )
+    # CSR 'system registers'.
+    self.csr    = CSR()
+    # RV32M multiply / divide unit.
+    self.muldiv = MulDiv()
+    # Memory module to hold peripherals and ROM / RAM module(s)
+    # (4KB of RAM = 1024 words), optional L1 I- / D-caches, and an
+    # optional shared L2 cache and ROM prefetch buffer. 'fast_ram'
+    # selects the RAM's single-cycle acknowledgement mode.
+    self.mem    = RV_Memory( rom_module, 1024, icache, dcache,
+                             l2cache, prefetch, fast_ram )
+
+  # Helper method to enter a trap handler: jump to the appropriate
+  # address, and set the MCAUSE / MEPC / MTVAL CSRs. The instruction
+  # which traps doesn't retire, so this fetches the handler's first
+  # instruction without calling 'retire'.
+  def trigger_trap( self, m, trap_num, tval = 0 ):
+    m.d.comb += self.csr.events[ EV_TRAP ].eq( 1 )
+    m.next = "FETCH"
+    m.d.sync += [
+      # Set mcause, mepc, mtval, interrupt context flag.
+      self.csr.mcause_interrupt.eq( 0 ),
+      self.csr.mcause_ecode.eq( trap_num ),
+      self.csr.mepc_mepc.eq( self.pc[ 2 : 32 ] ),
+      self.csr.mtval_einfo.eq( tval ),
+      # Disable interrupts globally until MRET or CSR write.
+      self.csr.mstatus_mie.eq( 0 ),
+      # Set the program counter to the interrupt handler address.
+      self.pc.eq( Cat( Repl( 0, 2 ),
+                     ( self.csr.mtvec_base +
+                       Mux( self.csr.mtvec_mode, trap_num, 0 ) ) ) )
+    ]
+
+  # Helper method to finish the current instruction.
+  def retire( self, m ):
+    m.d.comb += self.csr.retire.eq( 1 )
+    m.next = "FETCH"
+
+  # CPU object's 'elaborate' method to generate the hardware logic.
+  def elaborate( self, platform ):
+    # Core CPU module.
+    m = Module()
+    # Register the ALU, CSR, multiply / divide, and memory
+    # submodules.
+    m.submodules.alu    = self.alu
+    m.submodules.csr    = self.csr
+    m.submodules.mem    = self.mem
+    m.submodules.muldiv = self.muldiv
+    # Register the CPU register read/write ports.
+    m.submodules.ra  = self.ra
+    m.submodules.rb  = self.rb
+    m.submodules.rc  = self.rc
+
+    ir  = self.ir
+    pc  = self.pc
+    a   = self.ra.data
+    b   = self.rb.data
+    # Sign-extended immediate values for each encoding format.
+    imm_i = Cat( ir[ 20 : 32 ], Repl( ir[ 31 ], 20 ) )
+    imm_s = Cat( ir[ 7 : 12 ], ir[ 25 : 32 ], Repl( ir[ 31 ], 20 ) )
+    imm_b = Cat( Repl( 0, 1 ), ir[ 8 : 12 ], ir[ 25 : 31 ], ir[ 7 ],
+                 Repl( ir[ 31 ], 20 ) )
+    imm_j = Cat( Repl( 0, 1 ), ir[ 21 : 31 ], ir[ 20 ], ir[ 12 : 20 ],
+                 Repl( ir[ 31 ], 12 ) )
+    # Load / store address.
+    adr = Signal( 32, reset = 0x00000000 )
+    m.d.comb += adr.eq( a + Mux( ir[ 5 ], imm_s, imm_i ) )
+
+    # The register file is read with the address fields of the
+    # word on the instruction bus while it is fetched, and of the
+    # instruction register after that.
+    fetching = Signal()
+    m.d.comb += [
+      self.ra.addr.eq( Mux( fetching, self.mem.ibus.dat_r[ 15 : 20 ],
+                            ir[ 15 : 20 ] ) ),
+      self.rb.addr.eq( Mux( fetching, self.mem.ibus.dat_r[ 20 : 25 ],
+                            ir[ 20 : 25 ] ) ),
+      self.rc.addr.eq( ir[ 7 : 12 ] ),
+      # Instruction bus address is always set to the program counter.
+      self.mem.ibus.adr.eq( pc ),
+      # The CSR inputs are always wired the same.
+      self.csr.dat_w.eq( Mux( ir[ 14 ] == 0, a,
+                              Cat( ir[ 15 : 20 ], Repl( 0, 27 ) ) ) ),
+      self.csr.f.eq( ir[ 12 : 15 ] ),
+      self.csr.adr.eq( ir[ 20 : 32 ] ),
+      # Data bus address, store data and width are always wired
+      # the same.
+      self.mem.dbus.adr.eq( adr ),
+      self.mem.dbus.dat_w.eq( b ),
+      self.mem.dw.eq( ir[ 12 : 15 ] ),
+      # So are the multiply / divide unit's inputs.
+      self.muldiv.a.eq( a ),
+      self.muldiv.b.eq( b ),
+      self.muldiv.f.eq( ir[ 12 : 15 ] )
+    ]
+    muldiv = ( ir[ 0 : 7 ] == OP_REG ) & ( ir[ 25 : 32 ] == FF_MULDIV )
+
+    # Performance counter events: cycles spent waiting for the
+    # buses, and cache misses.
+    m.d.comb += [
+      self.csr.events[ EV_FETCH_STALL ].eq(
+        self.mem.ibus.cyc & ~self.mem.ibus.ack ),
+      self.csr.events[ EV_DBUS_STALL ].eq(
+        self.mem.dbus.cyc & ~self.mem.dbus.ack )
+    ]
+    if self.mem.icache is not None:
+      m.d.comb += self.csr.events[ EV_IMISS ].eq( self.mem.icache.miss )
+    if self.mem.dcache is not None:
+      m.d.comb += self.csr.events[ EV_DMISS ].eq( self.mem.dcache.miss )
+
+    # ALU inputs and register write-back value for the instruction
+    # in EXECUTE.
+    with m.Switch( ir[ 0 : 7 ] ):
+      # LUI / AUIPC: 20 upper bits, +pc for AUIPC.
+      with m.Case( '0-10111' ):
+        m.d.comb += self.rc.data.eq( Mux( ir[ 5 ], 0, pc ) +
+                                     Cat( Repl( 0, 12 ), ir[ 12 : 32 ] ) )
+
+      # JAL / JALR: link to the next instruction.
+      with m.Case( '110-111' ):
+        m.d.comb += self.rc.data.eq( pc + 4 )
+
+      # Conditional branches: the ALU performs the comparison.
+      # BEQ / BNE: use SUB ALU operation to check equality.
+      # BLT / BGE / BLTU / BGEU: use SLT or SLTU ALU operation.
+      with m.Case( OP_BRANCH ):
+        m.d.comb += [
+          self.alu.a.eq( a ),
+          self.alu.b.eq( b ),
+          self.alu.f.eq( Mux( ir[ 14 ], Cat( ir[ 13 ], 0b001 ), 0b1000 ) )
+        ]
+
+      # Loads: write back the loaded value.
+      with m.Case( OP_LOAD ):
+        m.d.comb += self.rc.data.eq( self.ld )
+
+      # R-type ALU operation: rc = ra ? rb
+      with m.Case( OP_REG ):
+        # RV32M operations: rc = the multiply / divide unit's result.
+        with m.If( ir[ 25 : 32 ] == FF_MULDIV ):
+          m.d.comb += self.rc.data.eq( self.muldiv.y )
+        # Implement left shifts using the right shift ALU operation,
+        # unless the ALU has its own left shifter.
+        with m.Elif( ( ir[ 12 : 15 ] == 0b001 ) & self.alu.flip ):
+          m.d.comb += [
+            self.alu.a.eq( FLIP( a ) ),
+            self.alu.f.eq( 0b0101 ),
+            self.rc.data.eq( FLIP( self.alu.y ) )
+          ]
+        with m.Else():
+          m.d.comb += [
+            self.alu.a.eq( a ),
+            self.alu.f.eq( Cat( ir[ 12 : 15 ], ir[ 30 ] ) ),
+            self.rc.data.eq( self.alu.y )
+          ]
+        m.d.comb += self.alu.b.eq( b )
+
+      # I-type ALU operation: rc = ra ? immediate
+      with m.Case( OP_IMM ):
+        with m.If( ir[ 12 : 14 ] == 0b01 ):
+          with m.If( ( ir[ 14 ] == 0 ) & self.alu.flip ):
+            m.d.comb += [
+              self.alu.a.eq( FLIP( a ) ),
+              self.alu.f.eq( 0b0101 ),
+              self.rc.data.eq( FLIP( self.alu.y ) )
+            ]
+          with m.Else():
+            m.d.comb += [
+              self.alu.a.eq( a ),
+              self.alu.f.eq( Cat( ir[ 12 : 15 ], ir[ 30 ] ) ),
+              self.rc.data.eq( self.alu.y )
+            ]
+        with m.Else():
+          m.d.comb += [
+            self.alu.a.eq( a ),
+            self.alu.f.eq( ir[ 12 : 15 ] ),
+            self.rc.data.eq( self.alu.y )
+          ]
+        m.d.comb += self.alu.b.eq( imm_i )
+
+      # CSR accesses: write back the old CSR value.
+      with m.Case( OP_SYSTEM ):
+        m.d.comb += self.rc.data.eq( self.csr.dat_r )
+
+    # Main state machine.
+    with m.FSM():
+      # Fetch the next instruction. Release 'cyc' as soon as 'ack'
+      # arrives, so that the memories see a fresh request next time.
+      with m.State( "FETCH" ):
+        m.d.comb += [
+          fetching.eq( 1 ),
+          self.mem.ibus.cyc.eq( ~self.mem.ibus.ack )
+        ]
+        with m.If( self.mem.ibus.ack ):
+          m.d.sync += ir.eq( self.mem.ibus.dat_r )
+          m.next = "EXECUTE"
+
+      # Execute the instruction, and retire it unless it accesses
+      # the data bus.
+      with m.State( "EXECUTE" ):
+        # Move on to the next instruction unless otherwise specified.
+        m.d.sync += pc.eq( pc + 4 )
+        with m.Switch( ir[ 0 : 7 ] ):
+          # LUI / AUIPC / R-type / I-type instructions: write the
+          # result to the destination register. RV32M operations
+          # start the multiply / divide unit instead.
+          with m.Case( '0-10-11' ):
+            with m.If( muldiv ):
+              m.d.comb += self.muldiv.start.eq( 1 )
+              m.next = "MULDIV"
+            with m.Else():
+              m.d.comb += self.rc.en.eq( self.rc.addr != 0 )
+              self.retire( m )
+
+          # JAL / JALR: jump to a new address and place the 'return
+          # PC' in the destination register. Jumping to a mis-aligned
+          # address traps on the jump itself.
+          with m.Case( '110-111' ):
+            jt = Signal( 32, reset = 0x00000000 )
+            m.d.comb += jt.eq( Mux( ir[ 3 ], pc + imm_j,
+              Cat( Repl( 0, 1 ), ( a + imm_i )[ 1 : 32 ] ) ) )
+            with m.If( jt[ :2 ] != 0 ):
+              self.trigger_trap( m, TRAP_IMIS, jt )
+            with m.Else():
+              m.d.sync += pc.eq( jt )
+              m.d.comb += [
+                self.rc.en.eq( self.rc.addr != 0 ),
+                self.csr.events[ EV_BRANCH ].eq( 1 )
+              ]
+              self.retire( m )
+            # Stop the ROM prefetch buffer reading ahead.
+            if self.mem.iprefetch is not None:
+              m.d.comb += self.mem.iprefetch.flush.eq( 1 )
+
+          # Conditional branches: only jump if the condition is met.
+          # (If the ALU result is zero: a == b for BEQ / BNE, or
+          #  a >= b for BLT[U] / BGE[U])
+          with m.Case( OP_BRANCH ):
+            with m.If( ( ( self.alu.y == 0 ) ^ ir[ 12 ] ) != ir[ 14 ] ):
+              with m.If( ( pc + imm_b )[ :2 ] != 0 ):
+                self.trigger_trap( m, TRAP_IMIS, pc + imm_b )
+              with m.Else():
+                m.d.sync += pc.eq( pc + imm_b )
+                m.d.comb += self.csr.events[ EV_BRANCH ].eq( 1 )
+                self.retire( m )
+              if self.mem.iprefetch is not None:
+                m.d.comb += self.mem.iprefetch.flush.eq( 1 )
+            with m.Else():
+              self.retire( m )
+
+          # Loads / stores: trap if the address is mis-aligned, or
+          # access the data bus.
+          with m.Case( '0-00011' ):
+            with m.If( ( ( ir[ 12 : 14 ] == 0b01 ) & adr[ 0 ] ) |
+                       ( ( ir[ 12 : 14 ] == 0b10 ) &
+                         ( adr[ :2 ] != 0 ) ) ):
+              self.trigger_trap( m,
+                Cat( Repl( 0, 1 ), ir[ 5 ], Repl( 1, 1 ) ), adr )
+            with m.Else():
+              m.d.sync += pc.eq( pc )
+              m.next = "MEM"
+
+          # System instructions: ECALL, EBREAK, MRET, WFI, and atomic
+          # CSR reads / writes.
+          with m.Case( OP_SYSTEM ):
+            with m.If( ir[ 12 : 15 ] == F_TRAPS ):
+              with m.Switch( ir[ 20 : 22 ] ):
+                with m.Case( 0 ):
+                  self.trigger_trap( m, TRAP_ECALL )
+                # (WFI shares EBREAK's low bits. This core doesn't
+                #  take interrupts, so WFI retires as a nop)
+                with m.Case( 1 ):
+                  with m.If( ir[ 20 : 32 ] == IMM_WFI ):
+                    self.retire( m )
+                  with m.Else():
+                    self.trigger_trap( m, TRAP_BREAK )
+                with m.Case( 2 ):
+                  m.d.sync += [
+                    self.csr.mstatus_mie.eq( 1 ),
+                    pc.eq( Cat( Repl( 0, 2 ), self.csr.mepc_mepc ) )
+                  ]
+                  self.retire( m )
+                with m.Default():
+                  self.retire( m )
+            with m.Else():
+              m.d.comb += [
+                self.rc.en.eq( self.rc.addr != 0 ),
+                self.csr.we.eq( 1 )
+              ]
+              self.retire( m )
+
+          # FENCE: the D-cache writes its dirty lines back, and then
+          # the I-cache is invalidated. (Without caches, there is
+          # nothing to wait for)
+          with m.Case( OP_FENCE ):
+            flushed = 1
+            if self.mem.dcache is not None:
+              flushed = self.mem.dcache.flushed
+              m.d.comb += self.mem.dcache.flush.eq( 1 )
+            if self.mem.icache is not None:
+              m.d.comb += self.mem.icache.flush.eq( flushed )
+            with m.If( flushed ):
+              self.retire( m )
+            with m.Else():
+              m.d.sync += pc.eq( pc )
+
+          # Anything else is treated as a no-op.
+          with m.Default():
+            self.retire( m )
+
+      # Wait for the multiply / divide unit, and write its result
+      # back.
+      with m.State( "MULDIV" ):
+        with m.If( ~self.muldiv.busy ):
+          m.d.comb += self.rc.en.eq( self.rc.addr != 0 )
+          self.retire( m )
+
+      # Access the data bus. Stores retire once they are
+      # acknowledged; loads sign- or zero-extend the returned
+      # byte / halfword and write it back on the next cycle.
+      with m.State( "MEM" ):
+        dat_r = self.mem.dbus.dat_r
+        m.d.comb += [
+          self.mem.dbus.cyc.eq( ~self.mem.dbus.ack ),
+          self.mem.dbus.we.eq( ir[ 5 ] )
+        ]
+        with m.If( self.mem.dbus.ack ):
+          m.d.sync += self.ld.bit_select( 0, 8 ).eq( dat_r[ :8 ] )
+          with m.If( ir[ 12 ] ):
+            m.d.sync += [
+              self.ld.bit_select( 8, 8 ).eq( dat_r[ 8 : 16 ] ),
+              self.ld.bit_select( 16, 16 ).eq(
+                Repl( ( ir[ 14 ] == 0 ) & dat_r[ 15 ], 16 ) )
+            ]
+          with m.Elif( ir[ 13 ] ):
+            m.d.sync += self.ld.bit_select( 8, 24 ).eq( dat_r[ 8 : 32 ] )
+          with m.Else():
+            m.d.sync += self.ld.bit_select( 8, 24 ).eq(
+              Repl( ( ir[ 14 ] == 0 ) & dat_r[ 7 ], 24 ) )
+          with m.If( ir[ 5 ] ):
+            m.d.sync += pc.eq( pc + 4 )
+            self.retire( m )
+          with m.Else():
+            m.next = "WRITEBACK"
+
+      # Write a loaded value back to the destination register.
+      with m.State( "WRITEBACK" ):
+        m.d.comb += self.rc.en.eq( self.rc.addr != 0 )
+        m.d.sync += pc.eq( pc + 4 )
+        self.retire( m )
+
+    # End of CPU module definition.
+    return m
@@ -0,0 +1,15 @@
+import importlib
+
+# Pipeline stages for 'src/pipeline_core.py'.
+# 'if' is a Python keyword, so the fetch stage has to be loaded
+# through importlib instead of a normal import statement.
+_if = importlib.import_module( ".if", __name__ )
+IF2ID_LAYOUT = _if.IF2ID_LAYOUT
+IF_Stage     = _if.IF_Stage
+
+from .id  import *
+from .ex  import *
+from .mem import *
+from .wb  import *
+from .hazard import *
+from .bp  import *
@@ -0,0 +1,258 @@
+from amaranth import *
+from math import log2
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+
+#############################################################
+# Branch predictor for the IF stage.                        #
+# IF looks at each instruction word as it arrives, and asks #
+# the predictor where the next fetch should come from. EX   #
+# reports every branch and jump as it resolves, so that the #
+# tables can learn and the misprediction counters can be    #
+# kept. A misprediction redirects the front end from EX,    #
+# exactly like an unpredicted jump. Modes:                  #
+# * BP_NONE:    always fetch the next word.                 #
+# * BP_BTFN:    static; backward branches are taken, and    #
+#               forward branches are not.                   #
+# * BP_BIMODAL: a table of 2-bit saturating counters,       #
+#               indexed by the branch's address.            #
+# * BP_BTB:     bimodal, plus a direct-mapped branch target #
+#               buffer for JALR targets and a return        #
+#               address stack for JALR returns.             #
+# Every mode except BP_NONE follows JAL, whose target is in #
+# the instruction word. With the C extension, IF passes in  #
+# expanded instructions, and says which were 16 bits long.  #
+#############################################################
+
+# Predictor modes.
+BP_NONE    = 0
+BP_BTFN    = 1
+BP_BIMODAL = 2
+BP_BTB     = 3
+
+# Is 'r' a link register? (x1 / x5, per the RISC-V calling
+# convention's return address hints)
+def LINK_REG( r ):
+  return ( r == 1 ) | ( r == 5 )
+
+class Branch_Predictor( Elaboratable ):
+  def __init__( self, mode = BP_NONE, bht_size = 64, btb_size = 8,
+                ras_depth = 4 ):
+    # Predictor mode and table sizes. (Powers of two)
+    self.mode      = mode
+    self.bht_size  = bht_size
+    self.btb_size  = btb_size
+    self.ras_depth = ras_depth
+    self.bbits = int( log2( bht_size ) )
+    self.tbits = int( log2( btb_size ) )
+
+    # Lookup: the address and word of the instruction which IF
+    # just fetched, and the predicted address of the next one.
+    self.pc    = Signal( 32, reset = 0x00000000 )
+    self.ir    = Signal( 32, reset = 0x00000000 )
+    self.npc   = Signal( 32, reset = 0x00000000 )
+    # 'Fire' input: IF accepted the word, so the return address
+    # stack should be updated for it.
+    self.fire  = Signal( 1, reset = 0 )
+    # 'RVC' input: the instruction is 16 bits long. 'C ext' input:
+    # instructions only need to be halfword-aligned.
+    self.rvc   = Signal( 1, reset = 0 )
+    self.c_ext = Signal( 1, reset = 0 )
+
+    # Update: a branch or jump resolved in EX. 'taken' is its real
+    # direction, 'target' its real target, and 'miss' is set if the
+    # predicted next address was wrong.
+    self.resolve = Signal( 1, reset = 0 )
+    self.rpc     = Signal( 32, reset = 0x00000000 )
+    self.rir     = Signal( 32, reset = 0x00000000 )
+    self.taken   = Signal( 1, reset = 0 )
+    self.target  = Signal( 32, reset = 0x00000000 )
+    self.miss    = Signal( 1, reset = 0 )
+    # 'Flush' input: EX redirected the front end, so the return
+    # address stack is rolled back to its last resolved state.
+    self.flush   = Signal( 1, reset = 0 )
+
+    # Counters: conditional branches and jumps which resolved, and
+    # how many of each were mispredicted.
+    self.branches      = Signal( 32, reset = 0 )
+    self.branch_misses = Signal( 32, reset = 0 )
+    self.jumps         = Signal( 32, reset = 0 )
+    self.jump_misses   = Signal( 32, reset = 0 )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    # Address of the next instruction in program order.
+    fall = Signal( 32, reset = 0x00000000 )
+    m.d.comb += fall.eq( self.pc + Mux( self.rvc, 2, 4 ) )
+
+    ir  = self.ir
+    rir = self.rir
+    # Immediates and instruction types for the word being fetched.
+    bimm = Cat( Repl( 0, 1 ), ir[ 8 : 12 ], ir[ 25 : 31 ], ir[ 7 ],
+                Repl( ir[ 31 ], 20 ) )
+    jimm = Cat( Repl( 0, 1 ), ir[ 21 : 31 ], ir[ 20 ], ir[ 12 : 20 ],
+                Repl( ir[ 31 ], 12 ) )
+    br   = ( ir[ 0 : 7 ] == OP_BRANCH )
+    jal  = ( ir[ 0 : 7 ] == OP_JAL )
+    jalr = ( ir[ 0 : 7 ] == OP_JALR )
+    # Calls push their return address, and returns pop it.
+    push = ( jal | jalr ) & LINK_REG( ir[ 7 : 12 ] )
+    pop  = jalr & LINK_REG( ir[ 15 : 20 ] ) & ~LINK_REG( ir[ 7 : 12 ] )
+    rbr  = ( rir[ 0 : 7 ] == OP_BRANCH )
+    rjalr = ( rir[ 0 : 7 ] == OP_JALR )
+    rpush = ( ( rir[ 0 : 7 ] == OP_JAL ) | rjalr ) & \
+            LINK_REG( rir[ 7 : 12 ] )
+    rpop  = rjalr & LINK_REG( rir[ 15 : 20 ] ) & \
+            ~LINK_REG( rir[ 7 : 12 ] )
+
+    # Count resolved branches / jumps and mispredictions.
+    with m.If( self.resolve ):
+      with m.If( rbr ):
+        m.d.sync += [
+          self.branches.eq( self.branches + 1 ),
+          self.branch_misses.eq( self.branch_misses + self.miss )
+        ]
+      with m.Else():
+        m.d.sync += [
+          self.jumps.eq( self.jumps + 1 ),
+          self.jump_misses.eq( self.jump_misses + self.miss )
+        ]
+
+    # Predicted direction of a conditional branch.
+    btaken = Signal()
+    if self.mode == BP_BTFN:
+      m.d.comb += btaken.eq( bimm[ 31 ] )
+    elif self.mode >= BP_BIMODAL:
+      # 2-bit counters: 0-1 predict not taken, 2-3 predict taken.
+      # They start out 'weakly not taken'.
+      bht = Signal( self.bht_size * 2,
+                    reset = int( "01" * self.bht_size, 2 ) )
+      bi  = self.pc[ 2 : 2 + self.bbits ]
+      rbi = self.rpc[ 2 : 2 + self.bbits ]
+      ctr = bht.word_select( rbi, 2 )
+      m.d.comb += btaken.eq( bht.word_select( bi, 2 )[ 1 ] )
+      with m.If( self.resolve & rbr ):
+        with m.If( self.taken & ( ctr != 3 ) ):
+          m.d.sync += ctr.eq( ctr + 1 )
+        with m.Elif( ~self.taken & ( ctr != 0 ) ):
+          m.d.sync += ctr.eq( ctr - 1 )
+
+    # Predicted JALR target: the return address stack for returns,
+    # otherwise the branch target buffer.
+    jtaken = Signal()
+    jtgt   = Signal( 32, reset = 0x00000000 )
+    if self.mode == BP_BTB:
+      # Branch target buffer: | tag | target[ 2: ] | per entry.
+      tw  = 30 - self.tbits
+      btb = Memory( width = tw + 30, depth = self.btb_size,
+                    init = ( 0 for i in range( self.btb_size ) ) )
+      btr = btb.read_port( domain = "comb" )
+      btw = btb.write_port()
+      m.submodules.btr = btr
+      m.submodules.btw = btw
+      bvalid = Signal( self.btb_size, reset = 0 )
+      m.d.comb += [
+        btr.addr.eq( self.pc[ 2 : 2 + self.tbits ] ),
+        btw.addr.eq( self.rpc[ 2 : 2 + self.tbits ] ),
+        btw.data.eq( Cat( self.target[ 2 : 32 ],
+                          self.rpc[ 2 + self.tbits : 32 ] ) ),
+        btw.en.eq( self.resolve & rjalr & ~rpop )
+      ]
+      with m.If( btw.en ):
+        m.d.sync += bvalid.bit_select( btw.addr, 1 ).eq( 1 )
+      bhit = ( bvalid.bit_select( btr.addr, 1 ) &
+               ( btr.data[ 30 : ] == self.pc[ 2 + self.tbits : 32 ] ) )
+
+      # Return address stack. It is a circular buffer, so a call
+      # which overflows it overwrites the oldest entry, and a return
+      # which underflows it leaves it alone. It is updated as calls
+      # and returns are fetched; a second stack pointer follows them
+      # as they resolve, and the first is rolled back to it on a
+      # redirect.
+      # (A wrong-path call can still overwrite an entry, which only
+      #  costs a misprediction later)
+      ras = Memory( width = 32, depth = self.ras_depth,
+                    init = ( 0 for i in range( self.ras_depth ) ) )
+      rr  = ras.read_port( domain = "comb" )
+      rw  = ras.write_port()
+      m.submodules.rr = rr
+      m.submodules.rw = rw
+      sp  = Signal( range( self.ras_depth ), reset = 0 )
+      n   = Signal( range( self.ras_depth + 1 ), reset = 0 )
+      csp = Signal( range( self.ras_depth ), reset = 0 )
+      cn  = Signal( range( self.ras_depth + 1 ), reset = 0 )
+      # Resolved stack pointer and depth after this cycle.
+      nsp = Signal( range( self.ras_depth ), reset = 0 )
+      nn  = Signal( range( self.ras_depth + 1 ), reset = 0 )
+      m.d.comb += [
+        nsp.eq( csp ),
+        nn.eq( cn )
+      ]
+      with m.If( self.resolve & rpush ):
+        m.d.comb += [
+          nsp.eq( csp + 1 ),
+          nn.eq( Mux( cn == self.ras_depth, cn, cn + 1 ) )
+        ]
+      with m.Elif( self.resolve & rpop & ( cn != 0 ) ):
+        m.d.comb += [
+          nsp.eq( csp - 1 ),
+          nn.eq( cn - 1 )
+        ]
+      m.d.sync += [
+        csp.eq( nsp ),
+        cn.eq( nn )
+      ]
+      m.d.comb += [
+        rr.addr.eq( sp - 1 ),
+        rw.addr.eq( sp ),
+        rw.data.eq( fall ),
+        rw.en.eq( self.fire & push & ~self.flush )
+      ]
+      with m.If( self.flush ):
+        m.d.sync += [
+          sp.eq( nsp ),
+          n.eq( nn )
+        ]
+      with m.Elif( self.fire & push ):
+        m.d.sync += [
+          sp.eq( sp + 1 ),
+          n.eq( Mux( n == self.ras_depth, n, n + 1 ) )
+        ]
+      with m.Elif( self.fire & pop & ( n != 0 ) ):
+        m.d.sync += [
+          sp.eq( sp - 1 ),
+          n.eq( n - 1 )
+        ]
+
+      with m.If( pop & ( n != 0 ) ):
+        m.d.comb += [
+          jtaken.eq( 1 ),
+          jtgt.eq( rr.data )
+        ]
+      with m.Elif( bhit ):
+        m.d.comb += [
+          jtaken.eq( 1 ),
+          jtgt.eq( Cat( Repl( 0, 2 ), btr.data[ : 30 ] ) )
+        ]
+
+    # Pick the next fetch address. Targets which aren't aligned
+    # would trap in EX, so they are never predicted.
+    pnpc = Signal( 32, reset = 0x00000000 )
+    m.d.comb += pnpc.eq( fall )
+    if self.mode != BP_NONE:
+      with m.If( br & btaken ):
+        m.d.comb += pnpc.eq( self.pc + bimm )
+      with m.Elif( jal ):
+        m.d.comb += pnpc.eq( self.pc + jimm )
+      with m.Elif( jalr & jtaken ):
+        m.d.comb += pnpc.eq( jtgt )
+    m.d.comb += self.npc.eq(
+      Mux( ( pnpc[ 0 ] == 0 ) & ( self.c_ext | ( pnpc[ 1 ] == 0 ) ),
+           pnpc, fall ) )
+
+    # End of branch predictor definition.
+    return m
@@ -0,0 +1,324 @@
+from amaranth import *
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+
+#############################################################
+# Execute (EX) stage.                                       #
+# Runs the ALU, resolves jumps and branches, computes load  #
+# and store addresses, and performs CSR / system accesses.  #
+# RV32M operations wait in EX for the multiply / divide     #
+# unit, sending bubbles on to MEM. With the C extension,    #
+# jumps only trap if their target isn't halfword-aligned,   #
+# and 16-bit instructions link to / fall through to pc+2.   #
+# Every control transfer (branch, jump, trap, MRET and      #
+# FENCE) is resolved here. Branches and jumps only redirect #
+# the front end if IF's predicted next address was wrong.   #
+#############################################################
+
+# EX/MEM pipeline register layout.
+EX2MEM_LAYOUT = [
+  ( "valid", 1 ),
+  ( "pc",   32 ),
+  # Address of the next instruction in program order.
+  ( "npc",  32 ),
+  ( "ir",   32 ),
+  ( "rd",    5 ),
+  ( "we",    1 ),
+  ( "ld",    1 ),
+  ( "st",    1 ),
+  # ALU / link / CSR result.
+  ( "y",    32 ),
+  # Load / store address and store data.
+  ( "adr",  32 ),
+  ( "sd",   32 ),
+]
+
+class EX_Stage( Elaboratable ):
+  def __init__( self, ID2EX, alu, csr, muldiv, compressed = False ):
+    # C extension enabled.
+    self.compressed = compressed
+    # ID/EX pipeline register (driven by the ID stage).
+    self.ID2EX = ID2EX
+    # Shared ALU, CSR, and multiply / divide submodules.
+    self.alu    = alu
+    self.csr    = csr
+    self.muldiv = muldiv
+    # Source operand values. The core decides where these come from.
+    self.a = Signal( 32, reset = 0x00000000 )
+    self.b = Signal( 32, reset = 0x00000000 )
+    # 'Stall' input: hold the EX/MEM register and skip side effects.
+    self.stall = Signal( 1, reset = 0 )
+    # 'Redirect' output: fetch from 'target' and flush IF / ID.
+    self.redirect = Signal( 1, reset = 0 )
+    self.target   = Signal( 32, reset = 0x00000000 )
+    # 'Resolve' outputs for the branch predictor: a branch or jump
+    # executed, whether it was taken and where to, and whether the
+    # address which IF predicted for the next instruction was wrong.
+    self.resolve    = Signal( 1, reset = 0 )
+    self.taken      = Signal( 1, reset = 0 )
+    self.jt         = Signal( 32, reset = 0x00000000 )
+    self.mispredict = Signal( 1, reset = 0 )
+    # 'Fence' outputs: a FENCE / FENCE.I instruction is waiting in
+    # EX for the D-cache to be flushed, and then executes.
+    self.fencing  = Signal( 1, reset = 0 )
+    self.fence    = Signal( 1, reset = 0 )
+    # 'Flushed' input: the D-cache has written back its dirty lines.
+    # (Always 1 without a D-cache)
+    self.flushed  = Signal( 1, reset = 1 )
+    # 'Muldiv wait' output: an RV32M instruction is waiting in EX for
+    # its result.
+    self.mdwait   = Signal( 1, reset = 0 )
+    # Trap flag, cause, and 'mtval' value for the instruction in EX.
+    self.trapped = Signal( 1, reset = 0 )
+    self.cause   = Signal( 4, reset = 0 )
+    self.tval    = Signal( 32, reset = 0x00000000 )
+    # EX/MEM pipeline register.
+    self.EX2MEM = Record( EX2MEM_LAYOUT, name = "EX2MEM" )
+
+  # Helper method to get the return address held in 'mepc'.
+  def mepc( self ):
+    if self.compressed:
+      return Cat( Repl( 0, 1 ), self.csr.mepc_half, self.csr.mepc_mepc )
+    return Cat( Repl( 0, 2 ), self.csr.mepc_mepc )
+
+  # Helper method to flag a trap for the instruction in EX.
+  def trap( self, m, trap_num, tval = None ):
+    m.d.comb += [
+      self.trapped.eq( 1 ),
+      self.cause.eq( trap_num )
+    ]
+    if tval is not None:
+      m.d.comb += self.tval.eq( tval )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    ir  = self.ID2EX.ir
+    pc  = self.ID2EX.pc
+    imm = self.ID2EX.imm
+    a   = self.a
+    b   = self.b
+    # Address of the next instruction in program order.
+    fall = Signal( 32, reset = 0x00000000 )
+    m.d.comb += fall.eq( pc + Mux( self.ID2EX.rvc, 2, 4 ) )
+
+    # Result, memory address, and control flow signals.
+    y     = Signal( 32, reset = 0x00000000 )
+    adr   = Signal( 32, reset = 0x00000000 )
+    st    = Signal( 1, reset = 0 )
+    jump  = Signal( 1, reset = 0 )
+    jt    = Signal( 32, reset = 0x00000000 )
+    cti   = Signal( 1, reset = 0 )
+    mret  = Signal( 1, reset = 0 )
+    fence = Signal( 1, reset = 0 )
+    md    = Signal( 1, reset = 0 )
+
+    # The instruction in EX takes effect on this clock edge. A
+    # FENCE doesn't, until the D-cache has been flushed, and an
+    # RV32M operation doesn't until its result is ready.
+    fire = Signal()
+    m.d.comb += [
+      self.fencing.eq( self.ID2EX.valid & fence & ~self.flushed ),
+      fire.eq( self.ID2EX.valid & ~self.stall & ~self.fencing &
+               ~self.mdwait )
+    ]
+
+    # Start the multiply / divide unit once per RV32M instruction;
+    # it holds the result until the instruction can move on.
+    mdgo = Signal( 1, reset = 0 )
+    m.d.comb += [
+      self.muldiv.a.eq( a ),
+      self.muldiv.b.eq( b ),
+      self.muldiv.f.eq( ir[ 12 : 15 ] ),
+      self.muldiv.start.eq( self.ID2EX.valid & md & ~mdgo ),
+      self.mdwait.eq( self.ID2EX.valid & md &
+                      ( ~mdgo | self.muldiv.busy ) )
+    ]
+    with m.If( fire ):
+      m.d.sync += mdgo.eq( 0 )
+    with m.Elif( self.muldiv.start ):
+      m.d.sync += mdgo.eq( 1 )
+
+    # The CSR inputs are always wired the same.
+    m.d.comb += [
+      self.csr.dat_w.eq( Mux( ir[ 14 ] == 0, a,
+                              Cat( ir[ 15 : 20 ], Repl( 0, 27 ) ) ) ),
+      self.csr.f.eq( ir[ 12 : 15 ] ),
+      self.csr.adr.eq( ir[ 20 : 32 ] ),
+    ]
+
+    with m.Switch( ir[ 0 : 7 ] ):
+      # LUI / AUIPC: 20 upper bits, +pc for AUIPC.
+      with m.Case( '0-10111' ):
+        m.d.comb += y.eq( Mux( ir[ 5 ], 0, pc ) + imm )
+
+      # JAL / JALR: link to the next instruction and jump.
+      with m.Case( '110-111' ):
+        m.d.comb += [
+          y.eq( fall ),
+          cti.eq( 1 ),
+          jump.eq( 1 ),
+          jt.eq( Mux( ir[ 3 ], pc + imm,
+                      Cat( Repl( 0, 1 ), ( a + imm )[ 1 : 32 ] ) ) )
+        ]
+
+      # Conditional branches: the ALU performs the comparison.
+      # BEQ / BNE: use SUB ALU operation to check equality.
+      # BLT / BGE / BLTU / BGEU: use SLT or SLTU ALU operation.
+      with m.Case( OP_BRANCH ):
+        m.d.comb += [
+          self.alu.a.eq( a ),
+          self.alu.b.eq( b ),
+          self.alu.f.eq( Mux( ir[ 14 ], Cat( ir[ 13 ], 0b001 ), 0b1000 ) ),
+          cti.eq( 1 ),
+          jump.eq( ( ( self.alu.y == 0 ) ^ ir[ 12 ] ) != ir[ 14 ] ),
+          jt.eq( pc + imm )
+        ]
+
+      # Loads / stores: compute the address and check its alignment.
+      with m.Case( '0-00011' ):
+        m.d.comb += adr.eq( a + imm )
+        with m.If( ( ( ir[ 12 : 14 ] == 0b01 ) & adr[ 0 ] ) |
+                   ( ( ir[ 12 : 14 ] == 0b10 ) & ( adr[ :2 ] != 0 ) ) ):
+          self.trap( m, Cat( Repl( 0, 1 ), ir[ 5 ], Repl( 1, 1 ) ), adr )
+        with m.Else():
+          m.d.comb += st.eq( ir[ 5 ] )
+
+      # R-type ALU operation: y = a ? b
+      with m.Case( OP_REG ):
+        # RV32M operations: y = the multiply / divide unit's result.
+        with m.If( ir[ 25 : 32 ] == FF_MULDIV ):
+          m.d.comb += [
+            md.eq( 1 ),
+            y.eq( self.muldiv.y )
+          ]
+        # Implement left shifts using the right shift ALU operation,
+        # unless the ALU has its own left shifter.
+        with m.Elif( ( ir[ 12 : 15 ] == 0b001 ) & self.alu.flip ):
+          m.d.comb += [
+            self.alu.a.eq( FLIP( a ) ),
+            self.alu.f.eq( 0b0101 ),
+            y.eq( FLIP( self.alu.y ) )
+          ]
+        with m.Else():
+          m.d.comb += [
+            self.alu.a.eq( a ),
+            self.alu.f.eq( Cat( ir[ 12 : 15 ], ir[ 30 ] ) ),
+            y.eq( self.alu.y )
+          ]
+        m.d.comb += self.alu.b.eq( b )
+
+      # I-type ALU operation: y = a ? immediate
+      with m.Case( OP_IMM ):
+        with m.If( ir[ 12 : 14 ] == 0b01 ):
+          with m.If( ( ir[ 14 ] == 0 ) & self.alu.flip ):
+            m.d.comb += [
+              self.alu.a.eq( FLIP( a ) ),
+              self.alu.f.eq( 0b0101 ),
+              y.eq( FLIP( self.alu.y ) )
+            ]
+          with m.Else():
+            m.d.comb += [
+              self.alu.a.eq( a ),
+              self.alu.f.eq( Cat( ir[ 12 : 15 ], ir[ 30 ] ) ),
+              y.eq( self.alu.y )
+            ]
+        with m.Else():
+          m.d.comb += [
+            self.alu.a.eq( a ),
+            self.alu.f.eq( ir[ 12 : 15 ] ),
+            y.eq( self.alu.y )
+          ]
+        m.d.comb += self.alu.b.eq( imm )
+
+      # System instructions: ECALL, EBREAK, MRET, WFI, and CSR
+      # accesses. (WFI shares EBREAK's low bits. This core doesn't
+      # take interrupts, so there is nothing to wait for, and WFI
+      # retires as a nop)
+      with m.Case( OP_SYSTEM ):
+        with m.If( ir[ 12 : 15 ] == F_TRAPS ):
+          with m.Switch( ir[ 20 : 22 ] ):
+            with m.Case( 0 ):
+              self.trap( m, TRAP_ECALL )
+            with m.Case( 1 ):
+              with m.If( ir[ 20 : 32 ] != IMM_WFI ):
+                self.trap( m, TRAP_BREAK )
+            with m.Case( 2 ):
+              m.d.comb += mret.eq( 1 )
+        with m.Else():
+          m.d.comb += [
+            self.csr.we.eq( fire ),
+            y.eq( self.csr.dat_r )
+          ]
+
+      # FENCE: re-fetch everything after this instruction, so that
+      # stores which have already completed are visible to fetch.
+      with m.Case( OP_FENCE ):
+        m.d.comb += fence.eq( 1 )
+
+    # Jumping to a mis-aligned address traps on the jump itself.
+    if self.compressed:
+      with m.If( jump & jt[ 0 ] ):
+        self.trap( m, TRAP_IMIS, jt )
+    else:
+      with m.If( jump & ( jt[ :2 ] != 0 ) ):
+        self.trap( m, TRAP_IMIS, jt )
+
+    # Work out where the next instruction comes from, and whether
+    # IF guessed it correctly.
+    nxt = Signal( 32, reset = 0x00000000 )
+    m.d.comb += [
+      nxt.eq( Mux( jump, jt, fall ) ),
+      self.mispredict.eq( self.ID2EX.pnpc != nxt ),
+      self.resolve.eq( fire & cti & ~self.trapped ),
+      self.taken.eq( jump ),
+      self.jt.eq( jt ),
+      self.redirect.eq( fire & ( self.trapped | mret | fence |
+                                 self.mispredict ) ),
+      self.fence.eq( fire & fence ),
+      self.target.eq(
+        Mux( self.trapped,
+             Cat( Repl( 0, 2 ), ( self.csr.mtvec_base +
+               Mux( self.csr.mtvec_mode, self.cause, 0 ) ) ),
+        Mux( mret, self.mepc(),
+        Mux( fence, fall, nxt ) ) ) )
+    ]
+
+    # Latch the results into the EX/MEM register. An instruction
+    # which traps doesn't retire, so it leaves a bubble.
+    with m.If( self.stall == 0 ):
+      m.d.sync += [
+        self.EX2MEM.valid.eq( self.ID2EX.valid & ~self.fencing &
+                              ~self.mdwait & ~self.trapped ),
+        self.EX2MEM.pc.eq( pc ),
+        self.EX2MEM.npc.eq( self.target ),
+        self.EX2MEM.ir.eq( ir ),
+        self.EX2MEM.rd.eq( self.ID2EX.rd ),
+        self.EX2MEM.we.eq( self.ID2EX.we & ~self.trapped ),
+        self.EX2MEM.ld.eq( self.ID2EX.ld & ~self.trapped ),
+        self.EX2MEM.st.eq( st ),
+        self.EX2MEM.y.eq( y ),
+        self.EX2MEM.adr.eq( adr ),
+        self.EX2MEM.sd.eq( b )
+      ]
+
+    # Enter the trap handler: set mcause / mepc / mtval and
+    # disable interrupts until MRET or a CSR write.
+    with m.If( fire & self.trapped ):
+      m.d.sync += [
+        self.csr.mcause_interrupt.eq( 0 ),
+        self.csr.mcause_ecode.eq( self.cause ),
+        self.csr.mepc_mepc.eq( pc[ 2 : 32 ] ),
+        self.csr.mtval_einfo.eq( self.tval ),
+        self.csr.mstatus_mie.eq( 0 )
+      ]
+      if self.compressed:
+        m.d.sync += self.csr.mepc_half.eq( pc[ 1 ] )
+    with m.If( fire & mret ):
+      m.d.sync += self.csr.mstatus_mie.eq( 1 )
+
+    # End of EX stage definition.
+    return m
@@ -0,0 +1,127 @@
+from amaranth import *
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+
+#############################################################
+# Hazard detection and operand forwarding unit.             #
+# Results are bypassed to the ALU inputs from EX/MEM and    #
+# MEM/WB, and to ID from MEM/WB (the register file is only  #
+# written at the end of WB). The one case which can't be    #
+# bypassed is a load followed by an instruction that uses   #
+# its result; that inserts exactly one bubble.              #
+#############################################################
+
+# Stall reasons, reported once per cycle.
+STALL_NONE     = 0
+# ID is empty because the instruction bus hasn't returned a word.
+STALL_FETCH    = 1
+# ID is empty because EX redirected the front end.
+STALL_FLUSH    = 2
+# A bubble was inserted after a load.
+STALL_LOAD_USE = 3
+# The whole pipeline is waiting on a data bus access.
+STALL_DBUS     = 4
+# The instruction in EX is waiting for a FENCE to finish, or for
+# the multiply / divide unit.
+STALL_EX       = 5
+
+class Hazard_Unit( Elaboratable ):
+  def __init__( self, IF2ID_IR, ID2EX, EX2MEM, MEM2WB ):
+    # Pipeline registers.
+    self.IF2ID_IR = IF2ID_IR
+    self.ID2EX    = ID2EX
+    self.EX2MEM   = EX2MEM
+    self.MEM2WB   = MEM2WB
+    # Source registers read by the instruction in ID.
+    self.rs1_used = Signal( 1, reset = 0 )
+    self.rs2_used = Signal( 1, reset = 0 )
+    # Register file read data for the instruction in ID.
+    self.rs1_data = Signal( 32, reset = 0x00000000 )
+    self.rs2_data = Signal( 32, reset = 0x00000000 )
+    # MEM is waiting on the data bus / EX is redirecting / EX is
+    # holding its instruction.
+    self.dbus_busy = Signal( 1, reset = 0 )
+    self.redirect  = Signal( 1, reset = 0 )
+    self.ex_busy   = Signal( 1, reset = 0 )
+    # Outputs: load-use bubble, ID operands, and EX operands.
+    self.bubble = Signal( 1, reset = 0 )
+    self.id_a   = Signal( 32, reset = 0x00000000 )
+    self.id_b   = Signal( 32, reset = 0x00000000 )
+    self.ex_a   = Signal( 32, reset = 0x00000000 )
+    self.ex_b   = Signal( 32, reset = 0x00000000 )
+    # Why the pipeline didn't issue an instruction to EX this cycle.
+    self.stall_reason = Signal( 3, reset = STALL_NONE )
+
+  # Does a pipeline register's instruction write register 'rs'?
+  def writes( self, r, rs ):
+    return r.valid & r.we & ( r.rd == rs ) & ( rs != 0 )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    IF2ID_IR = self.IF2ID_IR
+    ID2EX    = self.ID2EX
+    EX2MEM   = self.EX2MEM
+    MEM2WB   = self.MEM2WB
+
+    # WB -> ID bypass: the register file write lands at the end
+    # of this cycle, so ID would otherwise read the old value.
+    rs1 = IF2ID_IR.ir[ 15 : 20 ]
+    rs2 = IF2ID_IR.ir[ 20 : 25 ]
+    m.d.comb += [
+      self.id_a.eq( Mux( self.writes( MEM2WB, rs1 ),
+                         MEM2WB.y, self.rs1_data ) ),
+      self.id_b.eq( Mux( self.writes( MEM2WB, rs2 ),
+                         MEM2WB.y, self.rs2_data ) )
+    ]
+
+    # Load-use interlock: the load is in EX and its data won't be
+    # ready until it reaches WB.
+    m.d.comb += self.bubble.eq( IF2ID_IR.valid & ID2EX.ld & (
+      ( self.rs1_used & self.writes( ID2EX, rs1 ) ) |
+      ( self.rs2_used & self.writes( ID2EX, rs2 ) ) ) )
+
+    # MEM -> EX and WB -> EX bypasses, youngest producer first.
+    # (A load in MEM can't be a producer here, since the interlock
+    #  already separated it from its consumer by one bubble)
+    def fwd( rs, v ):
+      return Mux( self.writes( EX2MEM, rs ) & ~EX2MEM.ld, EX2MEM.y,
+             Mux( self.writes( MEM2WB, rs ), MEM2WB.y, v ) )
+    # While EX is stalled behind a data bus access, the producer in
+    # MEM/WB retires. Hold the forwarded operands until EX moves on.
+    hold = Signal( 1, reset = 0 )
+    ha   = Signal( 32, reset = 0x00000000 )
+    hb   = Signal( 32, reset = 0x00000000 )
+    m.d.comb += [
+      self.ex_a.eq( Mux( hold, ha, fwd( ID2EX.rs1, ID2EX.a ) ) ),
+      self.ex_b.eq( Mux( hold, hb, fwd( ID2EX.rs2, ID2EX.b ) ) )
+    ]
+    m.d.sync += [
+      hold.eq( self.dbus_busy ),
+      ha.eq( self.ex_a ),
+      hb.eq( self.ex_b )
+    ]
+
+    # Stall reason. A redirect empties ID until the first word
+    # from the new fetch address arrives.
+    refill = Signal( 1, reset = 0 )
+    with m.If( self.redirect ):
+      m.d.sync += refill.eq( 1 )
+    with m.Elif( IF2ID_IR.valid ):
+      m.d.sync += refill.eq( 0 )
+    with m.If( self.dbus_busy ):
+      m.d.comb += self.stall_reason.eq( STALL_DBUS )
+    with m.Elif( self.ex_busy ):
+      m.d.comb += self.stall_reason.eq( STALL_EX )
+    with m.Elif( self.bubble ):
+      m.d.comb += self.stall_reason.eq( STALL_LOAD_USE )
+    with m.Elif( self.redirect | ( refill & ~IF2ID_IR.valid ) ):
+      m.d.comb += self.stall_reason.eq( STALL_FLUSH )
+    with m.Elif( ~IF2ID_IR.valid ):
+      m.d.comb += self.stall_reason.eq( STALL_FETCH )
+
+    # End of hazard unit definition.
+    return m
@@ -0,0 +1,169 @@
+from amaranth import *
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+
+#############################################################
+# Instruction Decode (ID) stage.                            #
+# Reads the source registers, assembles the immediate value #
+# for the instruction's encoding format, and works out      #
+# whether the instruction writes a destination register.    #
+#############################################################
+
+# ID/EX pipeline register layout.
+ID2EX_LAYOUT = [
+  ( "valid", 1 ),
+  ( "pc",   32 ),
+  # Predicted address of the next instruction.
+  ( "pnpc", 32 ),
+  ( "ir",   32 ),
+  # Instruction was expanded from a 16-bit RV32C instruction.
+  ( "rvc",   1 ),
+  ( "rs1",   5 ),
+  ( "rs2",   5 ),
+  ( "rd",    5 ),
+  # Source register values.
+  ( "a",    32 ),
+  ( "b",    32 ),
+  # Sign-extended immediate value.
+  ( "imm",  32 ),
+  # Instruction writes 'rd'.
+  ( "we",    1 ),
+  # Instruction is a load.
+  ( "ld",    1 ),
+]
+
+class ID_Stage( Elaboratable ):
+  def __init__( self, IF2ID_IR, rs1, rs2 ):
+    # IF/ID pipeline register (driven by the IF stage).
+    self.IF2ID_IR = IF2ID_IR
+    # Asynchronous register file read ports.
+    self.rs1 = rs1
+    self.rs2 = rs2
+    # 'Stall' input: hold the ID/EX register.
+    self.stall  = Signal( 1, reset = 0 )
+    # 'Bubble' input: send a nop to EX instead of this instruction.
+    self.bubble = Signal( 1, reset = 0 )
+    # 'Flush' input: discard the instruction being decoded.
+    self.flush  = Signal( 1, reset = 0 )
+    # Source operand values. The core decides where these come from.
+    self.a = Signal( 32, reset = 0x00000000 )
+    self.b = Signal( 32, reset = 0x00000000 )
+    # Which source registers the instruction actually reads.
+    self.rs1_used = Signal( 1, reset = 0 )
+    self.rs2_used = Signal( 1, reset = 0 )
+    # Decoded destination register and write enable.
+    self.rd = Signal( 5, reset = 0 )
+    self.we = Signal( 1, reset = 0 )
+    # ID/EX pipeline register.
+    self.ID2EX = Record( ID2EX_LAYOUT, name = "ID2EX" )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    ir  = self.IF2ID_IR.ir
+    imm = Signal( 32, reset = 0x00000000 )
+    ld  = Signal( 1, reset = 0 )
+    we  = Signal( 1, reset = 0 )
+
+    m.d.comb += [
+      # Register file addresses come straight from the instruction.
+      self.rs1.addr.eq( ir[ 15 : 20 ] ),
+      self.rs2.addr.eq( ir[ 20 : 25 ] ),
+      self.rd.eq( ir[ 7 : 12 ] ),
+      self.we.eq( we & ( self.rd != 0 ) )
+    ]
+
+    # Decoder switch case: pick the immediate format and note which
+    # registers are read and written.
+    with m.Switch( ir[ 0 : 7 ] ):
+      # LUI / AUIPC: U-type immediate.
+      with m.Case( '0-10111' ):
+        m.d.comb += [
+          imm.eq( Cat( Repl( 0, 12 ), ir[ 12 : 32 ] ) ),
+          we.eq( 1 )
+        ]
+      # JAL: J-type immediate.
+      with m.Case( OP_JAL ):
+        m.d.comb += [
+          imm.eq( Cat( Repl( 0, 1 ), ir[ 21 : 31 ], ir[ 20 ],
+                       ir[ 12 : 20 ], Repl( ir[ 31 ], 12 ) ) ),
+          we.eq( 1 )
+        ]
+      # JALR: I-type immediate.
+      with m.Case( OP_JALR ):
+        m.d.comb += [
+          imm.eq( Cat( ir[ 20 : 32 ], Repl( ir[ 31 ], 20 ) ) ),
+          self.rs1_used.eq( 1 ),
+          we.eq( 1 )
+        ]
+      # Conditional branches: B-type immediate.
+      with m.Case( OP_BRANCH ):
+        m.d.comb += [
+          imm.eq( Cat( Repl( 0, 1 ), ir[ 8 : 12 ], ir[ 25 : 31 ],
+                       ir[ 7 ], Repl( ir[ 31 ], 20 ) ) ),
+          self.rs1_used.eq( 1 ),
+          self.rs2_used.eq( 1 )
+        ]
+      # Loads: I-type immediate.
+      with m.Case( OP_LOAD ):
+        m.d.comb += [
+          imm.eq( Cat( ir[ 20 : 32 ], Repl( ir[ 31 ], 20 ) ) ),
+          self.rs1_used.eq( 1 ),
+          ld.eq( 1 ),
+          we.eq( 1 )
+        ]
+      # Stores: S-type immediate.
+      with m.Case( OP_STORE ):
+        m.d.comb += [
+          imm.eq( Cat( ir[ 7 : 12 ], ir[ 25 : 32 ],
+                       Repl( ir[ 31 ], 20 ) ) ),
+          self.rs1_used.eq( 1 ),
+          self.rs2_used.eq( 1 )
+        ]
+      # R-type ALU operations.
+      with m.Case( OP_REG ):
+        m.d.comb += [
+          self.rs1_used.eq( 1 ),
+          self.rs2_used.eq( 1 ),
+          we.eq( 1 )
+        ]
+      # I-type ALU operations.
+      with m.Case( OP_IMM ):
+        m.d.comb += [
+          imm.eq( Cat( ir[ 20 : 32 ], Repl( ir[ 31 ], 20 ) ) ),
+          self.rs1_used.eq( 1 ),
+          we.eq( 1 )
+        ]
+      # CSR operations write 'rd'; the register forms also read 'rs1'.
+      with m.Case( OP_SYSTEM ):
+        m.d.comb += [
+          self.rs1_used.eq( ( ir[ 12 : 15 ] != F_TRAPS ) &
+                            ( ir[ 14 ] == 0 ) ),
+          we.eq( ir[ 12 : 15 ] != F_TRAPS )
+        ]
+
+    # Latch the decoded instruction into the ID/EX register.
+    with m.If( self.flush ):
+      m.d.sync += self.ID2EX.valid.eq( 0 )
+    with m.Elif( self.stall == 0 ):
+      m.d.sync += [
+        self.ID2EX.valid.eq( self.IF2ID_IR.valid & ~self.bubble ),
+        self.ID2EX.pc.eq( self.IF2ID_IR.pc ),
+        self.ID2EX.pnpc.eq( self.IF2ID_IR.pnpc ),
+        self.ID2EX.ir.eq( ir ),
+        self.ID2EX.rvc.eq( self.IF2ID_IR.rvc ),
+        self.ID2EX.rs1.eq( ir[ 15 : 20 ] ),
+        self.ID2EX.rs2.eq( ir[ 20 : 25 ] ),
+        self.ID2EX.rd.eq( self.rd ),
+        self.ID2EX.a.eq( self.a ),
+        self.ID2EX.b.eq( self.b ),
+        self.ID2EX.imm.eq( imm ),
+        self.ID2EX.we.eq( self.we ),
+        self.ID2EX.ld.eq( ld )
+      ]
+
+    # End of ID stage definition.
+    return m
@@ -0,0 +1,151 @@
+from amaranth import *
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+from src.rvc import *
+
+#############################################################
+# Instruction Fetch (IF) stage.                             #
+# Issues one instruction bus transaction at a time and      #
+# places each fetched word in the IF/ID pipeline register.  #
+# A fetch which is already in flight can't be aborted (the  #
+# SPI Flash keeps going once a command is sent), so a       #
+# redirect marks it as 'killed' and its result is dropped.  #
+# The branch predictor picks the address of the next fetch  #
+# as each word arrives; see 'src/pipeline/bp.py'.           #
+# With the C extension, 16-bit instructions are expanded as #
+# they arrive, so the later stages only see RV32I.          #
+#############################################################
+
+# IF/ID pipeline register layout.
+IF2ID_LAYOUT = [
+  ( "valid", 1 ),
+  ( "pc",   32 ),
+  # Predicted address of the next instruction.
+  ( "pnpc", 32 ),
+  ( "ir",   32 ),
+  # Instruction was expanded from a 16-bit RV32C instruction.
+  ( "rvc",   1 ),
+]
+
+class IF_Stage( Elaboratable ):
+  def __init__( self, bus, predictor, abortable = False,
+                compressed = False ):
+    # Instruction bus (the 'inst_mux' Wishbone interface).
+    self.bus    = bus
+    # The bus lets a fetch be abandoned by dropping 'cyc'. (This is
+    # true of the I-cache and the ROM prefetch buffer, but not of
+    # the SPI Flash)
+    self.abortable = abortable
+    # Branch predictor which picks the next fetch address.
+    self.bp     = predictor
+    # RV32C expander, if the C extension is enabled.
+    self.rvc    = RVC_Expander() if compressed else None
+    # Address of the next instruction to fetch.
+    self.pc     = Signal( 32, reset = 0x00000000 )
+    # 'Stall' input: the ID stage can't accept a new instruction.
+    self.stall  = Signal( 1, reset = 0 )
+    # 'Flush' input: discard everything and fetch from 'target'.
+    self.flush  = Signal( 1, reset = 0 )
+    self.target = Signal( 32, reset = 0x00000000 )
+    # IF/ID pipeline register.
+    self.IF2ID_IR = Record( IF2ID_LAYOUT, name = "IF2ID_IR" )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    # Fetched instruction, expanded if it is compressed.
+    ir  = Signal( 32, reset = 0x00000000 )
+    rvc = Signal( 1, reset = 0 )
+    if self.rvc is not None:
+      m.submodules.rvc = self.rvc
+      m.d.comb += [
+        self.rvc.c.eq( self.bus.dat_r ),
+        ir.eq( self.rvc.ir ),
+        rvc.eq( self.rvc.rvc ),
+        self.bp.c_ext.eq( 1 )
+      ]
+    else:
+      m.d.comb += ir.eq( self.bus.dat_r )
+
+    # A bus transaction is in flight.
+    busy = Signal( 1, reset = 0 )
+    # The in-flight transaction was made stale by a redirect.
+    kill = Signal( 1, reset = 0 )
+    # Address of the in-flight transaction.
+    fa   = Signal( 32, reset = 0x00000000 )
+    # One-entry skid buffer for words which arrive while ID stalls.
+    buf  = Record( IF2ID_LAYOUT, name = "if_buf" )
+
+    # The IF/ID register can take a new value on this clock edge.
+    room = Signal()
+    m.d.comb += room.eq( ( self.IF2ID_IR.valid == 0 ) |
+                         ( self.stall == 0 ) )
+    # A valid instruction word arrives on this cycle.
+    fetched = Signal()
+    m.d.comb += fetched.eq( self.bus.ack & ~kill )
+    # Ask the branch predictor where the next instruction is.
+    m.d.comb += [
+      self.bp.pc.eq( fa ),
+      self.bp.ir.eq( ir ),
+      self.bp.rvc.eq( rvc ),
+      self.bp.fire.eq( fetched )
+    ]
+
+    # Keep the address stable while a transaction is in flight,
+    # and release 'cyc' as soon as 'ack' arrives so that the
+    # memories see a fresh request for the next word. If the bus
+    # allows it, a redirect abandons the fetch in flight.
+    hold = busy
+    if self.abortable:
+      hold = busy & ( self.flush == 0 )
+    m.d.comb += [
+      self.bus.adr.eq( Mux( busy, fa, self.pc ) ),
+      self.bus.cyc.eq( ( hold | ( ( buf.valid == 0 ) & room &
+                                  ( self.flush == 0 ) ) ) &
+                       ~self.bus.ack ),
+    ]
+    m.d.sync += busy.eq( self.bus.cyc )
+    with m.If( self.bus.cyc & ~busy ):
+      m.d.sync += fa.eq( self.pc )
+
+    with m.If( self.flush ):
+      # Drop any buffered words and start over from the target.
+      m.d.sync += [
+        self.pc.eq( self.target ),
+        self.IF2ID_IR.valid.eq( 0 ),
+        buf.valid.eq( 0 ),
+        kill.eq( hold & ~self.bus.ack )
+      ]
+    with m.Else():
+      with m.If( self.bus.ack ):
+        m.d.sync += kill.eq( 0 )
+      with m.If( fetched ):
+        m.d.sync += self.pc.eq( self.bp.npc )
+      with m.If( room ):
+        with m.If( buf.valid ):
+          m.d.sync += [
+            self.IF2ID_IR.eq( buf ),
+            buf.valid.eq( 0 )
+          ]
+        with m.Else():
+          m.d.sync += [
+            self.IF2ID_IR.valid.eq( fetched ),
+            self.IF2ID_IR.pc.eq( fa ),
+            self.IF2ID_IR.pnpc.eq( self.bp.npc ),
+            self.IF2ID_IR.ir.eq( ir ),
+            self.IF2ID_IR.rvc.eq( rvc )
+          ]
+      with m.Elif( fetched ):
+        m.d.sync += [
+          buf.valid.eq( 1 ),
+          buf.pc.eq( fa ),
+          buf.pnpc.eq( self.bp.npc ),
+          buf.ir.eq( ir ),
+          buf.rvc.eq( rvc )
+        ]
+
+    # End of IF stage definition.
+    return m
@@ -0,0 +1,87 @@
+from amaranth import *
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+
+#############################################################
+# Memory access (MEM) stage.                                #
+# Performs loads and stores over the data bus. The stage is #
+# 'busy' until the bus acknowledges the access, which holds #
+# the EX / ID / IF stages and sends bubbles on to WB.       #
+#############################################################
+
+# MEM/WB pipeline register layout.
+MEM2WB_LAYOUT = [
+  ( "valid", 1 ),
+  ( "pc",   32 ),
+  ( "npc",  32 ),
+  ( "rd",    5 ),
+  ( "we",    1 ),
+  ( "y",    32 ),
+]
+
+class MEM_Stage( Elaboratable ):
+  def __init__( self, EX2MEM, bus, dw ):
+    # EX/MEM pipeline register (driven by the EX stage).
+    self.EX2MEM = EX2MEM
+    # Data bus (the 'data_mux' Wishbone interface) and the RAM's
+    # store width input.
+    self.bus = bus
+    self.dw  = dw
+    # 'Busy' output: a load or store is waiting for 'ack'.
+    self.busy = Signal( 1, reset = 0 )
+    # Formatted result for the instruction in MEM.
+    self.y = Signal( 32, reset = 0x00000000 )
+    # MEM/WB pipeline register.
+    self.MEM2WB = Record( MEM2WB_LAYOUT, name = "MEM2WB" )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    ir    = self.EX2MEM.ir
+    dat_r = self.bus.dat_r
+    ls    = Signal()
+    m.d.comb += ls.eq( self.EX2MEM.valid &
+                       ( self.EX2MEM.ld | self.EX2MEM.st ) )
+    # Address, store data and width are always wired the same.
+    m.d.comb += [
+      self.bus.adr.eq( self.EX2MEM.adr ),
+      self.bus.dat_w.eq( self.EX2MEM.sd ),
+      self.bus.we.eq( ls & self.EX2MEM.st ),
+      self.dw.eq( ir[ 12 : 15 ] ),
+      # Release 'cyc' as soon as 'ack' arrives.
+      self.bus.cyc.eq( ls & ~self.bus.ack ),
+      self.busy.eq( ls & ~self.bus.ack )
+    ]
+
+    # Loads: sign- or zero-extend the returned byte / halfword.
+    with m.If( self.EX2MEM.ld ):
+      m.d.comb += self.y.bit_select( 0, 8 ).eq( dat_r[ :8 ] )
+      with m.If( ir[ 12 ] ):
+        m.d.comb += [
+          self.y.bit_select( 8, 8 ).eq( dat_r[ 8 : 16 ] ),
+          self.y.bit_select( 16, 16 ).eq(
+            Repl( ( ir[ 14 ] == 0 ) & dat_r[ 15 ], 16 ) )
+        ]
+      with m.Elif( ir[ 13 ] ):
+        m.d.comb += self.y.bit_select( 8, 24 ).eq( dat_r[ 8 : 32 ] )
+      with m.Else():
+        m.d.comb += self.y.bit_select( 8, 24 ).eq(
+          Repl( ( ir[ 14 ] == 0 ) & dat_r[ 7 ], 24 ) )
+    with m.Else():
+      m.d.comb += self.y.eq( self.EX2MEM.y )
+
+    # Pass the instruction on to WB once its access completes.
+    m.d.sync += [
+      self.MEM2WB.valid.eq( self.EX2MEM.valid & ~self.busy ),
+      self.MEM2WB.pc.eq( self.EX2MEM.pc ),
+      self.MEM2WB.npc.eq( self.EX2MEM.npc ),
+      self.MEM2WB.rd.eq( self.EX2MEM.rd ),
+      self.MEM2WB.we.eq( self.EX2MEM.we ),
+      self.MEM2WB.y.eq( self.y )
+    ]
+
+    # End of MEM stage definition.
+    return m
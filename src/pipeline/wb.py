@@ -0,0 +1,35 @@
+from amaranth import *
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+
+#############################################################
+# Write-Back (WB) stage.                                    #
+# Writes results into the register file and retires the    #
+# instruction.                                              #
+#############################################################
+
+class WB_Stage( Elaboratable ):
+  def __init__( self, MEM2WB, rd ):
+    # MEM/WB pipeline register (driven by the MEM stage).
+    self.MEM2WB = MEM2WB
+    # Register file write port.
+    self.rd = rd
+    # 'Retire' output: an instruction completes on this cycle.
+    self.retire = Signal( 1, reset = 0 )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    m.d.comb += [
+      self.rd.addr.eq( self.MEM2WB.rd ),
+      self.rd.data.eq( self.MEM2WB.y ),
+      self.rd.en.eq( self.MEM2WB.valid & self.MEM2WB.we &
+                     ( self.MEM2WB.rd != 0 ) ),
+      self.retire.eq( self.MEM2WB.valid )
+    ]
+
+    # End of WB stage definition.
+    return m
@@ -20,20 +20,29 @@ RAM_DW_16 = 1
 RAM_DW_32 = 2
 
 class RAM( Elaboratable ):
-  def __init__( self, size_words ):
+  def __init__( self, size_words, fast = False ):
     # Record size.
     self.size = ( size_words * 4 )
+    # Acknowledge accesses one cycle after activation, instead of two.
+    self.fast = fast
     # Width of data input.
     self.dw   = Signal( 3, reset = 0b000 )
     # Data storage.
     self.data = Memory( width = 32, depth = size_words, init = ( 0x000000 for i in range( size_words ) ) )
-    # Read and write ports.
+    # Read and write ports. (The fast mode writes stores straight
+    # into their byte lanes, rather than merging them with the
+    # word that is already there)
     self.r = self.data.read_port()
-    self.w = self.data.write_port()
+    if fast:
+      self.w = self.data.write_port( granularity = 8 )
+    else:
+      self.w = self.data.write_port()
 
-    # Initialize Wishbone bus arbiter.
+    # Initialize Wishbone bus arbiter. Masters can use classic
+    # cycles, or linear incrementing bursts. (See 'elaborate')
     self.arb = Arbiter( addr_width = ceil( log2( self.size + 1 ) ),
-                        data_width = 32 )
+                        data_width = 32,
+                        features = { "cti", "bte" } )
     self.arb.bus.memory_map = MemoryMap(
       addr_width = self.arb.bus.addr_width,
       data_width = self.arb.bus.data_width,
@@ -42,7 +51,8 @@ class RAM( Elaboratable ):
   def new_bus( self ):
     # Initialize a new Wishbone bus interface.
     bus = Interface( addr_width = self.arb.bus.addr_width,
-                     data_width = self.arb.bus.data_width )
+                     data_width = self.arb.bus.data_width,
+                     features = { "cti", "bte" } )
     bus.memory_map = MemoryMap( addr_width = bus.addr_width,
                                 data_width = bus.data_width,
                                 alignment = 0 )
@@ -55,18 +65,43 @@ class RAM( Elaboratable ):
     m.submodules.r = self.r
     m.submodules.w = self.w
     m.submodules.arb = self.arb
+    if self.fast:
+      self.elaborate_fast( m )
+      return m
 
     # Ack two cycles after activation, for memory port access and
     # synchronous read-out (to prevent combinatorial loops).
-    rws = Signal( 1, reset = 0 )
-    m.d.sync += rws.eq( self.arb.bus.cyc )
-    m.d.sync += self.arb.bus.ack.eq( self.arb.bus.cyc & rws )
+    # Incrementing bursts: the master holds 'cyc', steps 'adr' by
+    # one word on each 'ack', and marks the last word as the end
+    # of the burst. Once the first word is underway, the read
+    # port is given the address after the one on the bus, so the
+    # next word is ready as soon as the master moves on and 'ack'
+    # stays high for one word per cycle. Writes simply follow the
+    # bus. The end of the burst is acknowledged like a classic
+    # cycle, and the next cycle starts from scratch. (Only linear
+    # bursts of whole words are supported: 'bte' is ignored)
+    rws  = Signal( 1, reset = 0 )
+    incr = Signal()
+    eob  = Signal()
+    radr = Signal( len( self.r.addr ), reset = 0 )
+    m.d.comb += [
+      incr.eq( rws & ( self.arb.bus.cti == CycleType.INCR_BURST ) ),
+      eob.eq( self.arb.bus.ack &
+              ( self.arb.bus.cti == CycleType.END_OF_BURST ) )
+    ]
+    m.d.sync += [
+      rws.eq( self.arb.bus.cyc & ~eob ),
+      self.arb.bus.ack.eq( self.arb.bus.cyc & rws & ~eob ),
+      radr.eq( Mux( incr, radr, self.arb.bus.adr[ 2: ] ) + 1 )
+    ]
     m.d.comb += [
       # Set the RAM port addresses.
-      self.r.addr.eq( self.arb.bus.adr[ 2: ] ),
+      self.r.addr.eq( Mux( incr, radr, self.arb.bus.adr[ 2: ] ) ),
       self.w.addr.eq( self.arb.bus.adr[ 2: ] ),
       # Set the 'write enable' flag once the reads are valid.
-      self.w.en.eq( self.arb.bus.we )
+      # (Partial stores merge with the read port's data, which
+      #  only holds the addressed word from the second cycle on)
+      self.w.en.eq( self.arb.bus.cyc & self.arb.bus.we & rws )
     ]
 
     # Read / Write logic: synchronous to avoid combinatorial loops.
@@ -111,3 +146,45 @@ class RAM( Elaboratable ):
     # End of RAM module definition.
     return m
 
+  # Fast mode: the address is put on the synchronous read port as
+  # soon as the access starts, so the word is ready on the next
+  # cycle. 'ack' is registered and 'dat_r' comes straight from the
+  # read port, so there is still no combinatorial path from the
+  # bus inputs back to its outputs.
+  def elaborate_fast( self, m ):
+    bus = self.arb.bus
+    # Bursts keep 'ack' high, and read the next word ahead as each
+    # one is acknowledged.
+    incr = Signal()
+    m.d.comb += incr.eq( bus.cti == CycleType.INCR_BURST )
+    m.d.sync += bus.ack.eq( bus.cyc & ( ~bus.ack | incr ) )
+    # Byte offset of the last access. (For load data alignment)
+    loff = Signal( 2, reset = 0 )
+    m.d.sync += loff.eq( bus.adr[ :2 ] )
+    m.d.comb += [
+      self.r.addr.eq( Mux( bus.ack & incr, bus.adr[ 2: ] + 1,
+                           bus.adr[ 2: ] ) ),
+      bus.dat_r.eq( self.r.data >> ( loff << 3 ) )
+    ]
+
+    # Stores are written on the first cycle that each new word is
+    # on the bus: after an idle cycle, or after an 'ack'.
+    new = Signal( 1, reset = 1 )
+    m.d.sync += new.eq( ~bus.cyc | bus.ack )
+    m.d.comb += [
+      self.w.addr.eq( bus.adr[ 2: ] ),
+      self.w.data.eq( ( bus.dat_w << ( bus.adr[ :2 ] << 3 ) )[ :32 ] )
+    ]
+    # Byte lanes, with the same rules as the two-cycle mode:
+    # halfwords can't start in the last byte of a word, and words
+    # must be aligned.
+    with m.If( bus.cyc & bus.we & new ):
+      with m.Switch( self.dw ):
+        with m.Case( RAM_DW_8 ):
+          m.d.comb += self.w.en.eq( 0b0001 << bus.adr[ :2 ] )
+        with m.Case( RAM_DW_16 ):
+          m.d.comb += self.w.en.eq( Mux( bus.adr[ :2 ] == 3, 0,
+                                         0b0011 << bus.adr[ :2 ] ) )
+        with m.Case():
+          m.d.comb += self.w.en.eq( Mux( bus.adr[ :2 ] == 0, 0b1111, 0 ) )
+
@@ -11,18 +11,21 @@ from .isa import *
 ###############################################
 
 class ROM(Elaboratable):
-    def __init__(self, data):
+    def __init__(self, data, fast=False):
+        # Acknowledge reads one cycle after activation, instead of two
+        self.fast = fast
         # Data storage
         self.data = Memory(width=32, depth=len(data), init=data)
         self.r = self.data.read_port()
-        # Initalize Wishbone bus arbiter
+        # Initalize Wishbone bus arbiter (classic cycles or linear
+        # incrementing bursts)
         self.size = len(data) * 4
-        self.arb = Arbiter(addr_width=ceil(log2(self.size+1)), data_width=32)
+        self.arb = Arbiter(addr_width=ceil(log2(self.size+1)), data_width=32, features={"cti", "bte"})
         self.arb.bus.memory_map = MemoryMap(addr_width=self.arb.bus.addr_width, data_width=self.arb.bus.data_width, alignment=0)
 	
     def new_bus(self):
         #Initial a new wishbone bus interface
-        bus = Interface(addr_width=self.arb.bus.addr_width, data_width=self.arb.bus.data_width)
+        bus = Interface(addr_width=self.arb.bus.addr_width, data_width=self.arb.bus.data_width, features={"cti", "bte"})
         bus.memory_map = MemoryMap(addr_width=bus.addr_width, data_width=bus.data_width, alignment=0)
         self.arb.add(bus)
 
@@ -35,18 +38,48 @@ class ROM(Elaboratable):
         m.submodules.arb = self.arb
         m.submodules.r = self.r
 
+        if self.fast:
+            # Fast mode: the address goes to the synchronous read port as
+            # soon as the read starts, and 'dat_r' comes straight from it
+            # on the next cycle, when 'ack' is set. Bursts keep 'ack' high
+            # and read the next word ahead as each one is acknowledged.
+            incr = Signal()
+            off = Signal(2, reset=0)
+            m.d.comb += incr.eq(self.arb.bus.cti == CycleType.INCR_BURST)
+            m.d.sync += [
+                self.arb.bus.ack.eq(self.arb.bus.cyc & (~self.arb.bus.ack | incr)),
+                off.eq(self.arb.bus.adr & 0b11)
+            ]
+            m.d.comb += [
+                self.r.addr.eq(Mux(self.arb.bus.ack & incr, (self.arb.bus.adr >> 2) + 1, self.arb.bus.adr >> 2)),
+                self.arb.bus.dat_r.eq(little_end(self.r.data << (off << 3)))
+            ]
+            return m
+
+        # Incrementing bursts work like the RAM module's: after the
+        # first word, read the word after the one on the bus, so that
+        # each following word is acked on the cycle after the master
+        # steps 'adr'. The end of a burst is acked like a classic cycle.
         rws = Signal(1, reset=0)
+        incr = Signal()
+        eob = Signal()
+        radr = Signal(len(self.r.addr), reset=0)
+        m.d.comb += [
+            incr.eq(rws & (self.arb.bus.cti == CycleType.INCR_BURST)),
+            eob.eq(self.arb.bus.ack & (self.arb.bus.cti == CycleType.END_OF_BURST))
+        ]
         m.d.sync += [
-        	rws.eq(self.arb.bus.cyc), 
-            self.arb.bus.ack.eq(self.arb.bus.cyc & rws)
+        	rws.eq(self.arb.bus.cyc & ~eob), 
+            self.arb.bus.ack.eq(self.arb.bus.cyc & rws & ~eob),
+            radr.eq(Mux(incr, radr, self.arb.bus.adr >> 2) + 1)
         ]
 
-        m.d.comb += self.r.addr.eq(self.arb.bus.adr >> 2)
+        m.d.comb += self.r.addr.eq(Mux(incr, radr, self.arb.bus.adr >> 2))
 
         with m.If((self.arb.bus.adr & 0b11) == 0b00):
             m.d.sync += self.arb.bus.dat_r.eq(little_end(self.r.data))
         with m.Else():
-            m.d.sync += self.arb.bus.dat_r.eq(little_end(self.r.data << ((self.arb.bus.adr&0b11) << 3)))
+            m.d.sync += self.arb.bus.dat_r.eq(little_end(self.r.data << (self.arb.bus.adr[:2] << 3)))
 
         return m
 
@@ -6,8 +6,10 @@ from amaranth_soc.memory import *
 import sys
 sys.path.append("..")
 
+from src.clint import *
 from src.isa import *
 from src.ram import *
+from src.rvc import *
 
 #############################################################
 # "RISC-V Memories" module.                                 #
@@ -21,33 +23,102 @@ from src.ram import *
 #############################################################
 
 class RV_Memory( Elaboratable ):
-  def __init__( self, rom_module, ram_words ):
-    # Memory multiplexers.
+  def __init__( self, rom_module, ram_words, icache = None,
+                dcache = None, l2cache = None, prefetch = None,
+                fast_ram = False, compressed = False ):
+    # Memory multiplexers. These pass the cycle type and burst type
+    # through, so that the caches can refill with bursts.
     # Data bus multiplexer.
     self.data_mux = Decoder( addr_width = 32,
                          data_width = 32,
-                         alignment = 0 )
+                         alignment = 0,
+                         features = { "cti", "bte" } )
     # Instruction bus multiplexer.
     self.inst_mux = Decoder( addr_width = 32,
                          data_width = 32,
-                         alignment = 0 )
+                         alignment = 0,
+                         features = { "cti", "bte" } )
+
+    # Optional prefetch buffer in front of the ROM. It takes the
+    # place of the ROM port which instruction fetches arrive on:
+    # the instruction multiplexer's, or the data multiplexer's
+    # if an L2 cache refills through that.
+    self.prefetch = prefetch
 
     # Add ROM and RAM buses to the data multiplexer.
     self.rom = rom_module
-    self.ram = RAM( ram_words )
-    self.rom_data = self.rom.new_bus()
+    self.ram = RAM( ram_words, fast_ram )
+    if ( prefetch is None ) or ( l2cache is None ):
+      self.rom_data = self.rom.new_bus()
+    else:
+      self.rom_data = prefetch.bus
     self.ram_data = self.ram.new_bus()
     self.data_mux.add( self.rom_data,    addr = 0x00000000 )
     self.data_mux.add( self.ram_data,    addr = 0x20000000 )
-    # (Later, when we write peripherals, they'll be added to the data bus here)
+    # Add peripherals to the data multiplexer: the CLINT's timer
+    # and software interrupt registers.
+    self.clint = CLINT()
+    self.data_mux.add( self.clint.bus,   addr = 0x40000000 )
 
     # Add ROM and RAM buses to the instruction multiplexer.
-    self.rom_inst = self.rom.new_bus()
+    if ( prefetch is None ) or ( l2cache is not None ):
+      self.rom_inst = self.rom.new_bus()
+    else:
+      self.rom_inst = prefetch.bus
     self.ram_inst = self.ram.new_bus()
     self.inst_mux.add( self.rom_inst,    addr = 0x00000000 )
     self.inst_mux.add( self.ram_inst,    addr = 0x20000000 )
     # (No peripherals on the instruction bus)
 
+    # Optional shared L2 cache in front of the data multiplexer.
+    # The instruction and data sides each get their own L2 bus,
+    # and the instruction multiplexer goes unused.
+    self.l2cache = l2cache
+    if l2cache is None:
+      self.inst_next = self.inst_mux.bus
+      self.data_next = self.data_mux.bus
+      self.next_dw   = self.ram.dw
+    else:
+      self.inst_next = l2cache.new_bus()
+      self.data_next = l2cache.new_bus()
+      self.next_dw   = l2cache.dw
+
+    # Optional L1 instruction cache in front of the instruction
+    # side. The core fetches through 'ibus' either way.
+    self.icache = icache
+    if icache is None:
+      self.ibus = self.inst_next
+    else:
+      self.ibus = icache.bus
+    # The prefetch buffer which the core fetches through directly,
+    # if there is one. (Jumps should flush it)
+    if ( icache is None ) and ( l2cache is None ):
+      self.iprefetch = prefetch
+    else:
+      self.iprefetch = None
+    # A fetch can be abandoned by dropping 'cyc'.
+    self.ibus_abortable = ( icache is not None ) or \
+                          ( self.iprefetch is not None )
+    # With the C extension, instructions are fetched through an
+    # aligner which accepts halfword-aligned addresses. It finishes
+    # any bus access that it starts, so fetches can be abandoned.
+    self.ialign = None
+    if compressed:
+      self.ialign = Fetch_Aligner( self.ibus )
+      self.ibus   = self.ialign.bus
+      self.ibus_abortable = True
+
+    # Optional L1 data cache in front of the data side.
+    # The core loads and stores through 'dbus', with 'dw' setting
+    # the store width.
+    self.dcache = dcache
+    if dcache is None:
+      self.dbus = self.data_next
+      self.dw   = self.next_dw
+    else:
+      self.dbus = dcache.bus
+      self.dw   = dcache.dw
+
   def elaborate( self, platform ):
     m = Module()
     # Register the multiplexers, peripherals, and memory submodules.
@@ -55,9 +126,64 @@ class RV_Memory( Elaboratable ):
     m.submodules.inst_mux     = self.inst_mux
     m.submodules.rom          = self.rom
     m.submodules.ram          = self.ram
+    m.submodules.clint        = self.clint
+    if self.prefetch is not None:
+      m.submodules.prefetch   = self.prefetch
+    # Stores invalidate the aligner's buffered instruction word.
+    if self.ialign is not None:
+      m.submodules.ialign     = self.ialign
+      m.d.comb += self.ialign.flush.eq( self.dbus.cyc & self.dbus.we )
+
+    # Refill the I-cache through the instruction side.
+    if self.icache is not None:
+      m.submodules.icache = self.icache
+      m.d.comb += [
+        self.inst_next.adr.eq( self.icache.mbus.adr ),
+        self.inst_next.cyc.eq( self.icache.mbus.cyc ),
+        self.icache.mbus.dat_r.eq( self.inst_next.dat_r ),
+        self.icache.mbus.ack.eq( self.inst_next.ack )
+      ]
+      if hasattr( self.inst_next, "cti" ):
+        m.d.comb += [
+          self.inst_next.cti.eq( self.icache.mbus.cti ),
+          self.inst_next.bte.eq( self.icache.mbus.bte )
+        ]
+    # Refill / write back the D-cache through the data side.
+    if self.dcache is not None:
+      m.submodules.dcache = self.dcache
+      m.d.comb += [
+        self.data_next.adr.eq( self.dcache.mbus.adr ),
+        self.data_next.dat_w.eq( self.dcache.mbus.dat_w ),
+        self.data_next.we.eq( self.dcache.mbus.we ),
+        self.data_next.cyc.eq( self.dcache.mbus.cyc ),
+        self.next_dw.eq( self.dcache.mdw ),
+        self.dcache.mbus.dat_r.eq( self.data_next.dat_r ),
+        self.dcache.mbus.ack.eq( self.data_next.ack )
+      ]
+      if hasattr( self.data_next, "cti" ):
+        m.d.comb += [
+          self.data_next.cti.eq( self.dcache.mbus.cti ),
+          self.data_next.bte.eq( self.dcache.mbus.bte )
+        ]
+    # Refill / write back the L2 cache through the data multiplexer.
+    if self.l2cache is not None:
+      m.submodules.l2cache = self.l2cache
+      m.d.comb += [
+        self.data_mux.bus.adr.eq( self.l2cache.mbus.adr ),
+        self.data_mux.bus.dat_w.eq( self.l2cache.mbus.dat_w ),
+        self.data_mux.bus.we.eq( self.l2cache.mbus.we ),
+        self.data_mux.bus.cyc.eq( self.l2cache.mbus.cyc ),
+        self.data_mux.bus.cti.eq( self.l2cache.mbus.cti ),
+        self.data_mux.bus.bte.eq( self.l2cache.mbus.bte ),
+        self.ram.dw.eq( self.l2cache.mdw ),
+        self.l2cache.mbus.dat_r.eq( self.data_mux.bus.dat_r ),
+        self.l2cache.mbus.ack.eq( self.data_mux.bus.ack ),
+        self.inst_next.stb.eq( self.inst_next.cyc ),
+        self.data_next.stb.eq( self.data_next.cyc )
+      ]
 
-    # Currently, all bus cycles are single-transaction.
-    # So set the 'strobe' signals equal to the 'cycle' ones.
+    # Masters never pause partway through a cycle or a burst, so
+    # set the 'strobe' signals equal to the 'cycle' ones.
     m.d.comb += [
       self.data_mux.bus.stb.eq( self.data_mux.bus.cyc ),
       self.inst_mux.bus.stb.eq( self.inst_mux.bus.cyc )
@@ -0,0 +1,319 @@
+from amaranth import *
+from amaranth_soc.wishbone import *
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+
+#############################################################
+# RV32C 'compressed instruction' support.                   #
+# * RVC_Expander turns a 16-bit instruction into the 32-bit #
+#   instruction which it stands for, so that the rest of    #
+#   the core only has to decode RV32I.                      #
+# * Fetch_Aligner sits in front of the instruction bus, and #
+#   returns the 32 bits starting at any halfword-aligned    #
+#   address. It keeps the last word that it fetched, so     #
+#   sequential 16-bit instructions cost one bus access per  #
+#   word instead of one per instruction.                    #
+#############################################################
+
+# Is halfword 'h' a compressed instruction? (32-bit instructions
+# have both of their LSbits set)
+def RVC( h ):
+  return h[ 0 : 2 ] != 0b11
+
+# Helper methods to assemble 32-bit instructions from fields.
+# Register fields must be 5 bits wide, and immediates wide enough
+# for their format; they are sign-extended here.
+def sext( v, n ):
+  return Cat( v, Repl( v[ -1 ], n - len( v ) ) )
+def RV32I_R_L( op, f, ff, rd, rs1, rs2 ):
+  return Cat( Const( op, 7 ), rd, Const( f, 3 ), rs1, rs2,
+              Const( ff, 7 ) )
+def RV32I_I_L( op, f, rd, rs1, imm ):
+  return Cat( Const( op, 7 ), rd, Const( f, 3 ), rs1,
+              sext( imm, 12 ) )
+def RV32I_S_L( op, f, rs1, rs2, imm ):
+  imm = sext( imm, 12 )
+  return Cat( Const( op, 7 ), imm[ 0 : 5 ], Const( f, 3 ), rs1, rs2,
+              imm[ 5 : 12 ] )
+def RV32I_B_L( op, f, rs1, rs2, imm ):
+  imm = sext( imm, 13 )
+  return Cat( Const( op, 7 ), imm[ 11 ], imm[ 1 : 5 ], Const( f, 3 ),
+              rs1, rs2, imm[ 5 : 11 ], imm[ 12 ] )
+def RV32I_U_L( op, rd, imm ):
+  return Cat( Const( op, 7 ), rd, sext( imm, 20 ) )
+def RV32I_J_L( op, rd, imm ):
+  imm = sext( imm, 21 )
+  return Cat( Const( op, 7 ), rd, imm[ 12 : 20 ], imm[ 11 ],
+              imm[ 1 : 11 ], imm[ 20 ] )
+
+class RVC_Expander( Elaboratable ):
+  def __init__( self ):
+    # Fetched instruction word. A compressed instruction is in the
+    # low halfword.
+    self.c   = Signal( 32, reset = 0x00000000 )
+    # Expanded 32-bit instruction. (All zeros, which no core
+    # executes, for reserved compressed encodings)
+    self.ir  = Signal( 32, reset = 0x00000000 )
+    # The word held a 16-bit instruction.
+    self.rvc = Signal( 1, reset = 0 )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    c = self.c
+    # Full and 'popular' (x8-x15) register fields.
+    rd   = c[ 7 : 12 ]
+    rs2  = c[ 2 : 7 ]
+    rdp  = Cat( c[ 2 : 5 ], Const( 0b01, 2 ) )
+    rs1p = Cat( c[ 7 : 10 ], Const( 0b01, 2 ) )
+    x0   = Const( 0, 5 )
+    x1   = Const( 1, 5 )
+    x2   = Const( 2, 5 )
+    # Immediates for each compressed format.
+    imm6   = Cat( c[ 2 : 7 ], c[ 12 ] )
+    imm4sp = Cat( Const( 0, 2 ), c[ 6 ], c[ 5 ], c[ 11 : 13 ],
+                  c[ 7 : 11 ], Const( 0, 1 ) )
+    imm_lw = Cat( Const( 0, 2 ), c[ 6 ], c[ 10 : 13 ], c[ 5 ],
+                  Const( 0, 1 ) )
+    imm_j  = Cat( Const( 0, 1 ), c[ 3 : 6 ], c[ 11 ], c[ 2 ], c[ 7 ],
+                  c[ 6 ], c[ 9 : 11 ], c[ 8 ], c[ 12 ] )
+    imm_16 = Cat( Const( 0, 4 ), c[ 6 ], c[ 2 ], c[ 5 ], c[ 3 : 5 ],
+                  c[ 12 ] )
+    imm_b  = Cat( Const( 0, 1 ), c[ 3 : 5 ], c[ 10 : 12 ], c[ 2 ],
+                  c[ 5 : 7 ], c[ 12 ] )
+    imm_lsp = Cat( Const( 0, 2 ), c[ 4 : 7 ], c[ 12 ], c[ 2 : 4 ],
+                   Const( 0, 1 ) )
+    imm_ssp = Cat( Const( 0, 2 ), c[ 9 : 13 ], c[ 7 : 9 ],
+                   Const( 0, 1 ) )
+
+    m.d.comb += self.rvc.eq( RVC( c ) )
+    with m.If( ~self.rvc ):
+      m.d.comb += self.ir.eq( c )
+    with m.Else():
+      # Select on the quadrant and 'funct3' bits.
+      with m.Switch( Cat( c[ 0 : 2 ], c[ 13 : 16 ] ) ):
+        # C.ADDI4SPN: addi rd', x2, nzuimm
+        with m.Case( 0b00000 ):
+          with m.If( c[ 5 : 13 ] != 0 ):
+            m.d.comb += self.ir.eq(
+              RV32I_I_L( OP_IMM, F_ADDI, rdp, x2, imm4sp ) )
+        # C.LW: lw rd', uimm(rs1')
+        with m.Case( 0b01000 ):
+          m.d.comb += self.ir.eq(
+            RV32I_I_L( OP_LOAD, F_LW, rdp, rs1p, imm_lw ) )
+        # C.SW: sw rs2', uimm(rs1')
+        with m.Case( 0b11000 ):
+          m.d.comb += self.ir.eq(
+            RV32I_S_L( OP_STORE, F_SW, rs1p, rdp, imm_lw ) )
+        # C.ADDI / C.NOP: addi rd, rd, imm
+        with m.Case( 0b00001 ):
+          m.d.comb += self.ir.eq(
+            RV32I_I_L( OP_IMM, F_ADDI, rd, rd, imm6 ) )
+        # C.JAL: jal x1, offset
+        with m.Case( 0b00101 ):
+          m.d.comb += self.ir.eq( RV32I_J_L( OP_JAL, x1, imm_j ) )
+        # C.LI: addi rd, x0, imm
+        with m.Case( 0b01001 ):
+          m.d.comb += self.ir.eq(
+            RV32I_I_L( OP_IMM, F_ADDI, rd, x0, imm6 ) )
+        # C.ADDI16SP: addi x2, x2, nzimm / C.LUI: lui rd, nzimm
+        with m.Case( 0b01101 ):
+          with m.If( rd == 2 ):
+            m.d.comb += self.ir.eq(
+              RV32I_I_L( OP_IMM, F_ADDI, x2, x2, imm_16 ) )
+          with m.Elif( imm6 != 0 ):
+            m.d.comb += self.ir.eq( RV32I_U_L( OP_LUI, rd, imm6 ) )
+        # Arithmetic on the 'popular' registers.
+        with m.Case( 0b10001 ):
+          with m.Switch( c[ 10 : 12 ] ):
+            # C.SRLI / C.SRAI: srli / srai rd', rd', shamt
+            with m.Case( 0b00 ):
+              m.d.comb += self.ir.eq( RV32I_R_L( OP_IMM, F_SRLI,
+                FF_SRLI, rs1p, rs1p, rs2 ) )
+            with m.Case( 0b01 ):
+              m.d.comb += self.ir.eq( RV32I_R_L( OP_IMM, F_SRAI,
+                FF_SRAI, rs1p, rs1p, rs2 ) )
+            # C.ANDI: andi rd', rd', imm
+            with m.Case( 0b10 ):
+              m.d.comb += self.ir.eq(
+                RV32I_I_L( OP_IMM, F_ANDI, rs1p, rs1p, imm6 ) )
+            # C.SUB / C.XOR / C.OR / C.AND: op rd', rd', rs2'
+            with m.Case( 0b11 ):
+              with m.Switch( Cat( c[ 5 : 7 ], c[ 12 ] ) ):
+                with m.Case( 0b000 ):
+                  m.d.comb += self.ir.eq( RV32I_R_L( OP_REG, F_SUB,
+                    FF_SUB, rs1p, rs1p, rdp ) )
+                with m.Case( 0b001 ):
+                  m.d.comb += self.ir.eq( RV32I_R_L( OP_REG, F_XOR,
+                    FF_XOR, rs1p, rs1p, rdp ) )
+                with m.Case( 0b010 ):
+                  m.d.comb += self.ir.eq( RV32I_R_L( OP_REG, F_OR,
+                    FF_OR, rs1p, rs1p, rdp ) )
+                with m.Case( 0b011 ):
+                  m.d.comb += self.ir.eq( RV32I_R_L( OP_REG, F_AND,
+                    FF_AND, rs1p, rs1p, rdp ) )
+        # C.J: jal x0, offset
+        with m.Case( 0b10101 ):
+          m.d.comb += self.ir.eq( RV32I_J_L( OP_JAL, x0, imm_j ) )
+        # C.BEQZ / C.BNEZ: beq / bne rs1', x0, offset
+        with m.Case( 0b11001 ):
+          m.d.comb += self.ir.eq(
+            RV32I_B_L( OP_BRANCH, F_BEQ, rs1p, x0, imm_b ) )
+        with m.Case( 0b11101 ):
+          m.d.comb += self.ir.eq(
+            RV32I_B_L( OP_BRANCH, F_BNE, rs1p, x0, imm_b ) )
+        # C.SLLI: slli rd, rd, shamt
+        with m.Case( 0b00010 ):
+          m.d.comb += self.ir.eq(
+            RV32I_R_L( OP_IMM, F_SLLI, FF_SLLI, rd, rd, rs2 ) )
+        # C.LWSP: lw rd, uimm(x2)
+        with m.Case( 0b01010 ):
+          with m.If( rd != 0 ):
+            m.d.comb += self.ir.eq(
+              RV32I_I_L( OP_LOAD, F_LW, rd, x2, imm_lsp ) )
+        # C.JR / C.MV / C.EBREAK / C.JALR / C.ADD
+        with m.Case( 0b10010 ):
+          with m.If( c[ 12 ] == 0 ):
+            with m.If( rs2 == 0 ):
+              with m.If( rd != 0 ):
+                m.d.comb += self.ir.eq(
+                  RV32I_I_L( OP_JALR, F_JALR, x0, rd, Const( 0, 12 ) ) )
+            with m.Else():
+              m.d.comb += self.ir.eq(
+                RV32I_R_L( OP_REG, F_ADD, FF_ADD, rd, x0, rs2 ) )
+          with m.Else():
+            with m.If( ( rs2 == 0 ) & ( rd == 0 ) ):
+              m.d.comb += self.ir.eq( RV32I_I_L( OP_SYSTEM, F_TRAPS,
+                x0, x0, Const( 1, 12 ) ) )
+            with m.Elif( rs2 == 0 ):
+              m.d.comb += self.ir.eq(
+                RV32I_I_L( OP_JALR, F_JALR, x1, rd, Const( 0, 12 ) ) )
+            with m.Else():
+              m.d.comb += self.ir.eq(
+                RV32I_R_L( OP_REG, F_ADD, FF_ADD, rd, rd, rs2 ) )
+        # C.SWSP: sw rs2, uimm(x2)
+        with m.Case( 0b11010 ):
+          m.d.comb += self.ir.eq(
+            RV32I_S_L( OP_STORE, F_SW, x2, rs2, imm_ssp ) )
+
+    # End of RVC expander definition.
+    return m
+
+class Fetch_Aligner( Elaboratable ):
+  def __init__( self, nbus ):
+    # Bus which instruction words are fetched from. (The I-cache, or
+    # the instruction multiplexer)
+    self.nbus = nbus
+    # Bus which the core fetches through. Its address only needs to
+    # be halfword-aligned, and 'dat_r' holds the 32 bits starting
+    # there until the next fetch is acknowledged.
+    # (A 16-bit instruction at the end of a word doesn't need the
+    #  next one, so the upper halfword is zero)
+    self.bus  = Interface( addr_width = 32, data_width = 32,
+                           features = { "cti", "bte" } )
+    # 'Flush' input: forget the buffered word. (Memory was written)
+    self.flush = Signal( 1, reset = 0 )
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    # Buffered word, its word address, and whether it is valid.
+    bw     = Signal( 32, reset = 0x00000000 )
+    bwa    = Signal( 30, reset = 0 )
+    bvalid = Signal( 1, reset = 0 )
+    # Word address and halfword of the fetch in progress, its low
+    # halfword if it spans two words, and whether the core gave up
+    # on it by dropping 'cyc'.
+    wa     = Signal( 30, reset = 0 )
+    hi     = Signal( 1, reset = 0 )
+    lo     = Signal( 16, reset = 0x0000 )
+    abort  = Signal( 1, reset = 0 )
+    # Value returned to the core.
+    out    = Signal( 32, reset = 0x00000000 )
+
+    m.d.comb += self.bus.dat_r.eq( out )
+    m.d.sync += self.bus.ack.eq( 0 )
+    if hasattr( self.nbus, "cti" ):
+      m.d.comb += [
+        self.nbus.cti.eq( CycleType.CLASSIC ),
+        self.nbus.bte.eq( 0 )
+      ]
+
+    # Finish a fetch with word 'w', which holds its first halfword.
+    # Returns the condition under which a second word is needed.
+    def first( m, w, h ):
+      with m.If( ~h ):
+        m.d.sync += [
+          out.eq( w ),
+          self.bus.ack.eq( 1 )
+        ]
+      with m.Elif( RVC( w[ 16 : 32 ] ) ):
+        m.d.sync += [
+          out.eq( Cat( w[ 16 : 32 ], Repl( 0, 16 ) ) ),
+          self.bus.ack.eq( 1 )
+        ]
+      with m.Else():
+        m.d.sync += lo.eq( w[ 16 : 32 ] )
+        m.next = "FETCH2"
+
+    with m.FSM():
+      # Wait for a new fetch, and serve it from the buffered word if
+      # possible.
+      with m.State( "IDLE" ):
+        with m.If( self.bus.cyc & ~self.bus.ack ):
+          m.d.sync += [
+            wa.eq( self.bus.adr[ 2 : 32 ] ),
+            hi.eq( self.bus.adr[ 1 ] ),
+            abort.eq( 0 )
+          ]
+          with m.If( bvalid & ( bwa == self.bus.adr[ 2 : 32 ] ) ):
+            first( m, bw, self.bus.adr[ 1 ] )
+          with m.Else():
+            m.next = "FETCH1"
+
+      # Fetch the word which holds the first halfword.
+      with m.State( "FETCH1" ):
+        m.d.comb += [
+          self.nbus.adr.eq( Cat( Const( 0, 2 ), wa ) ),
+          self.nbus.cyc.eq( ~self.nbus.ack )
+        ]
+        with m.If( ~self.bus.cyc ):
+          m.d.sync += abort.eq( 1 )
+        with m.If( self.nbus.ack ):
+          m.d.sync += [
+            bw.eq( self.nbus.dat_r ),
+            bwa.eq( wa ),
+            bvalid.eq( 1 )
+          ]
+          m.next = "IDLE"
+          with m.If( ~abort & self.bus.cyc ):
+            first( m, self.nbus.dat_r, hi )
+
+      # Fetch the next word, for a 32-bit instruction which
+      # straddles two of them.
+      with m.State( "FETCH2" ):
+        m.d.comb += [
+          self.nbus.adr.eq( Cat( Const( 0, 2 ), wa + 1 ) ),
+          self.nbus.cyc.eq( ~self.nbus.ack )
+        ]
+        with m.If( ~self.bus.cyc ):
+          m.d.sync += abort.eq( 1 )
+        with m.If( self.nbus.ack ):
+          m.d.sync += [
+            bw.eq( self.nbus.dat_r ),
+            bwa.eq( wa + 1 ),
+            bvalid.eq( 1 ),
+            out.eq( Cat( lo, self.nbus.dat_r[ 0 : 16 ] ) ),
+            self.bus.ack.eq( ~abort & self.bus.cyc )
+          ]
+          m.next = "IDLE"
+
+    # Stores might have changed the buffered word.
+    with m.If( self.flush ):
+      m.d.sync += bvalid.eq( 0 )
+
+    # End of fetch aligner definition.
+    return m
@@ -1,7 +1,6 @@
 from amaranth import *
 from amaranth.back import *
 from amaranth.sim import *
-from amaranth.hdl.ast import Past
 
 import os
 import sys
@@ -11,6 +10,7 @@ sys.path.append("..")
 from src.alu import *
 from src.csr import *
 from src.isa import *
+from src.muldiv import *
 from src.spi_flash import *
 from src.rom import *
 from src.rv_mem import *
@@ -18,9 +18,24 @@ from src.rv_mem import *
 # Optional: Enable verbose output for debugging.
 #os.environ["NMIGEN_verbose"] = "Yes"
 
-# CPU module.
+# Single-cycle core: every instruction executes and retires in
+# one clock cycle. It has its own ports on the ROM's and RAM's
+# storage, rather than going through their Wishbone buses, since
+# a bus access always takes at least one cycle to acknowledge:
+# * Instruction fetch is issued early: the synchronous read ports
+#   are given the address of the *next* instruction while the
+#   current one executes, so it is ready on the next cycle.
+# * Loads read asynchronously, so that the data arrives in the
+#   same cycle as the address. Stores are written on the clock
+#   edge at the end of the instruction.
+# (So 'rom_module' must be a 'ROM'; 'SPI_Flash' is too slow)
+# Loads and stores in the peripheral space go through the memory
+# module's data bus instead, and stall until they are acknowledged.
+# Other addresses read as 0, and ignore stores.
+# RV32M instructions also hold the PC, until the multiply / divide
+# unit has their result.
 class single_cycle_core( Elaboratable ):
-  def __init__( self, rom_module ):
+  def __init__( self, rom_module, shifter = SHIFT_FLIP ):
     # CPU signals:
     # 'Reset' signal for clock domains.
     self.clk_rst = Signal( reset = 0b0, reset_less = True )
@@ -32,31 +47,49 @@ class single_cycle_core( Elaboratable ):
 
     # CPU submodules:
     # Memory access ports for rs1 (ra), rs2 (rb), and rd (rc).
-    self.rs1    = self.register_file.read_port()
-    self.rs2    = self.register_file.read_port()
+    # The read ports are asynchronous, since the instruction only
+    # arrives at the start of the cycle that it executes in.
+    self.rs1    = self.register_file.read_port( domain = "comb" )
+    self.rs2    = self.register_file.read_port( domain = "comb" )
     self.rd     = self.register_file.write_port()
     # The ALU submodule which performs logical operations.
-    self.alu    = ALU()
+    # 'shifter' selects its shifter configuration.
+    self.alu    = ALU( shifter )
     # CSR 'system registers'.
     self.csr    = CSR()
+    # RV32M multiply / divide unit.
+    self.muldiv = MulDiv()
     # Memory module to hold peripherals and ROM / RAM module(s)
-    # (4KB of RAM = 1024 words)
+    # (4KB of RAM = 1024 words) Only peripheral accesses use its
+    # data bus.
     self.mem    = RV_Memory( rom_module, 1024 )
+    # Instruction fetch ports.
+    self.rom_i  = self.mem.rom.data.read_port()
+    self.ram_i  = self.mem.ram.data.read_port()
+    # Load / store ports.
+    self.rom_d  = self.mem.rom.data.read_port( domain = "comb" )
+    self.ram_d  = self.mem.ram.data.read_port( domain = "comb" )
+    self.ram_w  = self.mem.ram.data.write_port( granularity = 8 )
 
   # Helper method to enter a trap handler: jump to the appropriate
-  # address, and set the MCAUSE / MEPC CSRs.
-  def trigger_trap( self, m, trap_num, return_pc ):
+  # address, and set the MCAUSE / MEPC / MTVAL CSRs. The instruction
+  # which traps doesn't retire.
+  def trigger_trap( self, m, trap_num, tval = 0 ):
+    m.d.comb += [
+      self.csr.events[ EV_TRAP ].eq( 1 ),
+      self.csr.retire.eq( 0 ),
+      self.npc.eq( Cat( Repl( 0, 2 ),
+                        ( self.csr.mtvec_base +
+                          Mux( self.csr.mtvec_mode, trap_num, 0 ) ) ) )
+    ]
     m.d.sync += [
-      # Set mcause, mepc, interrupt context flag.
+      # Set mcause, mepc, mtval, interrupt context flag.
       self.csr.mcause_interrupt.eq( 0 ),
       self.csr.mcause_ecode.eq( trap_num ),
-      self.csr.mepc_mepc.eq( return_pc.bit_select( 2, 30 ) ),
+      self.csr.mepc_mepc.eq( self.pc[ 2 : 32 ] ),
+      self.csr.mtval_einfo.eq( tval ),
       # Disable interrupts globally until MRET or CSR write.
-      self.csr.mstatus_mie.eq( 0 ),
-      # Set the program counter to the interrupt handler address.
-      self.pc.eq( Cat( Repl( 0, 2 ),
-                     ( self.csr.mtvec_base +
-                       Mux( self.csr.mtvec_mode, trap_num, 0 ) ) ) )
+      self.csr.mstatus_mie.eq( 0 )
     ]
 
   # CPU object's 'elaborate' method to generate the hardware logic.
@@ -67,156 +100,222 @@ class single_cycle_core( Elaboratable ):
     m.submodules.alu = self.alu
     m.submodules.csr = self.csr
     m.submodules.mem = self.mem
+    m.submodules.muldiv = self.muldiv
     # Register the CPU register read/write ports.
     m.submodules.ra  = self.rs1
     m.submodules.rb  = self.rs2
     m.submodules.rc  = self.rd
+    # Register the memory ports.
+    m.submodules.rom_i = self.rom_i
+    m.submodules.ram_i = self.ram_i
+    m.submodules.rom_d = self.rom_d
+    m.submodules.ram_d = self.ram_d
+    m.submodules.ram_w = self.ram_w
 
-    # Wait-state counter to let internal memories load.
-    iws = Signal( 2, reset = 0 )
+    # Address of the next instruction. Fetching from it starts on
+    # this cycle.
+    self.npc = Signal( 32, reset = 0x00000000 )
+    # The instruction fetch ports only hold a valid instruction
+    # once the first fetch has been issued, after a reset.
+    started = Signal( 1, reset = 0 )
+    m.d.sync += started.eq( 1 )
 
+    # The instruction being executed: from RAM if the PC is in the
+    # RAM address space, or else from ROM.
+    # (The ROM stores words in little-endian byte order)
     self.instruction = Signal( 32, reset = 0 )
+    m.d.comb += self.instruction.eq(
+      Mux( self.pc[ 29 : 32 ] == 0b001, self.ram_i.data,
+           LITTLE_END_L( self.rom_i.data ) ) )
+    instruction = self.instruction
+    a = self.rs1.data
+    b = self.rs2.data
+    # Sign-extended immediate values for each encoding format.
+    imm_i = Cat( instruction[ 20 : 32 ], Repl( instruction[ 31 ], 20 ) )
+    imm_s = Cat( instruction[ 7 : 12 ], instruction[ 25 : 32 ],
+                 Repl( instruction[ 31 ], 20 ) )
+    imm_b = Cat( Repl( 0, 1 ), instruction[ 8 : 12 ],
+                 instruction[ 25 : 31 ], instruction[ 7 ],
+                 Repl( instruction[ 31 ], 20 ) )
+    imm_j = Cat( Repl( 0, 1 ), instruction[ 21 : 31 ],
+                 instruction[ 20 ], instruction[ 12 : 20 ],
+                 Repl( instruction[ 31 ], 12 ) )
+
+    # Load / store address, and the word which it falls in. Loads
+    # are shifted down by the address' two LSbits, like the RAM
+    # module's bus reads. (Peripherals only take whole words)
+    adr  = Signal( 32, reset = 0x00000000 )
+    word = Signal( 32, reset = 0x00000000 )
+    io   = Signal( 1, reset = 0 )
+    m.d.comb += [
+      adr.eq( a + Mux( instruction[ 5 ], imm_s, imm_i ) ),
+      io.eq( adr[ 29 : 32 ] == 0b010 ),
+      self.rom_d.addr.eq( adr[ 2 : ] ),
+      self.ram_d.addr.eq( adr[ 2 : ] ),
+      word.eq( Mux( adr[ 29 : 32 ] == 0b001, self.ram_d.data,
+               Mux( adr[ 29 : 32 ] == 0b000,
+                    LITTLE_END_L( self.rom_d.data ),
+               Mux( io, self.mem.dbus.dat_r, 0 ) ) ) >>
+               ( adr[ :2 ] << 3 ) ),
+      # Stores are shifted into their byte lanes.
+      self.ram_w.addr.eq( adr[ 2 : ] ),
+      self.ram_w.data.eq( ( b << ( adr[ :2 ] << 3 ) )[ :32 ] ),
+      # Peripheral accesses.
+      self.mem.dbus.adr.eq( adr ),
+      self.mem.dbus.dat_w.eq( b ),
+      self.csr.events[ EV_DBUS_STALL ].eq(
+        self.mem.dbus.cyc & ~self.mem.dbus.ack )
+    ]
+
+    # Multiply / divide unit inputs. 'md_wait' is set while an
+    # RV32M instruction waits for its result.
+    md_wait = Signal( 1, reset = 0 )
+    m.d.comb += [
+      self.muldiv.a.eq( a ),
+      self.muldiv.b.eq( b ),
+      self.muldiv.f.eq( instruction[ 12 : 15 ] )
+    ]
 
-    m.d.sync += self.instruction.eq( self.mem.imux.bus.dat_r) 
     # Top-level combinatorial logic.
     m.d.comb += [
+      # Start fetching the next instruction.
+      self.rom_i.addr.eq( self.npc[ 2 : ] ),
+      self.ram_i.addr.eq( self.npc[ 2 : ] ),
       # Set CPU register access addresses.
-      self.rs1.addr.eq( self.instruction[ 15 : 20 ] ),
-      self.rs2.addr.eq( self.instruction[ 20 : 25 ] ),
-      self.rd.addr.eq( self.instruction[ 7  : 12 ] ),
-      # self.instructionion bus address is always set to the program counter.
-      self.mem.imux.bus.adr.eq( self.pc ),
-
-      # Store data and width are always wired the same.
-      self.mem.ram.dw.eq( self.instruction[ 12 : 15 ] ),
-      self.mem.dmux.bus.dat_w.eq( self.rs2.data ),
+      self.rs1.addr.eq( instruction[ 15 : 20 ] ),
+      self.rs2.addr.eq( instruction[ 20 : 25 ] ),
+      self.rd.addr.eq( instruction[ 7  : 12 ] ),
+      # The CSR inputs are always wired the same.
+      self.csr.dat_w.eq( Mux( instruction[ 14 ] == 0, a,
+        Cat( instruction[ 15 : 20 ], Repl( 0, 27 ) ) ) ),
+      self.csr.f.eq( instruction[ 12 : 15 ] ),
+      self.csr.adr.eq( instruction[ 20 : 32 ] )
     ]
 
-    # Trigger an 'self.instructionion mis-aligned' trap if necessary. 
-    with m.If( self.pc[ :2 ] != 0 ):
-      self.trigger_trap( m, TRAP_IMIS, Past( self.pc ) )
+    # Wait for the first instruction after a reset.
+    with m.If( started == 0 ):
+      m.d.comb += self.npc.eq( self.pc )
+    # Execute the current instruction, and move on to the next one.
     with m.Else():
-      # I-bus is active until it completes a transaction.
-      m.d.comb += self.mem.imux.bus.cyc.eq( iws == 0 )
-
-    # Wait a cycle after 'ack' to load the appropriate CPU registers.
-    with m.If( self.mem.imux.bus.ack ):
-      # Increment the wait-state counter.
-      # (This also lets the self.instructionion bus' 'cyc' signal fall.)
-      m.d.sync += iws.eq( 1 )
-      with m.If( iws == 0 ):
-        # Increment pared-down 32-bit MINSTRET counter.
-        # I'd remove the whole MINSTRET CSR to save space, but the
-        # test harnesses depend on it to count instructions.
-        # TODO: This is OBO; it'll be 1 before the first retire.
-        m.d.sync += self.csr.minstret_instrs.eq(
-          self.csr.minstret_instrs + 1 )
-
-    # Execute the current self.instructionion, once it loads.
-    with m.If( iws != 0 ):
-      # Increment the PC and reset the wait-state unless
-      # otherwise specified.
-      m.d.sync += [
-        self.pc.eq( self.pc + 4 ),
-        iws.eq( 0 )
-      ]
+      # Increment the PC unless otherwise specified.
+      m.d.comb += self.npc.eq( self.pc + 4 )
+      m.d.comb += self.csr.retire.eq( 1 )
+      m.d.sync += self.pc.eq( self.npc )
 
       # Decoder switch case:
-      with m.Switch( self.instruction[ 0 : 7 ] ):
-        # LUI / AUIPC / R-type / I-type self.instructionions: apply
-        # pending CPU register write.
+      with m.Switch( instruction[ 0 : 7 ] ):
+        # LUI / AUIPC / R-type / I-type instructions: apply
+        # pending CPU register write. RV32M operations start the
+        # multiply / divide unit, and hold the PC until it has
+        # their result.
         with m.Case( '0-10-11' ):
-          m.d.comb += self.rd.en.eq( self.rd.addr != 0 )
+          with m.If( ( instruction[ 0 : 7 ] == OP_REG ) &
+                     ( instruction[ 25 : 32 ] == FF_MULDIV ) &
+                     ( ( md_wait == 0 ) | self.muldiv.busy ) ):
+            m.d.comb += [
+              self.muldiv.start.eq( md_wait == 0 ),
+              self.npc.eq( self.pc ),
+              self.csr.retire.eq( 0 )
+            ]
+            m.d.sync += md_wait.eq( 1 )
+          with m.Else():
+            m.d.comb += self.rd.en.eq( self.rd.addr != 0 )
+            m.d.sync += md_wait.eq( 0 )
 
-        # JAL / JALR self.instructionions: jump to a new address and place
+        # JAL / JALR instructions: jump to a new address and place
         # the 'return PC' in the destination register (rc).
+        # Jumping to a mis-aligned address traps on the jump itself.
         with m.Case( '110-111' ):
-          m.d.sync += self.pc.eq(
-            Mux( self.instruction[ 3 ],
-                 self.pc + Cat(
-                   Repl( 0, 1 ),
-                   self.instruction[ 21: 31 ],
-                   self.instruction[ 20 ],
-                   self.instruction[ 12 : 20 ],
-                   Repl( self.instruction[ 31 ], 12 ) ),
-                 self.rs1.data + Cat(
-                   self.instruction[ 20 : 32 ],
-                   Repl( self.instruction[ 31 ], 20 ) ) ),
-          )
-          m.d.comb += self.rd.en.eq( self.rd.addr != 0 )
+          jt = Signal( 32, reset = 0x00000000 )
+          m.d.comb += jt.eq( Mux( instruction[ 3 ], self.pc + imm_j,
+            Cat( Repl( 0, 1 ), ( a + imm_i )[ 1 : 32 ] ) ) )
+          with m.If( jt[ :2 ] != 0 ):
+            self.trigger_trap( m, TRAP_IMIS, jt )
+          with m.Else():
+            m.d.comb += [
+              self.npc.eq( jt ),
+              self.rd.en.eq( self.rd.addr != 0 ),
+              self.csr.events[ EV_BRANCH ].eq( 1 )
+            ]
 
-        # Conditional branch self.instructionions: similar to JAL / JALR,
+        # Conditional branch instructions: similar to JAL / JALR,
         # but only take the branch if the condition is met.
         with m.Case( OP_BRANCH ):
           # Check the ALU result. If it is zero, then:
           # a == b for BEQ/BNE, or a >= b for BLT[U]/BGE[U].
-          with m.If( ( ( self.alu.y == 0 ) ^
-                         self.instruction[ 12 ] ) !=
-                       self.instruction[ 14 ] ):
-            # Branch only if the condition is met.
-            m.d.sync += self.pc.eq( self.pc + Cat(
-              Repl( 0, 1 ),
-              self.instruction[ 8 : 12 ],
-              self.instruction[ 25 : 31 ],
-              self.instruction[ 7 ],
-              Repl( self.instruction[ 31 ], 20 ) ) )
+          with m.If( ( ( self.alu.y == 0 ) ^ instruction[ 12 ] ) !=
+                     instruction[ 14 ] ):
+            with m.If( ( self.pc + imm_b )[ :2 ] != 0 ):
+              self.trigger_trap( m, TRAP_IMIS, self.pc + imm_b )
+            with m.Else():
+              m.d.comb += [
+                self.npc.eq( self.pc + imm_b ),
+                self.csr.events[ EV_BRANCH ].eq( 1 )
+              ]
 
-        # Load / Store self.instructionions: perform memory access
-        # through the data bus.
+        # Load / Store instructions: trap if the address is
+        # mis-aligned, or perform the memory access.
+        # * Byte accesses are never mis-aligned.
+        # * Halfword accesses are mis-aligned if the address is odd.
+        # * Word accesses are mis-aligned unless the address is a
+        #   multiple of 4.
         with m.Case( '0-00011' ):
-          # Trigger a trap if the address is mis-aligned.
-          # * Byte accesses are never mis-aligned.
-          # * Word-aligned accesses are never mis-aligned.
-          # * Halfword accesses are only mis-aligned when both of
-          #   the address' LSbits are 1s.
-          with m.If( ( ( self.mem.dmux.bus.adr[ :2 ] == 0 ) |
-                       ( self.instruction[ 12 : 14 ] == 0 ) |
-                       ( ~( self.mem.dmux.bus.adr[ 0 ] &
-                            self.mem.dmux.bus.adr[ 1 ] &
-                            self.instruction[ 12 ] ) ) ) == 0 ):
+          with m.If( ( ( instruction[ 12 : 14 ] == 0b01 ) & adr[ 0 ] ) |
+                     ( ( instruction[ 12 : 14 ] == 0b10 ) &
+                       ( adr[ :2 ] != 0 ) ) ):
             self.trigger_trap( m,
-              Cat( Repl( 0, 1 ),
-                   self.instruction[ 5 ],
-                   Repl( 1, 1 ) ),
-              Past( self.pc ) )
-          with m.Else():
-            # Activate the data bus.
+              Cat( Repl( 0, 1 ), instruction[ 5 ], Repl( 1, 1 ) ), adr )
+          # Peripheral accesses: hold the PC, and keep fetching the
+          # same instruction, until the access is acknowledged.
+          with m.Elif( io ):
             m.d.comb += [
-              self.mem.dmux.bus.cyc.eq( 1 ),
-              # Stores only: set the 'write enable' bit.
-              self.mem.dmux.bus.we.eq( self.instruction[ 5 ] )
+              self.mem.dbus.cyc.eq( 1 ),
+              self.mem.dbus.we.eq( instruction[ 5 ] )
             ]
-            # Don't proceed until the memory access finishes.
-            with m.If( self.mem.dmux.bus.ack == 0 ):
-              m.d.sync += [
-                self.pc.eq( self.pc ),
-                iws.eq( 2 )
+            with m.If( self.mem.dbus.ack == 0 ):
+              m.d.comb += [
+                self.npc.eq( self.pc ),
+                self.csr.retire.eq( 0 )
               ]
-            # Loads only: write to the CPU register.
-            with m.Elif( self.instruction[ 5 ] == 0 ):
+            with m.Elif( instruction[ 5 ] == 0 ):
               m.d.comb += self.rd.en.eq( self.rd.addr != 0 )
+          # Other stores only write to RAM.
+          with m.Elif( instruction[ 5 ] ):
+            with m.If( adr[ 29 : 32 ] == 0b001 ):
+              with m.Switch( instruction[ 12 : 14 ] ):
+                with m.Case( 0b00 ):
+                  m.d.comb += self.ram_w.en.eq( 0b0001 << adr[ :2 ] )
+                with m.Case( 0b01 ):
+                  m.d.comb += self.ram_w.en.eq( 0b0011 << adr[ :2 ] )
+                with m.Default():
+                  m.d.comb += self.ram_w.en.eq( 0b1111 )
+          # Loads only: write to the CPU register.
+          with m.Else():
+            m.d.comb += self.rd.en.eq( self.rd.addr != 0 )
 
-        # System call self.instructionion: ECALL, EBREAK, MRET,
+        # System call instruction: ECALL, EBREAK, MRET, WFI,
         # and atomic CSR operations.
         with m.Case( OP_SYSTEM ):
-          with m.If( self.instruction[ 12 : 15 ] == F_TRAPS ):
-            with m.Switch( self.instruction[ 20 : 22 ] ):
-              # An 'empty' ECALL self.instructionion should raise an
+          with m.If( instruction[ 12 : 15 ] == F_TRAPS ):
+            with m.Switch( instruction[ 20 : 22 ] ):
+              # An 'empty' ECALL instruction should raise an
               # 'environment-call-from-M-mode" exception.
               with m.Case( 0 ):
-                self.trigger_trap( m, TRAP_ECALL, Past( self.pc ) )
-              # "EBREAK" self.instructionion: enter the interrupt context
+                self.trigger_trap( m, TRAP_ECALL )
+              # "EBREAK" instruction: enter the interrupt context
               # with 'breakpoint' as the cause of the exception.
+              # 'WFI' shares its low bits. This core doesn't take
+              # interrupts, so WFI has nothing to wait for, and
+              # retires as a nop.
               with m.Case( 1 ):
-                self.trigger_trap( m, TRAP_BREAK, Past( self.pc ) )
+                with m.If( instruction[ 20 : 32 ] != IMM_WFI ):
+                  self.trigger_trap( m, TRAP_BREAK )
               # 'MRET' jumps to the stored 'pre-trap' PC in the
               # 30 MSbits of the MEPC CSR.
               with m.Case( 2 ):
-                m.d.sync += [
-                  self.csr.mstatus_mie.eq( 1 ),
-                  self.pc.eq( Cat( Repl( 0, 2 ),
-                                   self.csr.mepc_mepc ) )
-                ]
+                m.d.comb += self.npc.eq( Cat( Repl( 0, 2 ),
+                                              self.csr.mepc_mepc ) )
+                m.d.sync += self.csr.mstatus_mie.eq( 1 )
           # Defer to the CSR module for atomic CSR reads/writes.
           # 'CSRR[WSC]': Write/Set/Clear CSR value from a register.
           # 'CSRR[WSC]I': Write/Set/Clear CSR value from immediate.
@@ -227,92 +326,78 @@ class single_cycle_core( Elaboratable ):
               self.csr.we.eq( 1 )
             ]
 
-        # FENCE self.instructionion: clear any I-caches and ensure all
-        # memory operations are applied. There is no I-cache,
-        # and there is no caching of memory operations.
-        # There is also no pipelining. So...this is a nop.
+        # FENCE instruction: there are no caches, and every store
+        # is written before the next instruction is fetched. (The
+        # fetch ports pass writes to the same address through)
+        # So...this is a nop.
         with m.Case( OP_FENCE ):
           pass
 
     # 'Always-on' decode/execute logic:
-    with m.Switch( self.instruction[ 0 : 7 ] ):
-      # LUI / AUIPC self.instructionions: set destination register to
+    with m.Switch( instruction[ 0 : 7 ] ):
+      # LUI / AUIPC instructions: set destination register to
       # 20 upper bits, +pc for AUIPC.
       with m.Case( '0-10111' ):
         m.d.comb += self.rd.data.eq(
-          Mux( self.instruction[ 5 ], 0, self.pc ) +
-          Cat( Repl( 0, 12 ),
-               self.instruction[ 12 : 32 ] ) )
+          Mux( instruction[ 5 ], 0, self.pc ) +
+          Cat( Repl( 0, 12 ), instruction[ 12 : 32 ] ) )
 
-      # JAL / JALR self.instructionions: set destination register to
+      # JAL / JALR instructions: set destination register to
       # the 'return PC' value.
       with m.Case( '110-111' ):
         m.d.comb += self.rd.data.eq( self.pc + 4 )
 
-      # Conditional branch self.instructionions:
+      # Conditional branch instructions:
       # set us up the ALU for the condition check.
       with m.Case( OP_BRANCH ):
         # BEQ / BNE: use SUB ALU operation to check equality.
         # BLT / BGE / BLTU / BGEU: use SLT or SLTU ALU operation.
         m.d.comb += [
-          self.alu.a.eq( self.rs1.data ),
-          self.alu.b.eq( self.rs2.data ),
-          self.alu.f.eq( Mux(
-            self.instruction[ 14 ],
-            Cat( self.instruction[ 13 ], 0b001 ),
-            0b1000 ) )
+          self.alu.a.eq( a ),
+          self.alu.b.eq( b ),
+          self.alu.f.eq( Mux( instruction[ 14 ],
+                              Cat( instruction[ 13 ], 0b001 ),
+                              0b1000 ) )
         ]
 
-      # Load self.instructionions: Set the memory address and data register.
+      # Load instructions: sign- or zero-extend the byte / halfword.
       with m.Case( OP_LOAD ):
-        m.d.comb += [
-          self.mem.dmux.bus.adr.eq( self.rs1.data +
-            Cat( self.instruction[ 20 : 32 ],
-                 Repl( self.instruction[ 31 ], 20 ) ) ),
-          self.rd.data.bit_select( 0, 8 ).eq(
-            self.mem.dmux.bus.dat_r[ :8 ] )
-        ]
-        with m.If( self.instruction[ 12 ] ):
+        m.d.comb += self.rd.data.bit_select( 0, 8 ).eq( word[ :8 ] )
+        with m.If( instruction[ 12 ] ):
           m.d.comb += [
-            self.rd.data.bit_select( 8, 8 ).eq(
-              self.mem.dmux.bus.dat_r[ 8 : 16 ] ),
+            self.rd.data.bit_select( 8, 8 ).eq( word[ 8 : 16 ] ),
             self.rd.data.bit_select( 16, 16 ).eq(
-              Repl( ( self.instruction[ 14 ] == 0 ) &
-                    self.mem.dmux.bus.dat_r[ 15 ], 16 ) )
+              Repl( ( instruction[ 14 ] == 0 ) & word[ 15 ], 16 ) )
           ]
-        with m.Elif( self.instruction[ 13 ] ):
+        with m.Elif( instruction[ 13 ] ):
           m.d.comb += self.rd.data.bit_select( 8, 24 ).eq(
-            self.mem.dmux.bus.dat_r[ 8 : 32 ] )
+            word[ 8 : 32 ] )
         with m.Else():
           m.d.comb += self.rd.data.bit_select( 8, 24 ).eq(
-            Repl( ( self.instruction[ 14 ] == 0 ) &
-                  self.mem.dmux.bus.dat_r[ 7 ], 24 ) )
-
-      # Store self.instructionions: Set the memory address.
-      with m.Case( OP_STORE ):
-        m.d.comb += self.mem.dmux.bus.adr.eq( self.rs1.data +
-          Cat( self.instruction[ 7 : 12 ],
-               self.instruction[ 25 : 32 ],
-               Repl( self.instruction[ 31 ], 20 ) ) )
+            Repl( ( instruction[ 14 ] == 0 ) & word[ 7 ], 24 ) )
 
       # R-type ALU operation: set inputs for rc = ra ? rb
       with m.Case( OP_REG ):
-        # Implement left shifts using the right shift ALU operation.
-        with m.If( self.instruction[ 12 : 15 ] == 0b001 ):
+        # RV32M operations: rd = the multiply / divide unit's result.
+        with m.If( instruction[ 25 : 32 ] == FF_MULDIV ):
+          m.d.comb += self.rd.data.eq( self.muldiv.y )
+        # Implement left shifts using the right shift ALU operation,
+        # unless the ALU has its own left shifter.
+        with m.Elif( ( instruction[ 12 : 15 ] == 0b001 ) &
+                     self.alu.flip ):
           m.d.comb += [
-            self.alu.a.eq( FLIP( self.rs1.data ) ),
+            self.alu.a.eq( FLIP( a ) ),
             self.alu.f.eq( 0b0101 ),
             self.rd.data.eq( FLIP( self.alu.y ) )
           ]
         with m.Else():
           m.d.comb += [
-            self.alu.a.eq( self.rs1.data ),
-            self.alu.f.eq( Cat(
-              self.instruction[ 12 : 15 ],
-              self.instruction[ 30 ] ) ),
+            self.alu.a.eq( a ),
+            self.alu.f.eq( Cat( instruction[ 12 : 15 ],
+                                instruction[ 30 ] ) ),
             self.rd.data.eq( self.alu.y ),
           ]
-        m.d.comb += self.alu.b.eq( self.rs2.data )
+        m.d.comb += self.alu.b.eq( b )
 
       # I-type ALU operation: set inputs for rc = ra ? immediate
       with m.Case( OP_IMM ):
@@ -320,31 +405,29 @@ class single_cycle_core( Elaboratable ):
         # They use 'funct7' bits like R-type operations, and the
         # left shift can be implemented as a right shift to avoid
         # having two barrel shifters in the ALU.
-        with m.If( self.instruction[ 12 : 14 ] == 0b01 ):
-          with m.If( self.instruction[ 14 ] == 0 ):
+        with m.If( instruction[ 12 : 14 ] == 0b01 ):
+          with m.If( ( instruction[ 14 ] == 0 ) & self.alu.flip ):
             m.d.comb += [
-              self.alu.a.eq( FLIP( self.rs1.data ) ),
+              self.alu.a.eq( FLIP( a ) ),
               self.alu.f.eq( 0b0101 ),
               self.rd.data.eq( FLIP( self.alu.y ) ),
             ]
           with m.Else():
             m.d.comb += [
-              self.alu.a.eq( self.rs1.data ),
-              self.alu.f.eq( Cat( 0b101, self.instruction[ 30 ] ) ),
+              self.alu.a.eq( a ),
+              self.alu.f.eq( Cat( instruction[ 12 : 15 ],
+                                  instruction[ 30 ] ) ),
               self.rd.data.eq( self.alu.y ),
             ]
         # Normal I-type operation:
         with m.Else():
           m.d.comb += [
-            self.alu.a.eq( self.rs1.data ),
-            self.alu.f.eq( self.instruction[ 12 : 15 ] ),
+            self.alu.a.eq( a ),
+            self.alu.f.eq( instruction[ 12 : 15 ] ),
             self.rd.data.eq( self.alu.y ),
           ]
         # Shared I-type logic:
-        m.d.comb += self.alu.b.eq( Cat(
-          self.instruction[ 20 : 32 ],
-          Repl( self.instruction[ 31 ], 20 ) ) )
+        m.d.comb += self.alu.b.eq( imm_i )
 
     # End of CPU module definition.
     return m
-
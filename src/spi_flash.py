@@ -8,9 +8,10 @@ from amaranth_boards.resources import *
 from .isa import *
 
 class DummyPin():
-    def __init__(self, name):
-        self.o = Signal(name='%s_o'%name)
-        self.i = Signal(name='%s_i'%name)
+    def __init__(self, name, width=1):
+        self.o = Signal(width, name='%s_o'%name)
+        self.oe = Signal(name='%s_oe'%name)
+        self.i = Signal(width, name='%s_i'%name)
 
 class DummySPI():
     def __init__(self):
@@ -18,13 +19,38 @@ class DummySPI():
         self.clk = DummyPin('clk')
         self.mosi = DummyPin('mosi')
         self.miso = DummyPin('miso')
+        self.dq = DummyPin('dq', 4)
+
+###############################################
+# SPI Flash read modes
+###############################################
+# Each mode is ( read command, address lines, dummy clocks,
+# data lines, board resource ):
+# * 0x03: plain 'read', one line throughout.
+# * 0x3B: 'dual output fast read', data comes back on IO0-1.
+# * 0x6B: 'quad output fast read', data comes back on IO0-3.
+# * 0xEB: 'quad I/O fast read', the address and an 8-bit mode
+#         byte (0x00, no 'continuous read') also go out on IO0-3.
+# The quad modes need the 'QE' bit in the Flash chip's status
+# register to be set, which is not done here.
+SPI_MODE_1X      = 0
+SPI_MODE_DUAL    = 1
+SPI_MODE_QUAD    = 2
+SPI_MODE_QUAD_IO = 3
+SPI_MODES = {
+  SPI_MODE_1X:      ( 0x03, 1, 0, 1, 'spi_flash_1x' ),
+  SPI_MODE_DUAL:    ( 0x3B, 1, 8, 2, 'spi_flash_2x' ),
+  SPI_MODE_QUAD:    ( 0x6B, 1, 8, 4, 'spi_flash_4x' ),
+  SPI_MODE_QUAD_IO: ( 0xEB, 4, 4, 4, 'spi_flash_4x' )
+}
 
 ###############################################
 # SPI Flash module
 ###############################################
 # Core SPI Flash "ROM" module.
 class SPI_Flash( Elaboratable ):
-  def __init__( self, dat_start, dat_end, data ):
+  def __init__( self, dat_start, dat_end, data, mode = SPI_MODE_1X,
+                burst = True ):
     # Starting address in the Flash chip. This probably won't
     # be zero, because many FPGA boards use their external SPI
     # Flash to store the bitstream which configures the chip.
@@ -33,10 +59,19 @@ class SPI_Flash( Elaboratable ):
     self.dend = dat_end
     # Length of accessible data.
     self.dlen = ( dat_end - dat_start ) + 1
+    # Read mode. (One of the 'SPI_MODE_*' values above)
+    self.mode = mode
+    ( self.cmd, self.alines, self.dummy,
+      self.dlines, self.resource ) = SPI_MODES[ mode ]
+    # Keep CS asserted after each word, so that a read from the
+    # next address can carry on without a new command.
+    self.burst = burst
     # SPI Flash address command.
-    self.spio = Signal( 32, reset = 0x03000000 )
+    self.spio = Signal( 32, reset = ( self.cmd << 24 ) )
     # Data counter.
     self.dc = Signal( 6, reset = 0b000000 )
+    # Bus address which would continue the current burst.
+    self.nadr = Signal( ceil( log2( self.dlen + 1 ) ), reset = 0 )
 
     # Backing data store for a test ROM image. Not used when
     # the module is built for real hardware.
@@ -70,11 +105,33 @@ class SPI_Flash( Elaboratable ):
     if platform is None:
       self.spi = DummySPI()
     else:
-      self.spi = platform.request( 'spi_flash_1x' )
+      self.spi = platform.request( self.resource )
 
     # Clock rests at 0.
     m.d.comb += self.spi.clk.o.eq( 0 )
 
+    # Data lines, as seen by the state machine. In the 1x mode they
+    # are the 'mosi' / 'miso' pins; otherwise they are IO0-3 ('dq'),
+    # which are only driven while 'doe' is set. (IO2-3 double as
+    # the active-low 'WP' and 'HOLD' pins, so they idle high)
+    dout = Signal( 4, reset = 0b1100 )
+    doe  = Signal( 1, reset = 0 )
+    din  = Signal( 4, reset = 0b0000 )
+    if self.mode == SPI_MODE_1X:
+      m.d.comb += [
+        self.spi.mosi.o.eq( dout[ 0 ] ),
+        din[ 0 ].eq( self.spi.miso.i )
+      ]
+    else:
+      m.d.comb += [
+        self.spi.dq.o.eq( dout ),
+        self.spi.dq.oe.eq( doe ),
+        din.eq( self.spi.dq.i )
+      ]
+    # Lowest data bit which is received on this clock.
+    lo = Signal( 6, reset = 0 )
+    m.d.comb += lo.eq( self.dc - ( self.dlines - 1 ) )
+
     # Use a state machine for Flash access.
     # "Mode 0" SPI is very simple:
     # - Device is active when CS is low, inactive otherwise.
@@ -96,7 +153,8 @@ class SPI_Flash( Elaboratable ):
       with m.State( "SPI_POWERUP" ):
         m.d.comb += [
           self.spi.clk.o.eq( ~ClockSignal( "sync" ) ),
-          self.spi.mosi.o.eq( self.spio[ 31 ] )
+          dout[ 0 ].eq( self.spio[ 31 ] ),
+          doe.eq( 1 )
         ]
         m.d.sync += [
           self.spio.eq( self.spio << 1 ),
@@ -126,13 +184,15 @@ class SPI_Flash( Elaboratable ):
                    ( self.arb.bus.ack == 0 ) ):
           m.d.sync += [
             self.spi.cs.o.eq( 1 ),
-            self.spio.eq( ( 0x03000000 | ( ( self.arb.bus.adr + self.dstart ) & 0x00FFFFFF ) ) ),
+            self.spio.eq( ( ( self.cmd << 24 ) | ( ( self.arb.bus.adr + self.dstart ) & 0x00FFFFFF ) ) ),
             self.arb.bus.ack.eq( 0 ),
-            self.dc.eq( 31 )
+            self.dc.eq( 31 if self.alines == 1 else 7 ),
+            self.nadr.eq( self.arb.bus.adr + 4 )
           ]
           m.next = "SPI_TX"
-      # 'Send read command' state: transmits the 0x03 'read' command
+      # 'Send read command' state: transmits the read command
       # followed by the desired 24-bit address. (Encoded in 'spio')
+      # In the 'quad I/O' mode, only the command is sent here.
       with m.State( "SPI_TX" ):
         # Set the 'mosi' pin to the next value and increment 'dc'.
         m.d.sync += [
@@ -141,10 +201,49 @@ class SPI_Flash( Elaboratable ):
         ]
         m.d.comb += [
           self.spi.clk.o.eq( ~ClockSignal( "sync" ) ),
-          self.spi.mosi.o.eq( self.spio[ 31 ] )
+          dout[ 0 ].eq( self.spio[ 31 ] ),
+          doe.eq( 1 )
+        ]
+        # Move on once all of the bits have been sent.
+        with m.If( self.dc == 0 ):
+          if self.alines > 1:
+            m.d.sync += self.dc.eq( ( 32 // self.alines ) - 1 )
+            m.next = "SPI_ADDR"
+          elif self.dummy > 0:
+            m.d.sync += self.dc.eq( self.dummy - 1 )
+            m.next = "SPI_DUMMY"
+          else:
+            # Also clear 'dat_r' and 'dc' before receiving.
+            m.d.sync += [
+              self.dc.eq( 7 ),
+              self.arb.bus.dat_r.eq( 0 )
+            ]
+            m.next = "SPI_RX"
+        with m.Else():
+          m.next = "SPI_TX"
+      # 'Send address' state: transmits the 24-bit address and the
+      # mode byte on several lines. ('spio' was left holding them
+      # once the command was shifted out)
+      with m.State( "SPI_ADDR" ):
+        m.d.sync += [
+          self.dc.eq( self.dc - 1 ),
+          self.spio.eq( self.spio << self.alines )
+        ]
+        m.d.comb += [
+          self.spi.clk.o.eq( ~ClockSignal( "sync" ) ),
+          dout.eq( self.spio[ 32 - self.alines : 32 ] ),
+          doe.eq( 1 )
         ]
-        # Move to 'receive data' state once 32 bits have elapsed.
-        # Also clear 'dat_r' and 'dc' before doing so.
+        with m.If( self.dc == 0 ):
+          m.d.sync += self.dc.eq( self.dummy - 1 )
+          m.next = "SPI_DUMMY"
+        with m.Else():
+          m.next = "SPI_ADDR"
+      # 'Dummy cycles' state: keep the clock running with the data
+      # lines released while the Flash chip turns them around.
+      with m.State( "SPI_DUMMY" ):
+        m.d.sync += self.dc.eq( self.dc - 1 )
+        m.d.comb += self.spi.clk.o.eq( ~ClockSignal( "sync" ) )
         with m.If( self.dc == 0 ):
           m.d.sync += [
             self.dc.eq( 7 ),
@@ -152,41 +251,70 @@ class SPI_Flash( Elaboratable ):
           ]
           m.next = "SPI_RX"
         with m.Else():
-          m.next = "SPI_TX"
+          m.next = "SPI_DUMMY"
       # 'Receive data' state: continue the clock signal and read
-      # the 'miso' pin on rising edges.
+      # the data line(s) on rising edges. Bytes arrive in address
+      # order, MSbit first, so the word ends up little-endian.
       # You can keep the clock signal going to receive as many bytes
-      # as you want, but this implementation only fetches one word.
+      # as you want; in burst mode, the clock pauses between words.
       with m.State( "SPI_RX" ):
-        # Simulate the 'miso' pin value for tests.
+        # Simulate the data line values for tests. Received bit 'j'
+        # is bit '8 * ( 3 - ( j // 8 ) ) + ( j % 8 )' of the ROM word.
         if platform is None:
-          with m.If( self.dc < 8 ):
-            m.d.comb += self.spi.miso.i.eq( ( self.data[ self.arb.bus.adr >> 2 ] >> ( self.dc + 24 ) ) & 0b1 )
-          with m.Elif( self.dc < 16 ):
-            m.d.comb += self.spi.miso.i.eq( ( self.data[ self.arb.bus.adr >> 2 ] >> ( self.dc + 8 ) ) & 0b1 )
-          with m.Elif( self.dc < 24 ):
-            m.d.comb += self.spi.miso.i.eq( ( self.data[ self.arb.bus.adr >> 2 ] >> ( self.dc - 8 ) ) & 0b1 )
-          with m.Else():
-            m.d.comb += self.spi.miso.i.eq( ( self.data[ self.arb.bus.adr >> 2 ] >> ( self.dc - 24 ) ) & 0b1 )
+          word = self.data[ self.arb.bus.adr >> 2 ]
+          sdat = Signal( 4, reset = 0b0000 )
+          for k in range( self.dlines ):
+            j = ( lo + k )[ :5 ]
+            m.d.comb += sdat[ k ].eq(
+              word.bit_select( Cat( j[ :3 ], ~j[ 3 : 5 ] ), 1 ) )
+          if self.mode == SPI_MODE_1X:
+            m.d.comb += self.spi.miso.i.eq( sdat[ 0 ] )
+          else:
+            m.d.comb += self.spi.dq.i.eq( sdat )
         m.d.sync += [
-          self.dc.eq( self.dc - 1 ),
-          self.arb.bus.dat_r.bit_select( self.dc, 1 ).eq( self.spi.miso.i )
+          self.dc.eq( self.dc - self.dlines ),
+          self.arb.bus.dat_r.bit_select( lo, self.dlines ).eq(
+            din[ : self.dlines ] )
         ]
         m.d.comb += self.spi.clk.o.eq( ~ClockSignal( "sync" ) )
         # Assert 'ack' signal and move back to 'waiting' state
-        # once a whole word of data has been received.
-        with m.If( self.dc[ :3 ] == 0 ):
+        # once a whole word of data has been received. (Or to the
+        # 'burst' state, which leaves CS asserted)
+        with m.If( self.dc[ :3 ] == ( self.dlines - 1 ) ):
           with m.If( self.dc[ 3 : 5 ] == 0b11 ):
-            m.d.sync += [
-              self.spi.cs.o.eq( 0 ),
-              self.arb.bus.ack.eq( self.arb.bus.cyc )
-            ]
-            m.next = "SPI_WAITING"
+            m.d.sync += self.arb.bus.ack.eq( self.arb.bus.cyc )
+            if self.burst:
+              m.next = "SPI_BURST"
+            else:
+              m.d.sync += self.spi.cs.o.eq( 0 )
+              m.next = "SPI_WAITING"
           with m.Else():
-            m.d.sync += self.dc.eq( self.dc + 15 )
+            m.d.sync += self.dc.eq( self.dc + 16 - self.dlines )
             m.next = "SPI_RX"
         with m.Else():
           m.next = "SPI_RX"
+      # 'Burst' state: the Flash chip is still in the middle of a
+      # read, with the clock stopped. Keep 'ack' asserted until
+      # 'stb' is released like the 'waiting' state does, then
+      # clock in the next word if it was requested. Any other
+      # address de-asserts CS and sends a new read command.
+      with m.State( "SPI_BURST" ):
+        m.d.sync += self.arb.bus.ack.eq( self.arb.bus.cyc &
+          ( self.arb.bus.ack & self.arb.bus.stb ) )
+        m.next = "SPI_BURST"
+        with m.If( ( self.arb.bus.cyc == 1 ) &
+                   ( self.arb.bus.stb == 1 ) &
+                   ( self.arb.bus.ack == 0 ) ):
+          with m.If( self.arb.bus.adr == self.nadr ):
+            m.d.sync += [
+              self.dc.eq( 7 ),
+              self.arb.bus.dat_r.eq( 0 ),
+              self.nadr.eq( self.arb.bus.adr + 4 )
+            ]
+            m.next = "SPI_RX"
+          with m.Else():
+            m.d.sync += self.spi.cs.o.eq( 0 )
+            m.next = "SPI_WAITING"
 
     # (End of SPI Flash "ROM" module logic)
     return m
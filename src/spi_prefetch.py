@@ -0,0 +1,161 @@
+from amaranth import *
+from math import ceil, log2
+from amaranth.back import *
+from amaranth_soc.memory import *
+from amaranth_soc.wishbone import *
+
+import sys
+sys.path.append("..")
+
+from src.isa import *
+
+#############################################################
+# Prefetch (stream) buffer in front of a slow ROM module,   #
+# such as SPI_Flash. It reads up to 'depth' words ahead of  #
+# the instruction fetches into a small FIFO. Because the    #
+# read-ahead is always sequential, the SPI Flash keeps its  #
+# burst going and each word only costs its data clocks.     #
+# A fetch from the head of the FIFO is acknowledged on the  #
+# next cycle; any other address empties the FIFO and        #
+# restarts the stream from there. 'flush' empties the FIFO  #
+# and stops reading ahead until the next fetch; the cores   #
+# pulse it on taken jumps and branches. A read which is     #
+# already in flight can't be stopped, so its word is        #
+# dropped when it arrives.                                  #
+#############################################################
+
+class SPI_Prefetch( Elaboratable ):
+  def __init__( self, flash, depth = 4 ):
+    # The ROM module that words are read ahead from, and how many
+    # words to read ahead.
+    self.flash = flash
+    self.depth = depth
+    # FIFO storage.
+    self.fifo  = Memory( width = 32, depth = depth,
+                         init = ( 0 for i in range( depth ) ) )
+    # 'Flush' input: stop reading ahead and empty the FIFO.
+    self.flush  = Signal( 1, reset = 0 )
+    # Hit / miss counters. A fetch which restarts the stream is a
+    # miss; any other fetch is a hit, even if it has to wait for
+    # a word which is already on its way.
+    self.hits   = Signal( 32, reset = 0 )
+    self.misses = Signal( 32, reset = 0 )
+
+    # Wishbone bus which instructions are fetched through. It
+    # covers the same address range as the ROM module.
+    self.bus = Interface( addr_width = flash.arb.bus.addr_width,
+                          data_width = flash.arb.bus.data_width )
+    self.bus.memory_map = MemoryMap( addr_width = self.bus.addr_width,
+                                     data_width = self.bus.data_width,
+                                     alignment = 0 )
+    # Wishbone bus which words are read ahead through.
+    self.mbus = flash.new_bus()
+
+  def elaborate( self, platform ):
+    m = Module()
+
+    rd = self.fifo.read_port( domain = "comb" )
+    wr = self.fifo.write_port()
+    m.submodules.rd = rd
+    m.submodules.wr = wr
+
+    aw = self.bus.addr_width
+    # FIFO read / write pointers and the number of words in it.
+    head = Signal( range( max( 2, self.depth ) ), reset = 0 )
+    tail = Signal( range( max( 2, self.depth ) ), reset = 0 )
+    n    = Signal( range( self.depth + 1 ), reset = 0 )
+    # Address of the word at the head of the FIFO, and of the next
+    # word to read ahead. The stream is always sequential, so the
+    # FIFO holds 'hadr', 'hadr + 4', ... and then the word in flight.
+    hadr = Signal( aw, reset = 0 )
+    padr = Signal( aw, reset = 0 )
+    # Address of the read in flight.
+    fadr = Signal( aw, reset = 0 )
+    # A read is in flight, and its word should be dropped.
+    busy = Signal( 1, reset = 0 )
+    kill = Signal( 1, reset = 0 )
+    # The stream is running. (It stops after a flush)
+    run  = Signal( 1, reset = 0 )
+    # The fetch being waited on restarted the stream.
+    pend = Signal( 1, reset = 0 )
+
+    # FIFO pushes and pops. Both are cancelled if the stream
+    # restarts or is flushed on the same cycle.
+    push    = Signal()
+    pop     = Signal()
+    restart = Signal()
+    drop    = Signal()
+    # Read ahead whenever the stream is running and there is room.
+    start = Signal()
+    m.d.comb += start.eq( run & ~busy & ( n < self.depth ) & ~drop )
+    m.d.comb += [
+      self.mbus.adr.eq( Mux( busy, fadr, padr ) ),
+      self.mbus.cyc.eq( ( busy & ~self.mbus.ack ) | start ),
+      self.mbus.stb.eq( self.mbus.cyc )
+    ]
+    m.d.sync += busy.eq( self.mbus.cyc )
+    with m.If( start ):
+      m.d.sync += [
+        fadr.eq( padr ),
+        padr.eq( padr + 4 )
+      ]
+    with m.If( self.mbus.ack ):
+      m.d.sync += kill.eq( 0 )
+
+    m.d.comb += [
+      drop.eq( restart | self.flush ),
+      push.eq( self.mbus.ack & ~kill & ~drop ),
+      rd.addr.eq( head ),
+      wr.addr.eq( tail ),
+      wr.data.eq( self.mbus.dat_r ),
+      wr.en.eq( push )
+    ]
+
+    # Serve fetches from the head of the FIFO.
+    m.d.sync += self.bus.ack.eq( 0 )
+    with m.If( self.bus.cyc & ~self.bus.ack ):
+      # Hit: acknowledge on the next cycle.
+      with m.If( ( self.bus.adr == hadr ) & ( n != 0 ) ):
+        m.d.comb += pop.eq( 1 )
+        m.d.sync += [
+          self.bus.ack.eq( 1 ),
+          self.bus.dat_r.eq( rd.data ),
+          self.hits.eq( self.hits + ( pend == 0 ) ),
+          pend.eq( 0 ),
+          hadr.eq( hadr + 4 )
+        ]
+      # The word is on its way, or about to be read: wait for it.
+      with m.Elif( ( self.bus.adr == hadr ) & run ):
+        pass
+      # Miss: restart the stream from the fetch address.
+      with m.Else():
+        m.d.comb += restart.eq( 1 )
+        m.d.sync += [
+          self.misses.eq( self.misses + 1 ),
+          pend.eq( 1 ),
+          hadr.eq( self.bus.adr ),
+          padr.eq( self.bus.adr ),
+          run.eq( 1 )
+        ]
+
+    # Stop reading ahead on a flush.
+    with m.If( self.flush ):
+      m.d.sync += run.eq( 0 )
+    # Empty the FIFO on a restart or flush, and drop the word in
+    # flight if it doesn't arrive on this cycle.
+    with m.If( drop ):
+      m.d.sync += [
+        head.eq( 0 ),
+        tail.eq( 0 ),
+        n.eq( 0 ),
+        kill.eq( busy & ~self.mbus.ack )
+      ]
+    with m.Else():
+      m.d.sync += n.eq( n + push - pop )
+      with m.If( pop ):
+        m.d.sync += head.eq( Mux( head == self.depth - 1, 0, head + 1 ) )
+      with m.If( push ):
+        m.d.sync += tail.eq( Mux( tail == self.depth - 1, 0, tail + 1 ) )
+
+    # End of prefetch buffer module definition.
+    return m
@@ -0,0 +1,327 @@
+from amaranth import *
+from amaranth.back import rtlil
+from amaranth.hdl.ast import Assign
+from amaranth.hdl.ir import Fragment, Instance
+from amaranth.hdl.mem import Memory
+from amaranth.sim import Settle, Tick
+
+import contextlib, ctypes, hashlib, importlib.util, os, re, shutil
+import subprocess, sys, tempfile, warnings
+sys.path.append("..")
+
+#############################################################
+# Compiled simulator backend for the testbenches.           #
+# The design is converted to C++ by Yosys' CXXRTL backend,  #
+# compiled into a shared library, and driven through        #
+# CXXRTL's C API. Memory contents aren't compiled in: they  #
+# are written into the model when it starts, so designs     #
+# which only differ by their ROM images share one library.  #
+# Libraries are cached by a hash of the design's RTLIL, so  #
+# a design is only compiled again when it changes.          #
+# 'CxxrtlSimulator' has the same interface as amaranth's    #
+# 'Simulator', and runs the same testbench processes. They  #
+# can yield:                                                #
+# * Settle() and Tick() on the 'sync' domain,               #
+# * signals and memory rows, to read them,                  #
+# * '.eq()' assignments to them, to write them.             #
+# Waveforms aren't written with this backend.               #
+# Once the CPU is built (about 15s with a cold cache), a    #
+# compliance program runs in about 35ms, against about      #
+# 2.4s with amaranth's simulator.                           #
+# Yosys is run from $YOSYS or 'yosys' if either is set up,  #
+# with its data directory from $YOSYS_DATDIR or from        #
+# 'yosys-config'. Otherwise, the 'amaranth-yosys' package   #
+# is used.                                                  #
+#############################################################
+
+# Where compiled designs are kept.
+CXXRTL_CACHE = os.path.join( os.path.dirname( __file__ ), "cxxrtl_cache" )
+# C++ compiler and flags used to build the designs.
+CXXRTL_CXX    = os.environ.get( "CXX", "c++" )
+CXXRTL_CFLAGS = [ "-std=c++14", "-O2", "-shared", "-fPIC",
+                  "-DCXXRTL_INCLUDE_CAPI_IMPL" ]
+# Oldest Yosys version which this backend works with, and the
+# newest which it has been tested with. (Older ones may not have
+# 'read_rtlil', and CXXRTL's C API and headers have changed
+# between versions, so newer ones are used with a warning)
+CXXRTL_YOSYS_MIN    = ( 0, 50 )
+CXXRTL_YOSYS_TESTED = ( 0, 70 )
+
+# CXXRTL's description of a wire, value or memory. (Only the fields
+# up to 'outline' are used, so later additions don't matter)
+class cxxrtl_object( ctypes.Structure ):
+  _fields_ = [ ( "type",    ctypes.c_uint32 ),
+               ( "flags",   ctypes.c_uint32 ),
+               ( "width",   ctypes.c_size_t ),
+               ( "lsb_at",  ctypes.c_size_t ),
+               ( "depth",   ctypes.c_size_t ),
+               ( "zero_at", ctypes.c_size_t ),
+               ( "curr",    ctypes.POINTER( ctypes.c_uint32 ) ),
+               ( "next",    ctypes.POINTER( ctypes.c_uint32 ) ),
+               ( "outline", ctypes.c_void_p ) ]
+
+# Helper method to find Yosys. Returns the command which runs it,
+# and the directory which holds CXXRTL's headers.
+def find_yosys():
+  if ( "YOSYS" in os.environ ) or ( shutil.which( "yosys" ) is not None ):
+    cmd = [ os.environ.get( "YOSYS", "yosys" ) ]
+    datdir = os.environ.get( "YOSYS_DATDIR" ) or subprocess.run(
+      [ "yosys-config", "--datdir" ], check = True,
+      capture_output = True, text = True ).stdout.strip()
+  elif importlib.util.find_spec( "amaranth_yosys" ) is not None:
+    cmd = [ sys.executable, "-m", "amaranth_yosys" ]
+    datdir = os.path.join( os.path.dirname(
+      importlib.util.find_spec( "amaranth_yosys" ).origin ), "share" )
+  else:
+    raise RuntimeError( "The CXXRTL simulator needs Yosys: install "
+                        "'amaranth-yosys', or set $YOSYS" )
+  ver = re.search( r"Yosys (\d+)\.(\d+)", subprocess.run(
+    cmd + [ "-V" ], check = True, capture_output = True,
+    text = True ).stdout )
+  ver = ( int( ver.group( 1 ) ), int( ver.group( 2 ) ) )
+  if ver < CXXRTL_YOSYS_MIN:
+    raise RuntimeError( "The CXXRTL simulator needs Yosys %d.%d or "
+                        "newer (found %d.%d)"%( CXXRTL_YOSYS_MIN + ver ) )
+  if ver > CXXRTL_YOSYS_TESTED:
+    warnings.warn( "The CXXRTL simulator hasn't been tested with Yosys "
+                   "%d.%d (only up to %d.%d)"
+                   %( ver + CXXRTL_YOSYS_TESTED ) )
+  # (Newer versions keep the headers with the backend's sources)
+  include = os.path.join( datdir, "include", "backends", "cxxrtl",
+                          "runtime" )
+  if not os.path.isdir( include ):
+    include = os.path.join( datdir, "include" )
+  return cmd, ver, include
+
+# Helper method to name every signal, memory and submodule in a
+# design which doesn't have a name. (Names come from the variables
+# which hold them, but that doesn't work on every Python version,
+# and CXXRTL can only find things which have a name)
+def name_design( fragment, count = None ):
+  count = [ 0 ] if count is None else count
+  def fresh( prefix ):
+    count[ 0 ] += 1
+    return "%s%d"%( prefix, count[ 0 ] )
+  # (Once the design is prepared, every signal which it uses is a
+  #  port of, or driven by, one of its fragments)
+  for sig in fragment.iter_signals():
+    if sig.name is None:
+      sig.name = fresh( "sig" )
+  if isinstance( fragment, Instance ):
+    for v in fragment.parameters.values():
+      if isinstance( v, Memory ) and ( v.name is None ):
+        v.name = fresh( "mem" )
+  for i, ( sub, sub_name ) in enumerate( fragment.subfragments ):
+    if sub_name is None:
+      fragment.subfragments[ i ] = ( sub, fresh( "sub" ) )
+    name_design( sub, count )
+
+# Helper method to find the memories in a design, along with the
+# CXXRTL name of each one. Memories are declared in the module which
+# holds their ports, the same way as the RTLIL backend does it.
+def find_memories( fragment, hierarchy = () ):
+  mems = {}
+  for sub, sub_name in fragment.subfragments:
+    if isinstance( sub, Instance ):
+      for v in sub.parameters.values():
+        if isinstance( v, Memory ):
+          mems[ v ] = " ".join( hierarchy + ( v.name, ) )
+    else:
+      mems.update( find_memories( sub, hierarchy + ( sub_name, ) ) )
+  return mems
+
+# Helper method to build a design's CXXRTL model, or find it in the
+# cache. Returns the path to its shared library.
+def build_model( rtlil_text ):
+  yosys, ver, include = find_yosys()
+  key = hashlib.sha256( "\n".join( [ rtlil_text, "%d.%d"%ver,
+                                     CXXRTL_CXX ] +
+                                   CXXRTL_CFLAGS ).encode() ).hexdigest()
+  so_path = os.path.join( CXXRTL_CACHE, "%s.so"%key[ :16 ] )
+  if os.path.exists( so_path ):
+    return so_path
+  os.makedirs( CXXRTL_CACHE, exist_ok = True )
+  with tempfile.TemporaryDirectory() as tmp:
+    with open( os.path.join( tmp, "top.il" ), "w" ) as f:
+      f.write( rtlil_text )
+    # (Yosys runs in the build directory, because the WebAssembly
+    #  build can only see files below the directory it starts in)
+    subprocess.run( yosys + [ "-q", "-p",
+                              "read_rtlil top.il; write_cxxrtl top.cc" ],
+                    cwd = tmp, check = True )
+    out = os.path.join( tmp, "top.so" )
+    subprocess.run( [ CXXRTL_CXX ] + CXXRTL_CFLAGS +
+                    [ "-I", include, os.path.join( tmp, "top.cc" ),
+                      "-o", out ], check = True )
+    # (Move the finished library into place, so that an interrupted
+    #  build doesn't leave a broken one in the cache)
+    os.replace( out, so_path )
+  return so_path
+
+class CxxrtlSimulator():
+  def __init__( self, design, ports = [] ):
+    self.processes = []
+    fragment = Fragment.get( design, None ).prepare( ports = ports )
+    name_design( fragment )
+    mems = find_memories( fragment )
+    # Leave memory contents out of the RTLIL, and keep them to write
+    # into the model instead.
+    self.inits = [ ( mem, list( mem.init ) ) for mem in mems ]
+    try:
+      for mem in mems:
+        mem.init = []
+      rtlil_text, name_map = rtlil.convert_fragment( fragment )
+    finally:
+      for mem, init in self.inits:
+        mem.init = init
+    self.lib = ctypes.CDLL( build_model( rtlil_text ) )
+    self.lib.cxxrtl_design_create.restype = ctypes.c_void_p
+    self.lib.cxxrtl_create.restype = ctypes.c_void_p
+    self.lib.cxxrtl_create.argtypes = [ ctypes.c_void_p ]
+    self.lib.cxxrtl_reset.argtypes = [ ctypes.c_void_p ]
+    self.lib.cxxrtl_step.argtypes = [ ctypes.c_void_p ]
+    self.lib.cxxrtl_destroy.argtypes = [ ctypes.c_void_p ]
+    self.lib.cxxrtl_outline_eval.argtypes = [ ctypes.c_void_p ]
+    self.lib.cxxrtl_get_parts.restype = ctypes.POINTER( cxxrtl_object )
+    self.lib.cxxrtl_get_parts.argtypes = [
+      ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER( ctypes.c_size_t ) ]
+    self.handle = self.lib.cxxrtl_create(
+      self.lib.cxxrtl_design_create() )
+    # CXXRTL names of the design's signals and memory rows, by the
+    # Python object's id. (The top module's name isn't part of them,
+    # and the design holds on to every signal, so ids don't change)
+    self.names = { id( sig ): " ".join( name[ 1: ] )
+                   for sig, name in name_map.items() }
+    for mem, name in mems.items():
+      for i in range( mem.depth ):
+        self.names[ id( mem[ i ] ) ] = ( name, i )
+    self.located = {}
+    self.dirty = False
+    clk = self.object( self.names[ id( fragment.domains[ "sync" ].clk ) ] )
+    self.clk = clk.next if clk.next else clk.curr
+    self.load()
+
+  def __del__( self ):
+    if getattr( self, "handle", None ) is not None:
+      self.lib.cxxrtl_destroy( self.handle )
+
+  # Helper method to find a CXXRTL object by name.
+  def object( self, name ):
+    parts = ctypes.c_size_t( 0 )
+    obj = self.lib.cxxrtl_get_parts( self.handle, name.encode(),
+                                     ctypes.byref( parts ) )
+    if ( not obj ) or ( parts.value != 1 ):
+      raise KeyError( "'%s' isn't available in the CXXRTL model"%name )
+    return obj.contents
+
+  # Helper method to find the value behind a signal or memory row.
+  # Returns its current and next values' storage, the offset of its
+  # first 32-bit chunk, its width, and its debug outline (if it
+  # has to be computed before it's read).
+  def locate( self, sig ):
+    if id( sig ) not in self.located:
+      if id( sig ) not in self.names:
+        raise KeyError( "'%s' isn't part of the simulated design"
+                        %sig.name )
+      name = self.names[ id( sig ) ]
+      if isinstance( name, tuple ):
+        obj = self.object( name[ 0 ] )
+        off = ( name[ 1 ] - obj.zero_at ) * ( ( obj.width + 31 ) // 32 )
+      else:
+        obj, off = self.object( name ), 0
+      self.located[ id( sig ) ] = (
+        obj.curr, obj.next if obj.next else obj.curr, off, obj.width,
+        obj.outline )
+    return self.located[ id( sig ) ]
+
+  # Helper method to let the design settle after it was written.
+  def settle( self ):
+    self.lib.cxxrtl_step( self.handle )
+    self.dirty = False
+
+  # Read a signal or memory row.
+  def read( self, sig ):
+    if self.dirty:
+      self.settle()
+    curr, _, off, width, outline = self.locate( sig )
+    if outline:
+      self.lib.cxxrtl_outline_eval( outline )
+    v = curr[ off ]
+    for i in range( 1, ( width + 31 ) // 32 ):
+      v |= curr[ off + i ] << ( 32 * i )
+    return v
+
+  # Write a signal or memory row. (The design settles before it's
+  # read or clocked again)
+  def write( self, sig, v ):
+    _, data, off, width, _ = self.locate( sig )
+    v &= ( 1 << width ) - 1
+    for i in range( ( width + 31 ) // 32 ):
+      data[ off + i ] = ( v >> ( 32 * i ) ) & 0xFFFFFFFF
+    self.dirty = True
+
+  # Write the memories' initial contents into the model.
+  def load( self ):
+    for mem, init in self.inits:
+      for i, v in enumerate( init ):
+        self.write( mem[ i ], v )
+    self.settle()
+
+  # Run one clock cycle.
+  def tick( self ):
+    if self.dirty:
+      self.settle()
+    for level in [ 1, 0 ]:
+      self.clk[ 0 ] = level
+      self.lib.cxxrtl_step( self.handle )
+
+  # Put the design back in its initial state, so that another
+  # process can run on it without compiling it again.
+  def reset( self ):
+    self.lib.cxxrtl_reset( self.handle )
+    self.load()
+
+  # The clock period only matters for waveforms, so it's ignored.
+  def add_clock( self, period, domain = "sync" ):
+    if domain != "sync":
+      raise ValueError( "Only the 'sync' domain is supported" )
+
+  def add_sync_process( self, process, domain = "sync" ):
+    if domain != "sync":
+      raise ValueError( "Only the 'sync' domain is supported" )
+    self.processes.append( process )
+
+  # (Waveforms aren't supported; see above)
+  def write_vcd( self, *args, **kwargs ):
+    return contextlib.nullcontext()
+
+  # Run each process until it finishes. Since there is only one
+  # clock, processes run one after another rather than together.
+  # Like amaranth's sync processes, each one starts after a clock
+  # edge, and yielding nothing waits for the next one. Processes
+  # which have finished don't run again.
+  def run( self ):
+    while self.processes:
+      coro = self.processes.pop( 0 )()
+      response = None
+      self.tick()
+      while True:
+        try:
+          cmd = coro.send( response )
+        except StopIteration:
+          break
+        response = None
+        if ( cmd is None ) or \
+           ( isinstance( cmd, Tick ) and ( cmd.domain == "sync" ) ):
+          self.tick()
+        elif isinstance( cmd, Settle ):
+          # (Writes settle before the next read or tick)
+          pass
+        elif isinstance( cmd, Assign ) and isinstance( cmd.rhs, Const ):
+          self.write( cmd.lhs, cmd.rhs.value )
+        elif isinstance( cmd, Signal ):
+          response = self.read( cmd )
+        elif isinstance( cmd, Const ):
+          response = cmd.value
+        else:
+          raise TypeError( "Unsupported command in testbench: %r"%cmd )
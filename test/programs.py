@@ -78,7 +78,222 @@ ram_exp = {
   'end': 22
 }
 
+# "Multiply / divide" program: run each RV32M operation once,
+# plus the division corner cases and back-to-back dependent ops.
+muldiv_rom = rom_img( [
+  LI( 1, 0x12345678 ), LI( 2, 0xFFFFFFF9 ),
+  MUL( 3, 1, 2 ), MULH( 4, 1, 2 ), MULHSU( 5, 2, 1 ), MULHU( 6, 1, 2 ),
+  DIV( 7, 1, 2 ), DIVU( 8, 1, 2 ), REM( 9, 1, 2 ), REMU( 10, 1, 2 ),
+  # Division by zero.
+  DIV( 11, 1, 0 ), REM( 12, 1, 0 ),
+  # Signed overflow: -2^31 / -1.
+  LI( 13, 0x80000000 ), ADDI( 14, 0, 0xFFF ),
+  DIV( 15, 13, 14 ), REM( 16, 13, 14 ),
+  # Use the results straight away.
+  ADDI( 17, 16, 5 ), MUL( 18, 17, 17 ),
+  # Done; infinite loop.
+  JAL( 1, 0x00000 )
+] )
+
+# Expected runtime values for the "Multiply / divide" program.
+muldiv_exp = {
+  4:  [ { 'r': 1, 'e': 0x12345678 }, { 'r': 2, 'e': 0xFFFFFFF9 } ],
+  8:  [
+        { 'r': 3, 'e': 0x8091A2B8 },
+        { 'r': 4, 'e': 0xFFFFFFFF },
+        { 'r': 5, 'e': 0xFFFFFFFF },
+        { 'r': 6, 'e': 0x12345677 }
+      ],
+  12: [
+        { 'r': 7,  'e': 0xFD663CCB },
+        { 'r': 8,  'e': 0x00000000 },
+        { 'r': 9,  'e': 0x00000005 },
+        { 'r': 10, 'e': 0x12345678 }
+      ],
+  14: [ { 'r': 11, 'e': 0xFFFFFFFF }, { 'r': 12, 'e': 0x12345678 } ],
+  19: [ { 'r': 15, 'e': 0x80000000 }, { 'r': 16, 'e': 0x00000000 } ],
+  21: [ { 'r': 17, 'e': 0x00000005 }, { 'r': 18, 'e': 0x00000019 } ],
+  'end': 22
+}
+
+# "Compressed" program: a loop, stack / pointer loads and stores,
+# and a call and return, written with RV32C instructions where
+# possible. (One 32-bit instruction straddles two words)
+rvc_rom = rvc_img( [
+  C_LI( 8, 10 ), C_LI( 9, 0 ), LI( 2, 0x20000100 ),
+  # Add 10 + 9 + ... + 1.
+  C_ADD( 9, 8 ), C_ADDI( 8, 0x3F ), C_BNEZ( 8, 0xFE ),
+  C_SWSP( 9, 4 ), C_LWSP( 10, 4 ), C_ADDI4SPN( 11, 8 ),
+  C_SW( 11, 9, 0 ), C_LW( 12, 11, 0 ), C_SLLI( 12, 2 ),
+  ADDI( 13, 12, 1 ),
+  # Call a function which copies r13 to r14, and loop forever.
+  C_JAL( 2 ), C_J( 0 ),
+  C_MV( 14, 13 ), C_JR( 1 )
+] )
+
+# The same program, without compressed instructions.
+rvc_rv32i_rom = rom_img( [
+  ADDI( 8, 0, 10 ), ADDI( 9, 0, 0 ), LI( 2, 0x20000100 ),
+  ADD( 9, 9, 8 ), ADDI( 8, 8, 0xFFF ), BNE( 8, 0, 0xFFC ),
+  SW( 2, 9, 4 ), LW( 10, 2, 4 ), ADDI( 11, 2, 8 ),
+  SW( 11, 9, 0 ), LW( 12, 11, 0 ), SLLI( 12, 12, 2 ),
+  ADDI( 13, 12, 1 ),
+  JAL( 1, 4 ), JAL( 0, 0 ),
+  ADD( 14, 0, 13 ), JALR( 0, 1, 0 )
+] )
+
+# Expected runtime values for both versions of the program, once
+# it reaches its final loop. (Apart from the return address)
+def rvc_exp( ra ):
+  return {
+    46: [
+          { 'r': 1,  'e': ra },
+          { 'r': 8,  'e': 0x00000000 },
+          { 'r': 9,  'e': 0x00000037 },
+          { 'r': 10, 'e': 0x00000037 },
+          { 'r': 11, 'e': 0x20000108 },
+          { 'r': 12, 'e': 0x000000DC },
+          { 'r': 13, 'e': 0x000000DD },
+          { 'r': 14, 'e': 0x000000DD },
+          { 'r': 'RAM%d'%( 0x104 ), 'e': 0x00000037 },
+          { 'r': 'RAM%d'%( 0x108 ), 'e': 0x00000037 }
+        ],
+    'end': 46
+  }
+
+# Performance counter program: count taken branches with
+# 'mhpmcounter3', and read 'minstret' after a short loop.
+counters_rom = rom_img( [
+  CSRRS( 1, CSRA_MINSTRET, 0 ),
+  ADDI( 2, 0, EV_BRANCH ), CSRRW( 0, CSRA_MHPMEVENT3, 2 ),
+  # Loop 4 times; the branch is taken 3 times.
+  ADDI( 3, 0, 4 ), ADDI( 3, 3, 0xFFF ), BNE( 3, 0, 0xFFE ),
+  CSRRS( 4, CSRA_MINSTRET, 0 ), CSRRS( 5, CSRA_MHPMCOUNTER3, 0 ),
+  CSRRS( 6, CSRA_MCYCLEH, 0 ),
+  JAL( 0, 0 )
+] )
+
+# Expected runtime values for the performance counter program.
+counters_exp = {
+  15: [
+        { 'r': 1, 'e': 0x00000000 },
+        { 'r': 3, 'e': 0x00000000 },
+        { 'r': 4, 'e': 0x0000000C },
+        { 'r': 5, 'e': 0x00000003 },
+        { 'r': 6, 'e': 0x00000000 }
+      ],
+  'end': 16
+}
+
+# Interrupt program: set up a vectored trap table at 0x100, arm
+# the CLINT timer, enable the timer, external and software
+# interrupts, and spin. The timer handler disarms the timer, and
+# the external interrupt handler disables itself and raises a
+# software interrupt, which is taken as soon as it returns.
+irq_rom = rom_img( [
+  LUI( 1, 0x40004000 ),
+  # mtimecmp = 40
+  ADDI( 2, 0, 40 ), SW( 1, 2, 0x000 ), SW( 1, 0, 0x004 ),
+  # mtvec = 0x100, vectored.
+  ADDI( 3, 0, 0x101 ), CSRRW( 0, CSRA_MTVEC, 3 ),
+  # mie = MEIE | MTIE | MSIE, then set mstatus.MIE.
+  ADDI( 4, 0, 0x444 ), ADD( 4, 4, 4 ), CSRRW( 0, CSRA_MIE, 4 ),
+  ADDI( 5, 0, 0x008 ), CSRRS( 0, CSRA_MSTATUS, 5 ),
+  # Spin loop, @ 0x2C.
+  ADDI( 10, 10, 1 ), JAL( 0, 0xFFFFE ) ] +
+  [ NOP() ] * 54 + [
+  # Vector table @ 0x100. Software interrupt @ 0x10C.
+  JAL( 0, 0x4A ), NOP(), NOP(), NOP(),
+  # Timer interrupt @ 0x11C.
+  JAL( 0, 0x12 ), NOP(), NOP(), NOP(),
+  # External interrupt @ 0x12C.
+  JAL( 0, 0x1A ), NOP(), NOP(), NOP(), NOP(),
+  # Timer handler @ 0x140: mtimecmp = 0xFFFFFFFF_00000028.
+  CSRRS( 6, CSRA_MCAUSE, 0 ), CSRRS( 7, CSRA_MEPC, 0 ),
+  ADDI( 2, 0, 0xFFF ), SW( 1, 2, 0x004 ), ADDI( 11, 11, 1 ),
+  MRET(), NOP(), NOP(),
+  # External interrupt handler @ 0x160: clear MEIE, set msip.
+  CSRRS( 8, CSRA_MCAUSE, 0 ), ADDI( 12, 12, 1 ),
+  ADDI( 9, 0, 0x400 ), ADD( 9, 9, 9 ), CSRRC( 0, CSRA_MIE, 9 ),
+  LUI( 14, 0x40000000 ), ADDI( 15, 0, 1 ), SW( 14, 15, 0x000 ),
+  MRET(), NOP(), NOP(), NOP(), NOP(), NOP(), NOP(), NOP(),
+  # Software interrupt handler @ 0x1A0: clear msip.
+  CSRRS( 13, CSRA_MCAUSE, 0 ), SW( 14, 0, 0x000 ), MRET()
+] )
+
+# WFI program: like the 'infinite loop' program, but the loop
+# sleeps until a timer interrupt every 'period' cycles.
+def wfi_rom( period ):
+  return rom_img( [
+    LUI( 1, 0x40004000 ),
+    # mtimecmp = period
+    ADDI( 2, 0, period ), SW( 1, 2, 0x000 ), SW( 1, 0, 0x004 ),
+    # mtvec = 0x100, direct.
+    ADDI( 3, 0, 0x100 ), CSRRW( 0, CSRA_MTVEC, 3 ),
+    # mie = MTIE, then set mstatus.MIE.
+    ADDI( 4, 0, 0x080 ), CSRRW( 0, CSRA_MIE, 4 ),
+    ADDI( 5, 0, 0x008 ), CSRRS( 0, CSRA_MSTATUS, 5 ),
+    # Sleep / wake loop, @ 0x28.
+    WFI(), ADDI( 10, 10, 1 ), JAL( 0, 0xFFFFC ) ] +
+    [ NOP() ] * 51 + [
+    # Timer handler @ 0x100: mtimecmp += period.
+    ADDI( 11, 11, 1 ), ADDI( 2, 2, period ), SW( 1, 2, 0x000 ),
+    MRET()
+  ] )
+
+# WFI nop program: for the cores which don't take interrupts, WFI
+# has nothing to wait for, so it retires like a nop. (It must not
+# trap like the EBREAK which it shares its low bits with)
+wfi_nop_rom = rom_img( [
+  ADDI( 1, 0, 0x005 ), WFI(), ADDI( 2, 1, 0x001 ),
+  JAL( 3, 0x00000 )
+] )
+
+# Expected runtime values for the WFI nop program.
+wfi_nop_exp = {
+  2: [ { 'r': 'pc', 'e': 0x00000008 }, { 'r': 1, 'e': 0x00000005 } ],
+  3: [ { 'r': 2, 'e': 0x00000006 } ],
+  4: [ { 'r': 'pc', 'e': 0x0000000C }, { 'r': 3, 'e': 0x00000010 } ],
+  'end': 4
+}
+
+# Peripheral access program: write and read back the CLINT's
+# 'mtimecmp' and 'msip' registers.
+clint_rom = rom_img( [
+  LUI( 1, 0x40004000 ),
+  ADDI( 2, 0, 0x123 ), SW( 1, 2, 0x000 ),
+  LW( 3, 1, 0x000 ), LW( 4, 1, 0x004 ),
+  LUI( 5, 0x40000000 ),
+  ADDI( 6, 0, 1 ), SW( 5, 6, 0x000 ), LW( 7, 5, 0x000 ),
+  JAL( 1, 0x00000 )
+] )
+
+# Expected runtime values for the peripheral access program.
+clint_exp = {
+  # 'mtimecmp' reads back its new low word, and its reset value
+  # in the high word.
+  5:  [
+        { 'r': 3, 'e': 0x00000123 },
+        { 'r': 4, 'e': 0xFFFFFFFF }
+      ],
+  # 'msip' reads back as set.
+  9:  [ { 'r': 7, 'e': 0x00000001 } ],
+  'end': 10
+}
+
 loop_test    = [ 'inifinite loop test', 'cpu_loop',
                  loop_rom, [], loop_exp ]
 ram_pc_test  = [ 'run from RAM test', 'cpu_ram',
                  ram_rom, [], ram_exp ]
+muldiv_test  = [ 'multiply / divide test', 'cpu_muldiv',
+                 muldiv_rom, [], muldiv_exp ]
+rvc_test     = [ 'compressed instructions test', 'cpu_rvc',
+                 rvc_rom, [], rvc_exp( 0x00000024 ) ]
+rvc_rv32i_test = [ 'uncompressed instructions test', 'cpu_rvc_rv32i',
+                   rvc_rv32i_rom, [], rvc_exp( 0x0000003C ) ]
+counters_test = [ 'performance counters test', 'cpu_counters',
+                  counters_rom, [], counters_exp ]
+clint_test   = [ 'peripheral access test', 'cpu_clint',
+                 clint_rom, [], clint_exp ]
+wfi_nop_test = [ 'WFI nop test', 'cpu_wfi_nop',
+                 wfi_nop_rom, [], wfi_nop_exp ]
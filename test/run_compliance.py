@@ -0,0 +1,149 @@
+from amaranth.hdl.ir import DriverConflict
+from waves import wave_args
+
+import contextlib, glob, importlib, io, json, multiprocessing, os, sys
+import time, traceback, warnings
+import xml.etree.ElementTree as ET
+sys.path.append("..")
+
+###################################
+# Parallel compliance test runner #
+###################################
+# Runs every '*_test' program in 'test_rom/' on the CPU testbench,
+# each in its own process, and writes a JSON and a JUnit summary
+# with each test's results, wall time and simulated cycles.
+# Usage: python run_compliance.py [-j N] [-cxxrtl] [-o NAME] [TEST..]
+# * -j N:    run N tests at a time (default: one per CPU).
+# * -cxxrtl: use the compiled CXXRTL simulator.
+# * -o NAME: write 'NAME.json' and 'NAME.xml'. (default: compliance)
+# * TEST:    only run tests whose names contain one of these.
+# The waveform options from 'waves.py' are passed on to each test.
+
+# Helper method to find the test programs: returns a list of
+# ( module, name ) pairs.
+def find_tests( filters = [] ):
+  tests = []
+  rom_dir = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+                          "test_rom" )
+  for path in sorted( glob.glob( os.path.join( rom_dir, "rv32i_*.py" ) ) ):
+    mod_name = "test_rom.%s"%os.path.basename( path )[ :-3 ]
+    mod = importlib.import_module( mod_name )
+    for name in sorted( vars( mod ) ):
+      if name.endswith( "_test" ) and \
+         type( getattr( mod, name ) ) == list:
+        if ( not filters ) or any( t in name for t in filters ):
+          tests.append( ( mod_name, name ) )
+  return tests
+
+# Helper method to run one test program in a worker process.
+# The testbench's pass / fail counters are per-process, so the
+# results are returned rather than counted globally.
+def run_test( args ):
+  mod_name, name, cxxrtl, full_vcd, waves = args
+  result = { 'name': name[ :-5 ], 'module': mod_name, 'passed': 0,
+             'failed': 0, 'cycles': 0, 'wall_time': 0.0, 'error': None }
+  out = io.StringIO()
+  start = time.perf_counter()
+  try:
+    with contextlib.redirect_stdout( out ), warnings.catch_warnings():
+      warnings.filterwarnings( "ignore", category = DriverConflict )
+      import test_cpu
+      if cxxrtl:
+        test_cpu.SIMULATOR = test_cpu.CxxrtlSimulator
+      test_cpu.FULL_VCD, test_cpu.WAVES = full_vcd, waves
+      test = getattr( importlib.import_module( mod_name ), name )
+      p, f = test_cpu.p, test_cpu.f
+      result[ 'cycles' ] = test_cpu.cpu_sim( test )
+      result[ 'passed' ] = test_cpu.p - p
+      result[ 'failed' ] = test_cpu.f - f
+  except Exception:
+    result[ 'error' ] = traceback.format_exc()
+  result[ 'wall_time' ] = time.perf_counter() - start
+  result[ 'output' ] = out.getvalue()
+  return result
+
+# Helper method to write the results as a JUnit XML report.
+def write_junit( path, results, wall_time ):
+  suite = ET.Element( "testsuite", {
+    'name': "rv32i compliance",
+    'tests': str( len( results ) ),
+    'failures': str( sum( 1 for r in results if r[ 'failed' ] ) ),
+    'errors': str( sum( 1 for r in results if r[ 'error' ] ) ),
+    'time': "%.3f"%wall_time } )
+  for r in results:
+    case = ET.SubElement( suite, "testcase", {
+      'classname': "rv32i", 'name': r[ 'name' ],
+      'time': "%.3f"%r[ 'wall_time' ] } )
+    ET.SubElement( ET.SubElement( case, "properties" ), "property", {
+      'name': "cycles", 'value': str( r[ 'cycles' ] ) } )
+    if r[ 'error' ]:
+      ET.SubElement( case, "error", { 'message': "testbench error" } ) \
+        .text = r[ 'error' ]
+    elif r[ 'failed' ]:
+      ET.SubElement( case, "failure", {
+        'message': "%d checks failed"%r[ 'failed' ] } )
+    ET.SubElement( case, "system-out" ).text = r[ 'output' ]
+  ET.ElementTree( suite ).write( path, encoding = "utf-8",
+                                 xml_declaration = True )
+
+# 'main' method to run the compliance tests.
+if __name__ == "__main__":
+  full_vcd, waves = wave_args( sys.argv )
+  args = sys.argv[ 1: ]
+  jobs = os.cpu_count()
+  cxxrtl = False
+  out_name = "compliance"
+  filters = []
+  while args:
+    a = args.pop( 0 )
+    if a == '-j':
+      jobs = int( args.pop( 0 ) )
+    elif a == '-cxxrtl':
+      cxxrtl = True
+    elif a == '-o':
+      out_name = args.pop( 0 )
+    else:
+      filters.append( a )
+
+  tests = find_tests( filters )
+  print( "--- Running %d compliance tests, %d at a time ---"
+         %( len( tests ), jobs ) )
+  start = time.perf_counter()
+  results = []
+  # (With the Python simulator, each worker only runs one test, so
+  #  that every test gets a fresh process. CXXRTL workers run many,
+  #  so that they only build the CPU once)
+  with multiprocessing.Pool( jobs, maxtasksperchild =
+                             None if cxxrtl else 1 ) as pool:
+    for r in pool.imap_unordered( run_test,
+                                  [ t + ( cxxrtl, full_vcd, waves )
+                                    for t in tests ] ):
+      results.append( r )
+      if r[ 'error' ]:
+        status = "\033[31mERROR\033[0m"
+      elif r[ 'failed' ]:
+        status = "\033[31mFAIL\033[0m"
+      else:
+        status = "\033[32mPASS\033[0m"
+      print( "  %s: %-14s %3d passed, %3d failed, %6d cycles, %6.1fs"
+             %( status, r[ 'name' ], r[ 'passed' ], r[ 'failed' ],
+                r[ 'cycles' ], r[ 'wall_time' ] ) )
+  wall_time = time.perf_counter() - start
+  results.sort( key = lambda r: r[ 'name' ] )
+
+  # Write the summaries.
+  passed = sum( r[ 'passed' ] for r in results )
+  failed = sum( r[ 'failed' ] for r in results )
+  errors = sum( 1 for r in results if r[ 'error' ] )
+  with open( "%s.json"%out_name, "w" ) as f:
+    json.dump( { 'simulator': "cxxrtl" if cxxrtl else "pysim",
+                 'wall_time': wall_time, 'passed': passed,
+                 'failed': failed, 'errors': errors,
+                 'tests': [ { k: v for k, v in r.items() if k != 'output' }
+                            for r in results ] }, f, indent = 2 )
+  write_junit( "%s.xml"%out_name, results, wall_time )
+
+  # Done; print results.
+  print( "Compliance Tests: %d Passed, %d Failed, %d errors in %.1fs"
+         %( passed, failed, errors, wall_time ) )
+  sys.exit( 1 if ( failed or errors ) else 0 )
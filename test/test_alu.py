@@ -40,7 +40,7 @@ def alu_test( alu ):
   yield Settle()
 
   # Print a test header.
-  print( "--- ALU Tests ---" )
+  print( "--- ALU Tests (shifter config %d) ---"%alu.shifter )
 
   # Test the bitwise 'AND' operation.
   print( "AND (&) tests:" )
@@ -123,22 +123,39 @@ def alu_test( alu ):
   yield from alu_ut( alu, 0x00000010, 1, ALU_SRA, 0x00000008 )
   yield from alu_ut( alu, 0x80000000, 1, ALU_SRA, 0xC0000000 )
   yield from alu_ut( alu, 0x80000000, 4, ALU_SRA, 0xF8000000 )
+  yield from alu_ut( alu, 0x80000000, 31, ALU_SRA, 0xFFFFFFFF )
+  yield from alu_ut( alu, 0x7FFFFFFF, 31, ALU_SRA, 0x00000000 )
+
+  # Test the shift left operation, if the ALU has a left shifter.
+  # (Otherwise, the CPU flips the inputs of a right shift)
+  if alu.shifter != SHIFT_FLIP:
+    print ( "SLL (<<) tests:" )
+    yield from alu_ut( alu, 0x00000001, 0, ALU_SLL, 0x00000001 )
+    yield from alu_ut( alu, 0x00000001, 1, ALU_SLL, 0x00000002 )
+    yield from alu_ut( alu, 0x00000011, 4, ALU_SLL, 0x00000110 )
+    yield from alu_ut( alu, 0x80000001, 1, ALU_SLL, 0x00000002 )
+    yield from alu_ut( alu, 0x00000001, 31, ALU_SLL, 0x80000000 )
+    yield from alu_ut( alu, 0xFFFFFFFF, 16, ALU_SLL, 0xFFFF0000 )
+    # Only the low 5 bits of B are used.
+    yield from alu_ut( alu, 0x00000003, 33, ALU_SLL, 0x00000006 )
 
   # Done.
   yield Tick()
-  print( "ALU Tests: %d Passed, %d Failed"%( p, f ) )
 
 # 'main' method to run a basic testbench.
 if __name__ == "__main__":
-  # Instantiate an ALU module.
-  dut = ALU()
-  def proc():
-    yield from alu_test( dut )
-  
-  # Run the tests.
-  sim = Simulator(dut)
-  sim.add_clock( 1e-6 )
-  sim.add_sync_process( proc )
-  with sim.write_vcd("alu.vcd"):
-    sim.run()
+  # Test each shifter configuration.
+  for shifter in [ SHIFT_FLIP, SHIFT_BIDIR, SHIFT_FUNNEL ]:
+    # Instantiate an ALU module.
+    dut = ALU( shifter )
+    def proc():
+      yield from alu_test( dut )
+
+    # Run the tests.
+    sim = Simulator(dut)
+    sim.add_clock( 1e-6 )
+    sim.add_sync_process( proc )
+    with sim.write_vcd("alu_%d.vcd"%shifter):
+      sim.run()
+  print( "ALU Tests: %d Passed, %d Failed"%( p, f ) )
 
@@ -0,0 +1,154 @@
+from amaranth import *
+from amaranth.sim import *
+from amaranth.hdl.ir import DriverConflict
+
+import os, sys, warnings
+sys.path.append("..")
+
+from src.isa import *
+from src.pipeline import *
+# Import the pipelined core harness, test programs, and the
+# compliance test ROM images.
+import test_pipeline_core
+from test_pipeline_core import *
+
+##################################
+# Branch predictor testbench:    #
+##################################
+# Keep track of test pass / fail rates.
+p = 0
+f = 0
+
+# Helper method to check a value and record the result.
+def check( name, got, expected ):
+  global p, f
+  if got == expected:
+    p += 1
+    print( "  \033[32mPASS:\033[0m %s == 0x%08X"%( name, expected ) )
+  else:
+    f += 1
+    print( "  \033[31mFAIL:\033[0m %s == 0x%08X (got: 0x%08X)"
+           %( name, expected, got ) )
+
+# Helper method to look up the predicted next address for a word.
+# 'fire' also updates the return address stack.
+def bp_lookup( bp, pc, ir, expected, fire = 1 ):
+  yield bp.pc.eq( pc )
+  yield bp.ir.eq( LITTLE_END( ir ) )
+  yield bp.fire.eq( fire )
+  yield Settle()
+  check( "npc @ 0x%08X"%pc, ( yield bp.npc ), expected )
+  yield Tick()
+  yield bp.fire.eq( 0 )
+
+# Helper method to resolve a branch or jump, as EX would.
+def bp_resolve( bp, pc, ir, taken, target, miss, flush = 0 ):
+  yield bp.resolve.eq( 1 )
+  yield bp.rpc.eq( pc )
+  yield bp.rir.eq( LITTLE_END( ir ) )
+  yield bp.taken.eq( taken )
+  yield bp.target.eq( target )
+  yield bp.miss.eq( miss )
+  yield bp.flush.eq( flush )
+  yield Tick()
+  yield bp.resolve.eq( 0 )
+  yield bp.flush.eq( 0 )
+
+# Predictor unit tests.
+def bp_test( bp ):
+  print( "--- Branch Predictor Tests (mode %d) ---"%bp.mode )
+  yield Tick()
+  # Non-control-transfer instructions always fall through.
+  yield from bp_lookup( bp, 0x100, ADDI( 1, 0, 5 ), 0x104 )
+  # JAL is followed by every mode except 'none'.
+  yield from bp_lookup( bp, 0x100, JAL( 0, 0x10 ),
+                        0x104 if bp.mode == BP_NONE else 0x120 )
+  # A backward branch is taken by 'BTFN', and a forward one isn't.
+  yield from bp_lookup( bp, 0x100, BNE( 1, 2, 0xFFC ),
+                        0x0F8 if bp.mode == BP_BTFN else 0x104 )
+  yield from bp_lookup( bp, 0x100, BNE( 1, 2, 0x004 ), 0x104 )
+  # The bimodal counters start out 'weakly not taken', so they
+  # flip after one taken branch and back after two untaken ones.
+  if bp.mode >= BP_BIMODAL:
+    yield from bp_resolve( bp, 0x100, BNE( 1, 2, 0x004 ), 1, 0x108, 1 )
+    yield from bp_lookup( bp, 0x100, BNE( 1, 2, 0x004 ), 0x108 )
+    yield from bp_resolve( bp, 0x100, BNE( 1, 2, 0x004 ), 1, 0x108, 0 )
+    yield from bp_resolve( bp, 0x100, BNE( 1, 2, 0x004 ), 0, 0x108, 1 )
+    yield from bp_lookup( bp, 0x100, BNE( 1, 2, 0x004 ), 0x108 )
+    yield from bp_resolve( bp, 0x100, BNE( 1, 2, 0x004 ), 0, 0x108, 1 )
+    yield from bp_lookup( bp, 0x100, BNE( 1, 2, 0x004 ), 0x104 )
+    # A different table entry is unaffected.
+    yield from bp_lookup( bp, 0x104, BNE( 1, 2, 0x004 ), 0x108 )
+    check( "branches", ( yield bp.branches ), 4 )
+    check( "branch misses", ( yield bp.branch_misses ), 3 )
+  if bp.mode == BP_BTB:
+    # Indirect jumps are predicted once the BTB has seen them.
+    yield from bp_lookup( bp, 0x200, JALR( 0, 6, 0 ), 0x204 )
+    yield from bp_resolve( bp, 0x200, JALR( 0, 6, 0 ), 1, 0x340, 1 )
+    yield from bp_lookup( bp, 0x200, JALR( 0, 6, 0 ), 0x340 )
+    # A different address which shares the BTB entry misses.
+    yield from bp_lookup( bp, 0x400, JALR( 0, 6, 0 ), 0x404 )
+    # Calls push their return addresses, and returns pop them.
+    yield from bp_lookup( bp, 0x300, JAL( 1, 0x40 ), 0x380 )
+    yield from bp_lookup( bp, 0x380, JAL( 5, 0x40 ), 0x400 )
+    yield from bp_lookup( bp, 0x400, JALR( 0, 5, 0 ), 0x384 )
+    yield from bp_lookup( bp, 0x384, JALR( 0, 1, 0 ), 0x304 )
+    # A return with an empty stack falls back to the BTB.
+    yield from bp_lookup( bp, 0x304, JALR( 0, 1, 0 ), 0x308 )
+    # A redirect rolls the stack back to the resolved calls.
+    yield from bp_lookup( bp, 0x300, JAL( 1, 0x40 ), 0x380 )
+    yield from bp_lookup( bp, 0x380, JAL( 1, 0x40 ), 0x400 )
+    yield from bp_resolve( bp, 0x300, JAL( 1, 0x40 ), 1, 0x380, 1, 1 )
+    yield from bp_lookup( bp, 0x500, JALR( 0, 1, 0 ), 0x304 )
+    check( "jumps", ( yield bp.jumps ), 2 )
+    check( "jump misses", ( yield bp.jump_misses ), 2 )
+
+# Helper method to simulate the predictor on its own.
+def bp_sim( mode ):
+  bp = Branch_Predictor( mode )
+  sim = Simulator( bp )
+  def proc():
+    yield from bp_test( bp )
+  sim.add_clock( 1e-6 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "bp_%d.vcd"%mode ):
+    sim.run()
+
+# Helper method to run a program on the pipelined core with a
+# given predictor, and report how often it guessed wrong.
+def bp_core_sim( test, mode ):
+  print( "\033[33mSTART\033[0m running '%s' program (predictor mode "
+         "%d):"%( test[ 0 ], mode ) )
+  bp  = Branch_Predictor( mode )
+  dut = core( ROM( test[ 2 ] ), predictor = bp )
+  cpu = ResetInserter( dut.clk_rst )( dut )
+  sim = Simulator( cpu )
+  def proc():
+    for i in range( len( test[ 3 ] ) ):
+      yield dut.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
+    yield from core_run( dut, test[ 4 ] )
+    print( "  %d / %d branches mispredicted, %d / %d jumps mispredicted"
+           %( ( yield bp.branch_misses ), ( yield bp.branches ),
+              ( yield bp.jump_misses ), ( yield bp.jumps ) ) )
+  sim.add_clock( 1 / 6000000 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "bp_%s_%d.vcd"%( test[ 1 ], mode ) ):
+    sim.run()
+
+# 'main' method to run the branch predictor testbench.
+if __name__ == "__main__":
+  with warnings.catch_warnings():
+    warnings.filterwarnings( "ignore", category = DriverConflict )
+
+    for mode in [ BP_NONE, BP_BTFN, BP_BIMODAL, BP_BTB ]:
+      bp_sim( mode )
+    # Compare the predictors on the control-flow compliance tests.
+    for test in [ beq_test, bne_test, jal_test, jalr_test ]:
+      for mode in [ BP_NONE, BP_BTFN, BP_BIMODAL, BP_BTB ]:
+        bp_core_sim( test, mode )
+
+    # Done; print results.
+    # (The core harness keeps its own pass / fail counts)
+    p += test_pipeline_core.p
+    f += test_pipeline_core.f
+    print( "Branch Predictor Tests: %d Passed, %d Failed"%( p, f ) )
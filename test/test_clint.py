@@ -0,0 +1,221 @@
+from amaranth import *
+from amaranth.sim import *
+from amaranth.hdl.ir import DriverConflict
+
+import os, sys, warnings
+sys.path.append("..")
+
+from src.clint import *
+from src.cpu import *
+from src.isa import *
+from src.rom import *
+from src.spi_flash import *
+from src.spi_prefetch import *
+from programs import *
+
+###################################
+# CLINT / interrupts testbench:   #
+###################################
+# Keep track of test pass / fail rates.
+p = 0
+f = 0
+
+# Helper method to check a value.
+def check( name, got, expected ):
+  global p, f
+  if hexs( got ) == hexs( expected ):
+    p += 1
+    print( "  \033[32mPASS:\033[0m %s == %s"%( name, hexs( expected ) ) )
+  else:
+    f += 1
+    print( "  \033[31mFAIL:\033[0m %s == %s (got: %s)"
+           %( name, hexs( expected ), hexs( got ) ) )
+
+# Helper method to perform a bus access to the CLINT.
+# Returns the value which was read.
+def clint_rw( clint, adr, we = 0, dat = 0 ):
+  yield clint.bus.adr.eq( adr )
+  yield clint.bus.we.eq( we )
+  yield clint.bus.dat_w.eq( dat )
+  yield clint.bus.cyc.eq( 1 )
+  yield Tick()
+  yield Settle()
+  while not ( yield clint.bus.ack ):
+    yield Tick()
+    yield Settle()
+  got = yield clint.bus.dat_r
+  yield clint.bus.cyc.eq( 0 )
+  yield clint.bus.we.eq( 0 )
+  yield Tick()
+  return got
+
+# CLINT register tests.
+def clint_test( clint ):
+  print( "--- CLINT Tests ---" )
+  # 'mtimecmp' starts at its maximum value, so the timer
+  # interrupt is clear.
+  check( "mtimecmp", ( yield from clint_rw( clint, CLINT_MTIMECMP ) ),
+         0xFFFFFFFF )
+  check( "mtimecmph", ( yield from clint_rw( clint, CLINT_MTIMECMPH ) ),
+         0xFFFFFFFF )
+  check( "mtip", ( yield clint.mtip ), 0 )
+  # 'mtime' counts up.
+  t0 = yield from clint_rw( clint, CLINT_MTIME )
+  t1 = yield from clint_rw( clint, CLINT_MTIME )
+  check( "mtime increments", t1 - t0, 2 )
+  # 'mtime' is 64 bits wide.
+  yield from clint_rw( clint, CLINT_MTIME, 1, 0xFFFFFFFC )
+  for i in range( 8 ):
+    yield Tick()
+  check( "mtimeh", ( yield from clint_rw( clint, CLINT_MTIMEH ) ), 1 )
+  check( "mtime wrapped",
+         ( yield from clint_rw( clint, CLINT_MTIME ) ) < 16, True )
+  # The timer interrupt is raised once mtime >= mtimecmp.
+  yield from clint_rw( clint, CLINT_MTIMECMPH, 1, 1 )
+  check( "mtip", ( yield clint.mtip ), 0 )
+  yield from clint_rw( clint, CLINT_MTIMECMPH, 1, 0 )
+  check( "mtip", ( yield clint.mtip ), 1 )
+  yield from clint_rw( clint, CLINT_MTIMECMPH, 1, 0xFFFFFFFF )
+  check( "mtip", ( yield clint.mtip ), 0 )
+  # The software interrupt follows bit 0 of 'msip'.
+  yield from clint_rw( clint, CLINT_MSIP, 1, 0xFFFFFFFF )
+  check( "msip", ( yield clint.msip ), 1 )
+  check( "msip", ( yield from clint_rw( clint, CLINT_MSIP ) ), 1 )
+  yield from clint_rw( clint, CLINT_MSIP, 1, 0 )
+  check( "msip", ( yield clint.msip ), 0 )
+  # Unused addresses read as 0.
+  check( "unused", ( yield from clint_rw( clint, 0x8000 ) ), 0 )
+
+# Prescaler test: 'mtime' only counts every few cycles.
+def clint_prescale_test( clint ):
+  for i in range( 16 ):
+    yield Tick()
+  yield Settle()
+  check( "mtime (prescaled by 4)", ( yield clint.mtime ), 4 )
+
+# Helper method to run the interrupt program on the CPU. The
+# external interrupt is raised once the timer interrupt has been
+# handled. Reports the cycles from each interrupt becoming pending
+# to the CPU jumping to its vector, and returns the longest one.
+def irq_sim( name, fast = False, prefetch = False ):
+  print( "\033[33mSTART\033[0m running interrupt program (%s):"%name )
+  if prefetch:
+    rom = ROM( irq_rom, fast )
+    dut = CPU( rom, prefetch = SPI_Prefetch( rom ), fast_ram = fast )
+  else:
+    dut = CPU( ROM( irq_rom, fast ), fast_ram = fast )
+  cpu = ResetInserter( dut.clk_rst )( dut )
+  lat = []
+
+  sim = Simulator( cpu )
+  def proc():
+    # Cycle when an enabled interrupt became pending.
+    start = None
+    for cycle in range( 600 ):
+      yield Settle()
+      pend = ( yield dut.csr.mstatus_mie ) and \
+             ( ( yield dut.csr.mie_mtie ) and ( yield dut.csr.mip_mtip ) or
+               ( yield dut.csr.mie_msie ) and ( yield dut.csr.mip_msip ) or
+               ( yield dut.csr.mie_meie ) and ( yield dut.csr.mip_meip ) )
+      if pend and ( start is None ):
+        start = cycle
+      if ( ( yield dut.pc ) in [ 0x10C, 0x11C, 0x12C ] ) and \
+         ( start is not None ):
+        lat.append( cycle - start )
+        start = None
+      # Raise the external interrupt after the timer interrupt.
+      if ( yield dut.register_file[ 11 ] ) == 1:
+        yield dut.irq.eq( 1 )
+      yield Tick()
+    yield dut.irq.eq( 0 )
+    # Each interrupt should be handled exactly once.
+    for r, e in [ ( 6, 0x80000007 ), ( 8, 0x8000000B ), ( 11, 1 ),
+                  ( 12, 1 ), ( 13, 0x80000003 ) ]:
+      check( "r%02d"%r, ( yield dut.register_file[ r ] ), e )
+    check( "msip", ( yield dut.mem.clint.msip ), 0 )
+    # The interrupted instruction was in the spin loop.
+    mepc = yield dut.register_file[ 7 ]
+    check( "mepc in spin loop", mepc in [ 0x2C, 0x30 ], True )
+  sim.add_clock( 1 / 6000000 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "cpu_irq_%s.vcd"%name ):
+    sim.run()
+  print( "  interrupt entry latency: %s cycles"%lat )
+  check( "interrupts taken", len( lat ), 3 )
+  print( "\033[35mDONE\033[0m running interrupt program (%s)"%name )
+  return max( lat + [ 0 ] )
+
+# Helper method to run the WFI program on the CPU for a number of
+# cycles, with a timer interrupt every 'period' cycles. Counts the
+# cycles when the CPU is idle, and the cycles when it uses the
+# instruction bus.
+def wfi_sim( name, rom, period, cycles ):
+  print( "\033[33mSTART\033[0m running WFI program (%s):"%name )
+  dut = CPU( rom )
+  cpu = ResetInserter( dut.clk_rst )( dut )
+
+  sim = Simulator( cpu )
+  def proc():
+    idle  = 0
+    fetch = 0
+    woken = 0
+    for cycle in range( cycles ):
+      yield Settle()
+      i = yield dut.idle
+      c = yield dut.mem.inst_mux.bus.cyc
+      idle  += i
+      fetch += c
+      woken += ( i and c )
+      yield Tick()
+    n = yield dut.register_file[ 11 ]
+    print( "  %d cycles: %d idle, %d fetching, %d timer interrupts"
+           %( cycles, idle, fetch, n ) )
+    check( "timer interrupts", n >= ( cycles // period ) - 2, True )
+    # The loop runs once after each interrupt.
+    check( "loop count",
+           n - ( yield dut.register_file[ 10 ] ) in [ 0, 1 ], True )
+    check( "no fetches while idle", woken, 0 )
+    check( "idle most of the time", idle > ( cycles // 2 ), True )
+  sim.add_clock( 1 / 6000000 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "cpu_wfi_%s.vcd"%name ):
+    sim.run()
+  print( "\033[35mDONE\033[0m running WFI program (%s)"%name )
+
+# 'main' method to run the CLINT / interrupt testbenches.
+if __name__ == "__main__":
+  with warnings.catch_warnings():
+    warnings.filterwarnings( "ignore", category = DriverConflict )
+
+    dut = CLINT()
+    sim = Simulator( dut )
+    def proc():
+      yield from clint_test( dut )
+    sim.add_clock( 1e-6 )
+    sim.add_sync_process( proc )
+    with sim.write_vcd( "clint.vcd" ):
+      sim.run()
+
+    dut = CLINT( prescale = 4 )
+    sim = Simulator( dut )
+    def proc():
+      yield from clint_prescale_test( dut )
+    sim.add_clock( 1e-6 )
+    sim.add_sync_process( proc )
+    with sim.write_vcd( "clint_prescale.vcd" ):
+      sim.run()
+
+    # Interrupts should be taken within a fetch of being raised.
+    for name, fast, prefetch in [ ( "ROM", False, False ),
+                                  ( "fast ROM", True, False ),
+                                  ( "prefetch", False, True ) ]:
+      lat = irq_sim( name, fast, prefetch )
+      check( "interrupt latency <= 3 cycles", lat <= 3, True )
+
+    # WFI should stop instruction fetches until the timer fires.
+    wfi_sim( "ROM", ROM( wfi_rom( 100 ) ), 100, 1000 )
+    wfi_sim( "SPI", SPI_Flash( 2 * 1024 * 1024, 2 * 1024 * 1024 + 1024,
+                               wfi_rom( 2000 ) ), 2000, 20000 )
+
+    # Done; print results.
+    print( "CLINT Tests: %d Passed, %d Failed"%( p, f ) )
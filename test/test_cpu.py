@@ -8,13 +8,17 @@ from amaranth.hdl.ast import Past, Cat, Repl
 from amaranth.hdl.ir import DriverConflict
 
 import os, sys, warnings
+from collections import deque
 sys.path.append("..")
 
 from src.isa import *
 from src.cpu import *
+from src.iss import *
 from src.rv_mem import *
 # Import test programs and expected runtime register values.
 from programs import *
+from cxxrtl_sim import *
+from waves import *
 
 ##################
 # CPU testbench: #
@@ -22,6 +26,22 @@ from programs import *
 # Keep track of test pass / fail rates.
 p = 0
 f = 0
+# Simulator to run the CPU with: amaranth's Python simulator, or
+# the compiled CXXRTL one. ('-cxxrtl' on the command line)
+SIMULATOR = Simulator
+# Waveform output, which is off by default. 'FULL_VCD' dumps every
+# signal with amaranth's VCD writer, and 'WAVES' holds the options
+# for a 'Waveform' which only records some of them. (See 'waves.py'
+# for the command line options)
+FULL_VCD = False
+WAVES = None
+# CPUs which have been built for the CXXRTL simulator, along with
+# their simulators, by ROM / RAM mode. Building a CPU takes much
+# longer than running a program on it, so each one is only built
+# once, and programs are written into its ROM at runtime. (ROM
+# images are padded to 'CXXRTL_ROM_WORDS', to fit any program)
+CXXRTL_CPUS = {}
+CXXRTL_ROM_WORDS = 1024
 
 # Helper method to check expected CPU register / memory values
 # at a specific point during a test program.
@@ -30,8 +50,10 @@ def check_vals( expected, ni, cpu ):
   if ni in expected:
     for j in range( len( expected[ ni ] ) ):
       ex = expected[ ni ][ j ]
+      # (Test programs name the register with 'r' or 'register_file')
+      r = ex.get( 'r', ex.get( 'register_file' ) )
       # Special case: program counter.
-      if ex[ 'register_file' ] == 'pc':
+      if r == 'pc':
         cpc = yield cpu.pc
         if hexs( cpc ) == hexs( ex[ 'e' ] ):
           p += 1
@@ -44,8 +66,8 @@ def check_vals( expected, ni, cpu ):
                  " after %d operations (got: %s)"
                  %( hexs( ex[ 'e' ] ), ni, hexs( cpc ) ) )
       # Special case: RAM data (must be word-aligned).
-      elif type( ex[ 'register_file' ] ) == str and ex[ 'register_file' ][ 0:3 ] == "RAM":
-        rama = int( ex[ 'register_file' ][ 3: ] )
+      elif type( r ) == str and r[ 0:3 ] == "RAM":
+        rama = int( r[ 3: ] )
         if ( rama % 4 ) != 0:
           f += 1
           print( "  \033[31mFAIL:\033[0m RAM == %s @ 0x%08X"
@@ -64,96 +86,249 @@ def check_vals( expected, ni, cpu ):
                    " after %d operations (got: %s)"
                    %( hexs( ex[ 'e' ] ), rama, ni, hexs( cpd ) ) )
       # Numbered general-purpose registers.
-      elif ex[ 'register_file' ] >= 0 and ex[ 'register_file' ] < 32:
-        cr = yield cpu.register_file[ ex[ 'register_file' ] ]
+      elif r >= 0 and r < 32:
+        cr = yield cpu.register_file[ r ]
         if hexs( cr ) == hexs( ex[ 'e' ] ):
           p += 1
           print( "  \033[32mPASS:\033[0m r%02d == %s"
                  " after %d operations"
-                 %( ex[ 'register_file' ], hexs( ex[ 'e' ] ), ni ) )
+                 %( r, hexs( ex[ 'e' ] ), ni ) )
         else:
           f += 1
           print( "  \033[31mFAIL:\033[0m r%02d == %s"
                  " after %d operations (got: %s)"
-                 %( ex[ 'register_file' ], hexs( ex[ 'e' ] ),
+                 %( r, hexs( ex[ 'e' ] ),
                     ni, hexs( cr ) ) )
 
+# Number of retired instructions to print when the CPU and the
+# instruction set simulator disagree.
+COSIM_TRACE = 8
+# CSRs which the ISS can't predict: cycle and event counters, and
+# pending interrupts. Values read from these are copied from the CPU.
+COSIM_SKIP_CSRS = [ CSRA_MCYCLE, CSRA_MCYCLEH, CSRA_MHPMCOUNTER3,
+                    CSRA_MHPMCOUNTER3H, CSRA_MIP ]
+
+# Helper method to step the instruction set simulator over an
+# instruction which the CPU has just retired or trapped on (if
+# 'trapped' is set) from address 'cpc', and compare their results:
+# the instruction's address, whether it trapped, the value of the
+# register it writes, and the RAM word it stores to.
+# Appends a line to the 'trace' list, and returns a description
+# of the first difference, or None if they agree.
+def cosim_step( cpu, iss, cpc, trace, trapped = False ):
+  ipc = iss.pc
+  n   = iss.instret
+  ir  = iss.load( ipc, 4 )
+  op  = ir & 0x7F
+  rd  = ( ir >> 7 ) & 0x1F
+  f3  = ( ir >> 12 ) & 0x7
+  # Work out the store address before the instruction runs.
+  sadr = None
+  if op == OP_STORE:
+    imm  = s32( ( ir & 0xFE000000 ) | ( rd << 20 ) ) >> 20
+    sadr = ( iss.x[ ( ir >> 15 ) & 0x1F ] + imm ) & M32 & ~3
+  iss.step()
+  # (Instructions which trap don't retire)
+  itrap = ( iss.instret == n )
+  line = "pc %s  ir %s%s"%( hexs( ipc ), hexs( ir ),
+                            "  (trap)" if itrap else "" )
+  trace.append( line )
+  if cpc != ipc:
+    return "pc  == %s (got: %s)"%( hexs( ipc ), hexs( cpc ) )
+  if itrap != trapped:
+    return "instruction %s (got: %s)"%(
+      "traps" if itrap else "retires",
+      "trapped" if trapped else "retired" )
+  # Instructions which write a register.
+  if ( op in [ OP_LUI, OP_AUIPC, OP_JAL, OP_JALR, OP_LOAD, OP_IMM,
+               OP_REG ] ) or ( ( op == OP_SYSTEM ) and ( f3 != 0 ) ):
+    got = yield cpu.register_file[ rd ]
+    if ( op == OP_SYSTEM ) and ( ( ir >> 20 ) in COSIM_SKIP_CSRS ) \
+       and ( rd != 0 ):
+      iss.x[ rd ] = got
+    trace[ -1 ] = "%s  r%02d = %s"%( line, rd, hexs( iss.x[ rd ] ) )
+    if got != iss.x[ rd ]:
+      return "r%02d == %s (got: %s)"%( rd, hexs( iss.x[ rd ] ),
+                                      hexs( got ) )
+  # Stores to RAM.
+  elif ( sadr is not None ) and ( ( sadr >> 29 ) == 1 ) and \
+       ( ( sadr & 0x1FFFFFFF ) < len( iss.ram ) ):
+    e = iss.load( sadr, 4 )
+    got = yield cpu.mem.ram.data[ ( sadr & 0x1FFFFFFF ) // 4 ]
+    trace[ -1 ] = "%s  [%s] = %s"%( line, hexs( sadr ), hexs( e ) )
+    if got != e:
+      return "RAM == %s @ %s (got: %s)"%( hexs( e ), hexs( sadr ),
+                                         hexs( got ) )
+  return None
+
+# Helper method to report a difference between the CPU and the
+# instruction set simulator, with the instructions leading up to it.
+def cosim_fail( err, ni, trace, wave ):
+  global f
+  f += 1
+  print( "  \033[31mFAIL:\033[0m %s after %d operations "
+         "(ISS lock-step)"%( err, ni ) )
+  print( "  Last %d instructions:"%len( trace ) )
+  for line in trace:
+    print( "    %s"%line )
+  if wave is not None:
+    wave.trigger()
+
 # Helper method to run a CPU device for a given number of cycles,
-# and verify its expected register values over time.
-def cpu_run( cpu, expected ):
+# and verify its expected register values over time. If an
+# instruction set simulator is given, it runs in lock-step with the
+# CPU, and the run stops at the first instruction where they differ.
+# It steps on every retired instruction, and on every trap. (The
+# ISS has no interrupts, so those programs can't use them)
+# Returns the number of cycles which the CPU ran for. If a
+# 'Waveform' is given, it records each cycle, and is triggered by
+# the first failure.
+def cpu_run( cpu, expected, iss = None, wave = None ):
   global p, f
-  # Record how many CPU instructions have been executed.
+  # Record how many CPU instructions and cycles have been executed.
   ni = -1
+  cycles = 0
   # Watch for timeouts if the CPU gets into a bad state.
   timeout = 0
-  instret = 0
+  # Count from wherever MINSTRET is now, in case the CPU has
+  # already been running.
+  start = yield cpu.csr.minstret_instrs
+  # Address of the instruction which the CPU is running, whether
+  # it trapped, and the most recent instructions which the ISS has
+  # run.
+  cpc = yield cpu.pc
+  trapped = False
+  trace = deque( maxlen = COSIM_TRACE )
+  fails = f
   # Let the CPU run for N instructions.
-  while ni <= expected[ 'end' ]:
+  while ni < expected[ 'end' ]:
     # Let combinational logic settle before checking values.
     yield Settle()
+    if wave is not None:
+      yield from wave.sample()
     timeout = timeout + 1
-    # Only check expected values once per instruction.
-    ninstret = yield cpu.csr.minstret_instrs
-    if ninstret != instret:
-      ni += 1
-      instret = ninstret
+    # Compare an instruction which trapped on the last cycle
+    # against the ISS. (It doesn't retire)
+    if trapped:
+      err = yield from cosim_step( cpu, iss, cpc, trace, True )
+      if err is not None:
+        cosim_fail( err, ni, trace, wave )
+        return cycles
+    # Only check expected values once per retired instruction.
+    # (MINSTRET counts instructions as they finish executing)
+    instret = ( yield cpu.csr.minstret_instrs ) - start
+    if ni < instret:
+      while ni < instret:
+        ni += 1
+        # Compare the retired instruction against the ISS.
+        if ( iss is not None ) and ( ni > 0 ):
+          err = yield from cosim_step( cpu, iss, cpc, trace )
+          if err is not None:
+            cosim_fail( err, ni, trace, wave )
+            return cycles
+        # Check expected values, if any.
+        yield from check_vals( expected, ni, cpu )
       timeout = 0
-      # Check expected values, if any.
-      yield from check_vals( expected, ni, cpu )
     elif timeout > 1000:
       f += 1
       print( "\033[31mFAIL: Timeout\033[0m" )
+    if ( wave is not None ) and ( f != fails ):
+      wave.trigger()
+    if timeout > 1000:
       break
+    if iss is not None:
+      cpc = yield cpu.pc
+      trapped = ( ( yield cpu.csr.events ) >> EV_TRAP ) & 1
     # Step the simulation.
+    cycles += 1
     yield Tick()
+  if ( iss is not None ) and ( ni >= expected[ 'end' ] ):
+    p += 1
+    print( "  \033[32mPASS:\033[0m CPU matches the ISS for %d "
+           "instructions"%ni )
+  return cycles
 
 # Helper method to simulate running a CPU with the given ROM image
 # for the specified number of CPU cycles. The 'name' field is used
 # for printing and generating the waveform filename: "cpu_[name].vcd".
-def cpu_sim( test ):
-  print( "\033[33mSTART\033[0m running '%s' program:"%test[ 0 ] )
-  # Create the CPU device.
-  dut = CPU( ROM( test[ 2 ] ) )
-  cpu = ResetInserter( dut.clk_rst )( dut )
+# 'fast' selects the single-cycle ROM and RAM modes, and 'cosim'
+# checks every instruction against the instruction set simulator.
+# Returns the number of cycles which the program ran for.
+def cpu_sim( test, fast = False, cosim = False ):
+  print( "\033[33mSTART\033[0m running '%s' program%s:"
+         %( test[ 0 ], " (fast ROM / RAM)" if fast else "" ) )
+  # Create the CPU device, or reuse a compiled one.
+  if SIMULATOR is CxxrtlSimulator:
+    if fast not in CXXRTL_CPUS:
+      dut = CPU( ROM( [ 0 ] * CXXRTL_ROM_WORDS, fast ), fast_ram = fast )
+      cpu = ResetInserter( dut.clk_rst )( dut )
+      CXXRTL_CPUS[ fast ] = ( dut, cpu, CxxrtlSimulator( cpu ) )
+    dut, cpu, sim = CXXRTL_CPUS[ fast ]
+    sim.reset()
+  else:
+    dut = CPU( ROM( test[ 2 ], fast ), fast_ram = fast )
+    cpu = ResetInserter( dut.clk_rst )( dut )
+    sim = SIMULATOR( cpu )
 
   # Run the simulation.
-  sim_name = "%s.vcd"%test[ 1 ]
-  sim = Simulator( cpu )
+  sim_name = "%s%s.vcd"%( test[ 1 ], "_fast" if fast else "" )
+  iss = ISS( test[ 2 ], test[ 3 ] ) if cosim else None
+  wave = None if WAVES is None else Waveform( sim_name, dut, **WAVES )
+  cycles = []
   def proc():
+    # Load the program into a reused CPU's ROM.
+    if SIMULATOR is CxxrtlSimulator:
+      for i in range( len( test[ 2 ] ) ):
+        yield dut.mem.rom.data[ i ].eq( test[ 2 ][ i ] )
     # Initialize RAM values.
     for i in range( len( test[ 3 ] ) ):
       yield cpu.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
-      # Run the program and print pass/fail for individual tests.
-      yield from cpu_run( cpu, test[ 4 ] )
-      print( "\033[35mDONE\033[0m running %s: executed %d instructions"
-             %( test[ 0 ], test[ 4 ][ 'end' ] ) )
+    # Run the program and print pass/fail for individual tests.
+    cycles.append( ( yield from cpu_run( cpu, test[ 4 ], iss, wave ) ) )
+    print( "\033[35mDONE\033[0m running %s: executed %d instructions"
+           %( test[ 0 ], test[ 4 ][ 'end' ] ) )
   sim.add_clock( 1 / 6000000 )
   sim.add_sync_process( proc )
-  with sim.write_vcd(sim_name):
+  if FULL_VCD:
+    with sim.write_vcd( sim_name ):
+      sim.run()
+  else:
     sim.run()
+  if wave is not None:
+    wave.close()
+  return cycles[ 0 ]
 
 # Helper method to simulate running a CPU from simulated SPI
-# Flash which contains a given ROM image.
-def cpu_spi_sim( test ):
+# Flash which contains a given ROM image, using the given read mode.
+def cpu_spi_sim( test, mode = SPI_MODE_1X ):
   print( "\033[33mSTART\033[0m running '%s' program (SPI):"%test[ 0 ] )
   # Create the CPU device.
   sim_spi_off = ( 2 * 1024 * 1024 )
-  dut = CPU( SPI_Flash( sim_spi_off, sim_spi_off + 1024, test[ 2 ] ) )
+  dut = CPU( SPI_Flash( sim_spi_off, sim_spi_off + 1024, test[ 2 ],
+                        mode ) )
   cpu = ResetInserter( dut.clk_rst )( dut )
 
   # Run the simulation.
   sim_name = "%s_spi.vcd"%test[ 1 ]
-  sim = Simulator( cpu ) 
+  sim = SIMULATOR( cpu )
+  wave = None if WAVES is None else Waveform( sim_name, dut, **WAVES )
   def proc():
+    # Initialize RAM values.
     for i in range( len( test[ 3 ] ) ):
-        yield cpu.mem.ram.data[ i ].eq( test[ 3 ][ i ] )
-        yield from cpu_run( cpu, test[ 4 ] )
-        print( "\033[35mDONE\033[0m running %s: executed %d instructions"
-             %( test[ 0 ], test[ 4 ][ 'end' ] ) )
+      yield cpu.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
+    # Run the program and print pass/fail for individual tests.
+    yield from cpu_run( cpu, test[ 4 ], wave = wave )
+    print( "\033[35mDONE\033[0m running %s: executed %d instructions"
+           %( test[ 0 ], test[ 4 ][ 'end' ] ) )
   sim.add_clock( 1 / 6000000 )
   sim.add_sync_process( proc )
-  with sim.write_vcd( sim_name ):
+  if FULL_VCD:
+    with sim.write_vcd( sim_name ):
+      sim.run()
+  else:
     sim.run()
+  if wave is not None:
+    wave.close()
 
 from test_rom.rv32i_add import *
 from test_rom.rv32i_addi import *
@@ -179,6 +354,8 @@ from test_rom.rv32i_lh import *
 from test_rom.rv32i_lhu import *
 from test_rom.rv32i_lw import *
 from test_rom.rv32i_lui import *
+from test_rom.rv32i_misalign_jmp import *
+from test_rom.rv32i_misalign_ldst import *
 from test_rom.rv32i_nop import *
 from test_rom.rv32i_or import *
 from test_rom.rv32i_ori import *
@@ -202,8 +379,24 @@ from test_rom.rv32i_sub import *
 from test_rom.rv32i_xor import *
 from test_rom.rv32i_xori import *
 
+# RV32I compliance test programs.
+rv32i_tests = [ add_test, addi_test, and_test, andi_test, auipc_test,
+                beq_test, bge_test, bgeu_test, blt_test, bltu_test, bne_test,
+                delay_slots_test, ebreak_test, ecall_test, endianess_test,
+                io_test, jal_test, jalr_test, lb_test, lbu_test, lh_test,
+                lhu_test, lw_test, lui_test, misalign_jmp_test,
+                misalign_ldst_test, nop_test, or_test, ori_test, rf_size_test,
+                rf_width_test, rf_x0_test, sb_test, sh_test, sw_test,
+                sll_test, slli_test, slt_test, slti_test, sltu_test,
+                sltiu_test, sra_test, srai_test, srl_test, srli_test,
+                sub_test, xor_test, xori_test ]
+
 # 'main' method to run a basic testbench.
 if __name__ == "__main__":
+  if '-cxxrtl' in sys.argv:
+    sys.argv.remove( '-cxxrtl' )
+    SIMULATOR = CxxrtlSimulator
+  FULL_VCD, WAVES = wave_args( sys.argv )
   if ( len( sys.argv ) == 2 ) and ( sys.argv[ 1 ] == '-b' ):
     # Build the application for an iCE40UP5K FPGA.
     # Currently, this is meaningless, because it builds the CPU
@@ -223,61 +416,29 @@ if __name__ == "__main__":
 
       print( '--- CPU Tests ---' )
       # Simulate the 'infinite loop' ROM to screen for syntax errors.
-      cpu_sim( loop_test )
+      cpu_sim( loop_test, cosim = True )
       cpu_spi_sim( loop_test )
-      cpu_sim( ram_pc_test )
+      cpu_sim( ram_pc_test, cosim = True )
       cpu_spi_sim( ram_pc_test )
-      # Simulate the RV32I compliance tests.
-      cpu_sim( add_test )
-      """
-      cpu_sim( addi_test )
-      cpu_sim( and_test )
-      cpu_sim( andi_test )
-      cpu_sim( auipc_test )
-      cpu_sim( beq_test )
-      cpu_sim( bge_test )
-      cpu_sim( bgeu_test )
-      cpu_sim( blt_test )
-      cpu_sim( bltu_test )
-      cpu_sim( bne_test )
-      cpu_sim( delay_slots_test )
-      cpu_sim( ebreak_test )
-      cpu_sim( ecall_test )
-      cpu_sim( endianess_test )
-      cpu_sim( io_test )
-      cpu_sim( jal_test )
-      cpu_sim( jalr_test )
-      cpu_sim( lb_test )
-      cpu_sim( lbu_test )
-      cpu_sim( lh_test )
-      cpu_sim( lhu_test )
-      cpu_sim( lw_test )
-      cpu_sim( lui_test )
-      cpu_sim( misalign_jmp_test )
-      cpu_sim( misalign_ldst_test )
-      cpu_sim( nop_test )
-      cpu_sim( or_test )
-      cpu_sim( ori_test )
-      cpu_sim( rf_size_test )
-      cpu_sim( rf_width_test )
-      cpu_sim( rf_x0_test )
-      cpu_sim( sb_test )
-      cpu_sim( sh_test )
-      cpu_sim( sw_test )
-      cpu_sim( sll_test )
-      cpu_sim( slli_test )
-      cpu_sim( slt_test )
-      cpu_sim( slti_test )
-      cpu_sim( sltu_test )
-      cpu_sim( sltiu_test )
-      cpu_sim( sra_test )
-      cpu_sim( srai_test )
-      cpu_sim( srl_test )
-      cpu_sim( srli_test )
-      cpu_sim( sub_test )
-      cpu_sim( xor_test )
-      cpu_sim( xori_test )
-      """
+      cpu_spi_sim( ram_pc_test, SPI_MODE_QUAD_IO )
+      # Simulate the RV32M multiply / divide instructions.
+      cpu_sim( muldiv_test, cosim = True )
+      cpu_sim( muldiv_test, True, cosim = True )
+      # Simulate the RV32I compliance tests, checking each
+      # instruction against the instruction set simulator.
+      cpu_sim( add_test, cosim = True )
+      # Run it again with single-cycle ROM / RAM.
+      cpu_sim( add_test, True, cosim = True )
+      # Programs which trap. (The mis-aligned load / store program
+      # isn't checked against the ISS: the CPU reads mis-aligned
+      # words instead of trapping, and the ISS doesn't model that)
+      for test in [ ecall_test, ebreak_test, misalign_jmp_test ]:
+        cpu_sim( test, cosim = True )
+      # The rest of them take a long time with the Python
+      # simulator, so they only run with the CXXRTL one.
+      if SIMULATOR is CxxrtlSimulator:
+        for test in rv32i_tests[ 1: ]:
+          cpu_sim( test )
       # Done; print results.
       print(Repl(2, 5))
       print( "CPU Tests: %d Passed, %d Failed"%( p, f ) )
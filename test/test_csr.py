@@ -66,6 +66,70 @@ def csr_rw_ut( csr, reg ):
   # 'Clear' with rin == 0 reads the value without writing.
   yield from csr_ut( csr, reg, 0x00000000, F_CSRRC,  0x00000000 )
 
+# Write a CSR without checking its old value.
+def csr_wr( csr, reg, rin ):
+  yield csr.adr.eq( reg )
+  yield csr.dat_w.eq( rin )
+  yield csr.f.eq( F_CSRRW )
+  yield csr.we.eq( 1 )
+  yield Tick()
+  yield Settle()
+  yield csr.adr.eq( 0 )
+  yield csr.dat_w.eq( 0 )
+  yield csr.f.eq( 0 )
+  yield csr.we.eq( 0 )
+
+# Apply the core's 'retire' and 'events' inputs for some cycles.
+def csr_count( csr, retire, events, cycles ):
+  yield csr.retire.eq( retire )
+  yield csr.events.eq( events )
+  for i in range( cycles ):
+    yield Tick()
+  yield Settle()
+  yield csr.retire.eq( 0 )
+  yield csr.events.eq( 0 )
+
+# Performance counter tests. 'csr_ut' takes two ticks, and a
+# 'set' with a zero input doesn't write, so running counters can
+# be checked as they count.
+def csr_counter_test( csr ):
+  # Stop every counter. (Only the implemented bits are writable)
+  yield from csr_wr( csr, CSRA_MCOUNTINHIBIT, 0xFFFFFFFF )
+  yield from csr_ut( csr, CSRA_MCOUNTINHIBIT, 0, F_CSRRS, 0x0000007D )
+  # 'mcycle' carries into 'mcycleh' once it runs.
+  yield from csr_wr( csr, CSRA_MCYCLE,  0xFFFFFFFE )
+  yield from csr_wr( csr, CSRA_MCYCLEH, 0x00000001 )
+  yield from csr_ut( csr, CSRA_MCYCLE,  0, F_CSRRS, 0xFFFFFFFE )
+  yield from csr_ut( csr, CSRA_MCYCLEH, 0, F_CSRRS, 0x00000001 )
+  yield from csr_wr( csr, CSRA_MCOUNTINHIBIT, 0x0000007C )
+  yield from csr_ut( csr, CSRA_MCYCLE,  0, F_CSRRS, 0xFFFFFFFF )
+  yield from csr_ut( csr, CSRA_MCYCLEH, 0, F_CSRRS, 0x00000002 )
+  yield from csr_ut( csr, CSRA_MCYCLE,  0, F_CSRRS, 0x00000003 )
+  # 'minstret' only counts cycles with 'retire' set.
+  yield from csr_wr( csr, CSRA_MINSTRET,  0xFFFFFFFF )
+  yield from csr_wr( csr, CSRA_MCOUNTINHIBIT, 0x00000000 )
+  yield from csr_count( csr, 1, 0, 3 )
+  yield from csr_ut( csr, CSRA_MINSTRET,  0, F_CSRRS, 0x00000002 )
+  yield from csr_ut( csr, CSRA_MINSTRETH, 0, F_CSRRS, 0x00000001 )
+  # 'mhpmcounterN' counts the event which 'mhpmeventN' selects.
+  yield from csr_wr( csr, CSRA_MHPMEVENT3, EV_BRANCH )
+  yield from csr_wr( csr, CSRA_MHPMEVENT3 + 1, EV_TRAP )
+  yield from csr_ut( csr, CSRA_MHPMEVENT3, 0, F_CSRRS, EV_BRANCH )
+  yield from csr_count( csr, 0, ( 1 << EV_BRANCH ), 4 )
+  yield from csr_count( csr, 0, ( 1 << EV_BRANCH ) | ( 1 << EV_TRAP ), 2 )
+  yield from csr_ut( csr, CSRA_MHPMCOUNTER3, 0, F_CSRRS, 0x00000006 )
+  yield from csr_ut( csr, CSRA_MHPMCOUNTER3 + 1, 0, F_CSRRS, 0x00000002 )
+  # Counters with no event selected stay at zero.
+  yield from csr_ut( csr, CSRA_MHPMCOUNTER3 + 2, 0, F_CSRRS, 0x00000000 )
+  # Inhibited counters hold their value.
+  yield from csr_wr( csr, CSRA_MCOUNTINHIBIT, 0x00000008 )
+  yield from csr_count( csr, 0, ( 1 << EV_BRANCH ), 2 )
+  yield from csr_ut( csr, CSRA_MHPMCOUNTER3, 0, F_CSRRS, 0x00000006 )
+  yield from csr_ut( csr, CSRA_MHPMCOUNTER3H, 0, F_CSRRS, 0x00000000 )
+  # The same low address bits in another bank don't alias.
+  yield from csr_ut( csr, 0x703, 0xFFFFFFFF, F_CSRRW, 0x00000000 )
+  yield from csr_ut( csr, CSRA_MHPMCOUNTER3, 0, F_CSRRS, 0x00000006 )
+
 # Top-level CSR test method.
 def csr_test( csr ):
   # Wait a tick and let signals settle after reset.
@@ -94,6 +158,19 @@ def csr_test( csr ):
   yield from csr_ut( csr, CSRA_MEPC, 0xFFFFCBA9, F_CSRRW,  0x0C0FFEE0 )
   yield from csr_ut( csr, CSRA_MEPC, 0xFFFFFFFF, F_CSRRCI, 0xFFFFCBA8 )
   yield from csr_ut( csr, CSRA_MEPC, 0x00000000, F_CSRRS,  0x00000000 )
+  # Test reading / writing the 'MIE' CSR. (Only the software,
+  # timer, and external interrupt enable bits can be written)
+  yield from csr_ut( csr, CSRA_MIE, 0xFFFFFFFF, F_CSRRW,  0x00000000 )
+  yield from csr_ut( csr, CSRA_MIE, 0x00000008, F_CSRRC,  0x00000888 )
+  yield from csr_ut( csr, CSRA_MIE, 0x00000000, F_CSRRS,  0x00000880 )
+  # Test the 'MIP' CSR: it follows its inputs, and ignores writes.
+  yield csr.mip_mtip.eq( 1 )
+  yield csr.mip_meip.eq( 1 )
+  yield from csr_ut( csr, CSRA_MIP, 0xFFFFFFFF, F_CSRRW,  0x00000880 )
+  yield from csr_ut( csr, CSRA_MIP, 0x00000000, F_CSRRS,  0x00000880 )
+  yield csr.mip_mtip.eq( 0 )
+  yield csr.mip_meip.eq( 0 )
+  yield from csr_ut( csr, CSRA_MIP, 0x00000000, F_CSRRS,  0x00000000 )
 
   # Test reading / writing the 'MCAUSE' CSR.
   yield from csr_rw_ut( csr, CSRA_MCAUSE )
@@ -108,6 +185,9 @@ def csr_test( csr ):
   yield from csr_ut( csr, 0x101, 0xFFFFCDEF, F_CSRRCI, 0x00000000 )
   yield from csr_ut( csr, 0x101, 0xFFFFCDEF, F_CSRRSI, 0x00000000 )
 
+  # Test the performance counters.
+  yield from csr_counter_test( csr )
+
   # Done.
   yield Tick()
   print( "CSR Tests: %d Passed, %d Failed"%( p, f ) )
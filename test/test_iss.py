@@ -0,0 +1,120 @@
+import os, sys, time
+sys.path.append("..")
+
+from src.isa import *
+from src.iss import *
+# Import test programs and the compliance test ROM images.
+from test_cpu import *
+from test_rom.rv32i_misalign_jmp import *
+from test_rom.rv32i_misalign_ldst import *
+
+##################################
+# Instruction set simulator      #
+# testbench:                     #
+##################################
+# Keep track of test pass / fail rates.
+p = 0
+f = 0
+
+# Helper method to check expected register / memory values.
+def check_vals( expected, ni, iss ):
+  global p, f
+  for ex in expected.get( ni, [] ):
+    r = ex.get( 'r', ex.get( 'register_file' ) )
+    if r == 'pc':
+      name = "pc "
+      got = iss.pc
+    elif type( r ) == str and r[ 0:3 ] == "RAM":
+      name = "RAM @ 0x%08X"%int( r[ 3: ] )
+      got = iss.load( 0x20000000 + int( r[ 3: ] ), 4 )
+    else:
+      name = "r%02d"%r
+      got = iss.x[ r ]
+    if hexs( got ) == hexs( ex[ 'e' ] ):
+      p += 1
+      print( "  \033[32mPASS:\033[0m %s == %s after %d operations"
+             %( name, hexs( ex[ 'e' ] ), ni ) )
+    else:
+      f += 1
+      print( "  \033[31mFAIL:\033[0m %s == %s after %d operations"
+             " (got: %s)"%( name, hexs( ex[ 'e' ] ), ni, hexs( got ) ) )
+
+# Helper method to run a test program on the ISS, checking the
+# expected values at each point.
+def iss_sim( test ):
+  print( "\033[33mSTART\033[0m running '%s' program (ISS):"%test[ 0 ] )
+  iss = ISS( test[ 2 ], test[ 3 ] )
+  ni = 0
+  check_vals( test[ 4 ], ni, iss )
+  for n in sorted( k for k in test[ 4 ] if k != 'end' ):
+    if n > ni:
+      iss.run( n - ni )
+      ni = n
+      check_vals( test[ 4 ], ni, iss )
+  print( "\033[35mDONE\033[0m running %s: executed %d instructions"
+         %( test[ 0 ], test[ 4 ][ 'end' ] ) )
+
+# 'main' method to run the ISS testbench.
+if __name__ == "__main__":
+  print( '--- ISS Tests ---' )
+  for test in [ loop_test, ram_pc_test, muldiv_test,
+                add_test, addi_test, and_test, andi_test, auipc_test,
+                beq_test, bge_test, bgeu_test, blt_test, bltu_test,
+                bne_test, delay_slots_test, ebreak_test, ecall_test,
+                endianess_test, io_test, jal_test, jalr_test, lb_test,
+                lbu_test, lh_test, lhu_test, lw_test, lui_test,
+                misalign_jmp_test, misalign_ldst_test, nop_test,
+                or_test, ori_test, rf_size_test, rf_width_test,
+                rf_x0_test, sb_test, sh_test, sw_test, sll_test,
+                slli_test, slt_test, slti_test, sltu_test, sltiu_test,
+                sra_test, srai_test, srl_test, srli_test, sub_test,
+                xor_test, xori_test ]:
+    iss_sim( test )
+
+  # Instructions which trap don't retire: an ECALL, and a jump to
+  # a mis-aligned address.
+  for name, rom, n, cause in [
+      ( "ECALL", [ ADDI( 1, 0, 1 ),
+                   RV32I_I( OP_SYSTEM, F_TRAPS, 0, 0, 0 ) ],
+        1, TRAP_ECALL ),
+      ( "mis-aligned JAL", [ JAL( 1, 0x00001 ) ], 0, TRAP_IMIS ) ]:
+    iss = ISS( rom_img( rom ) )
+    iss.run( len( rom ) )
+    got = ( iss.instret, iss.read_csr( CSRA_MCAUSE ) )
+    if got == ( n, cause ):
+      p += 1
+      print( "  \033[32mPASS:\033[0m %s traps without retiring"%name )
+    else:
+      f += 1
+      print( "  \033[31mFAIL:\033[0m %s traps without retiring"
+             " (got: minstret = %d, mcause = %d)"%( ( name, ) + got ) )
+
+  # CSRs from the CSR module's map, including the performance
+  # counter setup, can be written and read back.
+  for name, adr, e in [ ( "mcountinhibit", CSRA_MCOUNTINHIBIT, 0x7D ),
+                        ( "mhpmevent3",    CSRA_MHPMEVENT3,    0x07 ),
+                        ( "mhpmcounter4",  CSRA_MHPMCOUNTER3 + 1,
+                          0xFFFFFFFF ) ]:
+    iss = ISS( rom_img( [ ADDI( 1, 0, 0xFFF ), CSRRW( 0, adr, 1 ),
+                          CSRRS( 2, adr, 0 ) ] ) )
+    iss.run( 3 )
+    if iss.x[ 2 ] == e:
+      p += 1
+      print( "  \033[32mPASS:\033[0m %s reads back as %s"
+             %( name, hexs( e ) ) )
+    else:
+      f += 1
+      print( "  \033[31mFAIL:\033[0m %s reads back as %s (got: %s)"
+             %( name, hexs( e ), hexs( iss.x[ 2 ] ) ) )
+
+  # Report how fast the ISS runs a compliance test program.
+  iss = ISS( add_test[ 2 ], add_test[ 3 ] )
+  n = 1000000
+  t = time.perf_counter()
+  iss.run( n )
+  t = time.perf_counter() - t
+  print( "ISS speed: %d instructions in %.2fs (%.2f MIPS)"
+         %( n, t, n / t / 1e6 ) )
+
+  # Done; print results.
+  print( "ISS Tests: %d Passed, %d Failed"%( p, f ) )
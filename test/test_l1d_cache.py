@@ -0,0 +1,196 @@
+from amaranth import *
+from amaranth.sim import *
+from amaranth.hdl.ir import DriverConflict
+
+import os, sys, warnings
+sys.path.append("..")
+
+from src.isa import *
+from src.ram import *
+from src.l1i_cache import *
+from src.l1d_cache import *
+# Import the CPU / pipelined core harnesses, test programs, and
+# the compliance test ROM images.
+import test_cpu, test_pipeline_core
+from test_pipeline_core import *
+
+###############################
+# L1 data cache testbench     #
+###############################
+# Keep track of test pass / fail rates.
+p = 0
+f = 0
+
+# Test harness: a D-cache which refills from and writes back to
+# a RAM module, optionally with bursts.
+class Cache_RAM( Elaboratable ):
+  def __init__( self, size, line, ways, burst = False ):
+    self.ram   = RAM( 64 )
+    self.cache = L1D_Cache( size, line, ways, burst )
+    self.rbus  = self.ram.new_bus()
+
+  def elaborate( self, platform ):
+    m = Module()
+    m.submodules.ram   = self.ram
+    m.submodules.cache = self.cache
+    m.d.comb += [
+      self.rbus.adr.eq( self.cache.mbus.adr ),
+      self.rbus.dat_w.eq( self.cache.mbus.dat_w ),
+      self.rbus.we.eq( self.cache.mbus.we ),
+      self.rbus.cyc.eq( self.cache.mbus.cyc ),
+      self.rbus.stb.eq( self.cache.mbus.cyc ),
+      self.rbus.cti.eq( self.cache.mbus.cti ),
+      self.rbus.bte.eq( self.cache.mbus.bte ),
+      self.ram.dw.eq( self.cache.mdw ),
+      self.cache.mbus.dat_r.eq( self.rbus.dat_r ),
+      self.cache.mbus.ack.eq( self.rbus.ack )
+    ]
+    return m
+
+# Helper method to check a value and record the result.
+def check( name, got, expected ):
+  global p, f
+  if got == expected:
+    p += 1
+    print( "  \033[32mPASS:\033[0m %s == 0x%08X"%( name, expected ) )
+  else:
+    f += 1
+    print( "  \033[31mFAIL:\033[0m %s == 0x%08X (got: 0x%08X)"
+           %( name, expected, got ) )
+
+# Helper method to perform one load or store through the cache.
+# Returns the load data.
+def cache_access( dut, address, we = 0, data = 0, dw = RAM_DW_32 ):
+  cache = dut.cache
+  yield cache.bus.adr.eq( address )
+  yield cache.bus.we.eq( we )
+  yield cache.bus.dat_w.eq( data )
+  yield cache.dw.eq( dw )
+  yield cache.bus.cyc.eq( 1 )
+  for i in range( 1000 ):
+    yield Settle()
+    if ( yield cache.bus.ack ):
+      break
+    yield Tick()
+  got = yield cache.bus.dat_r
+  yield Tick()
+  yield cache.bus.cyc.eq( 0 )
+  yield cache.bus.we.eq( 0 )
+  yield Settle()
+  return got
+
+# Helper method to load a word and check its value.
+def cache_load( dut, address, expected ):
+  got = yield from cache_access( dut, address )
+  check( "D$[0x%08X]"%address, got, expected )
+
+# Helper method to request a flush and wait for it to finish.
+def cache_flush( dut ):
+  yield dut.cache.flush.eq( 1 )
+  for i in range( 1000 ):
+    yield Settle()
+    if ( yield dut.cache.flushed ):
+      break
+    yield Tick()
+  yield Tick()
+  yield dut.cache.flush.eq( 0 )
+  yield Settle()
+
+# Exercise stores of each width, eviction, and flushing.
+def cache_test( dut, ways ):
+  print( "--- L1 D-cache Tests (%d-way%s) ---"
+         %( ways, ", bursts" if dut.cache.burst else "" ) )
+  yield Settle()
+  # Word, byte, and halfword stores all land in the same line.
+  yield from cache_access( dut, 0x00, 1, 0x11223344 )
+  yield from cache_access( dut, 0x05, 1, 0x000000AA, RAM_DW_8 )
+  yield from cache_access( dut, 0x02, 1, 0x0000BEEF, RAM_DW_16 )
+  yield from cache_load( dut, 0x00, 0xBEEF3344 )
+  yield from cache_load( dut, 0x04, 0x0000AA00 )
+  # Loads are shifted down by the address' two LSbits.
+  yield from cache_load( dut, 0x02, 0x0000BEEF )
+  yield from cache_load( dut, 0x05, 0x000000AA )
+  # The line is dirty, so RAM hasn't been written yet.
+  check( "RAM[0x00]", ( yield dut.ram.data[ 0 ] ), 0x00000000 )
+  # 0x40 maps to the same set as 0x00. A direct-mapped cache has
+  # to write the dirty line back before refilling it.
+  yield from cache_load( dut, 0x40, 0x00000000 )
+  check( "RAM[0x00]", ( yield dut.ram.data[ 0 ] ),
+         0x00000000 if ways > 1 else 0xBEEF3344 )
+  check( "RAM[0x04]", ( yield dut.ram.data[ 1 ] ),
+         0x00000000 if ways > 1 else 0x0000AA00 )
+  # A flush writes every dirty line back.
+  yield from cache_access( dut, 0x44, 1, 0x55667788 )
+  yield from cache_flush( dut )
+  check( "RAM[0x00]", ( yield dut.ram.data[ 0 ] ), 0xBEEF3344 )
+  check( "RAM[0x44]", ( yield dut.ram.data[ 0x11 ] ), 0x55667788 )
+  # Nothing is cached after a flush.
+  misses = yield dut.cache.misses
+  yield from cache_load( dut, 0x44, 0x55667788 )
+  check( "D$ misses", ( yield dut.cache.misses ), misses + 1 )
+  check( "D$ hits", ( yield dut.cache.hits ), 7 )
+  check( "D$ write-backs", ( yield dut.cache.writebacks ), 2 )
+
+# Helper method to simulate the cache on its own.
+def cache_sim( ways, burst = False ):
+  dut = Cache_RAM( 64, 16, ways, burst )
+  sim = Simulator( dut )
+  def proc():
+    yield from cache_test( dut, ways )
+  sim.add_clock( 1e-6 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "l1d_cache_%dway%s.vcd"
+                      %( ways, "_burst" if burst else "" ) ):
+    sim.run()
+
+# Helper method to simulate a core with a D-cache (and optionally
+# an I-cache), optionally using bursts.
+def cached_sim( test, cls, icache = False, burst = False ):
+  print( "\033[33mSTART\033[0m running '%s' program (%s + D$%s%s):"
+         %( test[ 0 ], cls.__name__, " + I$" if icache else "",
+            ", bursts" if burst else "" ) )
+  dut = cls( ROM( test[ 2 ] ),
+             icache = L1I_Cache( 512, 16, 2, burst ) if icache else None,
+             dcache = L1D_Cache( 256, 16, 2, burst ) )
+  cpu = ResetInserter( dut.clk_rst )( dut )
+  sim = Simulator( cpu )
+  def proc():
+    for i in range( len( test[ 3 ] ) ):
+      yield dut.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
+    if cls == CPU:
+      yield from cpu_run( dut, test[ 4 ] )
+    else:
+      yield from core_run( dut, test[ 4 ] )
+    print( "  %d D$ hits, %d D$ misses, %d write-backs"
+           %( ( yield dut.mem.dcache.hits ),
+              ( yield dut.mem.dcache.misses ),
+              ( yield dut.mem.dcache.writebacks ) ) )
+  sim.add_clock( 1 / 6000000 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "dcache_%s.vcd"%test[ 1 ] ):
+    sim.run()
+
+# 'main' method to run the D-cache testbench.
+if __name__ == "__main__":
+  with warnings.catch_warnings():
+    warnings.filterwarnings( "ignore", category = DriverConflict )
+
+    cache_sim( 1 )
+    cache_sim( 2 )
+    cache_sim( 1, True )
+    cache_sim( 2, True )
+    # (The CPU harness only understands 'register_file' checks.
+    #  The 'run from RAM' program writes code without a FENCE.I,
+    #  so it can't run with a write-back D-cache)
+    cached_sim( add_test, CPU )
+    for test in [ lb_test, lbu_test, lh_test, lhu_test, lw_test,
+                  sb_test, sh_test, sw_test ]:
+      cached_sim( test, core )
+    cached_sim( sw_test, core, True )
+    cached_sim( sw_test, core, True, True )
+
+    # Done; print results.
+    # (The core harnesses keep their own pass / fail counts)
+    p += test_cpu.p + test_pipeline_core.p
+    f += test_cpu.f + test_pipeline_core.f
+    print( "L1 D-cache Tests: %d Passed, %d Failed"%( p, f ) )
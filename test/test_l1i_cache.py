@@ -0,0 +1,162 @@
+from amaranth import *
+from amaranth.sim import *
+from amaranth.hdl.ir import DriverConflict
+
+import os, sys, warnings
+sys.path.append("..")
+
+from src.isa import *
+from src.rom import *
+from src.l1i_cache import *
+# Import the CPU / pipelined core harnesses, test programs, and
+# the compliance test ROM images.
+import test_cpu, test_pipeline_core
+from test_pipeline_core import *
+
+##################################
+# L1 instruction cache testbench #
+##################################
+# Keep track of test pass / fail rates.
+p = 0
+f = 0
+
+# Test harness: an I-cache which refills from a ROM module,
+# optionally with bursts.
+class Cache_ROM( Elaboratable ):
+  def __init__( self, data, size, line, ways, burst = False ):
+    self.rom   = ROM( data )
+    self.cache = L1I_Cache( size, line, ways, burst )
+    self.rbus  = self.rom.new_bus()
+
+  def elaborate( self, platform ):
+    m = Module()
+    m.submodules.rom   = self.rom
+    m.submodules.cache = self.cache
+    m.d.comb += [
+      self.rbus.adr.eq( self.cache.mbus.adr ),
+      self.rbus.cyc.eq( self.cache.mbus.cyc ),
+      self.rbus.stb.eq( self.cache.mbus.cyc ),
+      self.rbus.cti.eq( self.cache.mbus.cti ),
+      self.rbus.bte.eq( self.cache.mbus.bte ),
+      self.cache.mbus.dat_r.eq( self.rbus.dat_r ),
+      self.cache.mbus.ack.eq( self.rbus.ack )
+    ]
+    return m
+
+# Helper method to check a value and record the result.
+def check( name, got, expected ):
+  global p, f
+  if got == expected:
+    p += 1
+    print( "  \033[32mPASS:\033[0m %s == 0x%08X"%( name, expected ) )
+  else:
+    f += 1
+    print( "  \033[31mFAIL:\033[0m %s == 0x%08X (got: 0x%08X)"
+           %( name, expected, got ) )
+
+# Helper method to fetch one word through the cache, and check
+# the returned value and whether it hit.
+def cache_read( dut, address, expected, hit ):
+  cache = dut.cache
+  hits = yield cache.hits
+  yield cache.bus.adr.eq( address )
+  yield cache.bus.cyc.eq( 1 )
+  for i in range( 1000 ):
+    yield Settle()
+    if ( yield cache.bus.ack ):
+      break
+    yield Tick()
+  got = yield cache.bus.dat_r
+  yield Tick()
+  yield cache.bus.cyc.eq( 0 )
+  yield Settle()
+  check( "I$[0x%08X]"%address, got, expected )
+  check( "I$[0x%08X] hit"%address,
+         ( yield cache.hits ) - hits, 1 if hit else 0 )
+
+# Read back every word of a small ROM image through the cache.
+def cache_test( dut, data, ways ):
+  print( "--- L1 I-cache Tests (%d-way%s) ---"
+         %( ways, ", bursts" if dut.cache.burst else "" ) )
+  yield Settle()
+  # The first word of each line misses, the rest hit.
+  for i in range( 8 ):
+    yield from cache_read( dut, i * 4, LITTLE_END( data[ i ] ),
+                           ( i % 4 ) != 0 )
+  # Both lines are now cached.
+  yield from cache_read( dut, 0x0, LITTLE_END( data[ 0 ] ), True )
+  yield from cache_read( dut, 0x1C, LITTLE_END( data[ 7 ] ), True )
+  # 0x40 maps to the same set as 0x00. It replaces line 0x00 in a
+  # direct-mapped cache, but not in a 2-way cache.
+  yield from cache_read( dut, 0x40, LITTLE_END( data[ 16 ] ), False )
+  yield from cache_read( dut, 0x44, LITTLE_END( data[ 17 ] ), True )
+  yield from cache_read( dut, 0x0, LITTLE_END( data[ 0 ] ), ways > 1 )
+  # A flush invalidates every line.
+  yield dut.cache.flush.eq( 1 )
+  yield Tick()
+  yield dut.cache.flush.eq( 0 )
+  yield from cache_read( dut, 0x8, LITTLE_END( data[ 2 ] ), False )
+  yield from cache_read( dut, 0xC, LITTLE_END( data[ 3 ] ), True )
+  check( "I$ misses", ( yield dut.cache.misses ),
+         5 if ways == 1 else 4 )
+
+# Helper method to simulate the cache on its own.
+def cache_sim( ways, burst = False ):
+  data = [ 0x01000000 * i + 0x00112233 for i in range( 32 ) ]
+  dut = Cache_ROM( data, 64, 16, ways, burst )
+  sim = Simulator( dut )
+  def proc():
+    yield from cache_test( dut, data, ways )
+  sim.add_clock( 1e-6 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "l1i_cache_%dway%s.vcd"
+                      %( ways, "_burst" if burst else "" ) ):
+    sim.run()
+
+# Helper method to simulate a core with an I-cache, optionally
+# refilling with bursts.
+def cached_sim( test, cls, burst = False ):
+  print( "\033[33mSTART\033[0m running '%s' program (%s + I$%s):"
+         %( test[ 0 ], cls.__name__, ", bursts" if burst else "" ) )
+  dut = cls( ROM( test[ 2 ] ),
+             icache = L1I_Cache( 512, 16, 2, burst ) )
+  cpu = ResetInserter( dut.clk_rst )( dut )
+  sim = Simulator( cpu )
+  def proc():
+    for i in range( len( test[ 3 ] ) ):
+      yield dut.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
+    if cls == CPU:
+      yield from cpu_run( dut, test[ 4 ] )
+    else:
+      yield from core_run( dut, test[ 4 ] )
+    print( "  %d I$ hits, %d I$ misses"
+           %( ( yield dut.mem.icache.hits ),
+              ( yield dut.mem.icache.misses ) ) )
+  sim.add_clock( 1 / 6000000 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "icache_%s.vcd"%test[ 1 ] ):
+    sim.run()
+
+# 'main' method to run the I-cache testbench.
+if __name__ == "__main__":
+  with warnings.catch_warnings():
+    warnings.filterwarnings( "ignore", category = DriverConflict )
+
+    cache_sim( 1 )
+    cache_sim( 2 )
+    cache_sim( 1, True )
+    cache_sim( 2, True )
+    # (The CPU harness only understands 'register_file' checks)
+    cached_sim( add_test, CPU )
+    # (The 'infinite loop' ROM is smaller than one cache line)
+    for test in [ ram_pc_test, add_test, beq_test, jal_test,
+                  jalr_test, lw_test, sw_test ]:
+      cached_sim( test, core )
+    for test in [ ram_pc_test, beq_test, jalr_test ]:
+      cached_sim( test, core, True )
+
+    # Done; print results.
+    # (The core harnesses keep their own pass / fail counts)
+    p += test_cpu.p + test_pipeline_core.p
+    f += test_cpu.f + test_pipeline_core.f
+    print( "L1 I-cache Tests: %d Passed, %d Failed"%( p, f ) )
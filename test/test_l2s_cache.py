@@ -0,0 +1,189 @@
+from amaranth import *
+from amaranth.sim import *
+from amaranth.hdl.ir import DriverConflict
+
+import os, sys, warnings
+sys.path.append("..")
+
+from src.isa import *
+from src.ram import *
+from src.l1i_cache import *
+from src.l1d_cache import *
+from src.l2s_cache import *
+# Import the CPU / pipelined core harnesses, test programs, and
+# the compliance test ROM images.
+import test_cpu, test_pipeline_core
+from test_pipeline_core import *
+
+###############################
+# Shared L2 cache testbench   #
+###############################
+# Keep track of test pass / fail rates.
+p = 0
+f = 0
+
+# Test harness: an L2 cache with two masters, which refills from
+# and writes back to a RAM module, optionally with bursts.
+class Cache_RAM( Elaboratable ):
+  def __init__( self, size, line, ways, burst = False ):
+    self.ram   = RAM( 64 )
+    self.cache = L2S_Cache( size, line, ways, burst )
+    self.rbus  = self.ram.new_bus()
+    self.ports = [ self.cache.new_bus(), self.cache.new_bus() ]
+
+  def elaborate( self, platform ):
+    m = Module()
+    m.submodules.ram   = self.ram
+    m.submodules.cache = self.cache
+    m.d.comb += [
+      self.rbus.adr.eq( self.cache.mbus.adr ),
+      self.rbus.dat_w.eq( self.cache.mbus.dat_w ),
+      self.rbus.we.eq( self.cache.mbus.we ),
+      self.rbus.cyc.eq( self.cache.mbus.cyc ),
+      self.rbus.stb.eq( self.cache.mbus.cyc ),
+      self.rbus.cti.eq( self.cache.mbus.cti ),
+      self.rbus.bte.eq( self.cache.mbus.bte ),
+      self.ram.dw.eq( self.cache.mdw ),
+      self.cache.mbus.dat_r.eq( self.rbus.dat_r ),
+      self.cache.mbus.ack.eq( self.rbus.ack )
+    ]
+    for bus in self.ports:
+      m.d.comb += bus.stb.eq( bus.cyc )
+    return m
+
+# Helper method to check a value and record the result.
+def check( name, got, expected ):
+  global p, f
+  if got == expected:
+    p += 1
+    print( "  \033[32mPASS:\033[0m %s == 0x%08X"%( name, expected ) )
+  else:
+    f += 1
+    print( "  \033[31mFAIL:\033[0m %s == 0x%08X (got: 0x%08X)"
+           %( name, expected, got ) )
+
+# Helper method to perform one word access on each of the given
+# ports at the same time. Returns the read data for each port.
+def cache_access( dut, ports, address, we = 0, data = 0 ):
+  got = {}
+  for i in ports:
+    yield dut.ports[ i ].adr.eq( address[ i ] )
+    yield dut.ports[ i ].we.eq( we )
+    yield dut.ports[ i ].dat_w.eq( data )
+    yield dut.ports[ i ].cyc.eq( 1 )
+  yield dut.cache.dw.eq( RAM_DW_32 )
+  for i in range( 1000 ):
+    yield Settle()
+    for j in ports:
+      if ( j not in got ) and ( yield dut.ports[ j ].ack ):
+        got[ j ] = yield dut.ports[ j ].dat_r
+        yield dut.ports[ j ].cyc.eq( 0 )
+        yield dut.ports[ j ].we.eq( 0 )
+    yield Tick()
+    if len( got ) == len( ports ):
+      break
+  yield Settle()
+  return got
+
+# Helper method to read one word on one port, and check the
+# returned value and whether it hit.
+def cache_read( dut, port, address, expected, hit ):
+  hits = yield dut.cache.hits
+  got = yield from cache_access( dut, [ port ], { port: address } )
+  check( "L2[0x%08X]"%address, got[ port ], expected )
+  check( "L2[0x%08X] hit"%address,
+         ( yield dut.cache.hits ) - hits, 1 if hit else 0 )
+
+# Share lines between the two ports, and check the replacement
+# order and write-backs.
+def cache_test( dut ):
+  print( "--- Shared L2 cache Tests%s ---"
+         %( " (bursts)" if dut.cache.burst else "" ) )
+  yield Settle()
+  for i in range( 64 ):
+    yield dut.ram.data[ i ].eq( 0x01010101 * i )
+  # A store from one port is visible to the other.
+  yield from cache_access( dut, [ 1 ], { 1: 0x00 }, 1, 0xAABBCCDD )
+  yield from cache_read( dut, 0, 0x00, 0xAABBCCDD, True )
+  check( "RAM[0x00]", ( yield dut.ram.data[ 0 ] ), 0x00000000 )
+  # Both ports can ask at once; the arbiter serves them in turn.
+  got = yield from cache_access( dut, [ 0, 1 ], { 0: 0x24, 1: 0x48 } )
+  check( "L2[0x00000024] (port 0)", got[ 0 ], 0x09090909 )
+  check( "L2[0x00000048] (port 1)", got[ 1 ], 0x12121212 )
+  # Fill the last way of set 0, then use line 0x00 again. The
+  # tree then points at line 0x40 as the least recently used.
+  yield from cache_read( dut, 1, 0x60, 0x18181818, False )
+  yield from cache_read( dut, 0, 0x04, 0x01010101, True )
+  yield from cache_read( dut, 1, 0x80, 0x20202020, False )
+  yield from cache_read( dut, 0, 0x20, 0x08080808, True )
+  yield from cache_read( dut, 0, 0x60, 0x18181818, True )
+  # That leaves the dirty line 0x00 as the least recently used.
+  yield from cache_read( dut, 1, 0x40, 0x10101010, False )
+  check( "RAM[0x00]", ( yield dut.ram.data[ 0 ] ), 0xAABBCCDD )
+  yield from cache_read( dut, 0, 0x00, 0xAABBCCDD, False )
+  check( "L2 misses", ( yield dut.cache.misses ), 7 )
+  check( "L2 write-backs", ( yield dut.cache.writebacks ), 1 )
+
+# Helper method to simulate the cache on its own.
+def cache_sim( burst = False ):
+  # 128 bytes, 16-byte lines, 4 ways: 2 sets.
+  dut = Cache_RAM( 128, 16, 4, burst )
+  sim = Simulator( dut )
+  def proc():
+    yield from cache_test( dut )
+  sim.add_clock( 1e-6 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "l2s_cache%s.vcd"%( "_burst" if burst else "" ) ):
+    sim.run()
+
+# Helper method to simulate a core with an L2 cache, and
+# optionally L1 I- and D-caches in front of it. With 'burst' set,
+# every cache refills and writes back with bursts.
+def cached_sim( test, cls, l1 = False, burst = False ):
+  print( "\033[33mSTART\033[0m running '%s' program (%s%s + L2%s):"
+         %( test[ 0 ], cls.__name__, " + I$ + D$" if l1 else "",
+            ", bursts" if burst else "" ) )
+  dut = cls( ROM( test[ 2 ] ),
+             icache = L1I_Cache( 128, 16, 1, burst ) if l1 else None,
+             dcache = L1D_Cache( 128, 16, 1, burst ) if l1 else None,
+             l2cache = L2S_Cache( 1024, 16, 4, burst ) )
+  cpu = ResetInserter( dut.clk_rst )( dut )
+  sim = Simulator( cpu )
+  def proc():
+    for i in range( len( test[ 3 ] ) ):
+      yield dut.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
+    if cls == CPU:
+      yield from cpu_run( dut, test[ 4 ] )
+    else:
+      yield from core_run( dut, test[ 4 ] )
+    print( "  %d L2 hits, %d L2 misses, %d write-backs"
+           %( ( yield dut.mem.l2cache.hits ),
+              ( yield dut.mem.l2cache.misses ),
+              ( yield dut.mem.l2cache.writebacks ) ) )
+  sim.add_clock( 1 / 6000000 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "l2cache_%s.vcd"%test[ 1 ] ):
+    sim.run()
+
+# 'main' method to run the L2 cache testbench.
+if __name__ == "__main__":
+  with warnings.catch_warnings():
+    warnings.filterwarnings( "ignore", category = DriverConflict )
+
+    cache_sim()
+    cache_sim( True )
+    # (The CPU harness only understands 'register_file' checks.
+    #  The 'run from RAM' program checks RAM values, which a
+    #  write-back cache doesn't update)
+    cached_sim( add_test, CPU )
+    for test in [ add_test, jal_test, lw_test, sb_test, sw_test ]:
+      cached_sim( test, core )
+      cached_sim( test, core, True )
+    for test in [ jal_test, sw_test ]:
+      cached_sim( test, core, True, True )
+
+    # Done; print results.
+    # (The core harnesses keep their own pass / fail counts)
+    p += test_cpu.p + test_pipeline_core.p
+    f += test_cpu.f + test_pipeline_core.f
+    print( "Shared L2 cache Tests: %d Passed, %d Failed"%( p, f ) )
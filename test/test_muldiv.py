@@ -0,0 +1,145 @@
+from amaranth import *
+from amaranth.sim import *
+
+import os, random, sys
+sys.path.append("..")
+
+from src.isa import *
+from src.muldiv import *
+
+###########################################
+# RV32M multiply / divide unit testbench: #
+###########################################
+# Keep track of test pass / fail rates.
+p = 0
+f = 0
+
+# Reference model: the result of an RV32M operation on two 32-bit
+# values, per the ISA specification.
+def muldiv_model( a, b, fn ):
+  sa = a - ( ( a & 0x80000000 ) << 1 )
+  sb = b - ( ( b & 0x80000000 ) << 1 )
+  if fn == F_MUL:
+    return ( a * b ) & 0xFFFFFFFF
+  elif fn == F_MULH:
+    return ( ( sa * sb ) >> 32 ) & 0xFFFFFFFF
+  elif fn == F_MULHSU:
+    return ( ( sa * b ) >> 32 ) & 0xFFFFFFFF
+  elif fn == F_MULHU:
+    return ( ( a * b ) >> 32 ) & 0xFFFFFFFF
+  # Division by zero / signed overflow.
+  if b == 0:
+    return a if ( fn & 0b010 ) else 0xFFFFFFFF
+  if ( fn == F_DIV or fn == F_REM ) and ( a == 0x80000000 ) and \
+     ( b == 0xFFFFFFFF ):
+    return 0x80000000 if fn == F_DIV else 0
+  if fn == F_DIVU:
+    return a // b
+  elif fn == F_REMU:
+    return a % b
+  # Signed division rounds towards zero.
+  q = abs( sa ) // abs( sb )
+  if ( sa < 0 ) != ( sb < 0 ):
+    q = -q
+  if fn == F_DIV:
+    return q & 0xFFFFFFFF
+  return ( sa - q * sb ) & 0xFFFFFFFF
+
+# Perform an individual unit test, and return the number of cycles
+# that it took.
+def muldiv_ut( md, a, b, fn ):
+  global p, f
+  a &= 0xFFFFFFFF
+  b &= 0xFFFFFFFF
+  yield md.a.eq( a )
+  yield md.b.eq( b )
+  yield md.f.eq( fn )
+  yield md.start.eq( 1 )
+  yield Tick()
+  yield md.start.eq( 0 )
+  cycles = 1
+  yield Settle()
+  while ( yield md.busy ):
+    yield Tick()
+    yield Settle()
+    cycles += 1
+  expected = muldiv_model( a, b, fn )
+  actual = yield md.y
+  if hexs( expected ) != hexs( actual ):
+    f += 1
+    print( "\033[31mFAIL:\033[0m %s %s %s = %s (got: %s)"
+           %( hexs( a ), MULDIV_STRS[ fn ], hexs( b ),
+              hexs( expected ), hexs( actual ) ) )
+  else:
+    p += 1
+    print( "\033[32mPASS:\033[0m %s %s %s = %s (%d cycles)"
+           %( hexs( a ), MULDIV_STRS[ fn ], hexs( b ),
+              hexs( expected ), cycles ) )
+  return cycles
+
+# Top-level multiply / divide unit test method.
+def muldiv_test( md ):
+  global p, f
+  print( "--- Multiply / Divide Unit Tests (radix %d) ---"%md.radix )
+  yield Tick()
+
+  # Corner cases for every operation.
+  vals = [ 0, 1, 7, 0x7FFFFFFF, 0x80000000, 0xFFFFFFFF, 0xFFFFFFF9,
+           0x12345678 ]
+  for fn in range( 8 ):
+    for a in vals:
+      for b in vals:
+        yield from muldiv_ut( md, a, b, fn )
+
+  # Random operands; keep track of how long divisions take.
+  random.seed( 42 )
+  dcycles = [ 0, 0 ]
+  for i in range( 64 ):
+    fn = random.randrange( 8 )
+    a  = random.getrandbits( random.choice( [ 8, 16, 32 ] ) )
+    b  = random.getrandbits( random.choice( [ 4, 8, 16, 32 ] ) )
+    if random.getrandbits( 1 ):
+      a = -a
+    c = yield from muldiv_ut( md, a, b, fn )
+    if fn & 0b100:
+      dcycles[ 0 ] += c
+      dcycles[ 1 ] += 1
+  print( "  average cycles per division: %.2f"
+         %( dcycles[ 0 ] / max( dcycles[ 1 ], 1 ) ) )
+
+  # Multiplies take one cycle, and so do divisions which finish
+  # early. Small dividends take fewer steps than large ones.
+  for name, got, expected in [
+    ( "MUL cycles", ( yield from muldiv_ut( md, -3, 5, F_MUL ) ), 1 ),
+    ( "DIV by zero cycles",
+      ( yield from muldiv_ut( md, 100, 0, F_DIV ) ), 1 ),
+    ( "DIVU by a larger divisor cycles",
+      ( yield from muldiv_ut( md, 100, 1000, F_DIVU ) ), 1 ),
+    ( "DIVU 8-bit dividend cycles",
+      ( yield from muldiv_ut( md, 200, 3, F_DIVU ) ),
+      1 + 8 // ( md.radix // 2 ) ),
+    ( "DIVU 32-bit dividend cycles",
+      ( yield from muldiv_ut( md, 0xF0000000, 3, F_DIVU ) ),
+      1 + 32 // ( md.radix // 2 ) ) ]:
+    if got == expected:
+      p += 1
+      print( "  \033[32mPASS:\033[0m %s == %d"%( name, expected ) )
+    else:
+      f += 1
+      print( "  \033[31mFAIL:\033[0m %s == %d (got: %d)"
+             %( name, expected, got ) )
+
+# 'main' method to run the multiply / divide unit testbench.
+if __name__ == "__main__":
+  for radix in [ 2, 4 ]:
+    dut = MulDiv( radix )
+    def proc():
+      yield from muldiv_test( dut )
+    sim = Simulator( dut )
+    sim.add_clock( 1e-6 )
+    sim.add_sync_process( proc )
+    with sim.write_vcd( "muldiv_%d.vcd"%radix ):
+      sim.run()
+
+  # Done; print results.
+  print( "Multiply / Divide Unit Tests: %d Passed, %d Failed"%( p, f ) )
@@ -0,0 +1,143 @@
+from amaranth import *
+from amaranth.sim import *
+from amaranth.hdl.ir import DriverConflict
+
+import os, sys, warnings
+sys.path.append("..")
+
+from src.isa import *
+from src.multiple_cycle_core import *
+# Import test programs and the compliance test ROM images.
+from test_cpu import *
+
+#################################
+# Multi-cycle core testbench:   #
+#################################
+# Keep track of test pass / fail rates.
+p = 0
+f = 0
+
+# Helper method to check expected CPU register / memory values.
+# 'ni' is the number of instructions which have retired, and 'pc'
+# is the address of the next instruction.
+def check_vals( expected, ni, cpu ):
+  global p, f
+  for ex in expected.get( ni, [] ):
+    r = ex.get( 'r', ex.get( 'register_file' ) )
+    if r == 'pc':
+      name = "pc "
+      got = yield cpu.pc
+    elif type( r ) == str and r[ 0:3 ] == "RAM":
+      name = "RAM @ 0x%08X"%int( r[ 3: ] )
+      got = yield cpu.mem.ram.data[ int( r[ 3: ] ) // 4 ]
+    else:
+      name = "r%02d"%r
+      got = yield cpu.register_file[ r ]
+    if hexs( got ) == hexs( ex[ 'e' ] ):
+      p += 1
+      print( "  \033[32mPASS:\033[0m %s == %s after %d operations"
+             %( name, hexs( ex[ 'e' ] ), ni ) )
+    else:
+      f += 1
+      print( "  \033[31mFAIL:\033[0m %s == %s after %d operations"
+             " (got: %s)"%( name, hexs( ex[ 'e' ] ), ni, hexs( got ) ) )
+
+# Helper method to run the core until it retires the expected
+# number of instructions. Reports the cycles per instruction, and
+# the average cycles taken by ALU instructions, loads and stores.
+# Returns those averages.
+def mc_run( cpu, expected ):
+  global p, f
+  ni = -1
+  cycles = 0
+  timeout = 0
+  # [ cycles, instructions ] for ALU ops, loads and stores.
+  classes = { 'alu': [ 0, 0 ], 'load': [ 0, 0 ], 'store': [ 0, 0 ] }
+  while ni < expected[ 'end' ]:
+    yield Settle()
+    instret = yield cpu.csr.minstret_instrs
+    if ni < instret:
+      # (The instruction register still holds the instruction
+      #  which just retired)
+      op = ( yield cpu.ir ) & 0x7F
+      c = None
+      if op in [ OP_REG, OP_IMM, OP_LUI, OP_AUIPC ]:
+        c = 'alu'
+      elif op == OP_LOAD:
+        c = 'load'
+      elif op == OP_STORE:
+        c = 'store'
+      if ( c is not None ) and ( ni >= 0 ):
+        classes[ c ][ 0 ] += timeout
+        classes[ c ][ 1 ] += 1
+      ni = instret
+      timeout = 0
+      yield from check_vals( expected, ni, cpu )
+    timeout += 1
+    if timeout > 1000:
+      f += 1
+      print( "\033[31mFAIL: Timeout\033[0m" )
+      break
+    cycles += 1
+    yield Tick()
+  print( "  %d instructions in %d cycles (CPI: %.2f)"
+         %( ni, cycles, cycles / max( ni, 1 ) ) )
+  avg = { c: v[ 0 ] / max( v[ 1 ], 1 ) for c, v in classes.items() }
+  print( "  cycles per ALU op: %.2f, per load: %.2f, per store: %.2f"
+         %( avg[ 'alu' ], avg[ 'load' ], avg[ 'store' ] ) )
+  return avg
+
+# Helper method to simulate the multi-cycle core with a ROM image.
+# 'fast' selects the single-cycle ROM and RAM modes.
+def mc_sim( test, fast = False ):
+  print( "\033[33mSTART\033[0m running '%s' program%s:"
+         %( test[ 0 ], " (fast ROM / RAM)" if fast else "" ) )
+  dut = multiple_cycle_core( ROM( test[ 2 ], fast ), fast_ram = fast )
+  cpu = ResetInserter( dut.clk_rst )( dut )
+  avg = {}
+
+  sim = Simulator( cpu )
+  def proc():
+    # Initialize RAM values.
+    for i in range( len( test[ 3 ] ) ):
+      yield dut.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
+    avg.update( ( yield from mc_run( dut, test[ 4 ] ) ) )
+    print( "\033[35mDONE\033[0m running %s: executed %d instructions"
+           %( test[ 0 ], test[ 4 ][ 'end' ] ) )
+  sim.add_clock( 1 / 6000000 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "mc_%s%s.vcd"
+                      %( test[ 1 ], "_fast" if fast else "" ) ):
+    sim.run()
+  return avg
+
+# 'main' method to run the multi-cycle core testbench.
+if __name__ == "__main__":
+  with warnings.catch_warnings():
+    warnings.filterwarnings( "ignore", category = DriverConflict )
+
+    print( '--- Multi-cycle Core Tests ---' )
+    mc_sim( loop_test )
+    mc_sim( ram_pc_test )
+    mc_sim( muldiv_test )
+    mc_sim( counters_test )
+    mc_sim( wfi_nop_test )
+    # Simulate the RV32I compliance tests.
+    for test in [ add_test, addi_test, and_test, auipc_test, beq_test,
+                  bne_test, jal_test, jalr_test, lb_test, lbu_test,
+                  lh_test, lhu_test, lw_test, sb_test, sh_test, sw_test,
+                  sll_test, srai_test, sub_test ]:
+      mc_sim( test )
+    # ALU ops skip the MEM and WRITEBACK states, so they should
+    # finish in fewer cycles than loads.
+    for fast in [ False, True ]:
+      avg = mc_sim( lw_test, fast )
+      if avg[ 'alu' ] < avg[ 'load' ]:
+        p += 1
+        print( "  \033[32mPASS:\033[0m ALU ops are faster than loads" )
+      else:
+        f += 1
+        print( "  \033[31mFAIL:\033[0m ALU ops are faster than loads" )
+
+    # Done; print results.
+    print( "Multi-cycle Core Tests: %d Passed, %d Failed"%( p, f ) )
@@ -0,0 +1,130 @@
+from amaranth import *
+from amaranth.sim import *
+from amaranth.hdl.ir import DriverConflict
+
+import os, sys, warnings
+sys.path.append("..")
+
+from src.isa import *
+from src.pipeline_core import *
+# Import test programs and the compliance test ROM images.
+from test_cpu import *
+
+###############################
+# Pipelined core testbench:   #
+###############################
+# Keep track of test pass / fail rates.
+p = 0
+f = 0
+
+# Helper method to check expected CPU register / memory values.
+# The pipelined core retires instructions in WB, so 'ni' is the
+# number of instructions which have completed and 'pc' is the
+# address of the next instruction to retire.
+def check_vals( expected, ni, cpu ):
+  global p, f
+  for ex in expected.get( ni, [] ):
+    r = ex.get( 'r', ex.get( 'register_file' ) )
+    if r == 'pc':
+      name = "pc "
+      got = yield cpu.pc
+    elif type( r ) == str and r[ 0:3 ] == "RAM":
+      name = "RAM @ 0x%08X"%int( r[ 3: ] )
+      got = yield cpu.mem.ram.data[ int( r[ 3: ] ) // 4 ]
+    else:
+      name = "r%02d"%r
+      got = yield cpu.r[ r ]
+    if hexs( got ) == hexs( ex[ 'e' ] ):
+      p += 1
+      print( "  \033[32mPASS:\033[0m %s == %s after %d operations"
+             %( name, hexs( ex[ 'e' ] ), ni ) )
+    else:
+      f += 1
+      print( "  \033[31mFAIL:\033[0m %s == %s after %d operations"
+             " (got: %s)"%( name, hexs( ex[ 'e' ] ), ni, hexs( got ) ) )
+
+# Helper method to run the core until it retires the expected
+# number of instructions, and report the cycles per instruction.
+def core_run( cpu, expected ):
+  global p, f
+  ni = -1
+  cycles = 0
+  timeout = 0
+  # Cycles spent on each 'stall_reason' value.
+  stalls = [ 0 ] * 6
+  while ni < expected[ 'end' ]:
+    yield Settle()
+    stalls[ ( yield cpu.stall_reason ) ] += 1
+    instret = yield cpu.csr.minstret_instrs
+    # Check every retire count, in case two retire back-to-back.
+    while ni < instret:
+      ni += 1
+      timeout = 0
+      yield from check_vals( expected, ni, cpu )
+    timeout += 1
+    if timeout > 1000:
+      f += 1
+      print( "\033[31mFAIL: Timeout\033[0m" )
+      break
+    cycles += 1
+    yield Tick()
+  print( "  %d instructions in %d cycles (CPI: %.2f)"
+         %( ni, cycles, cycles / max( ni, 1 ) ) )
+  print( "  stall cycles: %d fetch, %d flush, %d load-use, %d data bus,"
+         " %d EX busy"
+         %( stalls[ STALL_FETCH ], stalls[ STALL_FLUSH ],
+            stalls[ STALL_LOAD_USE ], stalls[ STALL_DBUS ],
+            stalls[ STALL_EX ] ) )
+
+# Helper method to simulate the pipelined core with a ROM image.
+# 'fast' selects the single-cycle ROM and RAM modes, and 'shifter'
+# selects the ALU's shifter configuration.
+def core_sim( test, fast = False, shifter = SHIFT_FLIP ):
+  print( "\033[33mSTART\033[0m running '%s' program%s%s:"
+         %( test[ 0 ], " (fast ROM / RAM)" if fast else "",
+            " (shifter config %d)"%shifter if shifter else "" ) )
+  dut = core( ROM( test[ 2 ], fast ), fast_ram = fast,
+              shifter = shifter )
+  cpu = ResetInserter( dut.clk_rst )( dut )
+
+  sim = Simulator( cpu )
+  def proc():
+    # Initialize RAM values.
+    for i in range( len( test[ 3 ] ) ):
+      yield dut.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
+    yield from core_run( dut, test[ 4 ] )
+    print( "\033[35mDONE\033[0m running %s: executed %d instructions"
+           %( test[ 0 ], test[ 4 ][ 'end' ] ) )
+  sim.add_clock( 1 / 6000000 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "pipe_%s%s%s.vcd"
+                      %( test[ 1 ], "_fast" if fast else "",
+                         "_sh%d"%shifter if shifter else "" ) ):
+    sim.run()
+
+# 'main' method to run the pipelined core testbench.
+if __name__ == "__main__":
+  with warnings.catch_warnings():
+    warnings.filterwarnings( "ignore", category = DriverConflict )
+
+    print( '--- Pipelined Core Tests ---' )
+    core_sim( loop_test )
+    core_sim( ram_pc_test )
+    core_sim( muldiv_test )
+    core_sim( counters_test )
+    core_sim( wfi_nop_test )
+    # Simulate the RV32I compliance tests.
+    for test in [ add_test, addi_test, and_test, beq_test, bne_test,
+                  jal_test, jalr_test, lb_test, lw_test, sb_test,
+                  sw_test, sll_test, srai_test, sub_test ]:
+      core_sim( test )
+    # Compare cycles per instruction with single-cycle ROM / RAM.
+    for test in [ ram_pc_test, add_test, beq_test, lw_test, sw_test ]:
+      core_sim( test, True )
+    # Shifts with the ALU's own left shifter, instead of flipping.
+    for shifter in [ SHIFT_BIDIR, SHIFT_FUNNEL ]:
+      for test in [ sll_test, slli_test, sra_test, srl_test ]:
+        core_sim( test, shifter = shifter )
+
+    # Done; print results.
+    print( "Pipelined Core Tests: %d Passed, %d Failed"%( p, f ) )
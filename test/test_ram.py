@@ -78,12 +78,67 @@ def ram_read_ut( ram, address, expected ):
     print( "\033[32mPASS:\033[0m RAM[ 0x%08X ] == 0x%08X"
            %( address, expected ) )
 
+# Perform an incrementing burst of word reads or writes. The first
+# word takes three cycles as usual (two in fast mode), and each
+# word after it takes one more.
+def ram_burst_ut( ram, address, data, we ):
+  global p, f
+  bus = ram.arb.bus
+  # Start a new bus cycle.
+  yield bus.cyc.eq( 0 )
+  yield Tick()
+  yield bus.we.eq( we )
+  yield bus.cyc.eq( 1 )
+  yield ram.dw.eq( RAM_DW_32 )
+  # Step the address after each 'ack', and mark the last word as
+  # the end of the burst.
+  cycles = 0
+  for i in range( len( data ) ):
+    yield bus.adr.eq( address + ( i * 4 ) )
+    yield bus.dat_w.eq( data[ i ] )
+    if i == len( data ) - 1:
+      yield bus.cti.eq( CycleType.END_OF_BURST )
+    else:
+      yield bus.cti.eq( CycleType.INCR_BURST )
+    for j in range( 10 ):
+      yield Settle()
+      if ( yield bus.ack ):
+        break
+      yield Tick()
+      cycles += 1
+    actual = yield bus.dat_r
+    if ( not we ) and ( data[ i ] != actual ):
+      f += 1
+      print( "\033[31mFAIL:\033[0m RAM[ 0x%08X ] == "
+             "0x%08X (burst, got: 0x%08X)"
+             %( address + ( i * 4 ), data[ i ], actual ) )
+    elif not we:
+      p += 1
+      print( "\033[32mPASS:\033[0m RAM[ 0x%08X ] == 0x%08X (burst)"
+             %( address + ( i * 4 ), data[ i ] ) )
+    yield Tick()
+    cycles += 1
+  # End the cycle, and check that no more words were acknowledged.
+  yield bus.cyc.eq( 0 )
+  yield bus.we.eq( 0 )
+  yield bus.cti.eq( CycleType.CLASSIC )
+  yield Settle()
+  expected = len( data ) + ( 1 if ram.fast else 2 )
+  if ( cycles != expected ) or ( yield bus.ack ):
+    f += 1
+    print( "\033[31mFAIL:\033[0m %d-word burst took %d cycles "
+           "(expected: %d)"%( len( data ), cycles, expected ) )
+  else:
+    p += 1
+    print( "\033[32mPASS:\033[0m %d-word burst took %d cycles"
+           %( len( data ), cycles ) )
+
 # Top-level RAM test method.
 def ram_test( ram ):
   global p, f
 
   # Print a test header.
-  print( "--- RAM Tests ---" )
+  print( "--- RAM Tests%s ---"%( " (fast)" if ram.fast else "" ) )
 
   # Assert 'cyc' to activate the bus.
   yield ram.arb.bus.cyc.eq( 1 )
@@ -151,20 +206,31 @@ def ram_test( ram ):
   yield from ram_read_ut( ram, ram.size - 4, 0x12CDEF89 )
   yield from ram_write_ut( ram, ram.size - 4, 0xABCDEF89, RAM_DW_32, 1 )
 
+  # Test incrementing bursts.
+  burst = [ 0x11111111 * i for i in range( 1, 9 ) ]
+  yield from ram_burst_ut( ram, 0x20, burst, 1 )
+  yield from ram_burst_ut( ram, 0x20, burst, 0 )
+  yield from ram_burst_ut( ram, 0x28, burst[ 2 : 4 ], 0 )
+  # A classic cycle after a burst takes two cycles, as usual.
+  yield ram.arb.bus.cyc.eq( 1 )
+  yield from ram_read_ut( ram, 0x3C, 0x88888888 )
+
   # Done.
   yield Tick()
   print( "RAM Tests: %d Passed, %d Failed"%( p, f ) )
 
 # 'main' method to run a basic testbench.
 if __name__ == "__main__":
-  # Instantiate a test RAM module with 128 bytes of data.
-  dut = RAM( 32 )
-  def proc():
-    yield from ram_test( dut )
-  
-  # Run the RAM tests.
-  sim = Simulator(dut)
-  sim.add_clock( 1e-6 )
-  sim.add_sync_process(proc)
-  with sim.write_vcd("ram.vcd"):
-    sim.run()
+  # Instantiate test RAM modules with 128 bytes of data, in the
+  # default and fast modes.
+  for fast in [ False, True ]:
+    dut = RAM( 32, fast )
+    def proc():
+      yield from ram_test( dut )
+
+    # Run the RAM tests.
+    sim = Simulator(dut)
+    sim.add_clock( 1e-6 )
+    sim.add_sync_process(proc)
+    with sim.write_vcd( "ram_fast.vcd" if fast else "ram.vcd" ):
+      sim.run()
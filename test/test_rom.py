@@ -25,28 +25,73 @@ def rom_read_ut(rom, address, expected):
         p += 1
         print( "\033[32mPASS:\033[0m ROM[0x%08X] = 0x%08X" % (address, expected))
 
+def rom_burst_ut(rom, address, expected):
+    global p, f
+    bus = rom.arb.bus
+    # Start a new bus cycle, then step the address after each 'ack'
+    # and mark the last word as the end of the burst.
+    yield bus.cyc.eq(0)
+    yield Tick()
+    yield bus.cyc.eq(1)
+    cycles = 0
+    for i in range(len(expected)):
+        yield bus.adr.eq(address + i * 4)
+        if i == len(expected) - 1:
+            yield bus.cti.eq(CycleType.END_OF_BURST)
+        else:
+            yield bus.cti.eq(CycleType.INCR_BURST)
+        for j in range(10):
+            yield Settle()
+            if (yield bus.ack):
+                break
+            yield Tick()
+            cycles += 1
+        actual = yield bus.dat_r
+        if expected[i] != actual:
+            f += 1
+            print("\033[31mFAIL:\033[0m ROM[0x%08X] = 0x%08X (burst, got: 0x%08X)" % (address + i * 4, expected[i], actual))
+        else:
+            p += 1
+            print("\033[32mPASS:\033[0m ROM[0x%08X] = 0x%08X (burst)" % (address + i * 4, expected[i]))
+        yield Tick()
+        cycles += 1
+    yield bus.cyc.eq(0)
+    yield bus.cti.eq(CycleType.CLASSIC)
+    # Three cycles for the first word (two in fast mode), then one per word.
+    n = len(expected) + (1 if rom.fast else 2)
+    if cycles != n:
+        f += 1
+        print("\033[31mFAIL:\033[0m %d-word burst took %d cycles (expected: %d)" % (len(expected), cycles, n))
+    else:
+        p += 1
+        print("\033[32mPASS:\033[0m %d-word burst took %d cycles" % (len(expected), cycles))
+    yield Tick()
+
 def rom_test(rom):
     yield Settle()
-    print("---ROM Tests---")
+    print("---ROM Tests%s---" % (" (fast)" if rom.fast else ""))
     yield rom.arb.bus.cyc.eq(1)
     yield from rom_read_ut(rom, 0x0, little_end(0x01234567))
     yield from rom_read_ut(rom, 0x4, little_end(0x89abcdef))
     yield from rom_read_ut(rom, 0x8, little_end(0x42424242))
     yield from rom_read_ut(rom, 0xc, little_end(0xdeadbeef))
+    yield from rom_burst_ut(rom, 0x0, [little_end(0x01234567), little_end(0x89abcdef), little_end(0x42424242), little_end(0xdeadbeef)])
+    yield from rom_burst_ut(rom, 0x4, [little_end(0x89abcdef), little_end(0x42424242)])
 
     yield Tick()
     print("ROM Tests: %d Passed, %d Failed" % (p, f))
 
 
 if __name__ == "__main__":
-    dut = ROM([0x01234567, 0x89ABCDEF, 0x42424242, 0xDEADBEEF])
-	
-    def proc():
-        yield from rom_test(dut)
-	
-    sim = Simulator(dut)
-    sim.add_clock(1e-6)
-    sim.add_sync_process(proc)
-    with sim.write_vcd("rom.vcd"):
-        sim.run()
+    for fast in [False, True]:
+        dut = ROM([0x01234567, 0x89ABCDEF, 0x42424242, 0xDEADBEEF], fast)
+
+        def proc():
+            yield from rom_test(dut)
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(proc)
+        with sim.write_vcd("rom_fast.vcd" if fast else "rom.vcd"):
+            sim.run()
 
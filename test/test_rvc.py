@@ -0,0 +1,230 @@
+from amaranth import *
+from amaranth.sim import *
+
+from amaranth.hdl.ir import DriverConflict
+
+import os, sys, warnings
+sys.path.append("..")
+
+from src.isa import *
+from src.rvc import *
+from src.rom import *
+from src.cpu import *
+from src.pipeline_core import *
+# Import test programs and expected runtime register values.
+from programs import *
+
+##################################
+# RV32C expander testbench:      #
+##################################
+# Keep track of test pass / fail rates.
+p = 0
+f = 0
+
+# Perform an individual expander test: the compressed instruction
+# 'c' should expand to the 32-bit instruction 'expected', which is
+# in the (little-endian) form that the RV32I helpers return.
+def rvc_ut( rvc, name, c, expected ):
+  global p, f
+  yield rvc.c.eq( 0xFFFF0000 | c )
+  yield Settle()
+  actual = yield rvc.ir
+  compressed = yield rvc.rvc
+  expected = LITTLE_END( expected ) if expected else 0
+  if ( actual == expected ) and compressed:
+    p += 1
+    print( "  \033[32mPASS:\033[0m %s (0x%04X) -> 0x%08X"
+           %( name, c, expected ) )
+  else:
+    f += 1
+    print( "  \033[31mFAIL:\033[0m %s (0x%04X) -> 0x%08X (got: 0x%08X)"
+           %( name, c, expected, actual ) )
+
+# Top-level expander test method.
+def rvc_expander_test( rvc ):
+  global p, f
+  print( "--- RV32C Expander Tests ---" )
+  yield Settle()
+  # 32-bit instructions pass straight through.
+  yield rvc.c.eq( LITTLE_END( ADD( 1, 2, 3 ) ) )
+  yield Settle()
+  if ( ( yield rvc.ir ) == LITTLE_END( ADD( 1, 2, 3 ) ) ) and \
+     not ( yield rvc.rvc ):
+    p += 1
+    print( "  \033[32mPASS:\033[0m 32-bit instructions pass through" )
+  else:
+    f += 1
+    print( "  \033[31mFAIL:\033[0m 32-bit instructions pass through" )
+  # Quadrant 0.
+  yield from rvc_ut( rvc, "C.ADDI4SPN", C_ADDI4SPN( 9, 0x3FC ),
+                     ADDI( 9, 2, 0x3FC ) )
+  yield from rvc_ut( rvc, "C.ADDI4SPN", C_ADDI4SPN( 15, 4 ),
+                     ADDI( 15, 2, 4 ) )
+  yield from rvc_ut( rvc, "C.LW", C_LW( 8, 15, 0x7C ), LW( 8, 15, 0x7C ) )
+  yield from rvc_ut( rvc, "C.LW", C_LW( 12, 10, 0x44 ),
+                     LW( 12, 10, 0x44 ) )
+  yield from rvc_ut( rvc, "C.SW", C_SW( 9, 14, 0x40 ),
+                     SW( 9, 14, 0x40 ) )
+  yield from rvc_ut( rvc, "C.SW", C_SW( 13, 8, 0x3C ),
+                     SW( 13, 8, 0x3C ) )
+  # Quadrant 1.
+  yield from rvc_ut( rvc, "C.NOP", C_NOP(), ADDI( 0, 0, 0 ) )
+  yield from rvc_ut( rvc, "C.ADDI", C_ADDI( 5, 0x3F ),
+                     ADDI( 5, 5, 0xFFF ) )
+  yield from rvc_ut( rvc, "C.ADDI", C_ADDI( 31, 0x1F ),
+                     ADDI( 31, 31, 0x01F ) )
+  yield from rvc_ut( rvc, "C.JAL", C_JAL( 0x7FF ), JAL( 1, 0xFFFFF ) )
+  yield from rvc_ut( rvc, "C.JAL", C_JAL( 0x6AA ), JAL( 1, 0xFFEAA ) )
+  yield from rvc_ut( rvc, "C.JAL", C_JAL( 0x155 ), JAL( 1, 0x00155 ) )
+  yield from rvc_ut( rvc, "C.LI", C_LI( 10, 0x20 ), ADDI( 10, 0, 0xFE0 ) )
+  yield from rvc_ut( rvc, "C.ADDI16SP", C_ADDI16SP( 0x1F0 ),
+                     ADDI( 2, 2, 0x1F0 ) )
+  yield from rvc_ut( rvc, "C.ADDI16SP", C_ADDI16SP( 0x3F0 ),
+                     ADDI( 2, 2, 0xFF0 ) )
+  yield from rvc_ut( rvc, "C.LUI", C_LUI( 3, 0x1F000 ),
+                     LUI( 3, 0x1F000 ) )
+  yield from rvc_ut( rvc, "C.LUI", C_LUI( 3, 0x20000 ),
+                     LUI( 3, 0xFFFE0000 ) )
+  yield from rvc_ut( rvc, "C.SRLI", C_SRLI( 11, 31 ), SRLI( 11, 11, 31 ) )
+  yield from rvc_ut( rvc, "C.SRAI", C_SRAI( 8, 1 ), SRAI( 8, 8, 1 ) )
+  yield from rvc_ut( rvc, "C.ANDI", C_ANDI( 15, 0x2A ),
+                     ANDI( 15, 15, 0xFEA ) )
+  yield from rvc_ut( rvc, "C.SUB", C_SUB( 8, 15 ), SUB( 8, 8, 15 ) )
+  yield from rvc_ut( rvc, "C.XOR", C_XOR( 9, 14 ), XOR( 9, 9, 14 ) )
+  yield from rvc_ut( rvc, "C.OR", C_OR( 10, 13 ), OR( 10, 10, 13 ) )
+  yield from rvc_ut( rvc, "C.AND", C_AND( 11, 12 ), AND( 11, 11, 12 ) )
+  yield from rvc_ut( rvc, "C.J", C_J( 0x7FF ), JAL( 0, 0xFFFFF ) )
+  yield from rvc_ut( rvc, "C.J", C_J( 0x3FF ), JAL( 0, 0x003FF ) )
+  yield from rvc_ut( rvc, "C.BEQZ", C_BEQZ( 8, 0xFF ),
+                     BEQ( 8, 0, 0xFFF ) )
+  yield from rvc_ut( rvc, "C.BEQZ", C_BEQZ( 12, 0x55 ),
+                     BEQ( 12, 0, 0x055 ) )
+  yield from rvc_ut( rvc, "C.BNEZ", C_BNEZ( 15, 0x7F ),
+                     BNE( 15, 0, 0x07F ) )
+  yield from rvc_ut( rvc, "C.BNEZ", C_BNEZ( 9, 0xAA ),
+                     BNE( 9, 0, 0xFAA ) )
+  # Quadrant 2.
+  yield from rvc_ut( rvc, "C.SLLI", C_SLLI( 20, 17 ), SLLI( 20, 20, 17 ) )
+  yield from rvc_ut( rvc, "C.LWSP", C_LWSP( 6, 0xFC ), LW( 6, 2, 0xFC ) )
+  yield from rvc_ut( rvc, "C.LWSP", C_LWSP( 25, 0x24 ),
+                     LW( 25, 2, 0x24 ) )
+  yield from rvc_ut( rvc, "C.JR", C_JR( 1 ), JALR( 0, 1, 0 ) )
+  yield from rvc_ut( rvc, "C.MV", C_MV( 12, 30 ), ADD( 12, 0, 30 ) )
+  yield from rvc_ut( rvc, "C.EBREAK", C_EBREAK(),
+                     RV32I_I( OP_SYSTEM, F_TRAPS, 0, 0, 1 ) )
+  yield from rvc_ut( rvc, "C.JALR", C_JALR( 7 ), JALR( 1, 7, 0 ) )
+  yield from rvc_ut( rvc, "C.ADD", C_ADD( 4, 28 ), ADD( 4, 4, 28 ) )
+  yield from rvc_ut( rvc, "C.SWSP", C_SWSP( 31, 0xFC ),
+                     SW( 2, 31, 0xFC ) )
+  yield from rvc_ut( rvc, "C.SWSP", C_SWSP( 1, 0x44 ), SW( 2, 1, 0x44 ) )
+  # Reserved encodings expand to all zeros.
+  yield from rvc_ut( rvc, "illegal", 0x0000, 0 )
+  yield from rvc_ut( rvc, "C.LWSP x0", C_LWSP( 0, 4 ), 0 )
+
+# Helper method to check expected register / memory values. 'rf'
+# is the core's register file.
+def check_vals( expected, ni, cpu, rf ):
+  global p, f
+  for ex in expected.get( ni, [] ):
+    r = ex[ 'r' ]
+    if type( r ) == str and r[ 0:3 ] == "RAM":
+      name = "RAM @ 0x%08X"%int( r[ 3: ] )
+      got = yield cpu.mem.ram.data[ int( r[ 3: ] ) // 4 ]
+    else:
+      name = "r%02d"%r
+      got = yield rf[ r ]
+    if hexs( got ) == hexs( ex[ 'e' ] ):
+      p += 1
+      print( "  \033[32mPASS:\033[0m %s == %s after %d operations"
+             %( name, hexs( ex[ 'e' ] ), ni ) )
+    else:
+      f += 1
+      print( "  \033[31mFAIL:\033[0m %s == %s after %d operations"
+             " (got: %s)"%( name, hexs( ex[ 'e' ] ), ni, hexs( got ) ) )
+
+# Helper method to run a core until it retires the expected number
+# of instructions, counting the words which it fetches from the
+# instruction bus. Returns the bytes fetched per instruction.
+def rvc_run( cpu, rf, expected ):
+  global p, f
+  ni = -1
+  words = 0
+  timeout = 0
+  while ni < expected[ 'end' ]:
+    yield Settle()
+    instret = yield cpu.csr.minstret_instrs
+    while ni < instret:
+      ni += 1
+      timeout = 0
+      yield from check_vals( expected, ni, cpu, rf )
+    words += yield cpu.mem.inst_mux.bus.ack
+    timeout += 1
+    if timeout > 1000:
+      f += 1
+      print( "\033[31mFAIL: Timeout\033[0m" )
+      break
+    yield Tick()
+  bpi = ( words * 4 ) / max( ni, 1 )
+  print( "  %d instructions, %d bytes fetched (%.2f per instruction)"
+         %( ni, words * 4, bpi ) )
+  return bpi
+
+# Helper method to simulate the CPU or the pipelined core with a
+# ROM image, with or without RV32C support. Returns the bytes
+# fetched per instruction.
+def rvc_sim( test, pipelined, compressed ):
+  print( "\033[33mSTART\033[0m running '%s' program on the %s"
+         " (C extension %s):"%( test[ 0 ],
+         "pipelined core" if pipelined else "CPU",
+         "on" if compressed else "off" ) )
+  if pipelined:
+    dut = core( ROM( test[ 2 ] ), compressed = compressed )
+    rf  = dut.r
+  else:
+    dut = CPU( ROM( test[ 2 ] ), compressed = compressed )
+    rf  = dut.register_file
+  cpu = ResetInserter( dut.clk_rst )( dut )
+  bpi = []
+
+  sim = Simulator( cpu )
+  def proc():
+    bpi.append( ( yield from rvc_run( dut, rf, test[ 4 ] ) ) )
+    print( "\033[35mDONE\033[0m running %s: executed %d instructions"
+           %( test[ 0 ], test[ 4 ][ 'end' ] ) )
+  sim.add_clock( 1 / 6000000 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "%s_%s%s.vcd"%( "pipe" if pipelined else "cpu",
+                      test[ 1 ], "_c" if compressed else "" ) ):
+    sim.run()
+  return bpi[ 0 ]
+
+# 'main' method to run the RV32C testbenches.
+if __name__ == "__main__":
+  with warnings.catch_warnings():
+    warnings.filterwarnings( "ignore", category = DriverConflict )
+
+    dut = RVC_Expander()
+    sim = Simulator( dut )
+    def proc():
+      yield from rvc_expander_test( dut )
+    sim.add_process( proc )
+    with sim.write_vcd( "rvc.vcd" ):
+      sim.run()
+
+    # Run the same program with and without compressed instructions
+    # on both cores, and compare the instruction fetch traffic.
+    for pipelined in [ False, True ]:
+      base = rvc_sim( rvc_rv32i_test, pipelined, False )
+      rvc_sim( rvc_rv32i_test, pipelined, True )
+      bpi = rvc_sim( rvc_test, pipelined, True )
+      if bpi < base:
+        p += 1
+        print( "  \033[32mPASS:\033[0m compressed code fetches fewer"
+               " bytes per instruction (%.2f < %.2f)"%( bpi, base ) )
+      else:
+        f += 1
+        print( "  \033[31mFAIL:\033[0m compressed code fetches fewer"
+               " bytes per instruction (%.2f >= %.2f)"%( bpi, base ) )
+
+    # Done; print results.
+    print( "RV32C Tests: %d Passed, %d Failed"%( p, f ) )
@@ -23,94 +23,80 @@ from programs import *
 p = 0
 f = 0
 
-# Helper method to check expected CPU register / memory values
-# at a specific point during a test program.
+# Helper method to check expected CPU register / memory values.
+# 'ni' is the number of instructions which have retired, and 'pc'
+# is the address of the next instruction.
 def check_vals( expected, ni, cpu ):
   global p, f
-  if ni in expected:
-    for j in range( len( expected[ ni ] ) ):
-      ex = expected[ ni ][ j ]
-      # Special case: program counter.
-      if ex[ 'r' ] == 'pc':
-        cpc = yield cpu.pc
-        if hexs( cpc ) == hexs( ex[ 'e' ] ):
-          p += 1
-          print( "  \033[32mPASS:\033[0m pc  == %s"
-                 " after %d operations"
-                 %( hexs( ex[ 'e' ] ), ni ) )
-        else:
-          f += 1
-          print( "  \033[31mFAIL:\033[0m pc  == %s"
-                 " after %d operations (got: %s)"
-                 %( hexs( ex[ 'e' ] ), ni, hexs( cpc ) ) )
-      # Special case: RAM data (must be word-aligned).
-      elif type( ex[ 'r' ] ) == str and ex[ 'r' ][ 0:3 ] == "RAM":
-        rama = int( ex[ 'r' ][ 3: ] )
-        if ( rama % 4 ) != 0:
-          f += 1
-          print( "  \033[31mFAIL:\033[0m RAM == %s @ 0x%08X"
-                 " after %d operations (mis-aligned address)"
-                 %( hexs( ex[ 'e' ] ), rama, ni ) )
-        else:
-          cpd = yield cpu.mem.ram.data[ rama // 4 ]
-          if hexs( cpd ) == hexs( ex[ 'e' ] ):
-            p += 1
-            print( "  \033[32mPASS:\033[0m RAM == %s @ 0x%08X"
-                   " after %d operations"
-                   %( hexs( ex[ 'e' ] ), rama, ni ) )
-          else:
-            f += 1
-            print( "  \033[31mFAIL:\033[0m RAM == %s @ 0x%08X"
-                   " after %d operations (got: %s)"
-                   %( hexs( ex[ 'e' ] ), rama, ni, hexs( cpd ) ) )
-      # Numbered general-purpose registers.
-      elif ex[ 'r' ] >= 0 and ex[ 'r' ] < 32:
-        cr = yield cpu.r[ ex[ 'r' ] ]
-        if hexs( cr ) == hexs( ex[ 'e' ] ):
-          p += 1
-          print( "  \033[32mPASS:\033[0m r%02d == %s"
-                 " after %d operations"
-                 %( ex[ 'r' ], hexs( ex[ 'e' ] ), ni ) )
-        else:
-          f += 1
-          print( "  \033[31mFAIL:\033[0m r%02d == %s"
-                 " after %d operations (got: %s)"
-                 %( ex[ 'r' ], hexs( ex[ 'e' ] ),
-                    ni, hexs( cr ) ) )
+  for ex in expected.get( ni, [] ):
+    r = ex.get( 'r', ex.get( 'register_file' ) )
+    # Special case: program counter.
+    if r == 'pc':
+      name = "pc "
+      got = yield cpu.pc
+    # Special case: RAM data (must be word-aligned).
+    elif type( r ) == str and r[ 0:3 ] == "RAM":
+      name = "RAM @ 0x%08X"%int( r[ 3: ] )
+      got = yield cpu.mem.ram.data[ int( r[ 3: ] ) // 4 ]
+    # Numbered general-purpose registers.
+    else:
+      name = "r%02d"%r
+      got = yield cpu.register_file[ r ]
+    if hexs( got ) == hexs( ex[ 'e' ] ):
+      p += 1
+      print( "  \033[32mPASS:\033[0m %s == %s after %d operations"
+             %( name, hexs( ex[ 'e' ] ), ni ) )
+    else:
+      f += 1
+      print( "  \033[31mFAIL:\033[0m %s == %s after %d operations"
+             " (got: %s)"%( name, hexs( ex[ 'e' ] ), ni, hexs( got ) ) )
 
-# Helper method to run a CPU device for a given number of cycles,
-# and verify its expected register values over time.
+# Helper method to run a CPU device until it retires the expected
+# number of instructions, and verify its expected register values
+# over time. Reports and returns the cycles per instruction.
+# (Instructions which trap don't retire, but still take a cycle,
+#  so they count as instructions here)
 def cpu_run( cpu, expected ):
   global p, f
-  # Record how many CPU instructions have been executed.
+  # Record how many CPU instructions have been executed, and how
+  # many have trapped.
   ni = -1
+  traps = 0
+  cycles = 0
   # Watch for timeouts if the CPU gets into a bad state.
   timeout = 0
-  instret = 0
-  # Let the CPU run for N instructions.
-  while ni <= expected[ 'end' ]:
+  while ni < expected[ 'end' ]:
     # Let combinational logic settle before checking values.
     yield Settle()
-    timeout = timeout + 1
-    # Only check expected values once per instruction.
-    ninstret = yield cpu.csr.minstret_instrs
-    if ninstret != instret:
+    # Check every retire count, in case two retire back-to-back.
+    instret = yield cpu.csr.minstret_instrs
+    while ni < instret:
       ni += 1
-      instret = ninstret
       timeout = 0
-      # Check expected values, if any.
       yield from check_vals( expected, ni, cpu )
-    elif timeout > 1000:
+    timeout += 1
+    if timeout > 1000:
       f += 1
       print( "\033[31mFAIL: Timeout\033[0m" )
       break
+    traps += ( ( yield cpu.csr.events ) >> EV_TRAP ) & 1
     # Step the simulation.
+    cycles += 1
     yield Tick()
+  cpi = cycles / max( ni + traps, 1 )
+  print( "  %d instructions and %d traps in %d cycles (CPI: %.2f)"
+         %( ni, traps, cycles, cpi ) )
+  return cpi
 
 # Helper method to simulate running a CPU with the given ROM image
-# for the specified number of CPU cycles. The 'name' field is used
-# for printing and generating the waveform filename: "cpu_[name].vcd".
-def cpu_sim( test ):
+# until it retires the program's expected number of instructions.
+# The 'name' field is used for printing and generating the
+# waveform filename: "[name].vcd". Checks that every instruction
+# took one cycle, unless 'stalls' is set. (Apart from the first
+# fetch after reset; peripheral accesses stall for their bus cycles,
+# and RV32M instructions for the multiply / divide unit)
+def cpu_sim( test, stalls = False ):
+  global p, f
   print( "\033[33mSTART\033[0m running '%s' program:"%test[ 0 ] )
   # Create the CPU device.
   dut = single_cycle_core( ROM( test[ 2 ] ) )
@@ -120,41 +106,28 @@ def cpu_sim( test ):
   sim_name = "%s.vcd"%test[ 1 ]
   sim = Simulator( cpu )
   def proc():
+    global p, f
     # Initialize RAM values.
     for i in range( len( test[ 3 ] ) ):
-      yield cpu.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
-      # Run the program and print pass/fail for individual tests.
-      yield from cpu_run( cpu, test[ 4 ] )
-      print( "\033[35mDONE\033[0m running %s: executed %d instructions"
-             %( test[ 0 ], test[ 4 ][ 'end' ] ) )
+      yield dut.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
+    # Run the program and print pass/fail for individual tests.
+    cpi = yield from cpu_run( dut, test[ 4 ] )
+    n = test[ 4 ][ 'end' ]
+    if stalls:
+      print( "  (some instructions take more than one cycle)" )
+    elif cpi <= ( n + 1 ) / n:
+      p += 1
+      print( "  \033[32mPASS:\033[0m one cycle per instruction" )
+    else:
+      f += 1
+      print( "  \033[31mFAIL:\033[0m one cycle per instruction" )
+    print( "\033[35mDONE\033[0m running %s: executed %d instructions"
+           %( test[ 0 ], test[ 4 ][ 'end' ] ) )
   sim.add_clock( 1 / 6000000 )
   sim.add_sync_process( proc )
   with sim.write_vcd(sim_name):
     sim.run()
 
-# Helper method to simulate running a CPU from simulated SPI
-# Flash which contains a given ROM image.
-def cpu_spi_sim( test ):
-  print( "\033[33mSTART\033[0m running '%s' program (SPI):"%test[ 0 ] )
-  # Create the CPU device.
-  sim_spi_off = ( 2 * 1024 * 1024 )
-  dut = CPU( SPI_Flash( sim_spi_off, sim_spi_off + 1024, test[ 2 ] ) )
-  cpu = ResetInserter( dut.clk_rst )( dut )
-
-  # Run the simulation.
-  sim_name = "%s_spi.vcd"%test[ 1 ]
-  sim = Simulator( cpu ) 
-  def proc():
-    for i in range( len( test[ 3 ] ) ):
-        yield cpu.mem.ram.data[ i ].eq( test[ 3 ][ i ] )
-        yield from cpu_run( cpu, test[ 4 ] )
-        print( "\033[35mDONE\033[0m running %s: executed %d instructions"
-             %( test[ 0 ], test[ 4 ][ 'end' ] ) )
-  sim.add_clock( 1 / 6000000 )
-  sim.add_sync_process( proc )
-  with sim.write_vcd( sim_name ):
-    sim.run()
-
 from test_rom.rv32i_add import *
 from test_rom.rv32i_addi import *
 from test_rom.rv32i_and import *
@@ -211,9 +184,8 @@ if __name__ == "__main__":
     with warnings.catch_warnings():
       warnings.filterwarnings( "ignore", category = DriverConflict )
       warnings.filterwarnings( "ignore", category = UnusedElaboratable )
-      # Build the CPU to read its program from a 2MB offset in SPI Flash.
-      prog_start = ( 2 * 1024 * 1024 )
-      cpu = CPU( SPI_ROM( prog_start, prog_start * 2, None ) )
+      # (The single-cycle core reads its program from a ROM module)
+      cpu = single_cycle_core( ROM( loop_rom ) )
       UpduinoPlatform().build( ResetInserter( cpu.clk_rst )( cpu ),
                                do_program = False )
   else:
@@ -221,15 +193,16 @@ if __name__ == "__main__":
     with warnings.catch_warnings():
       warnings.filterwarnings( "ignore", category = DriverConflict )
 
-      print( '--- CPU Tests ---' )
+      print( '--- Single-cycle Core Tests ---' )
       # Simulate the 'infinite loop' ROM to screen for syntax errors.
       cpu_sim( loop_test )
-      cpu_spi_sim( loop_test )
       cpu_sim( ram_pc_test )
-      cpu_spi_sim( ram_pc_test )
+      cpu_sim( counters_test )
+      cpu_sim( wfi_nop_test )
+      cpu_sim( clint_test, stalls = True )
+      cpu_sim( muldiv_test, stalls = True )
       # Simulate the RV32I compliance tests.
       cpu_sim( add_test )
-      """
       cpu_sim( addi_test )
       cpu_sim( and_test )
       cpu_sim( andi_test )
@@ -253,8 +226,6 @@ if __name__ == "__main__":
       cpu_sim( lhu_test )
       cpu_sim( lw_test )
       cpu_sim( lui_test )
-      cpu_sim( misalign_jmp_test )
-      cpu_sim( misalign_ldst_test )
       cpu_sim( nop_test )
       cpu_sim( or_test )
       cpu_sim( ori_test )
@@ -277,7 +248,5 @@ if __name__ == "__main__":
       cpu_sim( sub_test )
       cpu_sim( xor_test )
       cpu_sim( xori_test )
-      """
       # Done; print results.
-      print(Repl(2, 5))
-      print( "CPU Tests: %d Passed, %d Failed"%( p, f ) )
+      print( "Single-cycle Core Tests: %d Passed, %d Failed"%( p, f ) )
@@ -94,10 +94,135 @@ def spi_flash_test(srom):
     yield Tick()
     print( "SPI Flash Tests: %d Passed, %d Failed"%( p, f ) )
 
+# Helper method to test reading a word in one of the dual / quad
+# fast-read modes. Checks the command, address, and dummy phases,
+# and the number of SPI clocks that the read takes.
+def spi_fast_read_word( srom, virt_addr, phys_addr, simword ):
+    # Request a new read, as above.
+    yield srom.arb.bus.adr.eq(virt_addr)
+    yield srom.arb.bus.stb.eq(1)
+    yield srom.arb.bus.cyc.eq(1)
+    yield Tick()
+    yield Settle()
+    csa = yield srom.spi.cs.o
+    spi_flash_read_ut("CS Low", csa, 1)
+    # The command (and address, unless it goes out on 4 lines)
+    # is sent on IO0, MSbit first.
+    if srom.alines == 1:
+        cmd = ( srom.cmd << 24 ) | ( phys_addr & 0x00FFFFFF )
+        nbits = 32
+    else:
+        cmd = srom.cmd << 24
+        nbits = 8
+    for i in range(nbits):
+        yield Settle()
+        dout = yield srom.spi.dq.o
+        doe = yield srom.spi.dq.oe
+        spi_flash_read_ut("SPI Flash Read Cmd  [%d]"%i, dout & 0b1, (cmd >> ( 31 - i )) & 0b1)
+        spi_flash_read_ut("SPI Flash Read Cmd OE [%d]"%i, doe, 1)
+        yield Tick()
+    # In the 'quad I/O' mode, the address and a zero mode byte go
+    # out four bits at a time.
+    if srom.alines > 1:
+        adr = ( phys_addr & 0x00FFFFFF ) << 8
+        for i in range(32 // srom.alines):
+            yield Settle()
+            dout = yield srom.spi.dq.o
+            spi_flash_read_ut("SPI Flash Read Adr [%d]"%i, dout, (adr >> ( 28 - ( i * 4 ) )) & 0xF)
+            yield Tick()
+    # The data lines are released for the dummy cycles.
+    for i in range(srom.dummy):
+        yield Settle()
+        doe = yield srom.spi.dq.oe
+        spi_flash_read_ut("SPI Flash Dummy OE [%d]"%i, doe, 0)
+        yield Tick()
+    # Then the word arrives on several lines at once.
+    for i in range(32 // srom.dlines):
+        yield Tick()
+    yield Settle()
+    progress = yield srom.arb.bus.dat_r
+    spi_flash_read_ut( "SPI Flash Read Word", progress, simword )
+    yield Tick()
+    yield Settle()
+    ack = yield srom.arb.bus.ack
+    csa = yield srom.spi.cs.o
+    spi_flash_read_ut( "Ack", ack, 1 )
+    spi_flash_read_ut( "CS High (Waiting)", csa, 0 )
+    yield srom.arb.bus.stb.eq( 0 )
+    yield srom.arb.bus.cyc.eq( 0 )
+    yield Tick()
+    yield Settle()
+
+# Top-level test method for the dual / quad fast-read modes.
+def spi_fast_test(srom):
+    yield Tick()
+    yield Settle()
+    print( "--- SPI Flash Tests (command 0x%02X) ---"%srom.cmd )
+    yield from spi_fast_read_word( srom, 0x00, 0x200000, little_end( 0x89ABCDEF ) )
+    yield from spi_fast_read_word( srom, 0x10, 0x200010, little_end( 0xDEADFACE ) )
+    yield from spi_fast_read_word( srom, 0x0C, 0x20000C, little_end( 0xABACADAB ) )
+
+# Helper method to read a word and count how many cycles it takes
+# from the request to 'ack'. Also returns whether CS was released
+# at any point.
+def spi_timed_read( srom, virt_addr, simword ):
+    yield srom.arb.bus.adr.eq(virt_addr)
+    yield srom.arb.bus.stb.eq(1)
+    yield srom.arb.bus.cyc.eq(1)
+    cycles = 0
+    released = False
+    while True:
+        yield Tick()
+        yield Settle()
+        cycles += 1
+        if ( yield srom.spi.cs.o ) == 0:
+            released = True
+        if ( yield srom.arb.bus.ack ) or ( cycles > 200 ):
+            break
+    progress = yield srom.arb.bus.dat_r
+    spi_flash_read_ut( "SPI Flash Read Word [0x%02X]"%virt_addr, progress, simword )
+    yield srom.arb.bus.stb.eq( 0 )
+    yield srom.arb.bus.cyc.eq( 0 )
+    yield Tick()
+    yield Settle()
+    return ( cycles, released )
+
+# Top-level test method for sequential burst reads.
+def spi_burst_test(srom):
+    yield Tick()
+    yield Settle()
+    print( "--- SPI Flash Burst Tests (command 0x%02X) ---"%srom.cmd )
+    # Clocks for the command / address / dummy phases, and for data.
+    if srom.alines == 1:
+        cmd = 32 + srom.dummy
+    else:
+        cmd = 8 + ( 32 // srom.alines ) + srom.dummy
+    dat = 32 // srom.dlines
+    # The first read sends a command.
+    c, r = yield from spi_timed_read( srom, 0x00, little_end( 0x89ABCDEF ) )
+    spi_flash_read_ut( "Cycles (new read)", c, cmd + dat + 1 )
+    # Sequential reads only clock in the next word, and leave CS
+    # asserted, even if the bus goes idle between them.
+    c, r = yield from spi_timed_read( srom, 0x04, little_end( 0x0C0FFEE0 ) )
+    spi_flash_read_ut( "Cycles (burst)", c, dat + 1 )
+    spi_flash_read_ut( "CS held", r, False )
+    for i in range( 4 ):
+        yield Tick()
+    c, r = yield from spi_timed_read( srom, 0x08, little_end( 0xBABABABA ) )
+    spi_flash_read_ut( "Cycles (burst)", c, dat + 1 )
+    spi_flash_read_ut( "CS held", r, False )
+    # Anything else releases CS and starts a new read.
+    c, r = yield from spi_timed_read( srom, 0x10, little_end( 0xDEADFACE ) )
+    spi_flash_read_ut( "Cycles (new read)", c, cmd + dat + 2 )
+    spi_flash_read_ut( "CS released", r, True )
+    c, r = yield from spi_timed_read( srom, 0x14, little_end( 0x12345678 ) )
+    spi_flash_read_ut( "Cycles (burst)", c, dat + 1 )
+
 if __name__ == "__main__":
     # Instantiate a test SPI ROM module.
     off = ( 2 * 1024 * 1024 )
-    dut = SPI_Flash(off, off + 1024, [0x89ABCDEF, 0x0C0FFEE0, 0xBABABABA, 0xABACADAB, 0xDEADFACE, 0x12345678, 0x87654321, 0xDEADBEEF, 0xDEADBEEF])
+    # (Bursts are turned off for the one-word-at-a-time tests)
+    dut = SPI_Flash(off, off + 1024, [0x89ABCDEF, 0x0C0FFEE0, 0xBABABABA, 0xABACADAB, 0xDEADFACE, 0x12345678, 0x87654321, 0xDEADBEEF, 0xDEADBEEF], burst = False)
 
     def proc():
         for i in range(30):
@@ -110,3 +235,34 @@ if __name__ == "__main__":
     with sim.write_vcd("spi_flash.vcd"):
         sim.run()
 
+    # Repeat the reads with each of the faster read commands.
+    for mode in [ SPI_MODE_DUAL, SPI_MODE_QUAD, SPI_MODE_QUAD_IO ]:
+        dut = SPI_Flash(off, off + 1024, [0x89ABCDEF, 0x0C0FFEE0, 0xBABABABA, 0xABACADAB, 0xDEADFACE, 0x12345678, 0x87654321, 0xDEADBEEF, 0xDEADBEEF], mode, False)
+
+        def proc():
+            for i in range(30):
+                yield Tick()
+            yield from spi_fast_test(dut)
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(proc)
+        with sim.write_vcd("spi_flash_%02x.vcd"%dut.cmd):
+            sim.run()
+
+    # Sequential reads in each mode, with bursts turned on.
+    for mode in [ SPI_MODE_1X, SPI_MODE_DUAL, SPI_MODE_QUAD, SPI_MODE_QUAD_IO ]:
+        dut = SPI_Flash(off, off + 1024, [0x89ABCDEF, 0x0C0FFEE0, 0xBABABABA, 0xABACADAB, 0xDEADFACE, 0x12345678, 0x87654321, 0xDEADBEEF, 0xDEADBEEF], mode)
+
+        def proc():
+            for i in range(30):
+                yield Tick()
+            yield from spi_burst_test(dut)
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(proc)
+        with sim.write_vcd("spi_flash_burst_%02x.vcd"%dut.cmd):
+            sim.run()
+    print( "SPI Flash Tests: %d Passed, %d Failed"%( p, f ) )
+
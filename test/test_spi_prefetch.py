@@ -0,0 +1,155 @@
+from amaranth import *
+from amaranth.sim import *
+from amaranth.hdl.ir import DriverConflict
+
+import os, sys, warnings
+sys.path.append("..")
+
+from src.isa import *
+from src.spi_flash import *
+from src.spi_prefetch import *
+# Import the CPU / pipelined core harnesses, test programs, and
+# the compliance test ROM images.
+import test_cpu, test_pipeline_core
+from test_pipeline_core import *
+
+##################################
+# SPI Flash prefetch testbench   #
+##################################
+# Keep track of test pass / fail rates.
+p = 0
+f = 0
+
+# Simulated SPI Flash offset.
+SPI_OFF = ( 2 * 1024 * 1024 )
+
+# Test harness: a prefetch buffer in front of a simulated SPI Flash.
+class Prefetch_Flash( Elaboratable ):
+  def __init__( self, data, depth ):
+    self.flash = SPI_Flash( SPI_OFF, SPI_OFF + ( len( data ) * 4 ), data )
+    self.pf    = SPI_Prefetch( self.flash, depth )
+
+  def elaborate( self, platform ):
+    m = Module()
+    m.submodules.flash = self.flash
+    m.submodules.pf    = self.pf
+    return m
+
+# Helper method to check a value and record the result.
+def check( name, got, expected ):
+  global p, f
+  if got == expected:
+    p += 1
+    print( "  \033[32mPASS:\033[0m %s == 0x%08X"%( name, expected ) )
+  else:
+    f += 1
+    print( "  \033[31mFAIL:\033[0m %s == 0x%08X (got: 0x%08X)"
+           %( name, expected, got ) )
+
+# Helper method to fetch one word through the prefetch buffer.
+# Returns the number of cycles until 'ack'.
+def pf_read( dut, address, expected ):
+  bus = dut.pf.bus
+  yield bus.adr.eq( address )
+  yield bus.cyc.eq( 1 )
+  yield bus.stb.eq( 1 )
+  cycles = 0
+  for i in range( 1000 ):
+    yield Tick()
+    yield Settle()
+    cycles += 1
+    if ( yield bus.ack ):
+      break
+  check( "PF[0x%08X]"%address, ( yield bus.dat_r ), expected )
+  yield bus.cyc.eq( 0 )
+  yield bus.stb.eq( 0 )
+  yield Tick()
+  yield Settle()
+  return cycles
+
+# Read a few words in order, then jump around.
+def pf_test( dut, data ):
+  print( "--- SPI Flash Prefetch Tests (depth %d) ---"%dut.pf.depth )
+  for i in range( 30 ):
+    yield Tick()
+  yield Settle()
+  # The first fetch starts the stream.
+  yield from pf_read( dut, 0x00, LITTLE_END( data[ 0 ] ) )
+  # Given time, the next words are read ahead, and each fetch is
+  # acknowledged on the following cycle.
+  for i in range( 200 ):
+    yield Tick()
+  for i in range( 1, dut.pf.depth + 1 ):
+    c = yield from pf_read( dut, i * 4, LITTLE_END( data[ i ] ) )
+    check( "PF[0x%08X] cycles"%( i * 4 ), c, 1 )
+  # Back-to-back fetches keep up with the SPI Flash burst.
+  for i in range( dut.pf.depth + 1, 16 ):
+    yield from pf_read( dut, i * 4, LITTLE_END( data[ i ] ) )
+  # A jump restarts the stream.
+  yield from pf_read( dut, 0x80, LITTLE_END( data[ 32 ] ) )
+  yield from pf_read( dut, 0x84, LITTLE_END( data[ 33 ] ) )
+  # A flush drops the words which were read ahead.
+  yield dut.pf.flush.eq( 1 )
+  yield Tick()
+  yield dut.pf.flush.eq( 0 )
+  yield from pf_read( dut, 0x88, LITTLE_END( data[ 34 ] ) )
+  yield from pf_read( dut, 0x8C, LITTLE_END( data[ 35 ] ) )
+  check( "PF misses", ( yield dut.pf.misses ), 3 )
+  check( "PF hits", ( yield dut.pf.hits ), 17 )
+
+# Helper method to simulate the prefetch buffer on its own.
+def pf_sim( depth ):
+  data = [ 0x01000000 * i + 0x00112233 for i in range( 64 ) ]
+  dut = Prefetch_Flash( data, depth )
+  sim = Simulator( dut )
+  def proc():
+    yield from pf_test( dut, data )
+  sim.add_clock( 1e-6 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "spi_prefetch_%d.vcd"%depth ):
+    sim.run()
+
+# Helper method to simulate a core running from simulated SPI
+# Flash, with or without a prefetch buffer.
+def spi_sim( test, cls, depth ):
+  print( "\033[33mSTART\033[0m running '%s' program (%s, SPI, "
+         "prefetch depth %d):"%( test[ 0 ], cls.__name__, depth ) )
+  flash = SPI_Flash( SPI_OFF, SPI_OFF + ( len( test[ 2 ] ) * 4 ),
+                     test[ 2 ] )
+  pf = SPI_Prefetch( flash, depth ) if depth > 0 else None
+  dut = cls( flash, prefetch = pf )
+  cpu = ResetInserter( dut.clk_rst )( dut )
+  sim = Simulator( cpu )
+  def proc():
+    for i in range( len( test[ 3 ] ) ):
+      yield dut.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
+    if cls == CPU:
+      yield from cpu_run( dut, test[ 4 ] )
+    else:
+      yield from core_run( dut, test[ 4 ] )
+    if pf is not None:
+      print( "  %d prefetch hits, %d prefetch misses"
+             %( ( yield pf.hits ), ( yield pf.misses ) ) )
+  sim.add_clock( 1 / 6000000 )
+  sim.add_sync_process( proc )
+  with sim.write_vcd( "spi_prefetch_%s.vcd"%test[ 1 ] ):
+    sim.run()
+
+# 'main' method to run the prefetch buffer testbench.
+if __name__ == "__main__":
+  with warnings.catch_warnings():
+    warnings.filterwarnings( "ignore", category = DriverConflict )
+
+    pf_sim( 1 )
+    pf_sim( 4 )
+    # (The CPU harness only understands 'register_file' checks)
+    spi_sim( add_test, CPU, 4 )
+    for test in [ add_test, beq_test ]:
+      spi_sim( test, core, 0 )
+      spi_sim( test, core, 4 )
+
+    # Done; print results.
+    # (The core harnesses keep their own pass / fail counts)
+    p += test_cpu.p + test_pipeline_core.p
+    f += test_cpu.f + test_pipeline_core.f
+    print( "SPI Flash Prefetch Tests: %d Passed, %d Failed"%( p, f ) )
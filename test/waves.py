@@ -0,0 +1,158 @@
+from amaranth import *
+from vcd import VCDWriter
+
+from collections import deque
+import gzip, os, re, shutil, subprocess, sys
+sys.path.append("..")
+
+#############################################################
+# Selective waveform capture for the testbenches.           #
+# Amaranth's 'write_vcd' dumps every signal in the design   #
+# on every cycle. A 'Waveform' only records the signals     #
+# it is given, by sampling them from a testbench process    #
+# once per cycle. It can also:                              #
+# * keep only the last 'window' cycles until it is          #
+#   triggered, by a failed check or by signals reaching     #
+#   given values, and then record until it is closed.       #
+# * write gzip-compressed VCD ('gz'), or FST ('fst', which  #
+#   needs GTKWave's 'vcd2fst' tool).                        #
+#############################################################
+
+# Signals to record when none are picked: the program counter,
+# the fetch / execute state, and the bus handshakes.
+DEFAULT_WAVES = [ "pc", "iws", "mem.ibus.cyc", "mem.ibus.ack",
+                  "mem.dbus.cyc", "mem.dbus.ack", "mem.dbus.we" ]
+
+# Helper method to find a signal from a path of attributes, like
+# "mem.ibus.cyc" or "register_file[ 5 ]".
+def find_signal( obj, path ):
+  for part in path.split( "." ):
+    m = re.fullmatch( r"\s*(\w+)\s*(?:\[\s*(\d+)\s*\])?\s*", part )
+    if m is None:
+      raise ValueError( "Can't parse signal name '%s'"%path )
+    obj = getattr( obj, m.group( 1 ) )
+    if m.group( 2 ) is not None:
+      obj = obj[ int( m.group( 2 ) ) ]
+  if not isinstance( obj, Signal ):
+    raise ValueError( "'%s' isn't a signal"%path )
+  return obj
+
+class Waveform():
+  def __init__( self, path, dut, signals = DEFAULT_WAVES, window = 0,
+                trigger_on = {}, compress = None, period = 1 / 6000000 ):
+    if compress not in [ None, "gz", "fst" ]:
+      raise ValueError( "Unknown waveform compression: '%s'"%compress )
+    if ( compress == "fst" ) and ( shutil.which( "vcd2fst" ) is None ):
+      raise ValueError( "Writing FST files needs 'vcd2fst' (GTKWave)" )
+    self.path     = path
+    self.compress = compress
+    # (Signals which trigger the capture are always recorded)
+    names = list( signals ) + [ n for n in trigger_on if n not in signals ]
+    self.signals  = [ ( name, find_signal( dut, name ) )
+                      for name in names ]
+    # Clock period, in picoseconds.
+    self.period   = round( period * 1e12 )
+    # Values which trigger the capture, by signal index.
+    self.trigger_on = [ ( names.index( n ), v )
+                        for n, v in trigger_on.items() ]
+    # Cycles recorded so far, and samples waiting to be written.
+    # Until the capture is triggered, only the last 'window'
+    # cycles are kept. (With no window, it starts triggered)
+    self.cycle     = 0
+    self.triggered = ( window == 0 )
+    self.pending   = deque( maxlen = window if window else None )
+    self.file      = None
+    self.writer    = None
+
+  # Helper method to open the output file, and declare the signals.
+  def open( self ):
+    if self.compress == "gz":
+      self.file = gzip.open( "%s.gz"%self.path, "wt" )
+    else:
+      self.file = open( self.path, "w" )
+    self.writer = VCDWriter( self.file, timescale = "1 ps" )
+    self.vars = []
+    for name, sig in self.signals:
+      scope = ".".join( [ "top" ] + name.split( "." )[ :-1 ] )
+      self.vars.append( self.writer.register_var(
+        scope, name.split( "." )[ -1 ].replace( " ", "" ), "wire",
+        size = len( sig ) ) )
+
+  # Helper method to write out the samples which are waiting.
+  def flush( self ):
+    if self.writer is None:
+      self.open()
+    while self.pending:
+      cycle, values = self.pending.popleft()
+      for var, v in zip( self.vars, values ):
+        self.writer.change( var, cycle * self.period, v )
+
+  # Start recording for good: the samples in the window are kept.
+  def trigger( self ):
+    self.triggered = True
+
+  # Record the current cycle. (Call this from a testbench process,
+  # after letting the design settle)
+  def sample( self ):
+    values = []
+    for name, sig in self.signals:
+      values.append( ( yield sig ) )
+    for i, v in self.trigger_on:
+      if values[ i ] == v:
+        self.triggered = True
+    self.pending.append( ( self.cycle, values ) )
+    self.cycle += 1
+    if self.triggered:
+      self.flush()
+
+  # Finish the waveform. Nothing is written if it never triggered.
+  def close( self ):
+    if self.triggered:
+      self.flush()
+    if self.writer is None:
+      return
+    self.writer.close( self.cycle * self.period )
+    self.file.close()
+    if self.compress == "fst":
+      subprocess.run( [ "vcd2fst", self.path,
+                        "%s.fst"%os.path.splitext( self.path )[ 0 ] ],
+                      check = True, stdout = subprocess.DEVNULL )
+      os.remove( self.path )
+
+# Helper method to read the waveform options from a command line,
+# and remove them from it. Returns whether to dump every signal,
+# and the options for a 'Waveform' (or None):
+# * -vcd:             dump every signal with amaranth's VCD writer.
+# * -waves[=A,B,..]:  only record these signals. (Default:
+#                     'DEFAULT_WAVES')
+# * -window=N:        only keep N cycles before the trigger.
+# * -trigger-pc=ADR:  trigger when the PC reaches an address.
+# * -compress=gz|fst: compress the output.
+# The last three options imply '-waves'.
+def wave_args( argv ):
+  full_vcd = False
+  waves = None
+  for a in list( argv[ 1: ] ):
+    name, _, val = a.partition( "=" )
+    if name not in [ "-vcd", "-waves", "-window", "-trigger-pc",
+                     "-compress" ]:
+      continue
+    argv.remove( a )
+    if name == "-vcd":
+      full_vcd = True
+      continue
+    if waves is None:
+      waves = { 'signals': DEFAULT_WAVES, 'window': 0,
+                'trigger_on': {}, 'compress': None }
+    if ( name == "-waves" ) and val:
+      waves[ 'signals' ] = val.split( "," )
+    elif name == "-window":
+      waves[ 'window' ] = int( val )
+    elif name == "-trigger-pc":
+      waves[ 'trigger_on' ] = { 'pc': int( val, 0 ) }
+    elif name == "-compress":
+      waves[ 'compress' ] = val
+  if full_vcd and ( waves is not None ):
+    raise ValueError( "'-vcd' can't be used with the other waveform "
+                      "options" )
+  return full_vcd, waves